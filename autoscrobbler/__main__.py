@@ -1,17 +1,55 @@
+from __future__ import annotations
+
 import argparse
 import asyncio
+import dataclasses
+import datetime
 import json
 import logging
+import math
 import os
-import tempfile
+import socket
+import sys
 import time
-from typing import Any, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Optional, Tuple, TypeVar, Union
+
+from autoscrobbler import logs, metrics, nowplaying, ratelimit, tracing
+from autoscrobbler.addresses import (
+    DEFAULT_GROUP,
+    DEFAULT_HUB_PORT,
+    DEFAULT_PORT,
+    parse_address,
+)
+from autoscrobbler.dedupe import DedupeIndex, normalize_key
+from autoscrobbler.devices import DeviceRegistry, DeviceWatch
+from autoscrobbler.history import PlayHistory
+from autoscrobbler.lazy import lazy_import
+from autoscrobbler.profiling import Profiler
+from autoscrobbler.ratelimit import CircuitOpenError
+
+if TYPE_CHECKING:
+    import numpy as np
+    from shazamio import Shazam
+    from shazamio.interfaces.client import HTTPClientInterface
+    from shazamio.signature import DecodedMessage
+
+    from autoscrobbler.archive import BackfillQueue
+    from autoscrobbler.buffers import AudioBuffer
+    from autoscrobbler.capture import CaptureProcess, CaptureStats
+    from autoscrobbler.conditioning import Conditioner
+    from autoscrobbler.quality import CaptureQuality, QualityThresholds
+    from autoscrobbler.room import RoomPeer
+    from autoscrobbler.shazam_client import EventLoopThread
+
+# Heavy dependencies load on first use, so --help, --input-source list and
+# --stats start without numpy, pylast, shazamio or aiohttp
+pylast = lazy_import("pylast")
+sd = lazy_import("sounddevice")
+
+STARTED = time.perf_counter()
 
-import numpy as np
-import pylast
-import sounddevice as sd
-import soundfile as sf
-from shazamio import Shazam
+T = TypeVar("T")
 
 
 def find_credentials_path(credentials_path: Optional[str] = None) -> str:
@@ -55,11 +93,6 @@ def load_credentials(credentials_path: Optional[str] = None) -> dict[str, Any]:
         return json.load(f)
 
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
 logger = logging.getLogger(__name__)
 
 
@@ -77,28 +110,41 @@ def print_default_input_device_info() -> None:
         logger.error(f"Could not get default input device info: {e}")
 
 
+_devices: Optional[DeviceRegistry] = None
+
+
+def device_registry() -> DeviceRegistry:
+    """Return the process-wide input device registry, scanned once on first use."""
+    global _devices
+    if _devices is None:
+        _devices = DeviceRegistry(sd)
+    return _devices
+
+
 def list_input_devices() -> None:
     """List all available input devices and exit.
     
-    Displays all available input devices with their index, name, channel count,
-    and sample rate. Also shows usage examples.
+    Displays all available input devices with their index, name, host API,
+    channel count, and sample rate. Also shows usage examples.
     """
-    devices = sd.query_devices()
-    input_devices = [d for d in devices if d["max_input_channels"] > 0]
+    registry = device_registry()
+    input_devices = registry.devices
     
     if not input_devices:
         print("No input devices found.")
         return
     
-    default_input_device_index = sd.query_devices(kind="input").get("index")
+    default_input_device_index = registry.default_index
     
     print("Available input devices:")
     print("=" * 50)
     for dev in input_devices:
-        is_default = "(default)" if dev["index"] == default_input_device_index else ""
-        print(f"  [{dev['index']}] {dev['name']} {is_default}")
-        print(f"      Channels: {dev['max_input_channels']}")
-        print(f"      Sample Rate: {dev['default_samplerate']} Hz")
+        is_default = "(default)" if dev.index == default_input_device_index else ""
+        print(f"  [{dev.index}] {dev.name} {is_default}")
+        if dev.hostapi:
+            print(f"      Host API: {dev.hostapi}")
+        print(f"      Channels: {dev.channels}")
+        print(f"      Sample Rate: {dev.default_samplerate} Hz")
         print()
     
     print("Usage examples:")
@@ -121,24 +167,18 @@ def select_input_device(input_source: Optional[str] = None) -> int:
         RuntimeError: If no input devices are found.
         ValueError: If the specified device cannot be found or is invalid.
     """
-    devices = sd.query_devices()
-    input_devices = [d for d in devices if d["max_input_channels"] > 0]
+    registry = device_registry()
+    input_devices = registry.devices
     if not input_devices:
         raise RuntimeError("No input devices found.")
 
-    # Get default input device index from the filtered input devices
-    default_input_device_index = None
-    default_info = sd.query_devices(kind="input")
-    if default_info is not None:
-        default_input_device_index = default_info.get("index")
+    default_input_device_index = registry.default_index
 
     if input_source is None:
         # Prompt user
         print("Select input device:")
         for dev in input_devices:
-            print(
-                f"  [{dev['index']}] {dev['name']} (channels={dev['max_input_channels']})"
-            )
+            print(f"  [{dev.index}] {dev.name} (channels={dev.channels})")
         while True:
             choice = input(f"Enter device number [{default_input_device_index}]: ")
             if choice == "":
@@ -146,8 +186,8 @@ def select_input_device(input_source: Optional[str] = None) -> int:
             try:
                 idx = int(choice)
                 for dev in input_devices:
-                    if dev["index"] == idx:
-                        return dev["index"]
+                    if dev.index == idx:
+                        return dev.index
             except Exception:
                 pass
             print("Invalid selection. Try again.")
@@ -157,62 +197,243 @@ def select_input_device(input_source: Optional[str] = None) -> int:
         # Try to match by name (case-insensitive)
         logger.debug(f"Searching for device containing '{input_source}' in {len(input_devices)} input devices")
         for dev in input_devices:
-            if input_source.lower() in dev["name"].lower():
-                logger.info(f"Found matching device: [{dev['index']}] {dev['name']}")
-                return dev["index"]
+            if input_source.lower() in dev.name.lower():
+                logger.info(f"Found matching device: [{dev.index}] {dev.name}")
+                return dev.index
         # Log all available device names for debugging
-        available_names = [f"[{dev['index']}] {dev['name']}" for dev in input_devices]
+        available_names = [f"[{dev.index}] {dev.name}" for dev in input_devices]
         logger.info(f"Available input devices: {', '.join(available_names)}")
         raise ValueError(
             f"No input device found with name containing '{input_source}'."
         )
     elif isinstance(input_source, int):
         if 0 <= input_source < len(input_devices):
-            return input_devices[input_source]["index"]
+            return input_devices[input_source].index
         raise ValueError(f"Input device index {input_source} out of range.")
     else:
         raise ValueError(f"Invalid input_source: {input_source}")
 
 
-def record_audio(duration: int = 10, sample_rate: int = 44100, device: Optional[int] = None) -> np.ndarray:
+def record_audio(
+    duration: int = 10,
+    sample_rate: int = 44100,
+    device: Optional[int] = None,
+    out: Optional[Union[np.ndarray, AudioBuffer]] = None,
+) -> np.ndarray:
     """Record audio from the specified input device.
     
     Args:
         duration: Recording duration in seconds (default: 10).
         sample_rate: Audio sample rate in Hz (default: 44100).
         device: Optional device index to record from.
+        out: Optional preallocated mono int16 array or pooled buffer to record
+             into. When given, ``duration`` is ignored and it is filled in
+             place; a pooled buffer also gets its ``overflow`` flag set.
         
     Returns:
-        Numpy array containing the recorded audio data.
+        Numpy array containing the recorded audio data (a view of ``out``
+        when it was provided).
     """
+    from autoscrobbler.buffers import AudioBuffer
+
     logger.info("Recording audio...")
-    audio = sd.rec(
-        int(duration * sample_rate),
-        samplerate=sample_rate,
-        channels=1,
-        dtype="int16",
-        device=device,
-    )
-    sd.wait()
-    return audio.flatten()
+    buffer = out if isinstance(out, AudioBuffer) else None
+    if buffer is not None:
+        out = buffer.samples
+    if out is not None:
+        audio = sd.rec(
+            samplerate=sample_rate,
+            device=device,
+            out=out.reshape(-1, 1),
+        )
+    else:
+        audio = sd.rec(
+            int(duration * sample_rate),
+            samplerate=sample_rate,
+            channels=1,
+            dtype="int16",
+            device=device,
+        )
+    status = sd.wait()
+    if status:
+        logger.warning(f"Recording reported PortAudio status: {status}")
+        if buffer is not None:
+            buffer.overflow = bool(status.input_overflow)
+    return audio.reshape(-1)
+
+
+_shazam: Optional[Shazam] = None
+_shazam_loop: Optional[EventLoopThread] = None
+
+
+def get_shazam() -> Shazam:
+    """Return the process-wide Shazam client, creating it on first use.
+    
+    Building shazamio's recognizer and an HTTP session for every
+    identification is wasted work, so one client is kept for the process.
+    Its session lives on the loop used by :func:`run_shazam`.
+    """
+    if _shazam is None:
+        return configure_shazam()
+    return _shazam
+
+
+def configure_shazam(http_client: Optional[HTTPClientInterface] = None) -> Shazam:
+    """Replace the process-wide Shazam client.
+    
+    Args:
+        http_client: Client sending Shazam's HTTP requests, e.g. a local
+                     stand-in (default: :class:`ShazamHTTPClient`).
+        
+    Returns:
+        The new Shazam client.
+    """
+    global _shazam
+    from shazamio import Shazam
+
+    from autoscrobbler.shazam_client import ShazamHTTPClient
+
+    close_shazam()
+    _shazam = Shazam(http_client=http_client or ShazamHTTPClient())
+    return _shazam
+
 
+def shazam_loop() -> EventLoopThread:
+    """Return the process-wide event loop that Shazam requests run on."""
+    global _shazam_loop
+    if _shazam_loop is None:
+        from autoscrobbler.shazam_client import EventLoopThread
 
-async def identify_song(audio_data: np.ndarray, sample_rate: int = 44100) -> dict[str, Any]:
+        _shazam_loop = EventLoopThread(name="shazam")
+    return _shazam_loop
+
+
+def run_shazam(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run a Shazam coroutine, such as :func:`identify_song`, to completion.
+    
+    Args:
+        coroutine: Coroutine using the process-wide Shazam client.
+        
+    Returns:
+        The coroutine's result.
+    """
+    return shazam_loop().run(coroutine)
+
+
+async def warm_up_shazam() -> None:
+    """Create the Shazam client and open its connection ahead of the first capture."""
+    warm_up = getattr(get_shazam().http_client, "warm_up", None)
+    if asyncio.iscoroutinefunction(warm_up):
+        await warm_up()
+
+
+def close_shazam() -> None:
+    """Close the process-wide Shazam client's connections and forget it."""
+    global _shazam
+    shazam, _shazam = _shazam, None
+    http_client = getattr(shazam, "http_client", None)
+    close = getattr(http_client, "close", None)
+    if _shazam_loop is not None and asyncio.iscoroutinefunction(close):
+        run_shazam(close())
+
+
+async def identify_song(
+    audio_data: Union[np.ndarray, AudioBuffer], sample_rate: int = 44100
+) -> dict[str, Any]:
     """Identify a song using ShazamIO from audio data.
     
     Args:
-        audio_data: Audio data array to identify.
-        sample_rate: Audio sample rate in Hz (default: 44100).
+        audio_data: Audio data array or pooled buffer to identify. Pooled
+                    buffers are passed to Shazam without copying.
+        sample_rate: Audio sample rate in Hz (default: 44100). Ignored for
+                     pooled buffers, which carry their own sample rate.
+        
+    Returns:
+        Dictionary containing song identification results from Shazam.
+        
+    Raises:
+        CircuitOpenError: If Shazam calls are paused after repeated failures.
+    """
+    from autoscrobbler.buffers import AudioBuffer, encode_wav
+
+    if isinstance(audio_data, AudioBuffer):
+        wav = audio_data.wav
+    else:
+        wav = encode_wav(audio_data, sample_rate)
+    shazam = get_shazam()
+    with metrics.SHAZAM_SECONDS.time(), tracing.span("shazam.recognize", bytes=len(wav)):
+        return await ratelimit.get_limiter().call(lambda: shazam.recognize(wav))
+
+
+async def identify_signature(signature: DecodedMessage) -> dict[str, Any]:
+    """Identify a song from a precomputed Shazam signature.
+    
+    Args:
+        signature: Signature from a streaming signature generator.
         
     Returns:
         Dictionary containing song identification results from Shazam.
+        
+    Raises:
+        CircuitOpenError: If Shazam calls are paused after repeated failures.
+    """
+    shazam = get_shazam()
+    peaks = sum(len(p) for p in signature.frequency_band_to_sound_peaks.values())
+    with metrics.SHAZAM_SECONDS.time(), tracing.span("shazam.recognize", peaks=peaks):
+        return await ratelimit.get_limiter().call(
+            lambda: shazam.send_recognize_request(signature)
+        )
+
+
+def log_hub_reply(reply: dict[str, Any]) -> None:
+    """Log what the hub did with a fingerprint from this edge node.
+    
+    Args:
+        reply: Answer from the hub.
+        
+    Raises:
+        RuntimeError: If the hub could not identify the fingerprint.
+    """
+    if reply.get("error"):
+        raise RuntimeError(f"Hub could not identify capture: {reply['error']}")
+    track = reply.get("track")
+    if track:
+        logger.info(
+            f"Hub identified: {track['artist']} - {track['title']} (from {reply.get('source')})"
+        )
+        nowplaying.get_publisher().identified(
+            normalize_key(track["artist"], track["title"]),
+            track["artist"],
+            track["title"],
+            None,
+            time.time(),
+        )
+    else:
+        logger.info("Hub found no song.")
+        nowplaying.get_publisher().miss(time.time())
+
+
+def log_capture_stats(
+    capture: CaptureProcess, previous: Optional[CaptureStats] = None
+) -> CaptureStats:
+    """Log any new overflows or xruns reported by the capture process.
+    
+    Args:
+        capture: Running capture process.
+        previous: Counters from the previous call, if any.
+        
+    Returns:
+        The current counters, to pass back in on the next call.
     """
-    shazam = Shazam()
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmpfile:
-        sf.write(tmpfile.name, audio_data, sample_rate)
-        out = await shazam.recognize(tmpfile.name)
-    os.unlink(tmpfile.name)
-    return out
+    stats = capture.stats()
+    overflows = stats.overflows - (previous.overflows if previous else 0)
+    xruns = stats.xruns - (previous.xruns if previous else 0)
+    if overflows or xruns:
+        logger.warning(
+            f"Capture reported {overflows} input overflow(s) and {xruns} xrun(s) "
+            f"since last cycle (totals: {stats.overflows} overflows, {stats.xruns} xruns)"
+        )
+    return stats
 
 
 def get_last_scrobbled_track(network: pylast.LastFMNetwork, username: str) -> Optional[Tuple[str, str]]:
@@ -226,8 +447,9 @@ def get_last_scrobbled_track(network: pylast.LastFMNetwork, username: str) -> Op
         Tuple of (artist, title) in lowercase, or None if unavailable.
     """
     try:
-        user = network.get_user(username)
-        recent_tracks = user.get_recent_tracks(limit=1)
+        with metrics.LASTFM_LOOKUP_SECONDS.time(), tracing.span("lastfm.get_recent_tracks"):
+            user = network.get_user(username)
+            recent_tracks = user.get_recent_tracks(limit=1)
         if recent_tracks and len(recent_tracks) > 0:
             # Get the most recent track
             last_track = recent_tracks[0]
@@ -240,7 +462,13 @@ def get_last_scrobbled_track(network: pylast.LastFMNetwork, username: str) -> Op
     return None
 
 
-def scrobble_song(network: pylast.LastFMNetwork, artist: str, title: str, album: Optional[str] = None) -> None:
+def scrobble_song(
+    network: pylast.LastFMNetwork,
+    artist: str,
+    title: str,
+    album: Optional[str] = None,
+    timestamp: Optional[float] = None,
+) -> None:
     """Scrobble a song to Last.fm.
     
     Args:
@@ -248,20 +476,26 @@ def scrobble_song(network: pylast.LastFMNetwork, artist: str, title: str, album:
         artist: Artist name.
         title: Song title.
         album: Optional album name.
+        timestamp: When the song was heard (default: now).
     """
     logger.info(
         f"Scrobbling: {artist} - {title} [{album if album else 'Unknown album'}]"
     )
-    network.scrobble(
-        artist=artist, title=title, album=album, timestamp=int(time.time())
-    )
+    with metrics.LASTFM_SCROBBLE_SECONDS.time(), tracing.span("lastfm.scrobble"):
+        network.scrobble(
+            artist=artist,
+            title=title,
+            album=album,
+            timestamp=int(timestamp if timestamp is not None else time.time()),
+        )
+    metrics.SCROBBLES.inc()
 
 
-def parse_arguments() -> argparse.Namespace:
-    """Parse command line arguments.
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line argument parser.
     
     Returns:
-        Namespace containing parsed arguments.
+        Parser for the autoscrobbler command line.
     """
     parser = argparse.ArgumentParser(
         description="Automatically scrobble songs to Last.fm using audio recognition",
@@ -273,6 +507,9 @@ Examples:
   python -m autoscrobbler --duty-cycle 30
   python -m autoscrobbler -c /path/to/credentials.json -d 45
   python -m autoscrobbler --input-source list
+  python -m autoscrobbler bench --endpoint http://localhost:8080
+
+Run "python -m autoscrobbler bench --help" for the hardware benchmark.
         """,
     )
 
@@ -298,7 +535,919 @@ Examples:
         type=str,
         default=None,
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--device-rescan",
+        help="Seconds between rescans of the audio devices, so the input device is "
+        "found again after it is replugged; 0 rescans only after capture errors (default: 300)",
+        type=float,
+        default=300.0,
+    )
+    parser.add_argument(
+        "--capture-process",
+        help="Capture audio continuously in a separate process instead of recording each cycle",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--streaming-signature",
+        help="Compute the Shazam signature incrementally as audio arrives instead "
+        "of from scratch every cycle (implies --capture-process)",
+        action="store_true",
+    )
+    quality = parser.add_argument_group(
+        "capture quality", "Skip identification of captures that fail these checks"
+    )
+    quality.add_argument(
+        "--min-rms-dbfs",
+        help="Minimum capture level in dBFS; quieter captures count as silence (default: -60)",
+        type=float,
+        default=-60.0,
+    )
+    quality.add_argument(
+        "--max-clipping",
+        help="Maximum fraction of clipped samples (default: 0.05)",
+        type=float,
+        default=0.05,
+    )
+    quality.add_argument(
+        "--min-snr-db",
+        help="Minimum estimated signal-to-noise ratio in dB (default: not checked)",
+        type=float,
+        default=None,
+    )
+    quality.add_argument(
+        "--max-dc-offset",
+        help="Maximum absolute DC offset as a fraction of full scale (default: not checked)",
+        type=float,
+        default=None,
+    )
+    quality.add_argument(
+        "--skip-on-overflow",
+        help="Skip identification when the capture reported an input overflow",
+        action="store_true",
+    )
+    quality.add_argument(
+        "--quality-log",
+        help="Append per-capture quality metrics to this JSON lines file",
+        type=str,
+        default=None,
+    )
+    conditioning = parser.add_argument_group(
+        "audio conditioning",
+        "Remove rumble and hum and raise the level of captures before identification",
+    )
+    conditioning.add_argument(
+        "--condition",
+        help="Condition captures before identification (not with --streaming-signature)",
+        action="store_true",
+    )
+    conditioning.add_argument(
+        "--highpass-hz",
+        help="High-pass cutoff in Hz; 0 removes only DC (default: 100)",
+        type=float,
+        default=100.0,
+    )
+    conditioning.add_argument(
+        "--hum",
+        help="Mains hum to notch: 50, 60, auto to detect it, or off (default: auto)",
+        choices=["auto", "50", "60", "off"],
+        default="auto",
+    )
+    conditioning.add_argument(
+        "--agc-target-dbfs",
+        help="Level quiet captures are amplified towards, in dBFS (default: -20)",
+        type=float,
+        default=-20.0,
+    )
+    conditioning.add_argument(
+        "--agc-max-gain-db",
+        help="Largest amplification in dB; 0 leaves the level alone (default: 30)",
+        type=float,
+        default=30.0,
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="Write per-cycle timing spans (OpenTelemetry JSON) to this rotating JSON lines file",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-max-bytes",
+        help="Rotate the trace file when it reaches this size (default: 10485760)",
+        type=int,
+        default=10 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--trace-backups",
+        help="Number of rotated trace files to keep (default: 3)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the first cycles with cProfile and tracemalloc (send SIGUSR1 to profile again later)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile-cycles",
+        help="Number of cycles each profiling session covers (default: 10)",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="Directory for profiling output (default: profiles)",
+        type=str,
+        default="profiles",
+    )
+    parser.add_argument(
+        "--archive",
+        help="Ring file keeping recent captures on disk; captures that could not "
+        "be identified are retried later and scrobbled with their original time "
+        "(default: disabled)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--archive-hours",
+        help="Hours of captures the archive keeps (default: 3)",
+        type=float,
+        default=3.0,
+    )
+    parser.add_argument(
+        "--history-db",
+        help="SQLite database recording every identification, decision and "
+        "scrobble (default: history.db)",
+        type=str,
+        default="history.db",
+    )
+    parser.add_argument(
+        "--history-retention-days",
+        help="Days of play history to keep; older events are deleted hourly "
+        "(default: 90, 0 keeps everything)",
+        type=float,
+        default=90.0,
+        metavar="DAYS",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print play history statistics for the last N days and exit",
+        type=float,
+        nargs="?",
+        const=7.0,
+        default=None,
+        metavar="DAYS",
+    )
+    parser.add_argument(
+        "--once",
+        help="Capture and identify once, print the result as JSON and exit "
+        "(nothing is scrobbled)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dedupe-file",
+        help="File remembering recently heard songs across restarts "
+        "(default: dedupe_index.json)",
+        type=str,
+        default="dedupe_index.json",
+    )
+    parser.add_argument(
+        "--dedupe-window",
+        help="Seconds a song must go unheard before hearing it again counts as "
+        "a new play (default: 300)",
+        type=float,
+        default=300.0,
+    )
+    budget = parser.add_argument_group("identification budget")
+    budget.add_argument(
+        "--daily-budget",
+        help="Maximum Shazam identification calls per day, spent on the most "
+        "promising captures (default: no budget)",
+        type=int,
+        default=None,
+    )
+    budget.add_argument(
+        "--budget-history",
+        help="File keeping the hourly listening history used to plan the budget "
+        "(default: budget_history.json)",
+        type=str,
+        default="budget_history.json",
+    )
+    limits = parser.add_argument_group("Shazam rate limiting")
+    limits.add_argument(
+        "--shazam-rate",
+        help="Maximum sustained Shazam requests per minute (default: 6)",
+        type=float,
+        default=6.0,
+    )
+    limits.add_argument(
+        "--shazam-burst",
+        help="Shazam requests allowed back to back (default: 2)",
+        type=int,
+        default=2,
+    )
+    limits.add_argument(
+        "--shazam-retries",
+        help="Retries of throttled or failed Shazam requests (default: 3)",
+        type=int,
+        default=3,
+    )
+    limits.add_argument(
+        "--breaker-threshold",
+        help="Consecutive failed identifications that pause Shazam calls (default: 5)",
+        type=int,
+        default=5,
+    )
+    limits.add_argument(
+        "--breaker-cooldown",
+        help="Seconds to pause Shazam calls after repeated failures (default: 300)",
+        type=float,
+        default=300.0,
+    )
+    room = parser.add_argument_group(
+        "room coordination",
+        "Share identifications and scrobbles with other nodes hearing the same music",
+    )
+    room.add_argument(
+        "--room",
+        help="Coordinate with other nodes over UDP so each song is identified "
+        "and scrobbled once",
+        action="store_true",
+    )
+    room.add_argument(
+        "--room-group",
+        help=f"Multicast group to gossip on, or '' for unicast peers only (default: {DEFAULT_GROUP})",
+        type=str,
+        default=DEFAULT_GROUP,
+    )
+    room.add_argument(
+        "--room-port",
+        help=f"UDP port to listen on (default: {DEFAULT_PORT})",
+        type=int,
+        default=DEFAULT_PORT,
+    )
+    room.add_argument(
+        "--room-peer",
+        help="Unicast address HOST[:PORT] of another node; may be repeated",
+        action="append",
+        default=[],
+        metavar="HOST[:PORT]",
+    )
+    room.add_argument(
+        "--room-settle",
+        help="Seconds to wait for other nodes' claims before scrobbling (default: 0.5)",
+        type=float,
+        default=0.5,
+    )
+    hub = parser.add_argument_group(
+        "edge/hub split",
+        "Identify and scrobble centrally for several lightweight capture nodes",
+    )
+    hub.add_argument(
+        "--hub",
+        help="Run as an edge node: send fingerprints to the hub at this URL "
+        "instead of calling Shazam and Last.fm (no credentials needed)",
+        type=str,
+        default=None,
+        metavar="URL",
+    )
+    hub.add_argument(
+        "--hub-listen",
+        help=f"Run as the hub: accept fingerprints from edge nodes on this "
+        f"address (port defaults to {DEFAULT_HUB_PORT}) instead of capturing audio",
+        type=str,
+        default=None,
+        metavar="HOST[:PORT]",
+    )
+    hub.add_argument(
+        "--hub-batch-window",
+        help="Seconds the hub collects fingerprints before identifying them together (default: 1)",
+        type=float,
+        default=1.0,
+    )
+    feed = parser.add_argument_group(
+        "now playing feed",
+        "Push identifications and scrobbles to local displays and controllers",
+    )
+    feed.add_argument(
+        "--now-playing-socket",
+        help="Stream events as JSON lines to subscribers of this Unix socket",
+        type=str,
+        default=None,
+        metavar="PATH",
+    )
+    feed.add_argument(
+        "--now-playing-port",
+        help="Serve events over WebSocket, and the current track to plain GET "
+        "requests, on this port (default: disabled)",
+        type=int,
+        default=None,
+    )
+    feed.add_argument(
+        "--now-playing-host",
+        help="Address for the now playing port to bind (default: 127.0.0.1)",
+        type=str,
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve Prometheus metrics on this port at /metrics (default: disabled)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-host",
+        help="Address for the metrics endpoint to bind (default: 127.0.0.1)",
+        type=str,
+        default="127.0.0.1",
+    )
+    log = parser.add_argument_group("logging")
+    log.add_argument(
+        "--log-format",
+        help="Write log records as plain text or as one JSON object per line (default: text)",
+        choices=logs.LOG_FORMATS,
+        default="text",
+    )
+    log.add_argument(
+        "--log-level",
+        help="Lowest level of records written (default: INFO)",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+    )
+    log.add_argument(
+        "--log-repeats",
+        help="Times a message is written before further repeats of it are sampled; "
+        "0 writes every one (default: 3)",
+        type=int,
+        default=3,
+    )
+    log.add_argument(
+        "--log-repeat-sample",
+        help="While sampling, write one in this many repeats of a message (default: 10)",
+        type=int,
+        default=10,
+    )
+    return parser
+
+
+def record_quality_metrics(quality: CaptureQuality) -> None:
+    """Publish a capture's quality metrics as gauges.
+    
+    Args:
+        quality: Metrics of the latest capture.
+    """
+    metrics.CAPTURE_QUALITY.set(quality.rms_dbfs, metric="rms_dbfs")
+    metrics.CAPTURE_QUALITY.set(quality.clipping_ratio, metric="clipping_ratio")
+    metrics.CAPTURE_QUALITY.set(quality.dc_offset, metric="dc_offset")
+    metrics.CAPTURE_QUALITY.set(quality.snr_db, metric="snr_db")
+    if quality.overflow:
+        metrics.CAPTURE_OVERFLOWS.inc()
+
+
+def condition_capture(conditioner: Conditioner, samples: np.ndarray, sample_rate: int) -> None:
+    """Condition a capture in place and publish what was done as gauges.
+    
+    Args:
+        conditioner: Conditioner to apply.
+        samples: Mono int16 samples, modified in place.
+        sample_rate: Sample rate of the samples in Hz.
+    """
+    with metrics.CONDITIONING_SECONDS.time(), tracing.span("condition") as span:
+        result = conditioner.condition(samples, sample_rate)
+        span.set_attribute("gain_db", result.gain_db)
+        span.set_attribute("hum_hz", result.hum_hz or 0.0)
+    metrics.CONDITIONING.set(result.gain_db, metric="gain_db")
+    metrics.CONDITIONING.set(result.hum_hz or 0.0, metric="hum_hz")
+    metrics.CONDITIONING.set(result.notched_bins, metric="notched_bins")
+
+
+def track_details(track_info: dict[str, Any]) -> Optional[Tuple[str, str, Optional[str]]]:
+    """Extract the names to scrobble from the track of a Shazam result.
+    
+    Args:
+        track_info: The ``track`` of a Shazam result.
+        
+    Returns:
+        Tuple of (artist, title, album or None), or None if the artist or
+        title is missing.
+    """
+    artist = track_info.get("subtitle", "").strip()
+    title = track_info.get("title", "").split("(")[0].strip()
+    if len(title) < 3:
+        title = track_info.get("title", "").strip()
+    if not (artist and title):
+        return None
+    album = None
+    for section in track_info.get("sections", []):
+        if section.get("type") == "SONG":
+            for item in section.get("metadata", []):
+                if item.get("title") == "Album":
+                    album = item.get("text").split("(")[0].strip()
+                    break
+    return artist, title, album
+
+
+def process_result(
+    result: dict[str, Any],
+    network: pylast.LastFMNetwork,
+    username: str,
+    dedupe: DedupeIndex,
+    history: Optional[PlayHistory] = None,
+    timestamp: Optional[float] = None,
+    room: Optional[RoomPeer] = None,
+) -> None:
+    """Scrobble the song in a Shazam result unless it is a duplicate.
+    
+    Args:
+        result: Shazam recognition result.
+        network: Authenticated Last.fm network instance.
+        username: Last.fm username, for the duplicate check.
+        dedupe: Index of songs recently heard by this node.
+        history: Play history recording the result and what was done with it.
+        timestamp: When the audio was captured, for results identified later
+                   from the archive (default: now).
+        room: Peer coordinating scrobbles with other nodes hearing the same music.
+    """
+    now = timestamp if timestamp is not None else time.time()
+    publisher = nowplaying.get_publisher()
+    track_info = result.get("track")
+    if not track_info:
+        metrics.IDENTIFICATIONS.inc(result="miss")
+        logger.warning("No song identified.")
+        publisher.miss(now)
+        if history is not None:
+            history.record_identification(result, timestamp=now)
+            history.record_decision("miss", timestamp=now)
+        return
+    metrics.IDENTIFICATIONS.inc(result="hit")
+
+    details = track_details(track_info)
+    if details is None:
+        logger.warning("Incomplete track info, skipping.")
+        if history is not None:
+            history.record_identification(result, timestamp=now)
+            history.record_decision("incomplete", timestamp=now)
+        return
+    artist, title, album = details
+    key = normalize_key(artist, title)
+    track_kwargs = {}
+    if album is not None:
+        track_kwargs["album"] = album
+    publisher.identified(key, artist, title, album, now)
+    if history is not None:
+        history.record_identification(result, key, artist, title, timestamp=now)
+
+    # First check against songs heard recently (fast, in-memory check)
+    if dedupe.observe(key, now):
+        logger.info("Same song as last time, skipping scrobble.")
+        metrics.DEDUPE_SKIPS.inc(source="local")
+        if history is not None:
+            history.record_decision("duplicate_local", key, artist, title, timestamp=now)
+        return
+
+    # Let other nodes in the room scrobble it if they claimed it first
+    if room is not None and not room.claim(key, now):
+        logger.info(f"Another node is scrobbling {artist} - {title}, skipping")
+        metrics.DEDUPE_SKIPS.inc(source="room")
+        dedupe.record(key, now)
+        if history is not None:
+            history.record_decision("duplicate_room", key, artist, title, timestamp=now)
+        return
+
+    # If not heard recently, check against Last.fm's last scrobbled track
+    last_scrobbled = get_last_scrobbled_track(network, username)
+    if last_scrobbled and key == normalize_key(*last_scrobbled):
+        logger.info(
+            f"Same song as last scrobbled on Last.fm, skipping: {artist} - {title}"
+        )
+        metrics.DEDUPE_SKIPS.inc(source="lastfm")
+        dedupe.record(key, now)
+        if history is not None:
+            history.record_decision("duplicate_lastfm", key, artist, title, timestamp=now)
+        return
+
+    # Not a duplicate locally or on Last.fm, safe to scrobble
+    if timestamp is not None:
+        track_kwargs["timestamp"] = timestamp
+    scrobble_song(network, artist, title, **track_kwargs)
+    dedupe.record(key, now)
+    if room is not None:
+        room.announce_scrobble(key, now)
+    publisher.scrobbled(key, artist, title, album, now)
+    if history is not None:
+        history.record_decision("scrobbled", key, artist, title, timestamp=now)
+        history.record_scrobble(key, artist, title, album, timestamp=now)
+
+
+def backfill_segment(
+    backfill: BackfillQueue,
+    network: pylast.LastFMNetwork,
+    username: str,
+    dedupe: DedupeIndex,
+    history: Optional[PlayHistory] = None,
+    room: Optional[RoomPeer] = None,
+    conditioner: Optional[Conditioner] = None,
+) -> bool:
+    """Identify the oldest archived capture again and scrobble it as of its capture time.
+    
+    Args:
+        backfill: Queue of archived captures whose identification failed.
+        network: Authenticated Last.fm network instance.
+        username: Last.fm username, for the duplicate check.
+        dedupe: Index of songs recently heard by this node.
+        history: Play history recording the result.
+        room: Peer coordinating scrobbles with other nodes.
+        conditioner: Conditioner applied to the capture, which is archived
+                     as recorded.
+        
+    Returns:
+        True if a song was identified.
+    """
+    segment = backfill.next()
+    if segment is None:
+        return False
+    heard = time.ctime(segment.timestamp)
+    try:
+        samples, sample_rate = segment.read()
+        if conditioner is not None:
+            condition_capture(conditioner, samples, sample_rate)
+        with tracing.span("backfill", attempt=segment.attempts + 1):
+            result = run_shazam(identify_song(samples, sample_rate))
+    except Exception as e:
+        logger.warning(f"Backfill of capture from {heard} failed: {e}")
+        metrics.BACKFILLS.inc(result="error")
+        backfill.failed(segment)
+        return False
+    if not result.get("track"):
+        logger.info(f"Backfill of capture from {heard} found no song")
+        metrics.BACKFILLS.inc(result="miss")
+        backfill.failed(segment)
+        return False
+    logger.info(f"Backfilling capture from {heard}")
+    metrics.BACKFILLS.inc(result="hit")
+    process_result(
+        result, network, username, dedupe, history, timestamp=segment.timestamp, room=room
+    )
+    backfill.done(segment)
+    return True
+
+
+def print_stats(path: str, days: float) -> None:
+    """Print a summary of the play history.
+    
+    Args:
+        path: Play history database.
+        days: How many days back to summarize.
+    """
+    if not os.path.exists(path):
+        print(f"No play history at {path}")
+        return
+    history = PlayHistory(path)
+    try:
+        stats = history.stats(since=time.time() - days * 86400)
+    finally:
+        history.close()
+    print(f"Last {days:g} days:")
+    print(f"  Identifications: {stats['identifications']}")
+    for decision, count in stats["decisions"].items():
+        print(f"    {decision}: {count}")
+    print(f"  Scrobbles: {stats['scrobbles']}")
+    if stats["top_tracks"]:
+        print("  Top tracks:")
+        for artist, title, plays in stats["top_tracks"]:
+            print(f"    {plays:4d}  {artist} - {title}")
+
+
+def load_lastfm_credentials(credentials_path: Optional[str]) -> Optional[dict[str, str]]:
+    """Load the Last.fm section of the credentials file.
+    
+    Args:
+        credentials_path: Optional path to credentials file.
+        
+    Returns:
+        The Last.fm credentials, or None if no credentials were found.
+    """
+    try:
+        creds = load_credentials(credentials_path)
+    except FileNotFoundError as e:
+        logger.error(f"Error: {e}")
+        logger.error(
+            "Use --credentials flag to specify a custom path to credentials.json"
+        )
+        return None
+    # shazamio_creds = creds.get("shazamio", {})
+    # locale = shazamio_creds.get("locale", "en-US")
+    return creds["lastfm"]
+
+
+def connect_lastfm(credentials_path: Optional[str]) -> Optional[Tuple[pylast.LastFMNetwork, str]]:
+    """Load credentials and set up the Last.fm network.
+    
+    Args:
+        credentials_path: Optional path to credentials file.
+        
+    Returns:
+        Tuple of (network, username), or None if no credentials were found.
+    """
+    lastfm_creds = load_lastfm_credentials(credentials_path)
+    if lastfm_creds is None:
+        return None
+    return lastfm_network(lastfm_creds), lastfm_creds["username"]
+
+
+def lastfm_network(lastfm_creds: dict[str, str]) -> pylast.LastFMNetwork:
+    """Authenticate with Last.fm.
+    
+    Args:
+        lastfm_creds: API key, secret, username and password.
+        
+    Returns:
+        Authenticated Last.fm network instance.
+    """
+    network = pylast.LastFMNetwork(
+        api_key=lastfm_creds["api_key"],
+        api_secret=lastfm_creds["api_secret"],
+        username=lastfm_creds["username"],
+        password_hash=pylast.md5(lastfm_creds["password"]),
+    )
+
+    # Enable rate limiting to prevent overlapping requests
+    network.enable_rate_limit()
+    return network
+
+
+def lastfm_error_is_permanent(error: Exception) -> bool:
+    """Whether a Last.fm authentication error will not clear up by retrying.
+    
+    Network errors, server errors and Last.fm's outage and rate limit
+    responses are retried; any other web service error, such as rejected
+    credentials or an invalid API key, is permanent.
+    
+    Args:
+        error: Exception raised by :func:`lastfm_network`.
+        
+    Returns:
+        True if authenticating again cannot succeed.
+    """
+    if not isinstance(error, pylast.WSError):
+        return False
+    transient = {
+        pylast.STATUS_OPERATION_FAILED,
+        pylast.STATUS_OFFLINE,
+        pylast.STATUS_TEMPORARILY_UNAVAILABLE,
+        pylast.STATUS_RATE_LIMIT_EXCEEDED,
+        500,
+        502,
+        503,
+        504,
+    }
+    # Codes from the API response are strings, HTTP statuses are ints
+    try:
+        return int(error.get_id()) not in transient
+    except (TypeError, ValueError):
+        return True
+
+
+def collect_lastfm(
+    authentication: Future[pylast.LastFMNetwork],
+    pool: ThreadPoolExecutor,
+    lastfm_creds: dict[str, str],
+) -> Tuple[Optional[pylast.LastFMNetwork], Optional[Future[pylast.LastFMNetwork]]]:
+    """Wait for a background Last.fm authentication.
+    
+    Args:
+        authentication: Pending :func:`lastfm_network` call.
+        pool: Executor to authenticate again on after a transient error.
+        lastfm_creds: API key, secret, username and password.
+        
+    Returns:
+        Tuple of (network, None) once authenticated, or (None, a new
+        authentication attempt) after a transient error.
+        
+    Raises:
+        SystemExit: If Last.fm rejected the credentials, as at start-up
+                    before authentication moved to the background.
+    """
+    try:
+        return authentication.result(), None
+    except Exception as e:
+        if lastfm_error_is_permanent(e):
+            logger.error(f"Last.fm authentication failed: {e}")
+            sys.exit(1)
+        logger.warning(f"Last.fm authentication failed, retrying: {e}")
+        return None, pool.submit(lastfm_network, lastfm_creds)
+
+
+def quality_thresholds(args: argparse.Namespace) -> QualityThresholds:
+    """Build the capture quality thresholds from command line arguments."""
+    from autoscrobbler.quality import QualityThresholds
+
+    return QualityThresholds(
+        min_rms_dbfs=args.min_rms_dbfs,
+        max_clipping_ratio=args.max_clipping,
+        min_snr_db=args.min_snr_db,
+        max_dc_offset=args.max_dc_offset,
+        skip_on_overflow=args.skip_on_overflow,
+    )
+
+
+def audio_conditioner(args: argparse.Namespace) -> Optional[Conditioner]:
+    """Build the capture conditioner from command line arguments, if enabled."""
+    if not args.condition:
+        return None
+    from autoscrobbler.conditioning import Conditioner, ConditioningSettings
+
+    return Conditioner(
+        ConditioningSettings(
+            highpass_hz=args.highpass_hz,
+            hum=args.hum,
+            target_dbfs=args.agc_target_dbfs,
+            max_gain_db=args.agc_max_gain_db,
+        )
+    )
+
+
+def configure_shazam_limiter(
+    args: argparse.Namespace, retry_allowed: Optional[Callable[[], bool]] = None
+) -> None:
+    """Set up the Shazam rate limiter from command line arguments.
+    
+    Args:
+        args: Parsed command line arguments.
+        retry_allowed: Asked before each retry, such as the budget planner's
+                       :meth:`~autoscrobbler.budget.BudgetPlanner.claim_retry`.
+    """
+    ratelimit.configure_limiter(
+        rate=args.shazam_rate / 60,
+        burst=args.shazam_burst,
+        max_retries=args.shazam_retries,
+        failure_threshold=args.breaker_threshold,
+        cooldown=args.breaker_cooldown,
+        retry_allowed=retry_allowed,
+    )
+
+
+def start_now_playing(args: argparse.Namespace) -> nowplaying.NowPlaying:
+    """Start the now playing feed requested on the command line.
+    
+    Args:
+        args: Parsed command line arguments.
+        
+    Returns:
+        The process-wide publisher; without a socket or port it only keeps
+        the snapshot.
+    """
+    websocket = None
+    if args.now_playing_port is not None:
+        websocket = (args.now_playing_host, args.now_playing_port)
+    if args.now_playing_socket is None and websocket is None:
+        return nowplaying.get_publisher()
+    try:
+        publisher = nowplaying.configure_publisher(args.now_playing_socket, websocket)
+    except OSError as e:
+        logger.error(f"Could not start now playing feed: {e}")
+        return nowplaying.get_publisher()
+    if publisher.socket_path is not None:
+        logger.info(f"Publishing now playing events on {publisher.socket_path}")
+    if publisher.port is not None:
+        logger.info(
+            f"Publishing now playing events on ws://{args.now_playing_host}:{publisher.port}"
+        )
+    return publisher
+
+
+def identify_once(args: argparse.Namespace, device: Optional[int]) -> dict[str, Any]:
+    """Capture and identify a single window, for scripts and cron jobs.
+    
+    Nothing is scrobbled or recorded in the play history.
+    
+    Args:
+        args: Parsed command line arguments.
+        device: Input device index to record from.
+        
+    Returns:
+        JSON-serializable report with the ``track`` (or None), the capture
+        ``quality``, the reason identification was ``skipped`` or the
+        ``error`` it failed with, and ``timings`` in seconds, including the
+        ``startup`` time before capture began.
+    """
+    from autoscrobbler.buffers import BufferPool
+    from autoscrobbler.quality import measure_quality
+
+    timings = {"startup": time.perf_counter() - STARTED}
+    report: dict[str, Any] = {"track": None, "skipped": None, "error": None, "timings": timings}
+    configure_shazam_limiter(args)
+    buffer_pool = BufferPool(frames=10 * 44100, sample_rate=44100, size=1)
+    with buffer_pool.acquire() as buffer:
+        began = time.perf_counter()
+        record_audio(device=device, out=buffer)
+        timings["capture"] = time.perf_counter() - began
+        quality = measure_quality(buffer.samples, buffer.overflow)
+        report["quality"] = {
+            name: value if not isinstance(value, float) or math.isfinite(value) else None
+            for name, value in dataclasses.asdict(quality).items()
+        }
+        report["skipped"] = quality_thresholds(args).rejection_reason(quality)
+        if report["skipped"]:
+            return report
+        conditioner = audio_conditioner(args)
+        if conditioner is not None:
+            began = time.perf_counter()
+            condition_capture(conditioner, buffer.samples, buffer.sample_rate)
+            timings["condition"] = time.perf_counter() - began
+        began = time.perf_counter()
+        try:
+            result = run_shazam(identify_song(buffer))
+        except Exception as e:
+            report["error"] = str(e)
+            return report
+        finally:
+            timings["identify"] = time.perf_counter() - began
+    track_info = result.get("track")
+    details = track_details(track_info) if track_info else None
+    if details is not None:
+        artist, title, album = details
+        report["track"] = {
+            "artist": artist,
+            "title": title,
+            "album": album,
+            "key": normalize_key(artist, title),
+            "shazam_key": track_info.get("key"),
+        }
+    return report
+
+
+def run_hub(args: argparse.Namespace) -> None:
+    """Identify and scrobble fingerprints sent by edge nodes until interrupted.
+    
+    Args:
+        args: Parsed command line arguments.
+    """
+    from autoscrobbler.hub import Hub, start_hub_server
+
+    connection = connect_lastfm(args.credentials)
+    if connection is None:
+        return
+    network, username = connection
+    dedupe = DedupeIndex(args.dedupe_file, gap=args.dedupe_window)
+    history = PlayHistory(args.history_db, retention_days=args.history_retention_days or None)
+    configure_shazam_limiter(args)
+    shazam_loop().submit(warm_up_shazam())
+
+    def process(result: dict[str, Any], timestamp: float) -> None:
+        process_result(result, network, username, dedupe, history, timestamp=timestamp)
+
+    hub = Hub(
+        lambda signature: run_shazam(identify_signature(signature)),
+        process,
+        batch_window=args.hub_batch_window,
+    )
+    metrics.QUEUE_DEPTH.set_function(lambda: hub.pending, queue="hub")
+    metrics.QUEUE_DEPTH.set_function(lambda: history.pending, queue="history")
+    metrics_server = None
+    if args.metrics_port is not None:
+        try:
+            metrics_server = metrics.start_metrics_server(
+                args.metrics_port, host=args.metrics_host
+            )
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint: {e}")
+    host, port = parse_address(args.hub_listen, DEFAULT_HUB_PORT)
+    try:
+        server = start_hub_server(hub, port, host=host)
+    except OSError as e:
+        logger.error(f"Could not start hub: {e}")
+        hub.close()
+        history.close()
+        close_shazam()
+        return
+    publisher = start_now_playing(args)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        hub.close()
+        history.close()
+        publisher.close()
+        close_shazam()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse command line arguments.
+    
+    Returns:
+        Namespace containing parsed arguments.
+    """
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.room and args.hub is not None:
+        # Shared results would be scrobbled, which edge nodes cannot do
+        parser.error("--room cannot be combined with --hub; run --room on the nodes that scrobble")
+    return args
 
 
 def main() -> None:
@@ -306,14 +1455,47 @@ def main() -> None:
     
     Handles credential loading, device selection, and the main scrobbling loop.
     """
+    if sys.argv[1:2] == ["bench"]:
+        from autoscrobbler import hardware
+
+        hardware.main(sys.argv[2:])
+        return
+
     # Parse command line arguments
     args = parse_arguments()
+    logs.configure_logging(
+        args.log_format,
+        level=args.log_level,
+        repeats=args.log_repeats,
+        sample=args.log_repeat_sample,
+    )
 
     # Check if user wants to list input devices
     if args.input_source and args.input_source.lower() == "list":
         list_input_devices()
         return
 
+    if args.stats is not None:
+        print_stats(args.history_db, args.stats)
+        return
+
+    if args.hub_listen is not None:
+        run_hub(args)
+        return
+
+    from autoscrobbler.archive import AudioArchive, BackfillQueue
+    from autoscrobbler.budget import BudgetPlanner, ListeningHistory, spectral_profile
+    from autoscrobbler.buffers import BufferPool
+    from autoscrobbler.capture import CaptureProcess
+    from autoscrobbler.hub import HubClient
+    from autoscrobbler.quality import QualityLog, measure_quality
+    from autoscrobbler.room import RoomPeer
+    from autoscrobbler.signature import (
+        SignatureFollower,
+        StreamingSignatureGenerator,
+        signature_of,
+    )
+
     # Determine input device
     input_source = args.input_source
     # Try to convert to int if possible
@@ -330,100 +1512,332 @@ def main() -> None:
         logger.error(f"Error selecting input device: {e}")
         return
     logger.info(f"Using input device index: {selected_device}")
+    device = None
     try:
-        device_info = sd.query_devices(selected_device)
-        logger.info(f"  Name: {device_info['name']}")
-        logger.info(f"  Index: {selected_device}")
-        logger.info(f"  Samplerate: {device_info['default_samplerate']}")
-        logger.info(f"  Channels: {device_info['max_input_channels']}")
+        device = device_registry().by_index(selected_device)
     except Exception as e:
         logger.error(f"Could not get selected input device info: {e}")
+    if device is not None:
+        logger.info(f"  Name: {device.name}")
+        logger.info(f"  Index: {selected_device}")
+        logger.info(f"  Host API: {device.hostapi}")
+        logger.info(f"  Samplerate: {device.default_samplerate}")
+        logger.info(f"  Channels: {device.channels}")
 
-    # Load credentials
-    try:
-        creds = load_credentials(args.credentials)
-    except FileNotFoundError as e:
-        logger.error(f"Error: {e}")
-        logger.error(
-            "Use --credentials flag to specify a custom path to credentials.json"
-        )
+    # Independent start-up steps run concurrently: the Shazam client connects
+    # on its event loop and Last.fm authenticates on a worker thread while the
+    # input stream is opened and the first window captured. Last.fm is only
+    # waited for when the first result needs processing; credentials it
+    # rejects end the process as soon as that is known.
+    if args.hub is None:
+        shazam_loop().submit(warm_up_shazam())
+
+    if args.once:
+        try:
+            report = identify_once(args, selected_device)
+        finally:
+            close_shazam()
+        print(json.dumps(report, indent=2))
+        if report["error"]:
+            sys.exit(1)
         return
-    lastfm_creds = creds["lastfm"]
-    # shazamio_creds = creds.get("shazamio", {})
-    # locale = shazamio_creds.get("locale", "en-US")
 
-    # Set up Last.fm network
-    network = pylast.LastFMNetwork(
-        api_key=lastfm_creds["api_key"],
-        api_secret=lastfm_creds["api_secret"],
-        username=lastfm_creds["username"],
-        password_hash=pylast.md5(lastfm_creds["password"]),
+    # Edge nodes leave Last.fm, the dedupe index and the play history to the hub
+    network = username = None
+    hub_client = None
+    lastfm_creds = None
+    lastfm = None
+    lastfm_pool = None
+    dedupe = None
+    if args.hub is not None:
+        hub_client = HubClient(args.hub, node=socket.gethostname())
+    else:
+        lastfm_creds = load_lastfm_credentials(args.credentials)
+        if lastfm_creds is None:
+            close_shazam()
+            return
+        username = lastfm_creds["username"]
+        lastfm_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lastfm")
+        lastfm = lastfm_pool.submit(lastfm_network, lastfm_creds)
+        dedupe = DedupeIndex(args.dedupe_file, gap=args.dedupe_window)
+
+    # A single reusable capture buffer; it is recorded into and identified
+    # in place every cycle instead of allocating fresh arrays.
+    buffer_pool = BufferPool(frames=10 * 44100, sample_rate=44100, size=1)
+
+    capture = None
+    follower = None
+    if args.capture_process or args.streaming_signature:
+        capture = CaptureProcess(
+            window_frames=buffer_pool.frames,
+            sample_rate=buffer_pool.sample_rate,
+            device=selected_device,
+        )
+        try:
+            capture.start()
+        except Exception as e:
+            logger.error(f"Could not start capture process: {e}")
+            capture.stop()
+            if lastfm_pool is not None:
+                lastfm_pool.shutdown(wait=False)
+            close_shazam()
+            return
+        if args.streaming_signature:
+            follower = SignatureFollower(
+                capture.ring,
+                StreamingSignatureGenerator(
+                    window_seconds=buffer_pool.frames / buffer_pool.sample_rate,
+                    sample_rate=buffer_pool.sample_rate,
+                ),
+            )
+            follower.start()
+    capture_stats = None
+    # The device is followed by name and host API, so a replugged device is
+    # reopened in place even when PortAudio gives it another index
+    watch = None
+    if device is not None:
+        watch = DeviceWatch(device_registry(), device, interval=args.device_rescan)
+    capture_failed = False
+
+    thresholds = quality_thresholds(args)
+    conditioner = audio_conditioner(args)
+    if conditioner is not None and follower is not None:
+        logger.warning("Streaming signatures are computed before conditioning; only backfills are conditioned")
+    quality_log = QualityLog(args.quality_log) if args.quality_log else None
+    planner = None
+    if args.daily_budget is not None:
+        planner = BudgetPlanner(
+            args.daily_budget,
+            history=ListeningHistory(args.budget_history),
+            sample_rate=buffer_pool.sample_rate,
+            clock=lambda: datetime.datetime.fromtimestamp(time.time()),
+        )
+
+    history = None
+    if args.hub is None:
+        history = PlayHistory(args.history_db, retention_days=args.history_retention_days or None)
+    room = None
+    if args.room:
+        room = RoomPeer(
+            group=args.room_group or None,
+            port=args.room_port,
+            peers=[parse_address(peer, args.room_port) for peer in args.room_peer],
+            settle=args.room_settle,
+            window=args.dedupe_window,
+        )
+        logger.info(f"Coordinating with other nodes as {room.node_id} on UDP port {room.port}")
+    archive = None
+    backfill = None
+    if args.archive:
+        archive = AudioArchive(
+            args.archive,
+            slots=max(1, int(args.archive_hours * 3600 / max(args.duty_cycle, 1))),
+            frames=buffer_pool.frames,
+            sample_rate=buffer_pool.sample_rate,
+        )
+        backfill = BackfillQueue(archive.spool_dir)
+        metrics.QUEUE_DEPTH.set_function(lambda: len(backfill), queue="backfill")
+
+    metrics.QUEUE_DEPTH.set_function(
+        lambda: buffer_pool.size - buffer_pool.available, queue="audio_buffers"
     )
+    if history is not None:
+        metrics.QUEUE_DEPTH.set_function(lambda: history.pending, queue="history")
+    metrics_server = None
+    if args.metrics_port is not None:
+        try:
+            metrics_server = metrics.start_metrics_server(
+                args.metrics_port, host=args.metrics_host
+            )
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint: {e}")
+    publisher = start_now_playing(args)
 
-    username = lastfm_creds["username"]
-    last_song = None
+    # Every request counts, so retries are paid for out of the budget too
+    configure_shazam_limiter(args, retry_allowed=planner.claim_retry if planner is not None else None)
 
-    # Enable rate limiting to prevent overlapping requests
-    network.enable_rate_limit()
+    tracer = tracing.configure_tracing(
+        args.trace_file,
+        max_bytes=args.trace_max_bytes,
+        backup_count=args.trace_backups,
+    )
+
+    # Profiling sessions start on --profile or SIGUSR1 without stopping the loop
+    profiler = Profiler(args.profile_dir, cycles=args.profile_cycles, loops=[shazam_loop().loop])
+    profiler.install_signal_handler()
+    if args.profile:
+        profiler.request()
 
+    startup = time.perf_counter() - STARTED
+    metrics.STARTUP_SECONDS.set(startup)
     logger.info(
-        f"Starting passive audio scrobbler with {args.duty_cycle}s duty cycle. Press Ctrl+C to stop."
+        f"Starting passive audio scrobbler with {args.duty_cycle}s duty cycle "
+        f"(started in {startup:.2f}s). Press Ctrl+C to stop."
     )
-    while True:
-        start_time = time.time()
-        try:
-            audio_data = record_audio(device=selected_device)
-            result = asyncio.run(identify_song(audio_data))
-            # Write last result to file
-            with open("last_result.json", "w") as f:
-                json.dump(result, f)
-            track_info = result.get("track")
-            if track_info:
-                artist = track_info.get("subtitle").strip()
-                title = track_info.get("title").split("(")[0].strip()
-                if len(title) < 3:
-                    title = track_info.get("title").strip()
-                if artist and title:
-                    current_song = (artist.lower(), title.lower())
-                    
-                    # First check against local last_song (fast, in-memory check)
-                    if current_song == last_song:
-                        logger.info("Same song as last time, skipping scrobble.")
-                    else:
-                        # If different from local, check against Last.fm's last scrobbled track
-                        last_scrobbled = get_last_scrobbled_track(network, username)
-                        if last_scrobbled and current_song == last_scrobbled:
-                            logger.info(
-                                f"Same song as last scrobbled on Last.fm, skipping: {artist} - {title}"
-                            )
+    try:
+        while True:
+            start_time = time.time()
+            profiler.before_cycle()
+            with tracer.cycle(duty_cycle=args.duty_cycle) as cycle_span:
+                try:
+                    # Stop before spending a Shazam call if Last.fm already refused us
+                    if lastfm is not None and lastfm.done():
+                        network, lastfm = collect_lastfm(lastfm, lastfm_pool, lastfm_creds)
+                    if watch is not None and watch.check(failed=capture_failed):
+                        selected_device = watch.index
+                        metrics.DEVICE_REOPENS.inc()
+                        logger.info(f"Reopening input stream on device index {selected_device}")
+                        if capture is not None:
+                            capture.restart(selected_device)
+                    capture_failed = False
+                    with buffer_pool.acquire() as buffer:
+                        with metrics.CAPTURE_SECONDS.time(), tracing.span("capture") as span:
+                            try:
+                                if capture is not None:
+                                    span.set_attribute("source", "process")
+                                    previous_overflows = capture_stats.overflows if capture_stats else 0
+                                    capture.read_into(buffer.samples)
+                                    capture_stats = log_capture_stats(capture, capture_stats)
+                                    buffer.overflow = capture_stats.overflows > previous_overflows
+                                else:
+                                    span.set_attribute("source", "device")
+                                    record_audio(device=selected_device, out=buffer)
+                            except Exception:
+                                capture_failed = True
+                                raise
+                        slot = archive.append(buffer.samples, start_time) if archive is not None else None
+                        with tracing.span("quality") as span:
+                            buffer.quality = measure_quality(buffer.samples, buffer.overflow)
+                            record_quality_metrics(buffer.quality)
+                            skip_reason = thresholds.rejection_reason(buffer.quality)
+                            if quality_log is not None:
+                                quality_log.write(buffer.quality, skip_reason)
+                            span.set_attribute("rms_dbfs", buffer.quality.rms_dbfs)
+                            span.set_attribute("skipped", skip_reason or "")
+                        shared = None
+                        profile = None
+                        if not skip_reason and room is not None:
+                            with tracing.span("room.match") as span:
+                                profile = spectral_profile(buffer.samples, buffer.sample_rate)
+                                shared = room.match(profile, start_time)
+                                span.set_attribute("shared", shared is not None)
+                        budget_reason = None
+                        if not skip_reason and shared is None and planner is not None:
+                            with tracing.span("budget") as span:
+                                budget_reason = planner.claim(buffer.samples, buffer.quality)
+                                span.set_attribute("deferred", budget_reason or "")
+                        if skip_reason:
+                            logger.info(f"Skipping identification: {skip_reason}")
+                            metrics.CAPTURES_SKIPPED.inc()
+                            result = None
+                        elif shared is not None:
+                            logger.info("Another node identified this song, reusing its result")
+                            metrics.ROOM_SHARED_RESULTS.inc()
+                            result = shared
+                        elif budget_reason:
+                            logger.info(f"Deferring identification: {budget_reason}")
+                            metrics.BUDGET_DEFERRALS.inc()
+                            result = None
                         else:
-                            # Different from both local and Last.fm, safe to scrobble
-                            track_kwargs = {}
-                            sections = track_info.get("sections", [])
-                            for section in sections:
-                                if section.get("type") == "SONG":
-                                    for item in section.get("metadata", []):
-                                        if item.get("title") == "Album":
-                                            track_kwargs["album"] = (
-                                                item.get("text").split("(")[0].strip()
-                                            )
-                                            break
-                            scrobble_song(network, artist, title, **track_kwargs)
-                            last_song = current_song
-                else:
-                    logger.warning("Incomplete track info, skipping.")
-            else:
-                logger.warning("No song identified.")
-        except Exception as e:
-            logger.error(f"Error: {e}")
+                            try:
+                                if hub_client is not None:
+                                    if profile is None:
+                                        profile = spectral_profile(buffer.samples, buffer.sample_rate)
+                                    with tracing.span("hub.submit"):
+                                        if follower is not None:
+                                            signature = follower.generator.signature()
+                                        else:
+                                            if conditioner is not None:
+                                                condition_capture(conditioner, buffer.samples, buffer.sample_rate)
+                                            signature = signature_of(buffer.samples, buffer.sample_rate)
+                                        reply = hub_client.submit(signature, profile, start_time)
+                                    log_hub_reply(reply)
+                                    result = None
+                                elif follower is not None:
+                                    signature = follower.generator.signature()
+                                    result = run_shazam(identify_signature(signature))
+                                else:
+                                    if conditioner is not None:
+                                        condition_capture(conditioner, buffer.samples, buffer.sample_rate)
+                                    result = run_shazam(identify_song(buffer))
+                            except CircuitOpenError as e:
+                                logger.warning(f"Skipping identification: {e}")
+                                result = None
+                                if archive is not None:
+                                    archive.mark_failed(slot)
+                            except Exception:
+                                metrics.IDENTIFICATIONS.inc(result="error")
+                                if archive is not None:
+                                    archive.mark_failed(slot)
+                                raise
+                            if archive is not None and result is not None and not result.get("track"):
+                                archive.mark_failed(slot, miss=True)
+                            if room is not None and result is not None and result.get("track"):
+                                room.announce_result(result, profile, start_time)
+                    if result is not None:
+                        if planner is not None:
+                            planner.record_result(bool(result.get("track")))
+                        try:
+                            if lastfm is not None:
+                                network, lastfm = collect_lastfm(lastfm, lastfm_pool, lastfm_creds)
+                            if network is None:
+                                raise RuntimeError("Not authenticated with Last.fm yet")
+                            if room is not None:
+                                room.sync(dedupe)
+                            with tracing.span("process_result"):
+                                process_result(result, network, username, dedupe, history, room=room)
+                        except Exception:
+                            # Last.fm is down: keep the song to scrobble once it is back
+                            if archive is not None and result.get("track"):
+                                archive.mark_failed(slot)
+                            raise
+                        # Shazam is reachable again: retry one archived capture per cycle
+                        if (
+                            backfill is not None
+                            and network is not None
+                            and result.get("track")
+                            and len(backfill)
+                            and (planner is None or planner.claim_backfill())
+                        ):
+                            backfill_segment(
+                                backfill, network, username, dedupe, history, room, conditioner
+                            )
+                except Exception as e:
+                    cycle_span.record_error(e)
+                    logger.error(f"Error: {e}")
+            profiler.after_cycle()
 
-        # Calculate processing time and adjust sleep duration
-        processing_time = time.time() - start_time
-        sleep_time = max(0, args.duty_cycle - processing_time)
-        logger.info(
-            f"Processing took {processing_time:.1f}s, waiting {sleep_time:.1f}s before next attempt..."
-        )
-        time.sleep(sleep_time)
+            # Calculate processing time and adjust sleep duration
+            processing_time = time.time() - start_time
+            metrics.CYCLE_SECONDS.observe(processing_time)
+            if processing_time > args.duty_cycle:
+                metrics.CYCLE_OVERRUNS.inc()
+            sleep_time = max(0, args.duty_cycle - processing_time)
+            logger.info(
+                f"Processing took {processing_time:.1f}s, waiting {sleep_time:.1f}s before next attempt..."
+            )
+            time.sleep(sleep_time)
+    finally:
+        if follower is not None:
+            follower.stop()
+        if capture is not None:
+            capture.stop()
+        if quality_log is not None:
+            quality_log.close()
+        if history is not None:
+            history.close()
+        if room is not None:
+            room.close()
+        if archive is not None:
+            archive.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        publisher.close()
+        if lastfm_pool is not None:
+            lastfm_pool.shutdown(wait=False)
+        close_shazam()
+        tracer.close()
+        profiler.close()
 
 
 if __name__ == "__main__":
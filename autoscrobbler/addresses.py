@@ -0,0 +1,28 @@
+"""Default network addresses of the room and hub options.
+
+Kept free of heavy imports so the command line parser can use them without
+loading numpy.
+"""
+
+DEFAULT_GROUP = "239.255.42.99"
+DEFAULT_PORT = 45454
+DEFAULT_HUB_PORT = 8765
+
+
+def parse_address(value: str, default_port: int = DEFAULT_PORT) -> tuple[str, int]:
+    """Parse ``host[:port]`` into an address tuple.
+
+    Args:
+        value: Host name or IP address, optionally with a port.
+        default_port: Port used when none is given.
+
+    Returns:
+        Tuple of (host, port).
+
+    Raises:
+        ValueError: If the port is not a number.
+    """
+    host, _, port = value.rpartition(":")
+    if not host:
+        return value, default_port
+    return host, int(port)
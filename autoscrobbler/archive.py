@@ -0,0 +1,279 @@
+"""Rolling archive of captured audio, for re-identifying failed captures.
+
+:class:`AudioArchive` keeps the last few hours of captures in a memory-mapped
+ring file, one fixed-size slot per capture holding its timestamp, status and
+samples. Appending a capture is a single copy into the mapping; the kernel
+writes it back to disk, so the archive survives restarts.
+
+Captures whose identification failed (network error, throttling, a miss)
+are marked as failed and handed to a background thread that compresses them to
+FLAC files in a spool directory next to the ring, where they outlive the ring
+wrapping around. :class:`BackfillQueue` serves the spooled captures oldest
+first, so they can be identified again once Shazam is reachable and scrobbled
+with the time they were originally heard.
+
+The spool holds at most as many captures as the ring, oldest dropped first.
+Plain misses, which Shazam answered without finding a song, get a much
+smaller allowance and a single retry: in a quiet room nearly every capture is
+one, and they rarely match the second time.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+# Slot states
+EMPTY = 0
+CAPTURED = 1
+FAILED = 2
+SPOOLED = 3
+
+# Last.fm rejects scrobbles older than two weeks
+MAX_BACKFILL_AGE = 13 * 86400
+# Spooled captures that were plain misses rather than failed requests
+MAX_SPOOLED_MISSES = 10
+
+
+def _slot_dtype(frames: int) -> np.dtype:
+    return np.dtype([("timestamp", "<f8"), ("status", "<i8"), ("samples", "<i2", (frames,))])
+
+
+class AudioArchive:
+    """Memory-mapped ring of recent captures with FLAC spooling of failures.
+
+    An existing ring file with the same slot layout is reused, so captures
+    from before a restart stay available.
+
+    Args:
+        path: Ring file, created if missing.
+        slots: Number of captures kept.
+        frames: Samples per capture.
+        sample_rate: Sample rate of the captures in Hz.
+        max_spooled: Spooled captures kept, oldest removed first (default:
+                     ``slots``).
+        max_misses: Of those, how many may be plain misses.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        slots: int,
+        frames: int,
+        sample_rate: int = 44100,
+        max_spooled: Optional[int] = None,
+        max_misses: int = MAX_SPOOLED_MISSES,
+    ) -> None:
+        self.path = path
+        self.spool_dir = f"{path}.spool"
+        self.sample_rate = sample_rate
+        self.max_spooled = max_spooled if max_spooled is not None else slots
+        self.max_misses = max_misses
+        dtype = _slot_dtype(frames)
+        size = slots * dtype.itemsize
+        reuse = os.path.exists(path) and os.path.getsize(path) == size
+        self._ring = np.memmap(path, dtype=dtype, mode="r+" if reuse else "w+", shape=(slots,))
+        self._next = int(np.argmax(self._ring["timestamp"]) + 1) % slots if reuse else 0
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue: "queue.SimpleQueue[Optional[tuple[int, float, bool]]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._spool_loop, name="archive-spool", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def slots(self) -> int:
+        """Number of captures the ring holds."""
+        return len(self._ring)
+
+    def append(self, samples: np.ndarray, timestamp: float) -> int:
+        """Copy a capture into the next slot, overwriting the oldest.
+
+        Args:
+            samples: Mono int16 samples, exactly one slot long.
+            timestamp: When the capture was taken, in seconds since the epoch.
+
+        Returns:
+            The slot index, for :meth:`mark_failed`.
+        """
+        slot = self._next
+        self._ring["status"][slot] = EMPTY
+        self._ring["samples"][slot] = samples
+        self._ring["timestamp"][slot] = timestamp
+        self._ring["status"][slot] = CAPTURED
+        self._next = (slot + 1) % len(self._ring)
+        return slot
+
+    def mark_failed(self, slot: int, miss: bool = False) -> None:
+        """Queue a capture whose identification failed for spooling.
+
+        Args:
+            slot: Slot returned by :meth:`append`.
+            miss: Whether Shazam answered but found no song, rather than the
+                  request failing.
+        """
+        self._ring["status"][slot] = FAILED
+        self._queue.put((slot, float(self._ring["timestamp"][slot]), miss))
+
+    def status(self, slot: int) -> int:
+        """State of a slot: EMPTY, CAPTURED, FAILED or SPOOLED."""
+        return int(self._ring["status"][slot])
+
+    def flush(self) -> None:
+        """Wait for queued spooling to finish."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self) -> None:
+        """Spool queued captures, stop the background thread and unmap the ring."""
+        self._queue.put(None)
+        self._thread.join()
+        self._ring.flush()
+        del self._ring
+
+    def _spool_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            slot, timestamp, miss = item
+            samples = np.array(self._ring["samples"][slot])
+            if self._ring["timestamp"][slot] != timestamp:
+                logger.warning("Archived capture was overwritten before it could be spooled")
+                continue
+            path = os.path.join(self.spool_dir, _spool_name(timestamp, 0, miss))
+            try:
+                # Written under a temporary name so readers never see partial files
+                sf.write(f"{path}.tmp", samples, self.sample_rate, format="FLAC", subtype="PCM_16")
+                os.replace(f"{path}.tmp", path)
+            except Exception as e:
+                logger.error(f"Could not spool archived capture: {e}")
+                continue
+            if self._ring["timestamp"][slot] == timestamp:
+                self._ring["status"][slot] = SPOOLED
+            self._trim()
+
+    def _trim(self) -> None:
+        """Remove the oldest spooled captures beyond the limits."""
+        segments = spooled_segments(self.spool_dir)
+        misses = [segment for segment in segments if segment.miss]
+        excess = misses[: max(0, len(misses) - self.max_misses)]
+        kept = [segment for segment in segments if segment not in excess]
+        excess += kept[: max(0, len(kept) - self.max_spooled)]
+        if excess:
+            logger.info(f"Spool full, dropping {len(excess)} archived capture(s)")
+        for segment in excess:
+            _remove(segment)
+
+
+@dataclass
+class Segment:
+    """A spooled capture waiting to be identified again.
+
+    Attributes:
+        path: FLAC file holding the capture.
+        timestamp: When the capture was taken, in seconds since the epoch.
+        attempts: Failed backfill attempts so far.
+        miss: Whether the capture was a plain miss rather than a failed
+              request.
+    """
+
+    path: str
+    timestamp: float
+    attempts: int
+    miss: bool = False
+
+    def read(self) -> tuple[np.ndarray, int]:
+        """Decode the capture to int16 samples and its sample rate."""
+        samples, sample_rate = sf.read(self.path, dtype="int16")
+        return samples, sample_rate
+
+
+def _spool_name(timestamp: float, attempts: int, miss: bool) -> str:
+    return f"{int(timestamp * 1000)}.{attempts}{'.miss' if miss else ''}.flac"
+
+
+def spooled_segments(spool_dir: str) -> list[Segment]:
+    """Captures in a spool directory, oldest first."""
+    segments = []
+    try:
+        names = os.listdir(spool_dir)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        parts = name.split(".")
+        if parts[-1] != "flac" or len(parts) not in (3, 4) or parts[2:-1] not in ([], ["miss"]):
+            continue
+        millis, attempts = parts[:2]
+        if not millis.isdigit() or not attempts.isdigit():
+            continue
+        path = os.path.join(spool_dir, name)
+        segments.append(Segment(path, int(millis) / 1000, int(attempts), miss=len(parts) == 4))
+    return sorted(segments, key=lambda segment: segment.timestamp)
+
+
+def _remove(segment: Segment) -> None:
+    try:
+        os.remove(segment.path)
+    except FileNotFoundError:
+        pass
+
+
+class BackfillQueue:
+    """Spooled captures, oldest first, with a limited number of attempts each.
+
+    Args:
+        spool_dir: Directory the archive spools FLAC captures into.
+        max_attempts: Attempts before a capture is given up on (default: 2);
+                      plain misses get one.
+    """
+
+    def __init__(self, spool_dir: str, max_attempts: int = 2) -> None:
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+
+    def _segments(self) -> list[Segment]:
+        return spooled_segments(self.spool_dir)
+
+    def __len__(self) -> int:
+        return len(self._segments())
+
+    def next(self, now: Optional[float] = None) -> Optional[Segment]:
+        """Oldest capture still worth identifying; expired ones are removed."""
+        now = time.time() if now is None else now
+        for segment in self._segments():
+            if now - segment.timestamp <= MAX_BACKFILL_AGE:
+                return segment
+            logger.info(f"Dropping archived capture from {time.ctime(segment.timestamp)}, too old")
+            _remove(segment)
+        return None
+
+    def done(self, segment: Segment) -> None:
+        """Remove a capture that was identified."""
+        _remove(segment)
+
+    def failed(self, segment: Segment) -> None:
+        """Count a failed attempt, giving up after ``max_attempts``."""
+        attempts = segment.attempts + 1
+        if attempts >= (1 if segment.miss else self.max_attempts):
+            _remove(segment)
+            return
+        path = os.path.join(self.spool_dir, _spool_name(segment.timestamp, attempts, segment.miss))
+        try:
+            os.replace(segment.path, path)
+        except FileNotFoundError:
+            # Dropped from a full spool meanwhile
+            pass
+
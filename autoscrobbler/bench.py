@@ -0,0 +1,506 @@
+"""Offline benchmarks of the stages of a scrobbling cycle.
+
+Each stage runs the code used by the main loop on synthetic music, with the
+Shazam and Last.fm stand-ins from :mod:`autoscrobbler.standins` answering in
+process, so no microphone, network or API key is needed:
+
+* ``capture_handoff``: a second of audio written to the capture ring buffer,
+  then the latest window copied into a pooled WAV buffer.
+* ``condition``: conditioning a pooled buffer holding a window impaired like
+  a turntable capture (:data:`~autoscrobbler.standins.IMPAIRMENTS`).
+* ``identify``: :func:`identify_song` on a pooled buffer, covering signature
+  generation, the recognition request and its response.
+* ``parse_dedupe``: extracting the track from a Shazam response and checking
+  it against the dedupe index, for a session where the song changes every
+  few cycles.
+* ``lastfm_lookup``: fetching the latest scrobble for the duplicate check.
+* ``scrobble``: sending a scrobble.
+
+Every stage reports throughput, p50/p99 latency and allocations per cycle.
+Allocations are measured with tracemalloc in a separate pass, so tracing does
+not slow down the timed cycles. They only cover Python allocations: memory
+allocated by native code, such as shazamio's signature generator, is not seen.
+
+Run ``python -m autoscrobbler.bench`` for a table, or add ``--json``.
+
+With ``--match-rate``, windows of each track are impaired in each of the
+ways in :data:`~autoscrobbler.standins.IMPAIRMENTS` and identified through
+the Shazam stand-in as captured and after conditioning, to show what
+conditioning gains. ``--music`` uses recordings as the tracks instead of
+synthetic music.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from autoscrobbler import logs, ratelimit
+from autoscrobbler.__main__ import (
+    close_shazam,
+    configure_shazam,
+    get_last_scrobbled_track,
+    identify_song,
+    run_shazam,
+    scrobble_song,
+    track_details,
+)
+from autoscrobbler.buffers import BufferPool
+from autoscrobbler.capture import CaptureProcess
+from autoscrobbler.conditioning import Conditioner, ConditioningSettings
+from autoscrobbler.dedupe import DedupeIndex, normalize_key
+from autoscrobbler.standins import (
+    IMPAIRMENTS,
+    Impairment,
+    LastfmStandIn,
+    ShazamStandIn,
+    ShazamStandInClient,
+    Track,
+    impair,
+    synthetic_music,
+)
+
+SAMPLE_RATE = 44100
+WINDOW_SECONDS = 10
+USERNAME = "bench"
+
+
+@dataclass(frozen=True)
+class Stage:
+    """A benchmarked stage.
+
+    Attributes:
+        name: Stage name.
+        cycle: Runs one cycle of the stage.
+        iterations: Default number of timed cycles.
+    """
+
+    name: str
+    cycle: Callable[[], Any]
+    iterations: int
+
+
+@dataclass(frozen=True)
+class StageResult:
+    """Measurements of one stage.
+
+    Attributes:
+        name: Stage name.
+        iterations: Number of timed cycles.
+        throughput: Cycles per second.
+        p50_ms: Median cycle latency in milliseconds.
+        p99_ms: 99th percentile cycle latency in milliseconds.
+        alloc_bytes: Mean peak of Python memory allocated during a cycle.
+        retained_bytes: Mean growth of allocated memory per cycle.
+    """
+
+    name: str
+    iterations: int
+    throughput: float
+    p50_ms: float
+    p99_ms: float
+    alloc_bytes: int
+    retained_bytes: int
+
+
+@dataclass(frozen=True)
+class MatchRate:
+    """Recognitions of impaired captures, as captured and conditioned.
+
+    Attributes:
+        impairment: Name of the impairment.
+        captures: Captures identified each way.
+        raw: Fraction recognized as the track played, as captured.
+        conditioned: Fraction recognized as the track played after conditioning.
+        condition_ms: Median time to condition a capture in milliseconds.
+    """
+
+    impairment: str
+    captures: int
+    raw: float
+    conditioned: float
+    condition_ms: float
+
+
+def measure(
+    name: str,
+    cycle: Callable[[], Any],
+    iterations: int,
+    warmup: int = 2,
+    alloc_iterations: int = 20,
+) -> StageResult:
+    """Time a stage and measure its allocations.
+
+    Args:
+        name: Stage name.
+        cycle: Runs one cycle of the stage.
+        iterations: Number of timed cycles.
+        warmup: Untimed cycles run first, to fill caches and pools.
+        alloc_iterations: Most cycles run again under tracemalloc.
+
+    Returns:
+        The measurements.
+    """
+    for _ in range(warmup):
+        cycle()
+    latencies = np.empty(iterations)
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        cycle()
+        latencies[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - started
+
+    traced = max(1, min(iterations, alloc_iterations))
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        peaks = 0
+        first, _ = tracemalloc.get_traced_memory()
+        for _ in range(traced):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            cycle()
+            peaks += tracemalloc.get_traced_memory()[1] - current
+        last, _ = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    return StageResult(
+        name=name,
+        iterations=iterations,
+        throughput=iterations / elapsed if elapsed > 0 else float("inf"),
+        p50_ms=float(np.percentile(latencies, 50)) * 1000,
+        p99_ms=float(np.percentile(latencies, 99)) * 1000,
+        alloc_bytes=peaks // traced,
+        retained_bytes=(last - first) // traced,
+    )
+
+
+def session_results(tracks: Sequence[Track], cycles: int, cycles_per_track: int = 4) -> list[dict[str, Any]]:
+    """Shazam responses for a session where the song changes every few cycles.
+
+    Args:
+        tracks: Tracks played in turn.
+        cycles: Number of responses.
+        cycles_per_track: Consecutive cycles identifying the same track.
+
+    Returns:
+        One response per cycle; every fifth one is a miss.
+    """
+    results = []
+    for i in range(cycles):
+        if i % 5 == 4:
+            results.append({"matches": []})
+        else:
+            results.append(tracks[(i // cycles_per_track) % len(tracks)].shazam_result())
+    return results
+
+
+@contextlib.contextmanager
+def stages(
+    tracks: int = 3, track_seconds: float = 30.0, sample_rate: int = SAMPLE_RATE
+) -> Iterator[list[Stage]]:
+    """Set up every stage on synthetic music and the in-process stand-ins.
+
+    Identification goes through the process-wide Shazam client and request
+    limiter, so both are replaced: the client by one answering from the
+    stand-in, the limiter by one that never waits. The client is closed
+    afterwards; the limiter stays, as benchmarks run in a process of their own.
+
+    Args:
+        tracks: Number of synthetic tracks known to the Shazam stand-in.
+        track_seconds: Length of each track, at least the 10 second window.
+        sample_rate: Capture sample rate in Hz.
+
+    Yields:
+        The stages, in the order of a cycle.
+    """
+    window = WINDOW_SECONDS * sample_rate
+    music = [synthetic_music(track_seconds, sample_rate, seed=i) for i in range(tracks)]
+    known = [
+        Track(f"Bench Artist {i}", f"Bench Song {i} (Radio Edit)", f"Bench Album {i}", key=str(i))
+        for i in range(tracks)
+    ]
+    shazam = ShazamStandIn()
+    for track, audio in zip(known, music):
+        shazam.add_track(track, audio, sample_rate)
+    lastfm = LastfmStandIn()
+    network = lastfm.network(USERNAME)
+    pool = BufferPool(window, sample_rate, size=1)
+    capture = CaptureProcess(window_frames=window, sample_rate=sample_rate)
+    capture.ring.write(music[0][:window])
+    ratelimit.configure_limiter(rate=1e9, burst=1_000_000)
+    configure_shazam(ShazamStandInClient(shazam))
+
+    feed = {"offset": 0}
+
+    def capture_handoff() -> None:
+        audio = music[0]
+        start = feed["offset"] % (audio.size - sample_rate)
+        feed["offset"] += sample_rate
+        capture.ring.write(audio[start : start + sample_rate])
+        with pool.acquire(timeout=1) as buffer:
+            capture.read_into(buffer.samples, timeout=1)
+
+    windows = [audio[i * sample_rate : i * sample_rate + window] for i, audio in enumerate(music)]
+    conditioner = Conditioner()
+    impaired = [impair(audio, sample_rate, IMPAIRMENTS["turntable"], seed=i) for i, audio in enumerate(windows)]
+    turn = {"track": 0}
+
+    def condition() -> None:
+        audio = impaired[turn["track"] % len(impaired)]
+        turn["track"] += 1
+        with pool.acquire(timeout=1) as buffer:
+            np.copyto(buffer.samples, audio)
+            conditioner.condition(buffer.samples, sample_rate)
+
+    def identify() -> dict[str, Any]:
+        audio = windows[turn["track"] % len(windows)]
+        turn["track"] += 1
+        with pool.acquire(timeout=1) as buffer:
+            np.copyto(buffer.samples, audio)
+            return run_shazam(identify_song(buffer))
+
+    responses = session_results(known, 1000)
+    dedupe = DedupeIndex()
+    clock = {"cycle": 0}
+
+    def parse_dedupe() -> None:
+        cycle = clock["cycle"]
+        clock["cycle"] += 1
+        now = 1_700_000_000.0 + cycle * 60.0
+        track_info = responses[cycle % len(responses)].get("track")
+        if not track_info:
+            return
+        details = track_details(track_info)
+        if details is None:
+            return
+        key = normalize_key(details[0], details[1])
+        if not dedupe.observe(key, now):
+            dedupe.record(key, now)
+
+    def lastfm_lookup() -> None:
+        get_last_scrobbled_track(network, USERNAME)
+
+    def scrobble() -> None:
+        track = known[clock["cycle"] % len(known)]
+        clock["cycle"] += 1
+        scrobble_song(network, track.artist, track.title, track.album, timestamp=1_700_000_000)
+
+    try:
+        yield [
+            Stage("capture_handoff", capture_handoff, 500),
+            Stage("condition", condition, 50),
+            Stage("identify", identify, 20),
+            Stage("parse_dedupe", parse_dedupe, 5000),
+            Stage("lastfm_lookup", lastfm_lookup, 200),
+            Stage("scrobble", scrobble, 200),
+        ]
+    finally:
+        close_shazam()
+        capture.stop()
+
+
+def run(
+    names: Optional[Sequence[str]] = None,
+    iterations: Optional[int] = None,
+    **setup: Any,
+) -> list[StageResult]:
+    """Benchmark stages.
+
+    Args:
+        names: Stages to run (default: all).
+        iterations: Timed cycles per stage (default: each stage's own).
+        **setup: Options for :func:`stages`.
+
+    Returns:
+        One result per stage run.
+
+    Raises:
+        ValueError: If a stage name is unknown.
+    """
+    with stages(**setup) as available:
+        by_name = {stage.name: stage for stage in available}
+        unknown = set(names or ()) - set(by_name)
+        if unknown:
+            raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+        return [
+            measure(stage.name, stage.cycle, iterations or stage.iterations)
+            for stage in available
+            if not names or stage.name in names
+        ]
+
+
+def match_rates(
+    impairments: Optional[dict[str, Impairment]] = None,
+    music: Optional[Sequence[str]] = None,
+    tracks: int = 4,
+    track_seconds: float = 40.0,
+    windows: int = 3,
+    settings: ConditioningSettings = ConditioningSettings(),
+    sample_rate: int = SAMPLE_RATE,
+) -> list[MatchRate]:
+    """Compare recognition of impaired captures with and without conditioning.
+
+    Every track is known to the Shazam stand-in. Evenly spaced windows of each
+    are impaired, then identified through :func:`identify_song` as they are
+    and once more after conditioning.
+
+    Args:
+        impairments: Impairments by name (default: all of
+                     :data:`~autoscrobbler.standins.IMPAIRMENTS`).
+        music: Audio files to use as the tracks, named ``Artist - Title``
+               (default: synthetic music).
+        tracks: Number of synthetic tracks.
+        track_seconds: Length of each synthetic track.
+        windows: Windows taken from each track.
+        settings: Conditioning applied.
+        sample_rate: Capture sample rate in Hz.
+
+    Returns:
+        One result per impairment.
+
+    Raises:
+        ValueError: If a track is shorter than a capture window.
+    """
+    from autoscrobbler.loopback import read_track
+
+    window = WINDOW_SECONDS * sample_rate
+    if music:
+        known, audio = map(list, zip(*(read_track(path, sample_rate) for path in music)))
+    else:
+        known = [Track(f"Bench Artist {i}", f"Bench Song {i}", key=str(i)) for i in range(tracks)]
+        audio = [synthetic_music(track_seconds, sample_rate, seed=i) for i in range(tracks)]
+    shazam = ShazamStandIn()
+    for track, samples in zip(known, audio):
+        if samples.size < window:
+            raise ValueError(f"{track.artist} - {track.title} is shorter than {WINDOW_SECONDS}s")
+        shazam.add_track(track, samples, sample_rate)
+    ratelimit.configure_limiter(rate=1e9, burst=1_000_000)
+    configure_shazam(ShazamStandInClient(shazam))
+    conditioner = Conditioner(settings)
+    pool = BufferPool(window, sample_rate, size=1)
+
+    def recognized(track: Track, buffer: Any) -> bool:
+        details = track_details(run_shazam(identify_song(buffer)).get("track") or {})
+        return details is not None and details[:2] == (track.artist, track.title)
+
+    results = []
+    try:
+        for name, impairment in (impairments or IMPAIRMENTS).items():
+            raw = conditioned = 0
+            times = []
+            for i, (track, samples) in enumerate(zip(known, audio)):
+                starts = np.linspace(0, samples.size - window, windows).astype(int)
+                for j, start in enumerate(starts):
+                    captured = impair(samples[start : start + window], sample_rate, impairment, seed=i * windows + j)
+                    with pool.acquire(timeout=1) as buffer:
+                        np.copyto(buffer.samples, captured)
+                        raw += recognized(track, buffer)
+                        began = time.perf_counter()
+                        conditioner.condition(buffer.samples, sample_rate)
+                        times.append(time.perf_counter() - began)
+                        conditioned += recognized(track, buffer)
+            captures = len(times)
+            results.append(
+                MatchRate(
+                    impairment=name,
+                    captures=captures,
+                    raw=raw / captures,
+                    conditioned=conditioned / captures,
+                    condition_ms=float(np.median(times)) * 1000,
+                )
+            )
+    finally:
+        close_shazam()
+    return results
+
+
+def format_table(results: Sequence[StageResult]) -> str:
+    """Format results as a plain text table."""
+    lines = [
+        f"{'stage':<16} {'cycles':>7} {'cycles/s':>10} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'alloc KiB':>10} {'kept B':>8}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r.name:<16} {r.iterations:>7} {r.throughput:>10.1f} {r.p50_ms:>9.3f} "
+            f"{r.p99_ms:>9.3f} {r.alloc_bytes / 1024:>10.1f} {r.retained_bytes:>8}"
+        )
+    return "\n".join(lines)
+
+
+def format_match_rates(results: Sequence[MatchRate]) -> str:
+    """Format match rates as a plain text table."""
+    lines = [f"{'impairment':<12} {'captures':>8} {'raw':>7} {'conditioned':>12} {'ms':>7}"]
+    for r in results:
+        lines.append(
+            f"{r.impairment:<12} {r.captures:>8} {r.raw:>7.0%} {r.conditioned:>12.0%} "
+            f"{r.condition_ms:>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m autoscrobbler.bench",
+        description="Benchmark each stage of a scrobbling cycle offline.",
+    )
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        metavar="stage",
+        help="Stages to run: capture_handoff, condition, identify, parse_dedupe, "
+        "lastfm_lookup, scrobble (default: all)",
+    )
+    parser.add_argument(
+        "-n", "--iterations", type=int, default=None, help="Timed cycles per stage"
+    )
+    parser.add_argument(
+        "--match-rate",
+        action="store_true",
+        help="Compare recognition of impaired captures with and without conditioning instead",
+    )
+    parser.add_argument(
+        "--music",
+        nargs="+",
+        metavar="FILE",
+        default=None,
+        help="Recordings to impair for --match-rate, named 'Artist - Title' (default: synthetic music)",
+    )
+    parser.add_argument(
+        "--windows", type=int, default=3, help="Windows per track for --match-rate (default: 3)"
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+    if args.windows < 1:
+        parser.error("--windows must be at least 1")
+    # Per-cycle log lines would swamp the results
+    logs.configure_logging(level=logging.WARNING)
+    try:
+        if args.match_rate:
+            rates = match_rates(music=args.music, windows=args.windows)
+        else:
+            results = run(args.stages, args.iterations)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.match_rate:
+        print(json.dumps([asdict(r) for r in rates], indent=2) if args.json else format_match_rates(rates))
+    elif args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        print(format_table(results))
+
+
+if __name__ == "__main__":
+    main()
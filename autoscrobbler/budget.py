@@ -0,0 +1,296 @@
+"""Daily budget for Shazam identification calls.
+
+Without a budget every capture that passes the quality checks is sent to
+Shazam, i.e. ``86400 / duty_cycle`` calls a day whether anything is playing or
+not. :class:`BudgetPlanner` keeps a node under a fixed daily quota by scoring
+each capture and only spending a call when the score clears a threshold:
+
+* **Energy**: scales the whole score, so quiet captures are rarely worth a call.
+* **Novelty**: captures that sound like the last identified one are probably
+  the same song; a coarse log band-energy profile is compared against it.
+* **Staleness**: the longer since the last call, the likelier the song changed.
+* **Time of day**: an hourly hit rate learned from past identifications, kept
+  across restarts in a small JSON file along with the calls spent today.
+
+The same hourly history shapes the plan: the share of the budget that should
+be spent by any time of day follows the hours in which music is usually
+identified. The threshold rises while spending runs ahead of plan and drops
+while it lags behind, so the quota is used where it is most likely to produce
+scrobbles, and never exceeded: retries of failed requests and re-identified
+archived captures are charged as calls too.
+"""
+
+import datetime
+import json
+import logging
+import os
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from autoscrobbler import metrics
+from autoscrobbler.quality import CaptureQuality
+
+logger = logging.getLogger(__name__)
+
+PROFILE_BANDS = 24
+PROFILE_MIN_HZ = 80.0
+PROFILE_MAX_HZ = 8000.0
+
+# Relative weight of each score component; energy scales their sum
+NOVELTY_WEIGHT = 0.6
+STALENESS_WEIGHT = 0.25
+HOUR_WEIGHT = 0.15
+
+
+def spectral_profile(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Summarize a capture as normalized log energies in log-spaced bands.
+
+    Args:
+        samples: Mono int16 samples.
+        sample_rate: Sample rate in Hz.
+
+    Returns:
+        Zero-mean, unit-norm vector of ``PROFILE_BANDS`` band energies, or all
+        zeros for silence.
+    """
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float32)))
+    spectrum *= spectrum
+    edges = np.geomspace(PROFILE_MIN_HZ, PROFILE_MAX_HZ, PROFILE_BANDS + 1)
+    bins = np.rint(edges * len(samples) / sample_rate).astype(np.intp)
+    bins = np.maximum.accumulate(np.clip(bins, 0, len(spectrum) - 1))
+    energy = np.add.reduceat(spectrum[: bins[-1] + 1], bins[:-1])
+    profile = np.log1p(energy)
+    profile -= profile.mean()
+    norm = np.linalg.norm(profile)
+    return profile / norm if norm > 0 else profile
+
+
+def check_profile(values: Any) -> np.ndarray:
+    """Turn a spectral profile received from another node into an array.
+
+    Args:
+        values: Band energies as sent, e.g. a JSON list.
+
+    Returns:
+        The profile as a float64 array.
+
+    Raises:
+        ValueError: If it is not ``PROFILE_BANDS`` finite numbers.
+    """
+    profile = np.asarray(values, dtype=np.float64)
+    if profile.shape != (PROFILE_BANDS,) or not np.isfinite(profile).all():
+        raise ValueError(f"profile must be {PROFILE_BANDS} finite numbers")
+    return profile
+
+
+def novelty(profile: np.ndarray, reference: Optional[np.ndarray]) -> float:
+    """How different ``profile`` is from ``reference``, from 0 (same) to 1."""
+    if reference is None or not profile.any() or not reference.any():
+        return 1.0
+    return float(np.clip(1.0 - np.dot(profile, reference), 0.0, 1.0))
+
+
+class ListeningHistory:
+    """Hourly rate at which identification calls found a song.
+
+    Each hour holds an exponential moving average of hits (1) and misses (0),
+    starting at 0.5 for hours never seen. The file also keeps how many calls
+    were spent on which day, so a restart does not hand out the quota again.
+
+    Args:
+        path: JSON file to load from and save to, or None to keep it in memory.
+        alpha: Weight of each new call in the average (default: 0.05).
+    """
+
+    def __init__(self, path: Optional[str] = None, alpha: float = 0.05) -> None:
+        self.path = path
+        self.alpha = alpha
+        self.hit_rates = [0.5] * 24
+        self.day: Optional[datetime.date] = None
+        self.spent = 0
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+                rates = saved["hit_rates"]
+                if len(rates) == 24:
+                    self.hit_rates = [float(rate) for rate in rates]
+                if "day" in saved:
+                    self.day = datetime.date.fromisoformat(saved["day"])
+                    self.spent = int(saved["spent"])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Ignoring unreadable listening history {path}: {e}")
+
+    def record(self, hour: int, hit: bool) -> None:
+        """Fold one call's outcome into its hour and save the history."""
+        self.hit_rates[hour] += self.alpha * (float(hit) - self.hit_rates[hour])
+        self.save()
+
+    def record_spent(self, day: datetime.date, spent: int) -> None:
+        """Remember the calls spent on ``day`` and save the history."""
+        self.day = day
+        self.spent = spent
+        self.save()
+
+    def save(self) -> None:
+        """Write the history atomically, if it has a path."""
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                saved: dict[str, Any] = {"hit_rates": self.hit_rates}
+                if self.day is not None:
+                    saved.update(day=self.day.isoformat(), spent=self.spent)
+                json.dump(saved, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save listening history {self.path}: {e}")
+
+
+class BudgetPlanner:
+    """Decide which captures are worth one of the day's identification calls.
+
+    Args:
+        daily_budget: Maximum identification calls per local calendar day.
+        history: Hourly listening history (default: in memory only).
+        sample_rate: Sample rate of the captures in Hz.
+        base_threshold: Score needed to spend a call when exactly on plan.
+        min_rms_dbfs: Level scored as zero energy.
+        max_rms_dbfs: Level scored as full energy.
+        stale_after: Seconds after which staleness is fully scored.
+        clock: Returns the current local time.
+    """
+
+    def __init__(
+        self,
+        daily_budget: int,
+        history: Optional[ListeningHistory] = None,
+        sample_rate: int = 44100,
+        base_threshold: float = 0.3,
+        min_rms_dbfs: float = -60.0,
+        max_rms_dbfs: float = -20.0,
+        stale_after: float = 600.0,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+    ) -> None:
+        if daily_budget < 1:
+            raise ValueError("daily_budget must be at least 1")
+        self.daily_budget = daily_budget
+        self.history = history if history is not None else ListeningHistory()
+        self.sample_rate = sample_rate
+        self.base_threshold = base_threshold
+        self.min_rms_dbfs = min_rms_dbfs
+        self.max_rms_dbfs = max_rms_dbfs
+        self.stale_after = stale_after
+        self._clock = clock
+        self.day = clock().date()
+        # Calls already spent today before a restart still count
+        self.spent = self.history.spent if self.history.day == self.day else 0
+        self._reference: Optional[np.ndarray] = None
+        self._last_call: Optional[datetime.datetime] = None
+        self._pending_hour: Optional[int] = None
+        metrics.BUDGET_REMAINING.set_function(lambda: self.daily_budget - self.spent)
+        metrics.BUDGET_PLANNED.set_function(lambda: self.planned(self._clock()))
+
+    def planned(self, now: datetime.datetime) -> float:
+        """Calls that should have been spent by ``now`` according to the plan."""
+        # Every hour keeps a floor share so quiet hours are still sampled
+        weights = [0.1 + rate for rate in self.history.hit_rates]
+        elapsed = sum(weights[: now.hour])
+        elapsed += weights[now.hour] * (now.minute * 60 + now.second) / 3600
+        return self.daily_budget * elapsed / sum(weights)
+
+    def threshold(self, now: datetime.datetime) -> float:
+        """Score a capture needs now, given spending against the plan."""
+        # One call of slack so the first captures of the day are not starved
+        pace = self.spent / (self.planned(now) + 1.0)
+        return float(np.clip(self.base_threshold * pace, self.base_threshold / 2, 0.95))
+
+    def score(
+        self, profile: np.ndarray, quality: CaptureQuality, now: datetime.datetime
+    ) -> float:
+        """Score a capture from 0 (not worth a call) to 1."""
+        span = self.max_rms_dbfs - self.min_rms_dbfs
+        energy = float(np.clip((quality.rms_dbfs - self.min_rms_dbfs) / span, 0.0, 1.0))
+        if self._last_call is None:
+            staleness = 1.0
+        else:
+            elapsed = (now - self._last_call).total_seconds()
+            staleness = min(1.0, max(0.0, elapsed) / self.stale_after)
+        return energy * (
+            NOVELTY_WEIGHT * novelty(profile, self._reference)
+            + STALENESS_WEIGHT * staleness
+            + HOUR_WEIGHT * self.history.hit_rates[now.hour]
+        )
+
+    def claim(self, samples: np.ndarray, quality: CaptureQuality) -> Optional[str]:
+        """Spend a call on this capture if it is worth it.
+
+        Args:
+            samples: Mono int16 samples of the capture.
+            quality: Quality metrics of the capture.
+
+        Returns:
+            None if a call was claimed from the budget, otherwise the reason
+            to defer identification.
+        """
+        now = self._now()
+        if self.spent >= self.daily_budget:
+            return f"daily budget of {self.daily_budget} calls used up"
+        profile = spectral_profile(samples, self.sample_rate)
+        score = self.score(profile, quality, now)
+        threshold = self.threshold(now)
+        if score < threshold:
+            return f"score {score:.2f} below budget threshold {threshold:.2f}"
+        self._charge()
+        self._reference = profile
+        self._last_call = now
+        self._pending_hour = now.hour
+        return None
+
+    def claim_backfill(self) -> bool:
+        """Spend a call on re-identifying an archived capture, if any are left.
+
+        Returns:
+            True if a call was claimed from the budget.
+        """
+        return self._spend()
+
+    def claim_retry(self) -> bool:
+        """Spend a call on retrying a failed request, if any are left.
+
+        Returns:
+            True if a call was claimed from the budget.
+        """
+        return self._spend()
+
+    def _spend(self) -> bool:
+        self._now()
+        if self.spent >= self.daily_budget:
+            return False
+        self._charge()
+        return True
+
+    def _charge(self) -> None:
+        self.spent += 1
+        self.history.record_spent(self.day, self.spent)
+
+    def _now(self) -> datetime.datetime:
+        now = self._clock()
+        if now.date() != self.day:
+            logger.info(f"New budget day, {self.spent} of {self.daily_budget} calls were used")
+            self.day = now.date()
+            self.spent = 0
+        return now
+
+    def record_result(self, hit: bool) -> None:
+        """Learn from the outcome of the call last claimed.
+
+        Args:
+            hit: Whether Shazam identified a song.
+        """
+        if self._pending_hour is None:
+            return
+        self.history.record(self._pending_hour, hit)
+        self._pending_hour = None
@@ -0,0 +1,174 @@
+"""Preallocated capture buffers shared by the capture and identification stages.
+
+Each :class:`AudioBuffer` is a complete in-memory WAV file: a fixed 44 byte
+RIFF header followed by the PCM payload. The payload is exposed as an int16
+numpy view, so the capture stage records straight into the bytes that are
+later handed to Shazam and no stage needs to copy sample data.
+
+Ownership rules:
+
+* A buffer belongs to whoever acquired it from the :class:`BufferPool` until
+  it is released (explicitly or by leaving its ``with`` block).
+* Capture writes into ``buffer.samples`` in place; conditioning stages may
+  modify ``buffer.samples`` in place but never replace it.
+* Capture also records its metadata on the buffer (``overflow`` and, once
+  measured, ``quality``); these are reset when the buffer is acquired.
+* Identification reads ``buffer.wav`` without copying it.
+* Nothing may keep a reference to ``samples`` or ``wav`` after release; the
+  memory is reused by the next cycle.
+"""
+
+import queue
+import struct
+from typing import Any, Optional
+
+import numpy as np
+
+WAV_HEADER_SIZE = 44
+SAMPLE_WIDTH = 2  # int16
+
+
+def write_wav_header(
+    raw: bytearray, num_samples: int, sample_rate: int, channels: int = 1
+) -> None:
+    """Write a PCM int16 WAV header into the first 44 bytes of ``raw``.
+
+    Args:
+        raw: Buffer to write the header into.
+        num_samples: Number of samples (all channels) in the payload.
+        sample_rate: Audio sample rate in Hz.
+        channels: Number of interleaved channels (default: 1).
+    """
+    data_size = num_samples * SAMPLE_WIDTH
+    struct.pack_into(
+        "<4sI4s4sIHHIIHH4sI",
+        raw,
+        0,
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sample_rate,
+        sample_rate * channels * SAMPLE_WIDTH,
+        channels * SAMPLE_WIDTH,
+        SAMPLE_WIDTH * 8,
+        b"data",
+        data_size,
+    )
+
+
+def encode_wav(audio_data: np.ndarray, sample_rate: int) -> bytearray:
+    """Encode an int16 array as an in-memory WAV file.
+
+    This is the fallback for audio that was not captured into a pooled
+    buffer and therefore costs one copy of the samples.
+
+    Args:
+        audio_data: Mono audio samples.
+        sample_rate: Audio sample rate in Hz.
+
+    Returns:
+        Bytearray containing a complete WAV file.
+    """
+    samples = np.asarray(audio_data, dtype=np.int16).reshape(-1)
+    raw = bytearray(WAV_HEADER_SIZE + samples.nbytes)
+    write_wav_header(raw, samples.size, sample_rate)
+    np.frombuffer(raw, dtype=np.int16, offset=WAV_HEADER_SIZE)[:] = samples
+    return raw
+
+
+class AudioBuffer:
+    """A fixed-size int16 capture buffer backed by an in-memory WAV file.
+
+    Attributes:
+        wav: The complete WAV file image (header and payload).
+        samples: Writable int16 view onto the WAV payload.
+        sample_rate: Sample rate the header was written for.
+        overflow: Whether the capture stage reported an input overflow.
+        quality: Quality metrics of the current capture, once measured.
+    """
+
+    __slots__ = ("_pool", "wav", "samples", "sample_rate", "overflow", "quality")
+
+    def __init__(
+        self, frames: int, sample_rate: int, pool: Optional["BufferPool"] = None
+    ) -> None:
+        self._pool = pool
+        self.wav = bytearray(WAV_HEADER_SIZE + frames * SAMPLE_WIDTH)
+        self.samples = np.frombuffer(self.wav, dtype=np.int16, offset=WAV_HEADER_SIZE)
+        self.sample_rate = sample_rate
+        self.overflow = False
+        self.quality = None
+        write_wav_header(self.wav, frames, sample_rate)
+
+    def release(self) -> None:
+        """Return the buffer to its pool, if it has one."""
+        if self._pool is not None:
+            self._pool.release(self)
+
+    def __enter__(self) -> "AudioBuffer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class BufferPool:
+    """A thread-safe pool of preallocated :class:`AudioBuffer` objects.
+
+    Args:
+        frames: Number of samples per buffer.
+        sample_rate: Audio sample rate in Hz.
+        size: Number of buffers to preallocate (default: 2).
+    """
+
+    def __init__(self, frames: int, sample_rate: int, size: int = 2) -> None:
+        self.frames = frames
+        self.sample_rate = sample_rate
+        self.size = size
+        self._free: queue.LifoQueue[AudioBuffer] = queue.LifoQueue()
+        for _ in range(size):
+            self._free.put(AudioBuffer(frames, sample_rate, pool=self))
+
+    def acquire(self, timeout: Optional[float] = None) -> AudioBuffer:
+        """Take a buffer from the pool, waiting for one to be released.
+
+        Args:
+            timeout: Maximum seconds to wait, or None to wait forever.
+
+        Returns:
+            A buffer owned by the caller until it is released.
+
+        Raises:
+            RuntimeError: If no buffer became available within ``timeout``.
+        """
+        try:
+            buffer = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(
+                f"No free audio buffer after {timeout}s (pool size {self.size})."
+            ) from None
+        buffer.overflow = False
+        buffer.quality = None
+        return buffer
+
+    def release(self, buffer: AudioBuffer) -> None:
+        """Return a buffer to the pool.
+
+        Args:
+            buffer: Buffer previously obtained from :meth:`acquire`.
+
+        Raises:
+            ValueError: If the buffer does not belong to this pool.
+        """
+        if buffer._pool is not self:
+            raise ValueError("Buffer does not belong to this pool.")
+        self._free.put(buffer)
+
+    @property
+    def available(self) -> int:
+        """Number of buffers currently free."""
+        return self._free.qsize()
@@ -0,0 +1,404 @@
+"""Continuous audio capture in a dedicated process.
+
+The PortAudio callback runs in a child process and writes into a
+``multiprocessing.shared_memory`` ring buffer. The main process reads
+capture windows as numpy views of that shared memory, so JSON handling,
+logging and Last.fm calls in the main interpreter can no longer stall the
+audio callback and cause input overflows.
+
+The ring is single-producer/single-consumer and lock-free: the producer is
+the only writer of the write index and the capture counters, and publishes
+the write index only after the samples are in place. Readers detect that the
+producer lapped them by comparing indices, never by locking.
+"""
+
+import logging
+import multiprocessing
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Header slots (int64) at the start of the shared memory block
+_WRITE_INDEX = 0  # total frames ever written
+_READ_INDEX = 1  # total frames consumed by the reader
+_OVERFLOWS = 2  # PortAudio input overflow flags seen
+_XRUNS = 3  # callbacks with any status flag set
+_READY = 4  # set to 1 once the stream is running
+_HEADER_SLOTS = 8
+_HEADER_BYTES = _HEADER_SLOTS * 8
+
+
+@dataclass(frozen=True)
+class CaptureStats:
+    """Counters published by the capture process.
+
+    Attributes:
+        frames_written: Total frames written since the ring was created.
+        overflows: Number of callbacks that reported an input overflow.
+        xruns: Number of callbacks that reported any PortAudio status flag.
+        frames_read: Absolute index just past the last window read.
+    """
+
+    frames_written: int
+    overflows: int
+    xruns: int
+    frames_read: int
+
+
+class SharedRingBuffer:
+    """A lock-free int16 ring buffer in shared memory.
+
+    Data is stored with a mirrored tail of ``window_frames`` samples, so any
+    window of up to ``window_frames`` samples is contiguous in memory and can
+    be returned as a view regardless of where the ring wraps.
+
+    Args:
+        capacity: Number of frames held before the producer wraps.
+        window_frames: Largest window that can be read as a view.
+        name: Name of an existing block to attach to, or None to create one.
+    """
+
+    def __init__(
+        self, capacity: int, window_frames: int, name: Optional[str] = None
+    ) -> None:
+        if window_frames > capacity:
+            raise ValueError("window_frames cannot exceed the ring capacity.")
+        self.capacity = capacity
+        self.window_frames = window_frames
+        size = _HEADER_BYTES + (capacity + window_frames) * 2
+        self._owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._header = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        self._data = np.ndarray(
+            (capacity + window_frames,),
+            dtype=np.int16,
+            buffer=self.shm.buf,
+            offset=_HEADER_BYTES,
+        )
+        if self._owner:
+            self._header[:] = 0
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block, for attaching from another process."""
+        return self.shm.name
+
+    @property
+    def write_index(self) -> int:
+        """Total frames written by the producer."""
+        return int(self._header[_WRITE_INDEX])
+
+    # Producer side
+
+    def write(self, samples: np.ndarray) -> None:
+        """Append samples to the ring (producer only).
+
+        Args:
+            samples: Mono int16 samples; longer than ``capacity`` keeps the tail.
+        """
+        samples = samples.reshape(-1)
+        if samples.size > self.capacity:
+            # Only the tail survives; account for the rest as already overwritten
+            self._header[_WRITE_INDEX] += samples.size - self.capacity
+            samples = samples[-self.capacity :]
+        n = samples.size
+        start = int(self._header[_WRITE_INDEX]) % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start : start + first] = samples[:first]
+        if first < n:
+            self._data[: n - first] = samples[first:]
+        # Keep the mirrored tail in sync with the head of the ring
+        if start < self.window_frames:
+            end = min(start + first, self.window_frames)
+            self._data[self.capacity + start : self.capacity + end] = samples[
+                : end - start
+            ]
+        if first < n:
+            end = min(n - first, self.window_frames)
+            self._data[self.capacity : self.capacity + end] = samples[first : first + end]
+        # Publish only after the data is in place
+        self._header[_WRITE_INDEX] += n
+
+    def record_status(self, input_overflow: bool, any_status: bool) -> None:
+        """Count PortAudio status flags reported by a callback (producer only)."""
+        if input_overflow:
+            self._header[_OVERFLOWS] += 1
+        if any_status:
+            self._header[_XRUNS] += 1
+
+    def mark_ready(self) -> None:
+        """Signal that the capture stream is running."""
+        self._header[_READY] = 1
+
+    def mark_not_ready(self) -> None:
+        """Signal that the capture stream has stopped, before it is reopened."""
+        self._header[_READY] = 0
+
+    # Consumer side
+
+    @property
+    def ready(self) -> bool:
+        """Whether the producer has started its stream."""
+        return bool(self._header[_READY])
+
+    def latest_window(self, frames: int) -> Tuple[np.ndarray, int]:
+        """Return a zero-copy view of the most recent ``frames`` samples.
+
+        The view aliases shared memory and is only valid until the producer
+        laps it; check :meth:`is_intact` after using it if that matters.
+
+        Args:
+            frames: Window length, at most ``window_frames``.
+
+        Returns:
+            Tuple of (read-only view, absolute index of its first frame).
+
+        Raises:
+            ValueError: If ``frames`` exceeds ``window_frames`` or fewer
+                        frames have been written so far.
+        """
+        if frames > self.window_frames:
+            raise ValueError(
+                f"Window of {frames} frames exceeds the ring's {self.window_frames}."
+            )
+        end = self.write_index
+        if end < frames:
+            raise ValueError(f"Only {end} of {frames} frames captured so far.")
+        start = end - frames
+        offset = start % self.capacity
+        view = self._data[offset : offset + frames]
+        view.flags.writeable = False
+        self._header[_READ_INDEX] = end
+        return view, start
+
+    def read_from(self, start: int) -> Tuple[np.ndarray, int]:
+        """Return a zero-copy view of the samples written since ``start``.
+
+        Unlike :meth:`latest_window` this does not move the read index, so a
+        streaming consumer can follow the producer alongside the window
+        reader. At most ``window_frames`` samples are returned, so a consumer
+        that fell behind catches up over several calls; if the producer
+        already overwrote ``start``, the view begins at the oldest sample
+        still in the ring.
+
+        Args:
+            start: Absolute index of the first frame wanted.
+
+        Returns:
+            Tuple of (read-only view, absolute index of its first frame).
+        """
+        end = self.write_index
+        start = max(start, end - self.capacity)
+        frames = min(end - start, self.window_frames)
+        offset = start % self.capacity
+        view = self._data[offset : offset + frames]
+        view.flags.writeable = False
+        return view, start
+
+    def is_intact(self, start: int) -> bool:
+        """Check that a window starting at ``start`` has not been overwritten."""
+        return self.write_index - start <= self.capacity
+
+    def stats(self) -> CaptureStats:
+        """Snapshot the capture counters."""
+        return CaptureStats(
+            frames_written=int(self._header[_WRITE_INDEX]),
+            overflows=int(self._header[_OVERFLOWS]),
+            xruns=int(self._header[_XRUNS]),
+            frames_read=int(self._header[_READ_INDEX]),
+        )
+
+    def close(self) -> None:
+        """Detach from the shared memory, removing it if this side created it."""
+        # Drop our views first; SharedMemory refuses to close with exports alive
+        self._header = self._data = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _capture_worker(
+    ring_name: str,
+    capacity: int,
+    window_frames: int,
+    sample_rate: int,
+    device: Optional[int],
+    blocksize: int,
+    stop_event: Any,
+) -> None:
+    """Entry point of the capture process: stream the device into the ring."""
+    import sounddevice as sd
+
+    ring = SharedRingBuffer(capacity, window_frames, name=ring_name)
+
+    def callback(indata: np.ndarray, frames: int, time_info: Any, status: Any) -> None:
+        ring.record_status(bool(status.input_overflow), bool(status))
+        ring.write(indata[:, 0])
+
+    try:
+        with sd.InputStream(
+            samplerate=sample_rate,
+            channels=1,
+            dtype="int16",
+            device=device,
+            blocksize=blocksize,
+            callback=callback,
+        ) as stream:
+            ring.mark_ready()
+            while not stop_event.wait(0.5):
+                # PortAudio stops the stream when the device goes away
+                if not stream.active:
+                    raise RuntimeError("Input stream stopped.")
+    finally:
+        ring.close()
+
+
+class CaptureProcess:
+    """Run continuous capture in a child process and read windows from it.
+
+    Args:
+        window_frames: Length of the windows read for identification.
+        sample_rate: Audio sample rate in Hz (default: 44100).
+        device: Optional device index to record from.
+        ring_seconds: Seconds of audio held in the ring (default: 30).
+        blocksize: Frames per PortAudio callback (default: 2048).
+    """
+
+    def __init__(
+        self,
+        window_frames: int,
+        sample_rate: int = 44100,
+        device: Optional[int] = None,
+        ring_seconds: int = 30,
+        blocksize: int = 2048,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.device = device
+        self.blocksize = blocksize
+        capacity = max(ring_seconds * sample_rate, 2 * window_frames)
+        self.ring = SharedRingBuffer(capacity, window_frames)
+        # spawn: PortAudio must not inherit state from a forked parent
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+        self._last_read = 0
+
+    def start(self, timeout: float = 10.0) -> None:
+        """Start the capture process and wait for its stream to open.
+
+        Args:
+            timeout: Seconds to wait for the stream to start.
+
+        Raises:
+            RuntimeError: If the capture process exits or does not start in time.
+        """
+        self._process = self._ctx.Process(
+            target=_capture_worker,
+            args=(
+                self.ring.name,
+                self.ring.capacity,
+                self.ring.window_frames,
+                self.sample_rate,
+                self.device,
+                self.blocksize,
+                self._stop,
+            ),
+            name="autoscrobbler-capture",
+            daemon=True,
+        )
+        self._process.start()
+        deadline = time.monotonic() + timeout
+        while not self.ring.ready:
+            if not self._process.is_alive():
+                raise RuntimeError(
+                    f"Capture process exited with code {self._process.exitcode}."
+                )
+            if time.monotonic() > deadline:
+                self._stop_process()
+                raise RuntimeError(f"Capture stream did not start within {timeout}s.")
+            time.sleep(0.05)
+        logger.info(f"Capture process started (pid {self._process.pid})")
+
+    def read_into(self, out: np.ndarray, timeout: float = 30.0) -> np.ndarray:
+        """Copy the most recent window into ``out`` once enough audio exists.
+
+        This is the single copy on the capture path: from shared memory into
+        the pooled WAV buffer that is handed to Shazam. A window the producer
+        overwrote while it was being copied is read again.
+
+        Args:
+            out: Preallocated int16 array to fill.
+            timeout: Seconds to wait for a full window to be captured, or for
+                     new audio since the previous read.
+
+        Returns:
+            ``out``, filled with the latest audio.
+
+        Raises:
+            RuntimeError: If the capture process died or no new audio arrived
+                          in time, or every copy was overwritten before it
+                          finished.
+        """
+        frames = out.size
+        deadline = time.monotonic() + timeout
+        while self.ring.write_index < frames or self.ring.write_index == self._last_read:
+            if self._process is not None and not self._process.is_alive():
+                raise RuntimeError("Capture process is not running.")
+            if time.monotonic() > deadline:
+                if self.ring.write_index < frames:
+                    raise RuntimeError(f"No full capture window within {timeout}s.")
+                raise RuntimeError(f"No new audio captured within {timeout}s.")
+            time.sleep(0.05)
+        while True:
+            view, start = self.ring.latest_window(frames)
+            np.copyto(out, view)
+            if self.ring.is_intact(start):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No intact capture window within {timeout}s.")
+            logger.warning("Capture window was overwritten while copying it, reading it again")
+        self._last_read = start + frames
+        return out
+
+    def stats(self) -> CaptureStats:
+        """Return the capture-side overflow and xrun counters."""
+        return self.ring.stats()
+
+    def restart(self, device: Optional[int], timeout: float = 10.0) -> None:
+        """Reopen the input stream in a new capture process.
+
+        The ring and everything reading from it are kept, so a device that
+        was unplugged and came back, possibly at another index, is recovered
+        without restarting autoscrobbler.
+
+        Args:
+            device: Device index to record from.
+            timeout: Seconds to wait for the stream to start.
+
+        Raises:
+            RuntimeError: If the capture process exits or does not start in time.
+        """
+        self._stop_process()
+        self.device = device
+        self._stop = self._ctx.Event()
+        self.ring.mark_not_ready()
+        self.start(timeout)
+
+    def _stop_process(self) -> None:
+        self._stop.set()
+        if self._process is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def stop(self) -> None:
+        """Stop the capture process and release the shared memory."""
+        self._stop_process()
+        if self.ring.shm is not None and self.ring._header is not None:
+            self.ring.close()
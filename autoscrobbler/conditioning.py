@@ -0,0 +1,222 @@
+"""Conditioning of captures before identification.
+
+Turntable rumble, mains hum and low microphone gain cost matches: harmonics
+of the hum become spectral peaks of their own in the signature, and in a
+quiet capture over rumble little of the music stands out. A
+:class:`Conditioner` cleans a capture window in place before it is sent to
+Shazam:
+
+* DC and everything below ``highpass_hz`` are removed, with a raised cosine
+  transition over the octave below the cutoff.
+* Harmonics of 50 or 60 Hz mains hum are notched up to the top of Shazam's
+  highest band, but only the bins that stand out from the spectrum around
+  them, so music at those frequencies is kept. With ``hum="auto"`` the mains
+  frequency is detected in each capture.
+* Quiet captures are amplified towards ``target_dbfs``, by at most
+  ``max_gain_db`` and never so much that the loudest sample clips.
+
+All three work on one FFT of the window: the filters are gains applied to its
+bins, and the result is rounded back into the int16 capture buffer. The
+spectrum and work arrays are kept per window size, so only the hum search
+allocates while a capture is conditioned.
+
+Quality is measured before conditioning, on the capture as recorded.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+FULL_SCALE = 32768.0
+MAINS_HZ = (50.0, 60.0)
+HUM_CHOICES = ("auto", "50", "60", "off")
+# Top of the highest frequency band of Shazam signatures
+NOTCH_MAX_HZ = 5500.0
+# Hum is searched for within this distance of each harmonic, plus the
+# relative drift of the mains frequency times the harmonic's frequency; bins
+# found are notched together with their neighbours this close, where the
+# tone leaks
+NOTCH_WIDTH_HZ = 0.3
+MAINS_DRIFT = 0.002
+# Bins on either side of a harmonic whose median power is its background
+BACKGROUND_HZ = 10.0
+# Power over the background for a bin to count as hum (20 dB); noise bins
+# reach 10 dB over their median often enough to be found among thousands
+PROMINENCE = 100.0
+# Hum is a steady tone, far narrower than a note in a 10 second window: its
+# bins also stand out as much from the spectrum this far away
+NARROW_HZ = 1.0
+# Harmonics that must stand out to detect the mains frequency
+MIN_HUM_HARMONICS = 2
+
+
+@dataclass(frozen=True)
+class ConditioningSettings:
+    """How captures are conditioned.
+
+    Attributes:
+        highpass_hz: High-pass cutoff; 0 removes only DC.
+        hum: Mains frequency to notch, "50", "60", "auto" to detect it in
+             each capture, or "off".
+        target_dbfs: RMS level quiet captures are amplified towards.
+        max_gain_db: Largest amplification; 0 leaves the level alone.
+    """
+
+    highpass_hz: float = 100.0
+    hum: str = "auto"
+    target_dbfs: float = -20.0
+    max_gain_db: float = 30.0
+
+
+@dataclass(frozen=True)
+class ConditioningResult:
+    """What conditioning did to one capture.
+
+    Attributes:
+        gain_db: Amplification applied.
+        hum_hz: Mains frequency whose harmonics were notched, or None.
+        notched_bins: FFT bins removed as hum.
+    """
+
+    gain_db: float
+    hum_hz: Optional[float]
+    notched_bins: int
+
+
+class _Plan:
+    """Filter gains, hum search bins and work arrays for one window size."""
+
+    def __init__(self, frames: int, sample_rate: int, highpass_hz: float) -> None:
+        self.frames = frames
+        bins = frames // 2 + 1
+        resolution = sample_rate / frames
+        frequencies = np.arange(bins) * resolution
+        if highpass_hz > 0:
+            ramp = np.clip((frequencies - highpass_hz / 2) / (highpass_hz / 2), 0.0, 1.0)
+            self.highpass: Optional[np.ndarray] = 0.5 - 0.5 * np.cos(np.pi * ramp)
+        else:
+            self.highpass = None
+        # Double precision, as numpy's FFT converts anything else to it first
+        self.work = np.empty(frames, dtype=np.float64)
+        self.spectrum = np.empty(bins, dtype=np.complex128)
+        self.power = np.empty(bins, dtype=np.float64)
+        background = int(BACKGROUND_HZ / resolution)
+        self.narrow = max(1, int(round(NARROW_HZ / resolution)))
+        self.leak = np.arange(-int(NOTCH_WIDTH_HZ / resolution), int(NOTCH_WIDTH_HZ / resolution) + 1)
+        # Per mains frequency: bins searched around each harmonic (padded
+        # with -1), and the bins of each harmonic's background
+        self.hum: dict[float, tuple[np.ndarray, np.ndarray]] = {}
+        for mains in MAINS_HZ:
+            top = min(NOTCH_MAX_HZ, sample_rate / 2 - BACKGROUND_HZ)
+            harmonics = np.arange(1, int(top / mains) + 1) * mains
+            if not harmonics.size:
+                continue
+            centres = np.rint(harmonics / resolution).astype(np.int64)
+            widths = np.ceil((NOTCH_WIDTH_HZ + MAINS_DRIFT * harmonics) / resolution).astype(np.int64)
+            offsets = np.arange(-widths.max(), widths.max() + 1)
+            search = centres[:, None] + offsets[None, :]
+            search[np.abs(offsets)[None, :] > widths[:, None]] = -1
+            around = centres[:, None] + np.arange(-background, background + 1)[None, :]
+            self.hum[mains] = (search, np.clip(around, 0, bins - 1))
+
+
+class Conditioner:
+    """Remove rumble and hum from captures and normalize their level, in place.
+
+    Args:
+        settings: What to do to each capture.
+
+    Raises:
+        ValueError: If the hum setting is unknown.
+    """
+
+    def __init__(self, settings: ConditioningSettings = ConditioningSettings()) -> None:
+        if settings.hum not in HUM_CHOICES:
+            raise ValueError(f"Unknown hum setting '{settings.hum}', expected one of {', '.join(HUM_CHOICES)}.")
+        self.settings = settings
+        self._plans: dict[tuple[int, int], _Plan] = {}
+
+    def _plan(self, frames: int, sample_rate: int) -> _Plan:
+        plan = self._plans.get((frames, sample_rate))
+        if plan is None:
+            plan = self._plans[(frames, sample_rate)] = _Plan(
+                frames, sample_rate, self.settings.highpass_hz
+            )
+        return plan
+
+    def _notch_hum(self, plan: _Plan) -> tuple[Optional[float], int]:
+        """Zero the hum bins of the plan's spectrum; return the mains frequency and bin count."""
+        if self.settings.hum == "off":
+            return None, 0
+        spectrum, power = plan.spectrum, plan.power
+        np.abs(spectrum, out=power)
+        np.square(power, out=power)
+        candidates = MAINS_HZ if self.settings.hum == "auto" else (float(self.settings.hum),)
+        best: tuple[Optional[float], Optional[np.ndarray], int] = (None, None, 0)
+        for mains in candidates:
+            if mains not in plan.hum:
+                continue
+            search, around = plan.hum[mains]
+            background = np.median(power[around], axis=1)
+            level = power[search]
+            beside = np.maximum(
+                power[np.clip(search - plan.narrow, 0, power.size - 1)],
+                power[np.clip(search + plan.narrow, 0, power.size - 1)],
+            )
+            hot = (
+                (search >= 0)
+                & (level > PROMINENCE * background[:, None])
+                & (level > PROMINENCE * beside)
+            )
+            harmonics = int(np.count_nonzero(hot.any(axis=1)))
+            if harmonics > best[2]:
+                best = (mains, search[hot], harmonics)
+        mains, bins, harmonics = best
+        if mains is None or bins is None or (self.settings.hum == "auto" and harmonics < MIN_HUM_HARMONICS):
+            return None, 0
+        bins = np.unique(np.clip((bins[:, None] + plan.leak[None, :]).ravel(), 0, spectrum.size - 1))
+        spectrum[bins] = 0
+        return mains, int(bins.size)
+
+    def condition(self, samples: np.ndarray, sample_rate: int) -> ConditioningResult:
+        """Condition a capture in place.
+
+        Args:
+            samples: Mono int16 samples, modified in place.
+            sample_rate: Sample rate of the samples in Hz.
+
+        Returns:
+            What was done to the capture.
+        """
+        samples = samples.reshape(-1)
+        if not samples.size:
+            return ConditioningResult(0.0, None, 0)
+        plan = self._plan(samples.size, sample_rate)
+        work, spectrum = plan.work, plan.spectrum
+        np.copyto(work, samples)
+        np.fft.rfft(work, out=spectrum)
+        hum_hz, notched = self._notch_hum(plan)
+        if plan.highpass is not None:
+            spectrum *= plan.highpass
+        else:
+            spectrum[0] = 0
+        np.fft.irfft(spectrum, samples.size, out=work)
+
+        gain = 1.0
+        if self.settings.max_gain_db > 0:
+            rms = math.sqrt(float(np.dot(work, work)) / work.size)
+            if rms > 0:
+                target = FULL_SCALE * 10 ** (self.settings.target_dbfs / 20)
+                gain = min(max(1.0, target / rms), 10 ** (self.settings.max_gain_db / 20))
+        # Filtering can raise peaks past the original, so the gain may also
+        # have to bring them back into range
+        peak = max(float(work.max()), -float(work.min()))
+        if peak * gain > FULL_SCALE - 1:
+            gain = (FULL_SCALE - 1) / peak
+        if gain != 1.0:
+            work *= gain
+        np.rint(work, out=work)
+        np.copyto(samples, work, casting="unsafe")
+        return ConditioningResult(20 * math.log10(gain) if gain > 0 else 0.0, hum_hz, notched)
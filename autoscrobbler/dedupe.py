@@ -0,0 +1,183 @@
+"""Index of recently heard songs, for skipping duplicate scrobbles.
+
+Each song is keyed by its normalized (artist, title) and remembered as a
+*play*: the time it was first heard and the time it was last heard. A song
+identified again while its play is still running is a duplicate, which covers
+songs spanning several cycles as well as A-B-A flips and crossfades between
+two songs. A play ends once the song has not been heard for ``gap`` seconds, or
+``max_play`` seconds after it started, so a song played again later is
+scrobbled again.
+
+Lookups are a dict access plus float comparisons; repeat hearings update the
+entry in place, so the common case allocates nothing. Plays are kept in LRU
+order up to ``capacity`` entries and saved to a small JSON file whenever a new
+play starts (and at most every ``gap / 2`` seconds while one runs), so a
+restart neither rescrobbles the current song nor needs a Last.fm lookup to
+find out it was already scrobbled.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_BRACKETS = re.compile(r"[\(\[][^\)\]]*[\)\]]")
+_FEATURING = re.compile(r"\s(?:feat\.?|ft\.?|featuring)\s.*$")
+_SUFFIX = re.compile(r"\s-\s.*$")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    text = _PUNCTUATION.sub(" ", _FEATURING.sub("", text.casefold()))
+    return _SPACE.sub(" ", text).strip()
+
+
+def normalize_key(artist: str, title: str) -> str:
+    """Build the dedupe key of a song.
+
+    Case, punctuation, featured artists and bracketed or dashed title
+    suffixes such as "(Radio Edit)" or "- Remastered 2011" are ignored.
+
+    Args:
+        artist: Artist name as reported by Shazam or Last.fm.
+        title: Song title as reported by Shazam or Last.fm.
+
+    Returns:
+        The normalized key.
+    """
+    stripped = _SUFFIX.sub("", _BRACKETS.sub("", title))
+    return f"{_normalize(artist)}\t{_normalize(stripped) or _normalize(title)}"
+
+
+class _Play:
+    """When a song was first and last heard."""
+
+    __slots__ = ("started", "last_heard")
+
+    def __init__(self, started: float, last_heard: float) -> None:
+        self.started = started
+        self.last_heard = last_heard
+
+
+class DedupeIndex:
+    """Recently heard songs with play-time windows and LRU eviction.
+
+    Args:
+        path: JSON file to load from and save to, or None to keep it in memory.
+        gap: Seconds without hearing a song after which its play ends.
+        max_play: Seconds after which a play ends even if still heard.
+        capacity: Maximum number of songs remembered.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        gap: float = 300.0,
+        max_play: float = 900.0,
+        capacity: int = 256,
+    ) -> None:
+        self.path = path
+        self.gap = gap
+        self.max_play = max_play
+        self.capacity = capacity
+        self._plays: "OrderedDict[str, _Play]" = OrderedDict()
+        self._saved_at = float("-inf")
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self) -> int:
+        return len(self._plays)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._plays
+
+    def _running(self, play: _Play, now: float) -> bool:
+        # Backfilled songs can be heard out of order, before a play's start
+        return (
+            play.started - self.gap <= now <= play.last_heard + self.gap
+            and play.last_heard - self.max_play <= now <= play.started + self.max_play
+        )
+
+    def is_playing(self, key: str, now: float) -> bool:
+        """Whether the song is part of a play that is still running."""
+        play = self._plays.get(key)
+        return play is not None and self._running(play, now)
+
+    def observe(self, key: str, now: float) -> bool:
+        """Check a newly identified song against the index.
+
+        A song whose play is still running is marked as heard again; the
+        index is saved if that has not happened for ``gap / 2`` seconds.
+
+        Args:
+            key: Key from :func:`normalize_key`.
+            now: Current time in seconds since the epoch.
+
+        Returns:
+            True if the song is a duplicate of a running play.
+        """
+        play = self._plays.get(key)
+        if play is None or not self._running(play, now):
+            return False
+        if now > play.last_heard:
+            play.last_heard = now
+        elif now < play.started:
+            play.started = now
+        self._plays.move_to_end(key)
+        if now - self._saved_at >= self.gap / 2:
+            self.save(now)
+        return True
+
+    def record(self, key: str, now: float) -> None:
+        """Start a new play of a song and save the index.
+
+        A backfilled play older than the one already indexed leaves the
+        newer play in place.
+
+        Args:
+            key: Key from :func:`normalize_key`.
+            now: Current time in seconds since the epoch.
+        """
+        play = self._plays.get(key)
+        if play is None:
+            self._plays[key] = _Play(now, now)
+            while len(self._plays) > self.capacity:
+                self._plays.popitem(last=False)
+        elif now >= play.last_heard:
+            play.started = play.last_heard = now
+            self._plays.move_to_end(key)
+        self.save(now)
+
+    def save(self, now: Optional[float] = None) -> None:
+        """Write the index atomically, if it has a path.
+
+        Args:
+            now: Current time, remembered to rate-limit saves from :meth:`observe`.
+        """
+        if self.path is None:
+            return
+        if now is not None:
+            self._saved_at = now
+        plays = [[key, play.started, play.last_heard] for key, play in self._plays.items()]
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"plays": plays}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save dedupe index {self.path}: {e}")
+
+    def _load(self, path: str) -> None:
+        try:
+            with open(path) as f:
+                plays = json.load(f)["plays"]
+            for key, started, last_heard in plays[-self.capacity :]:
+                self._plays[str(key)] = _Play(float(started), float(last_heard))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._plays.clear()
+            logger.warning(f"Ignoring unreadable dedupe index {path}: {e}")
@@ -0,0 +1,201 @@
+"""Input device registry that survives devices being unplugged and replugged.
+
+PortAudio numbers devices by their position in its device list, so an index
+chosen at start-up points at a different device, or at nothing, once a USB
+interface resets or another device is plugged in. Devices are therefore
+tracked by a stable key of device name and host API, and the registry maps
+that key back to the current index after every rescan.
+
+PortAudio only enumerates devices when it is initialized, so a rescan
+re-initializes it. That is only safe while no stream is open in this
+process, which holds between captures: ``record_audio`` closes its stream
+before returning, and ``--capture-process`` streams from a child process
+with its own PortAudio instance.
+"""
+
+import logging
+import time
+import types
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from autoscrobbler import metrics
+
+logger = logging.getLogger(__name__)
+
+DeviceKey = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class InputDevice:
+    """An input device as listed by PortAudio.
+
+    Attributes:
+        index: Position in the current PortAudio device list.
+        name: Device name.
+        hostapi: Name of the host API, e.g. ALSA or Core Audio.
+        channels: Maximum number of input channels.
+        default_samplerate: Default sample rate in Hz.
+    """
+
+    index: int
+    name: str
+    hostapi: str
+    channels: int
+    default_samplerate: float
+
+    @property
+    def key(self) -> DeviceKey:
+        """Key identifying the device across rescans and restarts."""
+        return self.name, self.hostapi
+
+
+class DeviceRegistry:
+    """Cached list of input devices, scanned once and refreshed on demand.
+
+    Args:
+        sd: The sounddevice module.
+    """
+
+    def __init__(self, sd: types.ModuleType) -> None:
+        self.sd = sd
+        self._devices: Optional[list[InputDevice]] = None
+        self._default_index: Optional[int] = None
+
+    @property
+    def devices(self) -> list[InputDevice]:
+        """Input devices, scanning on first use."""
+        if self._devices is None:
+            self.scan()
+        return self._devices or []
+
+    @property
+    def default_index(self) -> Optional[int]:
+        """Index of the default input device, if there is one."""
+        if self._devices is None:
+            self.scan()
+        return self._default_index
+
+    def scan(self, refresh: bool = False) -> list[InputDevice]:
+        """Query PortAudio for the input devices.
+
+        Args:
+            refresh: Re-initialize PortAudio first so that devices plugged in
+                     or removed since the last scan are seen. No stream may be
+                     open in this process.
+
+        Returns:
+            The input devices.
+        """
+        if refresh:
+            metrics.DEVICE_RESCANS.inc()
+            terminate = getattr(self.sd, "_terminate", None)
+            initialize = getattr(self.sd, "_initialize", None)
+            if terminate is not None and initialize is not None:
+                terminate()
+                initialize()
+        try:
+            hostapis = [api["name"] for api in self.sd.query_hostapis()]
+        except Exception:
+            hostapis = []
+        devices = []
+        for position, info in enumerate(self.sd.query_devices()):
+            if info["max_input_channels"] <= 0:
+                continue
+            hostapi = info.get("hostapi")
+            devices.append(InputDevice(
+                index=info.get("index", position),
+                name=info["name"],
+                hostapi=hostapis[hostapi] if isinstance(hostapi, int) and hostapi < len(hostapis) else "",
+                channels=info["max_input_channels"],
+                default_samplerate=info["default_samplerate"],
+            ))
+        self._devices = devices
+        try:
+            self._default_index = self.sd.query_devices(kind="input").get("index")
+        except Exception:
+            # PortAudio raises when there is no default input device
+            self._default_index = None
+        return devices
+
+    def by_index(self, index: Optional[int]) -> Optional[InputDevice]:
+        """Return the input device at an index of the latest scan."""
+        for device in self.devices:
+            if device.index == index:
+                return device
+        return None
+
+    def find(self, key: DeviceKey) -> Optional[InputDevice]:
+        """Return the input device with a key, or None if it is not connected.
+
+        Of several identical devices on one host API the first is returned.
+        """
+        for device in self.devices:
+            if device.key == key:
+                return device
+        return None
+
+
+class DeviceWatch:
+    """Follow one input device across rescans.
+
+    Args:
+        registry: Registry to rescan.
+        device: Device chosen at start-up.
+        interval: Seconds between periodic rescans.
+        clock: Monotonic clock, replaceable in tests.
+    """
+
+    def __init__(
+        self,
+        registry: DeviceRegistry,
+        device: InputDevice,
+        interval: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.registry = registry
+        self.device = device
+        self.interval = interval
+        self.clock = clock
+        self.missing = False
+        self._next_scan = clock() + interval
+
+    @property
+    def index(self) -> int:
+        """Current index of the followed device."""
+        return self.device.index
+
+    def check(self, failed: bool = False) -> bool:
+        """Rescan when due and report whether the stream should be reopened.
+
+        Args:
+            failed: The last capture failed, so rescan right away.
+
+        Returns:
+            True if the device is connected and its stream must be reopened
+            on :attr:`index`: it failed, moved to another index or came back.
+        """
+        now = self.clock()
+        if not failed and now < self._next_scan:
+            return False
+        self._next_scan = now + self.interval
+        found = None
+        try:
+            self.registry.scan(refresh=True)
+            found = self.registry.find(self.device.key)
+        except Exception as e:
+            logger.warning(f"Could not rescan input devices: {e}")
+        if found is None:
+            if not self.missing:
+                logger.warning(
+                    f"Input device '{self.device.name}' ({self.device.hostapi}) is missing, "
+                    "waiting for it to come back"
+                )
+            self.missing = True
+            return False
+        reopen = failed or self.missing or found.index != self.device.index
+        if reopen:
+            logger.info(f"Input device '{found.name}' ({found.hostapi}) is at index {found.index}")
+        self.missing = False
+        self.device = found
+        return reopen
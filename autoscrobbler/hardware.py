@@ -0,0 +1,372 @@
+"""Benchmark of the machine autoscrobbler runs on: ``autoscrobbler bench``.
+
+Where :mod:`autoscrobbler.bench` compares code changes offline, this measures
+whether a given device, such as a Raspberry Pi with its USB microphone, can
+keep up, and prints the results as JSON so machines can be compared:
+
+* ``capture``: a callback input stream on the selected device, as used by
+  ``--capture-process``, runs for ``--seconds``. Reported are the time to open
+  the stream and to its first block, the latency from the ADC to each
+  callback as PortAudio reports it, the spacing of callbacks against the
+  block length, and how many callbacks reported an overflow or other xrun.
+* ``signature``: the time to compute the signature of a 10 second window of
+  synthetic music at ``--sample-rate``, per second of audio.
+* ``conditioning``: the time to condition the same window, as ``--condition``
+  does before identification, per second of audio.
+* ``memory``: the resident set size, its peak so far, the capture buffer and
+  the peak Python allocations while computing a signature.
+* ``identify``: round trips of :func:`autoscrobbler.__main__.identify_song`
+  to ``--endpoint``, by default Shazam itself, or a local stand-in such as
+  :func:`autoscrobbler.standins.serve_shazam`. Each request is sent once,
+  without retries.
+
+A section that fails reports its error instead, and the command then exits
+with status 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+from autoscrobbler import __main__ as app
+from autoscrobbler import logs, ratelimit
+from autoscrobbler.profiling import peak_rss_bytes, rss_bytes
+
+WINDOW_SECONDS = 10
+
+
+def summarize(values: Sequence[float], scale: float = 1.0) -> dict[str, Optional[float]]:
+    """p50, p99 and maximum of ``values`` times ``scale``, or None when empty."""
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    array = np.asarray(values) * scale
+    return {
+        "p50": float(np.percentile(array, 50)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+    }
+
+
+def bench_window(sample_rate: int) -> np.ndarray:
+    """The 10 second window every machine computes signatures of."""
+    from autoscrobbler.standins import synthetic_music
+
+    return synthetic_music(WINDOW_SECONDS, sample_rate, seed=0)
+
+
+def measure_capture(
+    device: Optional[int], sample_rate: int, seconds: float, blocksize: int
+) -> dict[str, Any]:
+    """Stream from an input device and time its callbacks.
+
+    Args:
+        device: Input device index.
+        sample_rate: Sample rate in Hz.
+        seconds: How long to stream.
+        blocksize: Frames per callback.
+
+    Returns:
+        Capture measurements.
+    """
+    lock = threading.Lock()
+    arrivals: list[float] = []
+    adc_latencies: list[float] = []
+    counts = {"frames": 0, "overflows": 0, "xruns": 0}
+
+    def callback(indata: np.ndarray, frames: int, time_info: Any, status: Any) -> None:
+        now = time.perf_counter()
+        with lock:
+            arrivals.append(now)
+            counts["frames"] += frames
+            counts["overflows"] += bool(status.input_overflow)
+            counts["xruns"] += bool(status)
+            # Host APIs without timing information report zero
+            if time_info.inputBufferAdcTime > 0:
+                adc_latencies.append(time_info.currentTime - time_info.inputBufferAdcTime)
+
+    began = time.perf_counter()
+    with app.sd.InputStream(
+        samplerate=sample_rate,
+        channels=1,
+        dtype="int16",
+        device=device,
+        blocksize=blocksize,
+        callback=callback,
+    ) as stream:
+        started = time.perf_counter()
+        time.sleep(seconds)
+        reported_latency = stream.latency
+    stopped = time.perf_counter()
+    with lock:
+        intervals = np.diff(arrivals).tolist()
+        first_block = arrivals[0] - started if arrivals else None
+        return {
+            "device": device,
+            "sample_rate": sample_rate,
+            "blocksize": blocksize,
+            "seconds": stopped - started,
+            "open_ms": (started - began) * 1000,
+            "first_block_ms": first_block * 1000 if first_block is not None else None,
+            "reported_latency_ms": float(reported_latency) * 1000,
+            "adc_latency_ms": summarize(adc_latencies, 1000.0),
+            "expected_interval_ms": blocksize / sample_rate * 1000,
+            "callback_interval_ms": summarize(intervals, 1000.0),
+            "blocks": len(arrivals),
+            "frames": counts["frames"],
+            "frames_per_second": counts["frames"] / (stopped - started),
+            "overflows": counts["overflows"],
+            "xruns": counts["xruns"],
+        }
+
+
+def measure_signature(samples: np.ndarray, sample_rate: int, runs: int) -> dict[str, Any]:
+    """Time signature generation for a window of audio.
+
+    Args:
+        samples: Mono int16 window.
+        sample_rate: Sample rate of the window in Hz.
+        runs: Number of signatures to compute.
+
+    Returns:
+        Signature timings.
+    """
+    from autoscrobbler.signature import signature_of
+
+    audio_seconds = samples.size / sample_rate
+    times = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        signature_of(samples, sample_rate)
+        times.append(time.perf_counter() - began)
+    return {
+        "window_seconds": audio_seconds,
+        "runs": runs,
+        "ms_per_audio_second": summarize(times, 1000.0 / audio_seconds),
+        "realtime_factor": audio_seconds / float(np.median(times)),
+    }
+
+
+def measure_conditioning(samples: np.ndarray, sample_rate: int, runs: int) -> dict[str, Any]:
+    """Time conditioning of a window of audio.
+
+    Args:
+        samples: Mono int16 window; conditioned copies of it are timed.
+        sample_rate: Sample rate of the window in Hz.
+        runs: Number of windows to condition.
+
+    Returns:
+        Conditioning timings.
+    """
+    from autoscrobbler.conditioning import Conditioner
+
+    conditioner = Conditioner()
+    window = np.empty_like(samples)
+    audio_seconds = samples.size / sample_rate
+    times = []
+    for _ in range(runs):
+        np.copyto(window, samples)
+        began = time.perf_counter()
+        conditioner.condition(window, sample_rate)
+        times.append(time.perf_counter() - began)
+    return {
+        "runs": runs,
+        "ms_per_audio_second": summarize(times, 1000.0 / audio_seconds),
+        "realtime_factor": audio_seconds / float(np.median(times)),
+    }
+
+
+def measure_memory(samples: np.ndarray, sample_rate: int) -> dict[str, Any]:
+    """Memory used by a capture buffer and by computing its signature.
+
+    Args:
+        samples: Mono int16 window.
+        sample_rate: Sample rate of the window in Hz.
+
+    Returns:
+        Memory measurements in bytes.
+    """
+    from autoscrobbler.buffers import BufferPool
+    from autoscrobbler.signature import signature_of
+
+    pool = BufferPool(frames=WINDOW_SECONDS * sample_rate, sample_rate=sample_rate, size=1)
+    with pool.acquire() as buffer:
+        buffer_bytes = buffer.samples.nbytes
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        signature_of(samples, sample_rate)
+        signature_peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return {
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "capture_buffer_bytes": buffer_bytes,
+        "signature_peak_traced_bytes": signature_peak,
+    }
+
+
+def measure_identify(
+    samples: np.ndarray, sample_rate: int, endpoint: Optional[str], requests: int, timeout: float
+) -> dict[str, Any]:
+    """Time identification round trips.
+
+    Args:
+        samples: Mono int16 window to identify.
+        sample_rate: Sample rate of the window in Hz.
+        endpoint: Base URL of the identification server (default: Shazam).
+        requests: Number of requests.
+        timeout: Timeout of each request in seconds.
+
+    Returns:
+        Round trip timings.
+    """
+    from autoscrobbler.shazam_client import WARM_UP_URL, ShazamHTTPClient
+
+    client = ShazamHTTPClient(timeout=timeout, base_url=endpoint)
+    app.configure_shazam(client)
+    # One attempt per request, not held back by the daemon's rate limit
+    ratelimit.configure_limiter(rate=1000.0, burst=max(1, requests), max_retries=0)
+    try:
+        began = time.perf_counter()
+        app.run_shazam(client.warm_up())
+        connect = time.perf_counter() - began
+        times = []
+        errors = []
+        matched = 0
+        for _ in range(requests):
+            began = time.perf_counter()
+            try:
+                result = app.run_shazam(app.identify_song(samples, sample_rate))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            times.append(time.perf_counter() - began)
+            matched += bool(result.get("track"))
+    finally:
+        app.close_shazam()
+    return {
+        "endpoint": endpoint or WARM_UP_URL,
+        "requests": requests,
+        "connect_ms": connect * 1000,
+        "round_trip_ms": summarize(times, 1000.0),
+        "matched": matched,
+        "errors": errors,
+    }
+
+
+def host_info() -> dict[str, Any]:
+    """What the benchmark ran on."""
+    return {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _section(measure: Any, *args: Any) -> dict[str, Any]:
+    try:
+        return measure(*args)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def run_bench(
+    input_source: str = "auto",
+    sample_rate: int = 44100,
+    seconds: float = 10.0,
+    blocksize: int = 2048,
+    signature_runs: int = 5,
+    endpoint: Optional[str] = None,
+    identify_requests: int = 3,
+    timeout: float = 30.0,
+) -> dict[str, Any]:
+    """Measure this machine.
+
+    Args:
+        input_source: Input device, as for ``--input-source``.
+        sample_rate: Sample rate of capture and signatures in Hz.
+        seconds: How long to stream from the device; 0 skips capture.
+        blocksize: Frames per capture callback.
+        signature_runs: Signatures to compute, and windows to condition.
+        endpoint: Base URL of the identification server (default: Shazam).
+        identify_requests: Identification round trips; 0 skips them.
+        timeout: Timeout of each identification request in seconds.
+
+    Returns:
+        The report, as printed by the command line.
+    """
+    report: dict[str, Any] = {"host": host_info(), "sample_rate": sample_rate}
+    if seconds > 0:
+
+        def capture() -> dict[str, Any]:
+            source = int(input_source) if input_source.isdigit() else input_source
+            device = app.select_input_device(source)
+            result = measure_capture(device, sample_rate, seconds, blocksize)
+            result["device_name"] = app.device_registry().by_index(device).name
+            return result
+
+        report["capture"] = _section(capture)
+    window = bench_window(sample_rate)
+    report["signature"] = _section(measure_signature, window, sample_rate, signature_runs)
+    report["conditioning"] = _section(measure_conditioning, window, sample_rate, signature_runs)
+    report["memory"] = _section(measure_memory, window, sample_rate)
+    if identify_requests > 0:
+        report["identify"] = _section(
+            measure_identify, window, sample_rate, endpoint, identify_requests, timeout
+        )
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run the benchmark from the command line and print its report as JSON."""
+    parser = argparse.ArgumentParser(
+        prog="autoscrobbler bench",
+        description="Measure capture, signature generation, memory and identification on this machine.",
+    )
+    parser.add_argument("-i", "--input-source", type=str, default="auto", help="Input device index or name (default: auto)")
+    parser.add_argument("--sample-rate", type=int, default=44100, help="Sample rate in Hz (default: 44100)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Seconds to stream from the device; 0 skips capture (default: 10)")
+    parser.add_argument("--blocksize", type=int, default=2048, help="Frames per capture callback (default: 2048)")
+    parser.add_argument("--signature-runs", type=int, default=5, help="Signatures to compute and windows to condition (default: 5)")
+    parser.add_argument("--endpoint", type=str, default=None, help="Base URL of the identification server (default: Shazam)")
+    parser.add_argument("--identify-requests", type=int, default=3, help="Identification round trips; 0 skips them (default: 3)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout of each identification request (default: 30)")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+    if args.signature_runs < 1:
+        parser.error("--signature-runs must be at least 1")
+    logs.configure_logging()
+
+    report = run_bench(
+        input_source=args.input_source,
+        sample_rate=args.sample_rate,
+        seconds=args.seconds,
+        blocksize=args.blocksize,
+        signature_runs=args.signature_runs,
+        endpoint=args.endpoint,
+        identify_requests=args.identify_requests,
+        timeout=args.timeout,
+    )
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if any(isinstance(section, dict) and "error" in section for section in report.values()):
+        sys.exit(1)
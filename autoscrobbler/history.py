@@ -0,0 +1,273 @@
+"""Append-only play history in a local SQLite database.
+
+Every identification (with the full Shazam response), every scrobble decision
+and every scrobble is recorded as one row of the ``events`` table. Rows are
+queued by the main loop and written by a background thread in batched
+transactions, so recording never waits on the disk. The database runs in WAL
+mode, which lets stats queries read while the writer appends, and is indexed
+on timestamp and normalized track key. With a retention period the writer
+also deletes older rows once an hour, so the database stops growing after
+that many days; SQLite reuses the freed pages.
+"""
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+IDENTIFICATION = "identification"
+DECISION = "decision"
+SCROBBLE = "scrobble"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    kind TEXT NOT NULL,
+    track_key TEXT,
+    artist TEXT,
+    title TEXT,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_kind ON events (kind, timestamp);
+CREATE INDEX IF NOT EXISTS events_track_key ON events (track_key, timestamp);
+"""
+
+PRUNE_INTERVAL = 3600.0
+
+_INSERT = (
+    "INSERT INTO events (timestamp, kind, track_key, artist, title, detail) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+Event = tuple[float, str, Optional[str], Optional[str], Optional[str], Any]
+
+
+def _encode(detail: Any) -> Optional[str]:
+    """Store strings as-is and anything else as JSON."""
+    if detail is None or isinstance(detail, str):
+        return detail
+    return json.dumps(detail, separators=(",", ":"))
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class PlayHistory:
+    """Record identifications, decisions and scrobbles from a background thread.
+
+    Args:
+        path: SQLite database file, created if missing.
+        batch_size: Maximum rows written per transaction (default: 64).
+        flush_interval: Seconds the writer waits to fill a batch (default: 1).
+        retention_days: Days of events to keep, or None to keep everything.
+        prune_interval: Seconds between deletions of expired events
+                        (default: ``PRUNE_INTERVAL``).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        retention_days: Optional[float] = None,
+        prune_interval: float = PRUNE_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        conn = _connect(path)
+        with conn:
+            conn.executescript(_SCHEMA)
+        conn.close()
+        self._reader: Optional[sqlite3.Connection] = None
+        self._thread = threading.Thread(
+            target=self._write_loop, name="history-writer", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """Rows queued but not yet written."""
+        return self._queue.qsize()
+
+    def _put(
+        self,
+        kind: str,
+        key: Optional[str],
+        artist: Optional[str],
+        title: Optional[str],
+        detail: Any,
+        timestamp: Optional[float],
+    ) -> None:
+        ts = timestamp if timestamp is not None else time.time()
+        self._queue.put((ts, kind, key, artist, title, detail))
+
+    def record_identification(
+        self,
+        result: dict[str, Any],
+        key: Optional[str] = None,
+        artist: Optional[str] = None,
+        title: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        """Record a Shazam response; it is serialized on the writer thread.
+
+        Args:
+            result: Full Shazam response; it must not be modified afterwards.
+            key: Normalized track key, if a song was identified.
+            artist: Artist name, if a song was identified.
+            title: Song title, if a song was identified.
+            timestamp: When the audio was captured (default: now).
+        """
+        self._put(IDENTIFICATION, key, artist, title, result, timestamp)
+
+    def record_decision(
+        self,
+        decision: str,
+        key: Optional[str] = None,
+        artist: Optional[str] = None,
+        title: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        """Record what was done with an identification, e.g. ``duplicate_local``."""
+        self._put(DECISION, key, artist, title, decision, timestamp)
+
+    def record_scrobble(
+        self,
+        key: str,
+        artist: str,
+        title: str,
+        album: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        """Record a song scrobbled to Last.fm."""
+        self._put(SCROBBLE, key, artist, title, {"album": album} if album else None, timestamp)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is written.
+
+        Returns:
+            False if the writer did not catch up within ``timeout``.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """Write queued rows and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _write_loop(self) -> None:
+        conn = _connect(self.path)
+        try:
+            next_prune = time.monotonic()
+            running = True
+            while running:
+                if self.retention_days is not None and time.monotonic() >= next_prune:
+                    self._prune(conn)
+                    next_prune = time.monotonic() + self.prune_interval
+                batch: list[Event] = []
+                waiters: list[threading.Event] = []
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    if not running or waiters or len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                self._write(conn, batch)
+                for waiter in waiters:
+                    waiter.set()
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: list[Event]) -> None:
+        if not batch:
+            return
+        rows = [
+            (ts, kind, key, artist, title, _encode(detail))
+            for ts, kind, key, artist, title, detail in batch
+        ]
+        try:
+            with conn:
+                conn.executemany(_INSERT, rows)
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(rows)} history event(s): {e}")
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            with conn:
+                deleted = conn.execute("DELETE FROM events WHERE timestamp < ?", (cutoff,)).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Could not delete expired history events: {e}")
+            return
+        if deleted:
+            logger.info(f"Deleted {deleted} history event(s) older than {self.retention_days:g} days")
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        if self._reader is None:
+            self._reader = _connect(self.path)
+        return self._reader.execute(sql, params).fetchall()
+
+    def count(self, kind: str, since: float = 0.0) -> int:
+        """Number of events of a kind since a time."""
+        sql = "SELECT COUNT(*) FROM events WHERE timestamp >= ? AND kind = ?"
+        return self._query(sql, (since, kind))[0][0]
+
+    def top_tracks(self, since: float = 0.0, limit: int = 10) -> list[tuple[str, str, int]]:
+        """Most scrobbled songs since a time, as (artist, title, plays)."""
+        return self._query(
+            "SELECT artist, title, COUNT(*) AS plays FROM events "
+            "WHERE timestamp >= ? AND kind = ? "
+            "GROUP BY track_key ORDER BY plays DESC, MAX(timestamp) DESC LIMIT ?",
+            (since, SCROBBLE, limit),
+        )
+
+    def last_scrobble(self, key: str) -> Optional[float]:
+        """Time a song was last scrobbled, if ever."""
+        row = self._query(
+            "SELECT MAX(timestamp) FROM events WHERE track_key = ? AND kind = ?",
+            (key, SCROBBLE),
+        )
+        return row[0][0]
+
+    def stats(self, since: float = 0.0, limit: int = 10) -> dict[str, Any]:
+        """Summary of activity since a time."""
+        return {
+            "identifications": self.count(IDENTIFICATION, since),
+            "decisions": dict(self._query(
+                "SELECT detail, COUNT(*) FROM events WHERE timestamp >= ? AND kind = ? "
+                "GROUP BY detail ORDER BY detail",
+                (since, DECISION),
+            )),
+            "scrobbles": self.count(SCROBBLE, since),
+            "top_tracks": self.top_tracks(since, limit),
+        }
@@ -0,0 +1,318 @@
+"""Central identification hub for lightweight edge nodes.
+
+In hub mode a single autoscrobbler instance holds the Shazam rate limiter,
+the Last.fm session, the dedupe index and the play history. Edge nodes only
+capture audio, apply the quality checks and compute the Shazam signature,
+then POST the signature (a few KB of base64, never raw audio) together with
+the capture's coarse spectral profile to the hub's ``/identify`` endpoint.
+
+The hub collects submissions for a short batch window and groups those that
+sound the same, e.g. several rooms hearing one song. Each group costs at most
+one Shazam call, made with the signature holding the most peaks, and is
+scrobbled once. Identified songs are cached by spectral profile, so a room
+that keeps hearing the same song is answered without calling Shazam at all.
+"""
+
+import base64
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+import numpy as np
+from shazamio.signature import DATA_URI_PREFIX, DecodedMessage
+
+from autoscrobbler import metrics
+from autoscrobbler.budget import check_profile, novelty
+
+logger = logging.getLogger(__name__)
+
+SUBMIT_PATH = "/identify"
+MAX_SUBMISSION_BYTES = 256 * 1024
+
+
+@dataclass
+class Submission:
+    """A signature sent by an edge node, waiting for identification.
+
+    Attributes:
+        node: Name of the edge node.
+        signature: Decoded Shazam signature.
+        profile: Spectral profile of the capture.
+        timestamp: When the capture was taken, in seconds since the epoch.
+        reply: Answer for the edge node, set once processed.
+    """
+
+    node: str
+    signature: DecodedMessage
+    profile: np.ndarray
+    timestamp: float
+    reply: Optional[dict[str, Any]] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def peaks(self) -> int:
+        """Number of spectral peaks in the signature."""
+        return sum(len(p) for p in self.signature.frequency_band_to_sound_peaks.values())
+
+
+def encode_submission(
+    node: str, signature: DecodedMessage, profile: np.ndarray, timestamp: float
+) -> bytes:
+    """Serialize a submission as sent by edge nodes."""
+    return json.dumps({
+        "node": node,
+        "signature": signature.encode_to_uri(),
+        "profile": [round(float(x), 4) for x in profile],
+        "timestamp": timestamp,
+    }, separators=(",", ":")).encode()
+
+
+def decode_submission(data: bytes) -> Submission:
+    """Parse and validate a submission.
+
+    Args:
+        data: Request body from an edge node.
+
+    Returns:
+        The submission.
+
+    Raises:
+        ValueError: If the body, the signature or the profile is malformed.
+    """
+    try:
+        message = json.loads(data)
+        uri = message["signature"]
+        if not uri.startswith(DATA_URI_PREFIX):
+            raise ValueError("not a Shazam signature URI")
+        signature = DecodedMessage.decode_from_binary(
+            base64.b64decode(uri[len(DATA_URI_PREFIX):], validate=True)
+        )
+        return Submission(
+            node=str(message["node"]),
+            signature=signature,
+            profile=check_profile(message["profile"]),
+            timestamp=float(message["timestamp"]),
+        )
+    except (AssertionError, KeyError, TypeError, AttributeError, ValueError) as e:
+        # DecodedMessage checks magic numbers and the CRC with assertions
+        raise ValueError(f"Invalid submission: {e}") from e
+
+
+def _summary(result: dict[str, Any]) -> Optional[dict[str, str]]:
+    track = result.get("track")
+    if not track:
+        return None
+    return {"artist": track.get("subtitle", ""), "title": track.get("title", "")}
+
+
+class Hub:
+    """Batch, deduplicate, cache and process submissions on one worker thread.
+
+    Args:
+        identify: Calls Shazam with a signature and returns its result.
+        process: Scrobbles a result heard at a timestamp (unless a duplicate).
+        batch_window: Seconds to collect submissions before identifying them.
+        match_threshold: Largest profile novelty for two captures to count as
+                         the same song.
+        cache_ttl: Seconds an identified song answers matching submissions.
+    """
+
+    def __init__(
+        self,
+        identify: Callable[[DecodedMessage], dict[str, Any]],
+        process: Callable[[dict[str, Any], float], None],
+        batch_window: float = 1.0,
+        match_threshold: float = 0.15,
+        cache_ttl: float = 120.0,
+    ) -> None:
+        self.identify = identify
+        self.process = process
+        self.batch_window = batch_window
+        self.match_threshold = match_threshold
+        self.cache_ttl = cache_ttl
+        self._cache: list[tuple[float, np.ndarray, dict[str, Any]]] = []
+        self._queue: "queue.SimpleQueue[Optional[Submission]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._work_loop, name="hub-worker", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """Submissions waiting for the worker."""
+        return self._queue.qsize()
+
+    def submit(self, submission: Submission, timeout: float = 60.0) -> dict[str, Any]:
+        """Queue a submission and wait for its answer.
+
+        Args:
+            submission: Decoded submission.
+            timeout: Seconds to wait for the worker.
+
+        Returns:
+            The reply for the edge node.
+        """
+        self._queue.put(submission)
+        if not submission.done.wait(timeout):
+            return {"error": "timed out waiting for identification"}
+        return submission.reply or {}
+
+    def close(self) -> None:
+        """Finish queued submissions and stop the worker."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work_loop(self) -> None:
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.batch_window
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            try:
+                for group in self._group(batch):
+                    self._handle(group)
+            except Exception as e:
+                # Answer the rest of the batch and keep serving the next one
+                logger.error(f"Hub could not process a batch of {len(batch)} submission(s): {e}")
+                for submission in batch:
+                    if not submission.done.is_set():
+                        submission.reply = {"error": str(e)}
+                        submission.done.set()
+
+    def _group(self, batch: list[Submission]) -> list[list[Submission]]:
+        groups: list[list[Submission]] = []
+        for submission in batch:
+            for group in groups:
+                if novelty(submission.profile, group[0].profile) <= self.match_threshold:
+                    group.append(submission)
+                    break
+            else:
+                groups.append([submission])
+        return groups
+
+    def _cached(self, profile: np.ndarray, now: float) -> Optional[dict[str, Any]]:
+        self._cache = [entry for entry in self._cache if now - entry[0] <= self.cache_ttl]
+        for _, reference, result in self._cache:
+            if novelty(profile, reference) <= self.match_threshold:
+                return result
+        return None
+
+    def _handle(self, group: list[Submission]) -> None:
+        now = time.time()
+        timestamp = min(s.timestamp for s in group)
+        source = "cache"
+        try:
+            result = self._cached(group[0].profile, now)
+            if result is None:
+                source = "shazam"
+                best = max(group, key=lambda s: s.peaks)
+                result = self.identify(best.signature)
+                if result.get("track"):
+                    self._cache.append((now, best.profile, result))
+            self.process(result, timestamp)
+            reply = {"track": _summary(result), "source": source, "batched": len(group)}
+        except Exception as e:
+            logger.error(f"Hub could not identify submission from {group[0].node}: {e}")
+            reply = {"error": str(e)}
+        metrics.HUB_SUBMISSIONS.inc(source=source)
+        if len(group) > 1:
+            metrics.HUB_SUBMISSIONS.inc(len(group) - 1, source="batch")
+        for submission in group:
+            submission.reply = reply
+            submission.done.set()
+
+
+class _HubHandler(BaseHTTPRequestHandler):
+    hub: Hub
+
+    def do_POST(self) -> None:  # noqa: N802 (http.server naming)
+        if self.path.split("?")[0] != SUBMIT_PATH:
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_SUBMISSION_BYTES:
+            self.send_error(413)
+            return
+        try:
+            submission = decode_submission(self.rfile.read(length))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(self.hub.submit(submission)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        logger.debug(f"hub: {format % args}")
+
+
+def start_hub_server(hub: Hub, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve ``/identify`` from a daemon thread.
+
+    Args:
+        hub: Hub processing the submissions.
+        port: TCP port to listen on (0 picks a free port).
+        host: Address to bind (default: all interfaces).
+
+    Returns:
+        The running server; call ``shutdown()`` to stop it.
+    """
+    handler = type("HubHandler", (_HubHandler,), {"hub": hub})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="autoscrobbler-hub", daemon=True)
+    thread.start()
+    logger.info(f"Hub accepting fingerprints on http://{host}:{server.server_address[1]}{SUBMIT_PATH}")
+    return server
+
+
+class HubClient:
+    """Send signatures from an edge node to a hub.
+
+    Args:
+        url: Base URL of the hub, e.g. ``http://hub.local:8765``.
+        node: Name of this edge node.
+        timeout: Seconds to wait for the hub's answer.
+    """
+
+    def __init__(self, url: str, node: str, timeout: float = 60.0) -> None:
+        self.url = url.rstrip("/") + SUBMIT_PATH
+        self.node = node
+        self.timeout = timeout
+
+    def submit(
+        self, signature: DecodedMessage, profile: np.ndarray, timestamp: float
+    ) -> dict[str, Any]:
+        """Send a signature and return the hub's answer.
+
+        Raises:
+            ConnectionError: If the hub cannot be reached or rejects the request.
+        """
+        data = encode_submission(self.node, signature, profile, timestamp)
+        request = urllib.request.Request(
+            self.url, data=data, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                reply = json.loads(response.read())
+        except (OSError, ValueError) as e:
+            raise ConnectionError(f"Hub {self.url} unavailable: {e}") from e
+        metrics.HUB_UPLOAD_BYTES.inc(len(data))
+        return reply
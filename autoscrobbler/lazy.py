@@ -0,0 +1,38 @@
+"""Deferred imports for heavy dependencies.
+
+numpy, pylast, sounddevice and shazamio take seconds to import on a Raspberry
+Pi Zero. Modes that never touch them, such as ``--help`` or ``--stats``,
+should not pay for them.
+"""
+
+import importlib.util
+import sys
+import types
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Import a module when one of its attributes is first used.
+
+    The module is registered in ``sys.modules`` right away, so later plain
+    imports of it share the same (lazily loaded) module object.
+
+    Args:
+        name: Absolute module name.
+
+    Returns:
+        The module, loaded on first attribute access.
+
+    Raises:
+        ModuleNotFoundError: If the module is not installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,552 @@
+"""Load test the main loop against loopback audio and stand-in services.
+
+``python -m autoscrobbler.loadtest --nodes 8 --speed 30 --duration 3600``
+simulates an hour of eight devices listening to music:
+
+1. Tracks are read from ``--audio`` (``Artist - Title.wav`` and similar
+   files) or generated as synthetic music.
+2. The Shazam and Last.fm stand-ins from :mod:`autoscrobbler.standins` serve
+   on localhost with the requested latency and error rates. The Shazam
+   stand-in learns every track, so identification depends on what was
+   actually captured.
+3. Each simulated device runs in a node process executing the unmodified
+   :func:`autoscrobbler.__main__.main`, with ``sounddevice`` replaced by a
+   loopback device playing the tracks in its own order, ``time`` by a
+   :class:`~autoscrobbler.loopback.ScaledClock` running ``--speed`` times
+   faster, and the Shazam and Last.fm clients pointed at the stand-ins. Each
+   node scrobbles as its own Last.fm user and writes a trace file.
+4. After ``--duration`` simulated seconds the nodes are interrupted, and the
+   scrobbles received are scored against the plays of each device.
+
+Only time spent waiting speeds up: signature generation and requests take
+as long as they really do, which is what a load test should show. Shazam rate
+limits (``--shazam-rate``, ``--breaker-cooldown``) and retry backoff are
+scaled so they act on simulated time as they would on real time.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import soundfile as sf
+
+from autoscrobbler import logs
+from autoscrobbler.dedupe import normalize_key
+from autoscrobbler.loopback import (
+    LoopbackDevice,
+    LoopbackSoundDevice,
+    Play,
+    ScaledClock,
+    read_track,
+)
+from autoscrobbler.standins import (
+    API_KEY,
+    API_SECRET,
+    Faults,
+    LastfmStandIn,
+    Scrobble,
+    ShazamStandIn,
+    serve_lastfm,
+    serve_shazam,
+    synthetic_music,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".aiff")
+DEFAULT_SHAZAM_RATE = 6.0
+DEFAULT_BREAKER_COOLDOWN = 300.0
+
+
+@dataclass(frozen=True)
+class NodeConfig:
+    """Everything a node process needs, passed to it as JSON.
+
+    Attributes:
+        name: Node and device name; also the Last.fm username.
+        playlist: Audio files the device plays, in order.
+        speed: Simulated seconds per real second.
+        origin: Real time at which simulated time starts.
+        delay: Simulated seconds after the start before the first cycle, so
+               that nodes do not all capture at once.
+        shazam_url: Base URL of the Shazam stand-in.
+        lastfm_url: Base URL of the Last.fm stand-in.
+        argv: Command line arguments of the node's main loop.
+    """
+
+    name: str
+    playlist: list[str]
+    speed: float
+    origin: float
+    delay: float
+    shazam_url: str
+    lastfm_url: str
+    argv: list[str]
+
+
+def run_node(config: NodeConfig) -> None:
+    """Run the main loop of one simulated device until interrupted.
+
+    Args:
+        config: The node's configuration.
+    """
+    import pylast
+
+    from autoscrobbler import __main__ as app
+    from autoscrobbler import ratelimit
+    from autoscrobbler.shazam_client import ShazamHTTPClient
+    from autoscrobbler.standins import RedirectTransport
+
+    clock = ScaledClock(config.speed, config.origin)
+    tracks = [read_track(path, SAMPLE_RATE) for path in config.playlist]
+    app.sd = LoopbackSoundDevice(
+        [LoopbackDevice(config.name, tracks, SAMPLE_RATE, start=clock.epoch)], clock
+    )
+    app.time = clock
+    backoff_delay = ratelimit.backoff_delay
+    ratelimit.backoff_delay = lambda *args: backoff_delay(*args) / config.speed
+    app.configure_shazam(ShazamHTTPClient(base_url=config.shazam_url))
+    transport = RedirectTransport(config.lastfm_url)
+
+    def lastfm_network(lastfm_creds: dict[str, str]) -> pylast.LastFMNetwork:
+        network = pylast.LastFMNetwork(
+            api_key=lastfm_creds["api_key"],
+            api_secret=lastfm_creds["api_secret"],
+            username=lastfm_creds["username"],
+            password_hash=pylast.md5(lastfm_creds["password"]),
+            proxy={"https://": transport},
+        )
+        network.enable_rate_limit()
+        return network
+
+    app.lastfm_network = lastfm_network
+    sys.argv = ["autoscrobbler", *config.argv]
+    try:
+        time.sleep(max(0.0, clock.to_real(clock.epoch + config.delay) - time.time()))
+        app.main()
+    except KeyboardInterrupt:
+        pass
+
+
+@dataclass(frozen=True)
+class Score:
+    """Scrobbles of one device compared with what it played.
+
+    Attributes:
+        scrobbles: Scrobbles received.
+        correct: Plays scrobbled, each counted once.
+        duplicates: Further scrobbles of an already scrobbled play.
+        wrong: Scrobbles of a track that was not playing.
+        missed: Plays long enough to be identified that were not scrobbled.
+        time_to_scrobble: Seconds from the start of each scrobbled play to
+                          its first scrobble.
+    """
+
+    scrobbles: int
+    correct: int
+    duplicates: int
+    wrong: int
+    missed: int
+    time_to_scrobble: list[float] = field(default_factory=list)
+
+
+def score_scrobbles(
+    plays: Sequence[Play],
+    scrobbles: Sequence[Scrobble],
+    start: float,
+    end: float,
+    min_play: float,
+    slack: float,
+) -> Score:
+    """Match scrobbles to the plays they should record.
+
+    A scrobble belongs to the latest play of its track that started before
+    the scrobble and ended no more than ``slack`` seconds earlier, as a
+    capture is only identified and scrobbled some time after it began.
+
+    Args:
+        plays: Plays of the device.
+        scrobbles: Scrobbles received for the device.
+        start: Start of the scored span, in simulated time.
+        end: End of the scored span.
+        min_play: Shortest play that must be scrobbled; shorter plays, and
+                  plays not within the span, count neither way when missed.
+        slack: Seconds after a play's end its scrobble may arrive.
+
+    Returns:
+        The score.
+    """
+    by_key: dict[str, list[Play]] = {}
+    for play in plays:
+        by_key.setdefault(normalize_key(play.track.artist, play.track.title), []).append(play)
+    scrobbled: dict[Play, float] = {}
+    duplicates = wrong = 0
+    for scrobble in sorted(scrobbles, key=lambda s: s.timestamp):
+        candidates = [
+            play
+            for play in by_key.get(normalize_key(scrobble.artist, scrobble.title), [])
+            if play.start <= scrobble.timestamp <= play.end + slack
+        ]
+        if not candidates:
+            wrong += 1
+        elif candidates[-1] in scrobbled:
+            duplicates += 1
+        else:
+            scrobbled[candidates[-1]] = scrobble.timestamp - candidates[-1].start
+    missed = sum(
+        1
+        for play in plays
+        if play not in scrobbled
+        and play.start >= start
+        and play.end <= end
+        and play.end - play.start >= min_play
+    )
+    return Score(
+        len(scrobbles), len(scrobbled), duplicates, wrong, missed, list(scrobbled.values())
+    )
+
+
+def read_spans(path: str) -> list[dict[str, Any]]:
+    """Read a trace file, skipping a line cut short by an interrupted node."""
+    spans = []
+    if not os.path.exists(path):
+        return spans
+    with open(path) as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+
+def span_seconds(span: dict[str, Any]) -> float:
+    """Duration of a traced span in seconds."""
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e9
+
+
+def percentiles(values: Sequence[float], scale: float = 1.0) -> dict[str, Optional[float]]:
+    """p50, p99 and maximum of ``values`` times ``scale``, or None when empty."""
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    array = np.asarray(values) * scale
+    return {
+        "p50": float(np.percentile(array, 50)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+    }
+
+
+def prepare_tracks(directory: str, audio: Optional[str], count: int, seconds: float) -> list[str]:
+    """Audio files to play: those in ``audio``, or generated synthetic tracks.
+
+    Args:
+        directory: Where generated tracks are written.
+        audio: Directory of audio files, or None to generate tracks.
+        count: Number of tracks to generate.
+        seconds: Length of each generated track.
+
+    Returns:
+        Paths of the audio files.
+
+    Raises:
+        ValueError: If ``audio`` holds no audio files.
+    """
+    if audio is not None:
+        paths = sorted(
+            path
+            for path in glob.glob(os.path.join(audio, "*"))
+            if path.lower().endswith(AUDIO_EXTENSIONS)
+        )
+        if not paths:
+            raise ValueError(f"No audio files in {audio}.")
+        return paths
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"Load Artist {i} - Load Song {i}.wav")
+        sf.write(path, synthetic_music(seconds, SAMPLE_RATE, seed=i), SAMPLE_RATE)
+        paths.append(path)
+    return paths
+
+
+def run_load(
+    nodes: int = 4,
+    speed: float = 20.0,
+    duration: float = 1800.0,
+    duty_cycle: int = 60,
+    audio: Optional[str] = None,
+    tracks: int = 8,
+    track_seconds: float = 150.0,
+    shazam_faults: Faults = Faults(),
+    lastfm_faults: Faults = Faults(),
+    node_args: Sequence[str] = (),
+    workdir: Optional[str] = None,
+    startup: float = 5.0,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Run simulated devices against the stand-ins and report on them.
+
+    Args:
+        nodes: Number of simulated devices, each in its own process.
+        speed: Simulated seconds per real second.
+        duration: Simulated seconds to run for.
+        duty_cycle: Duty cycle of every node in simulated seconds.
+        audio: Directory of audio files to play (default: synthetic tracks).
+        tracks: Number of synthetic tracks.
+        track_seconds: Length of each synthetic track.
+        shazam_faults: Latency and errors of the Shazam stand-in.
+        lastfm_faults: Latency and errors of the Last.fm stand-in.
+        node_args: Extra command line arguments for every node.
+        workdir: Directory for tracks, node state, traces and logs
+                 (default: a new temporary directory).
+        startup: Real seconds given to the nodes to start before the
+                 simulated time begins.
+        seed: Seed of the playlists and fault injection.
+
+    Returns:
+        The report, as printed by the command line.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="autoscrobbler-load-")
+    paths = prepare_tracks(os.path.join(workdir, "tracks"), audio, tracks, track_seconds)
+    shazam = ShazamStandIn()
+    for path in paths:
+        track, samples = read_track(path, SAMPLE_RATE)
+        shazam.add_track(track, samples, SAMPLE_RATE)
+    lastfm = LastfmStandIn()
+    shazam_server = serve_shazam(shazam, shazam_faults, seed=seed)
+    lastfm_server = serve_lastfm(lastfm, lastfm_faults, seed=seed + 1)
+
+    rng = random.Random(seed)
+    origin = time.time() + startup
+    configs = []
+    processes = []
+    try:
+        for i in range(nodes):
+            name = f"loopback-{i}"
+            node_dir = os.path.join(workdir, name)
+            os.makedirs(node_dir, exist_ok=True)
+            credentials = os.path.join(node_dir, "credentials.json")
+            with open(credentials, "w") as f:
+                json.dump({"lastfm": {
+                    "api_key": API_KEY,
+                    "api_secret": API_SECRET,
+                    "username": name,
+                    "password": "password",
+                }}, f)
+            playlist = rng.sample(paths, len(paths))
+            config = NodeConfig(
+                name=name,
+                playlist=playlist,
+                speed=speed,
+                origin=origin,
+                delay=rng.uniform(0.0, duty_cycle),
+                shazam_url=shazam_server.url,
+                lastfm_url=lastfm_server.url,
+                argv=[
+                    "--input-source", "auto",
+                    "--credentials", credentials,
+                    "--duty-cycle", str(duty_cycle),
+                    "--history-db", os.path.join(node_dir, "history.db"),
+                    "--dedupe-file", os.path.join(node_dir, "dedupe_index.json"),
+                    "--budget-history", os.path.join(node_dir, "budget_history.json"),
+                    "--trace-file", os.path.join(node_dir, "trace.jsonl"),
+                    "--shazam-rate", str(DEFAULT_SHAZAM_RATE * speed),
+                    "--breaker-cooldown", str(DEFAULT_BREAKER_COOLDOWN / speed),
+                    *node_args,
+                ],
+            )
+            config_path = os.path.join(node_dir, "node.json")
+            with open(config_path, "w") as f:
+                json.dump(asdict(config), f)
+            with open(os.path.join(node_dir, "node.log"), "w") as log:
+                processes.append(subprocess.Popen(
+                    [sys.executable, "-m", "autoscrobbler.loadtest", "--node", config_path],
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                ))
+            configs.append(config)
+        logger.info(f"Started {nodes} node(s) in {workdir}")
+
+        time.sleep(max(0.0, origin + duration / speed - time.time()))
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        shazam_server.close()
+        lastfm_server.close()
+
+    clock = ScaledClock(speed, origin)
+    return build_report(
+        configs, clock, duration, duty_cycle, lastfm, shazam_server.latencies,
+        shazam_server.errors, lastfm_server.latencies, lastfm_server.errors, workdir,
+        [process.returncode for process in processes],
+    )
+
+
+def build_report(
+    configs: Sequence[NodeConfig],
+    clock: ScaledClock,
+    duration: float,
+    duty_cycle: int,
+    lastfm: LastfmStandIn,
+    shazam_latencies: Sequence[float],
+    shazam_errors: int,
+    lastfm_latencies: Sequence[float],
+    lastfm_errors: int,
+    workdir: str,
+    exit_codes: Sequence[Optional[int]],
+) -> dict[str, Any]:
+    """Score every node and summarize throughput and latency.
+
+    Plays must last two duty cycles to be expected as scrobbles, so that at
+    least one full capture window falls inside them whatever the phase of
+    the node's cycle. Plays that started before a node's first cycle are not
+    expected, and the cycle cut short when the nodes are stopped is ignored.
+    """
+    end = clock.epoch + duration
+    nodes = []
+    totals = {"scrobbles": 0, "correct": 0, "duplicates": 0, "wrong": 0, "missed": 0}
+    time_to_scrobble: list[float] = []
+    cycle_seconds: list[float] = []
+    cycle_errors = 0
+    for config, exit_code in zip(configs, exit_codes):
+        cycles = [
+            span
+            for span in read_spans(os.path.join(workdir, config.name, "trace.jsonl"))
+            if span["name"] == "cycle"
+            and not span["parentSpanId"]
+            and not span["status"].get("message", "").startswith("KeyboardInterrupt")
+        ]
+        first_cycle = min(
+            (int(span["startTimeUnixNano"]) / 1e9 for span in cycles), default=clock.to_real(end)
+        )
+        tracks = [read_track(path, SAMPLE_RATE) for path in config.playlist]
+        device = LoopbackDevice(config.name, tracks, SAMPLE_RATE, start=clock.epoch)
+        score = score_scrobbles(
+            device.plays(end),
+            lastfm.scrobbles_of(config.name),
+            max(clock.epoch, clock.epoch + (first_cycle - clock.origin) * clock.speed),
+            end,
+            min_play=2 * duty_cycle,
+            slack=duty_cycle,
+        )
+        errors = sum(1 for span in cycles if span["status"]["code"] == 2)
+        cycle_seconds.extend(span_seconds(span) for span in cycles)
+        cycle_errors += errors
+        time_to_scrobble.extend(score.time_to_scrobble)
+        for key in totals:
+            totals[key] += getattr(score, key)
+        nodes.append({
+            "name": config.name,
+            "exit_code": exit_code,
+            "cycles": len(cycles),
+            "cycle_errors": errors,
+            **{key: getattr(score, key) for key in totals},
+        })
+    real_seconds = duration / clock.speed
+    expected = totals["correct"] + totals["missed"]
+    return {
+        "nodes": len(configs),
+        "speed": clock.speed,
+        "simulated_seconds": duration,
+        "real_seconds": real_seconds,
+        "throughput": {
+            "cycles": len(cycle_seconds),
+            "cycles_per_second": len(cycle_seconds) / real_seconds,
+            "shazam_requests_per_second": len(shazam_latencies) / real_seconds,
+            "lastfm_requests_per_second": len(lastfm_latencies) / real_seconds,
+        },
+        "scrobbles": {
+            **totals,
+            "recall": totals["correct"] / expected if expected else None,
+            "precision": totals["correct"] / totals["scrobbles"] if totals["scrobbles"] else None,
+        },
+        "latency": {
+            "cycle_ms": percentiles(cycle_seconds, 1000.0),
+            "cycle_errors": cycle_errors,
+            "cycle_overruns": sum(1 for s in cycle_seconds if s * clock.speed > duty_cycle),
+            "time_to_scrobble_s": percentiles(time_to_scrobble),
+            "shazam_ms": percentiles(shazam_latencies, 1000.0),
+            "shazam_injected_errors": shazam_errors,
+            "lastfm_ms": percentiles(lastfm_latencies, 1000.0),
+            "lastfm_injected_errors": lastfm_errors,
+        },
+        "per_node": nodes,
+        "workdir": workdir,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run a load test from the command line and print its report as JSON."""
+    parser = argparse.ArgumentParser(
+        prog="python -m autoscrobbler.loadtest",
+        description="Run simulated devices against local Shazam and Last.fm stand-ins.",
+        epilog="Arguments after -- are passed to every node's main loop.",
+    )
+    parser.add_argument("--nodes", type=int, default=4, help="Simulated devices (default: 4)")
+    parser.add_argument("--speed", type=float, default=20.0, help="Simulated seconds per real second (default: 20)")
+    parser.add_argument("--duration", type=float, default=1800.0, help="Simulated seconds (default: 1800)")
+    parser.add_argument("-d", "--duty-cycle", type=int, default=60, help="Duty cycle of the nodes (default: 60)")
+    parser.add_argument("--audio", type=str, default=None, help="Directory of 'Artist - Title' audio files (default: synthetic tracks)")
+    parser.add_argument("--tracks", type=int, default=8, help="Synthetic tracks (default: 8)")
+    parser.add_argument("--track-seconds", type=float, default=150.0, help="Length of synthetic tracks (default: 150)")
+    for service in ("shazam", "lastfm"):
+        parser.add_argument(f"--{service}-latency", type=float, default=0.0, help=f"Seconds added to every {service} response")
+        parser.add_argument(f"--{service}-jitter", type=float, default=0.0, help=f"Up to this many more seconds per {service} response")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0, help=f"Share of {service} requests failing with HTTP 503")
+    parser.add_argument("--workdir", type=str, default=None, help="Directory for tracks, node state and logs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of playlists and faults")
+    parser.add_argument("--node", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("node_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.node is not None:
+        with open(args.node) as f:
+            run_node(NodeConfig(**json.load(f)))
+        # main() has closed everything; interpreter teardown can abort in
+        # native threads of the signature generator, so skip it
+        logs.stop_logging()
+        logging.shutdown()
+        sys.stdout.flush()
+        os._exit(0)
+
+    logs.configure_logging()
+    node_args = args.node_args[1:] if args.node_args[:1] == ["--"] else args.node_args
+    report = run_load(
+        nodes=args.nodes,
+        speed=args.speed,
+        duration=args.duration,
+        duty_cycle=args.duty_cycle,
+        audio=args.audio,
+        tracks=args.tracks,
+        track_seconds=args.track_seconds,
+        shazam_faults=Faults(args.shazam_latency, args.shazam_jitter, args.shazam_error_rate),
+        lastfm_faults=Faults(args.lastfm_latency, args.lastfm_jitter, args.lastfm_error_rate),
+        node_args=node_args,
+        workdir=args.workdir,
+        seed=args.seed,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Logging that never holds up the main loop.
+
+Records are put on a bounded queue by a
+:class:`~logging.handlers.QueueHandler` and written to stderr by a
+:class:`~logging.handlers.QueueListener` thread. When stderr is slow, such
+as under journald backpressure, only that thread waits and the capture
+carries on. If the queue fills up anyway, further records are dropped and
+counted instead of waited for.
+
+Messages logged every cycle, such as "No song identified.", are sampled by
+:class:`RepeatFilter` before they are queued. Messages count as repeats when
+they differ only in their numbers, so "Processing took 9.8s, ..." repeats
+however long each cycle took. The next record let through notes how many
+were suppressed. Only the written log is sampled; other handlers on the root
+logger still see every record.
+
+Records are written as plain text, or with ``--log-format json`` as one JSON
+object per line for log pipelines.
+"""
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import re
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, TextIO, Union
+
+from autoscrobbler import metrics
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+LOG_FORMATS = ("text", "json")
+QUEUE_SIZE = 10000
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_TRACEBACKS = logging.Formatter()
+
+
+class RepeatFilter(logging.Filter):
+    """Let the first repeats of a message through, then a sample of them.
+
+    Args:
+        burst: Occurrences passed before sampling starts; 0 disables it.
+        sample: While sampling, one in this many occurrences is passed.
+        window: Seconds without an occurrence after which a message is new again.
+        max_messages: Distinct messages remembered; the least recent are
+                      forgotten first.
+    """
+
+    def __init__(
+        self, burst: int = 3, sample: int = 10, window: float = 600.0, max_messages: int = 1024
+    ) -> None:
+        super().__init__()
+        self.burst = burst
+        self.sample = max(1, sample)
+        self.window = window
+        self.max_messages = max_messages
+        # Message -> [last seen, occurrences, suppressed since last passed]
+        self._seen: dict[tuple[str, int, str], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Return whether to write the record; passed repeats get a ``suppressed`` count."""
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, _NUMBER.sub("#", str(record.msg)))
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or record.created - state[0] > self.window:
+                if state is None and len(self._seen) >= self.max_messages:
+                    del self._seen[min(self._seen, key=lambda k: self._seen[k][0])]
+                state = self._seen[key] = [record.created, 0, 0]
+            state[0] = record.created
+            state[1] += 1
+            if state[1] > self.burst and (state[1] - self.burst) % self.sample:
+                state[2] += 1
+                metrics.LOG_RECORDS_DROPPED.inc(reason="repeat")
+                return False
+            suppressed = int(state[2])
+            state[2] = 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """The plain text format, noting suppressed repeats."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar messages suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with time, level, logger, thread and message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _StderrHandler(logging.StreamHandler):
+    """Stream handler writing to whatever ``sys.stderr`` is at the time."""
+
+    def __init__(self) -> None:
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self) -> TextIO:  # type: ignore[override]
+        return sys.stderr
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records when the queue is full instead of erroring."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is formatted now, as its arguments may change before it
+        # is written, but the traceback is kept apart for the JSON format
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _TRACEBACKS.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+class _Listener(QueueListener):
+    """Queue listener that can be stopped while the queue is full."""
+
+    def enqueue_sentinel(self) -> None:
+        # Waits for room, which the listener's own thread is making
+        self.queue.put(self._sentinel)
+
+
+_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_registered_exit = False
+
+
+def configure_logging(
+    log_format: str = "text",
+    level: Optional[Union[int, str]] = logging.INFO,
+    repeats: int = 3,
+    sample: int = 10,
+    stream: Optional[TextIO] = None,
+    queue_size: int = QUEUE_SIZE,
+) -> QueueListener:
+    """Route the root logger through a queue to a writer thread.
+
+    Replaces the queue set up by an earlier call; other handlers of the root
+    logger are left alone.
+
+    Args:
+        log_format: "text" or "json".
+        level: Root logger level, or None to leave it unchanged.
+        repeats: Occurrences of a message written before it is sampled;
+                 0 writes every one.
+        sample: While sampling, one in this many occurrences is written.
+        stream: Where records are written (default: stderr).
+        queue_size: Records that can wait to be written before new ones
+                    are dropped.
+
+    Returns:
+        The listener writing the records.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    global _handler, _listener, _registered_exit
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}', expected one of {', '.join(LOG_FORMATS)}.")
+    stop_logging()
+    output = logging.StreamHandler(stream) if stream is not None else _StderrHandler()
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(LOG_FORMAT))
+    records: queue.Queue[logging.LogRecord] = queue.Queue(queue_size)
+    _handler = _DroppingQueueHandler(records)
+    _handler.addFilter(RepeatFilter(burst=repeats, sample=sample))
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    if level is not None:
+        root.setLevel(level)
+    _listener = _Listener(records, output)
+    _listener.start()
+    metrics.QUEUE_DEPTH.set_function(records.qsize, queue="log")
+    if not _registered_exit:
+        # Registered after logging's own exit handler, so it runs first and
+        # the queue is written out before logging shuts down
+        atexit.register(stop_logging)
+        _registered_exit = True
+    return _listener
+
+
+def stop_logging() -> None:
+    """Write out queued records and detach the queue from the root logger."""
+    global _handler, _listener
+    handler, listener = _handler, _listener
+    _handler = _listener = None
+    if handler is not None:
+        logging.getLogger().removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+        for output in listener.handlers:
+            output.flush()
@@ -0,0 +1,295 @@
+"""Simulated audio input and time for running the main loop without hardware.
+
+:class:`LoopbackSoundDevice` implements the parts of the sounddevice API that
+autoscrobbler records with. Its devices are :class:`LoopbackDevice` objects
+that play a playlist of audio files in a loop, so a recording returns
+whatever the playlist was playing at that moment.
+
+:class:`ScaledClock` replaces the ``time`` module of the main loop with one
+running many times faster than real time: sleeping for the duty cycle and
+recording a 10 second window take a fraction of the time, while computing a
+signature or waiting for a server takes as long as it really does. Clocks
+given the same origin agree on the simulated time, so separate processes
+and the harness that started them share one timeline.
+
+:class:`VirtualClock` goes further for a single process: sleeping takes no
+time at all and only moves the clock forward, so hours of simulated
+listening run as fast as the main loop can compute its decisions.
+"""
+
+import os
+import time as _time
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import soundfile as sf
+
+from autoscrobbler.standins import Track
+
+
+class ScaledClock:
+    """Stand-in for the ``time`` module with a faster wall clock.
+
+    Only :meth:`time`, :meth:`monotonic` and :meth:`sleep` are scaled; other
+    attributes, such as ``perf_counter`` for timing work, are the real ones.
+
+    Args:
+        speed: How many simulated seconds pass per real second.
+        origin: Real time (``time.time()``) at which the simulation starts.
+        epoch: Simulated time at ``origin`` (default: ``origin``).
+    """
+
+    def __init__(self, speed: float, origin: Optional[float] = None, epoch: Optional[float] = None) -> None:
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.speed = speed
+        self.origin = _time.time() if origin is None else origin
+        self.epoch = self.origin if epoch is None else epoch
+
+    def time(self) -> float:
+        """Simulated seconds since the Unix epoch."""
+        return self.epoch + (_time.time() - self.origin) * self.speed
+
+    def monotonic(self) -> float:
+        """Simulated monotonic clock."""
+        return self.time()
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep for simulated seconds."""
+        _time.sleep(max(0.0, seconds) / self.speed)
+
+    def to_real(self, simulated: float) -> float:
+        """Real time at which the simulated clock shows ``simulated``."""
+        return self.origin + (simulated - self.epoch) / self.speed
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_time, name)
+
+
+class ClockStopped(BaseException):
+    """Raised by :meth:`VirtualClock.sleep` when the clock reaches its end.
+
+    It derives from BaseException, like KeyboardInterrupt, so that it leaves
+    the main loop instead of being logged as a failed cycle.
+    """
+
+
+class VirtualClock:
+    """Stand-in for the ``time`` module advancing only when slept on.
+
+    Like :class:`ScaledClock`, ``perf_counter`` and other attributes not
+    overridden here are the real ones.
+
+    Args:
+        start: Simulated time the clock starts at.
+        end: Simulated time at which sleeping raises :class:`ClockStopped`
+             (default: never).
+    """
+
+    def __init__(self, start: float, end: Optional[float] = None) -> None:
+        self.now = start
+        self.end = end
+
+    def time(self) -> float:
+        """Simulated seconds since the Unix epoch."""
+        return self.now
+
+    def monotonic(self) -> float:
+        """Simulated monotonic clock."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the clock by ``seconds`` without waiting.
+
+        Raises:
+            ClockStopped: If the clock reached its end.
+        """
+        self.now += max(0.0, seconds)
+        if self.end is not None and self.now >= self.end:
+            raise ClockStopped(f"Simulated time reached {self.end}")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_time, name)
+
+
+def read_track(path: str, sample_rate: int = 44100) -> Tuple[Track, np.ndarray]:
+    """Read an audio file as a track for a loopback device.
+
+    The file is mixed down to mono and resampled to ``sample_rate``. Files
+    named ``Artist - Title.ext`` become that track; others take the file name
+    as title and an unknown artist.
+
+    Args:
+        path: Path of a file soundfile can read, such as WAV or FLAC.
+        sample_rate: Sample rate of the device in Hz.
+
+    Returns:
+        Tuple of (track, mono int16 audio).
+    """
+    data, rate = sf.read(path, dtype="float32", always_2d=True)
+    audio = data.mean(axis=1)
+    if rate != sample_rate and audio.size:
+        frames = int(round(audio.size * sample_rate / rate))
+        audio = np.interp(np.arange(frames) * (rate / sample_rate), np.arange(audio.size), audio)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    artist, sep, title = stem.partition(" - ")
+    track = Track(artist.strip(), title.strip(), key=stem) if sep else Track("Unknown Artist", stem, key=stem)
+    return track, np.clip(audio * 32768.0, -32768, 32767).astype(np.int16)
+
+
+@dataclass(frozen=True)
+class Play:
+    """One play of a track on a loopback device, in simulated time.
+
+    Attributes:
+        track: The track played.
+        start: When the play started.
+        end: When the play ended.
+    """
+
+    track: Track
+    start: float
+    end: float
+
+
+class LoopbackDevice:
+    """An input device playing a playlist in a loop.
+
+    Args:
+        name: Device name.
+        tracks: Tracks and their mono int16 audio, in playing order.
+        sample_rate: Sample rate of the audio in Hz.
+        start: Simulated time at which the first track starts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        tracks: Sequence[Tuple[Track, np.ndarray]],
+        sample_rate: int,
+        start: float,
+    ) -> None:
+        if not tracks:
+            raise ValueError("A loopback device needs at least one track.")
+        self.name = name
+        self.tracks = [track for track, _ in tracks]
+        self.sample_rate = sample_rate
+        self.start = start
+        self._audio = np.concatenate([audio for _, audio in tracks])
+        self._offsets = np.cumsum([0] + [audio.size for _, audio in tracks])
+
+    def read(self, when: float, frames: int) -> np.ndarray:
+        """Return the audio played from simulated time ``when`` on.
+
+        Silence is returned for any part before the playlist starts.
+        """
+        out = np.zeros(frames, dtype=np.int16)
+        first = int(round((when - self.start) * self.sample_rate))
+        skip = min(frames, max(0, -first))
+        position = max(0, first) % self._audio.size
+        filled = skip
+        while filled < frames:
+            n = min(frames - filled, self._audio.size - position)
+            out[filled : filled + n] = self._audio[position : position + n]
+            filled += n
+            position = 0
+        return out
+
+    def plays(self, until: float) -> list[Play]:
+        """Plays that started before simulated time ``until``."""
+        plays = []
+        loop = self._offsets[-1] / self.sample_rate
+        cycle = 0
+        while True:
+            for i, track in enumerate(self.tracks):
+                start = self.start + cycle * loop + self._offsets[i] / self.sample_rate
+                if start >= until:
+                    return plays
+                plays.append(Play(track, start, self.start + cycle * loop + self._offsets[i + 1] / self.sample_rate))
+            cycle += 1
+
+
+class LoopbackSoundDevice:
+    """The parts of the sounddevice module used for recording, over loopback devices.
+
+    Assign an instance to ``autoscrobbler.__main__.sd``. Only blocking
+    recordings (``rec`` and ``wait``) are supported; ``--capture-process``
+    opens its stream in a child process, which this does not reach.
+
+    Args:
+        devices: The input devices, listed in this order.
+        clock: Clock recordings are timed against.
+
+    Attributes:
+        recordings: Number of recordings made.
+        last_recording: Simulated start time and length in seconds of the
+                        latest recording, or None before the first.
+    """
+
+    def __init__(
+        self, devices: Sequence[LoopbackDevice], clock: Union[ScaledClock, VirtualClock]
+    ) -> None:
+        self.devices = list(devices)
+        self.clock = clock
+        self.recordings = 0
+        self.last_recording: Optional[Tuple[float, float]] = None
+        self._recording_seconds = 0.0
+
+        class _Default:
+            device = [0, None]
+
+        self.default = _Default()
+
+    def query_hostapis(self) -> list[dict[str, Any]]:
+        return [{"name": "Loopback"}]
+
+    def query_devices(self, device: Optional[int] = None, kind: Optional[str] = None) -> Any:
+        listed = [
+            {
+                "name": d.name,
+                "index": i,
+                "hostapi": 0,
+                "max_input_channels": 1,
+                "max_output_channels": 0,
+                "default_samplerate": float(d.sample_rate),
+            }
+            for i, d in enumerate(self.devices)
+        ]
+        if kind == "input":
+            return listed[0]
+        if device is not None:
+            return listed[device]
+        return listed
+
+    def rec(
+        self,
+        frames: Optional[int] = None,
+        samplerate: Optional[float] = None,
+        channels: Optional[int] = None,
+        dtype: Optional[str] = None,
+        out: Optional[np.ndarray] = None,
+        device: Optional[int] = None,
+        **kwargs: Any,
+    ) -> np.ndarray:
+        """Record from a loopback device; the audio is ready after :meth:`wait`."""
+        source = self.devices[device or 0]
+        if out is None:
+            out = np.empty((frames or 0, channels or 1), dtype=np.int16)
+        frames = out.shape[0]
+        if samplerate is not None and int(samplerate) != source.sample_rate:
+            raise ValueError(
+                f"Loopback device '{source.name}' plays at {source.sample_rate} Hz, not {samplerate}."
+            )
+        started = self.clock.time()
+        out[:] = source.read(started, frames).reshape(-1, 1)
+        self.recordings += 1
+        self._recording_seconds = frames / source.sample_rate
+        self.last_recording = (started, self._recording_seconds)
+        return out
+
+    def wait(self) -> None:
+        """Wait for the recording to finish, in simulated time."""
+        seconds, self._recording_seconds = self._recording_seconds, 0.0
+        self.clock.sleep(seconds)
+        return None
@@ -0,0 +1,439 @@
+"""Prometheus-style metrics for the scrobbling pipeline.
+
+Metrics are always collected (updating one costs a lock and an addition) and
+can optionally be served in the Prometheus text exposition format from a
+local HTTP ``/metrics`` endpoint with :func:`start_metrics_server`.
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds, from fast local work up to slow network calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value the way Prometheus expects."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Render a label set, e.g. ``{result="hit"}``."""
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    """Base class holding the name, help text and label names of a metric."""
+
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def expose(self) -> str:
+        """Render the metric in the text exposition format."""
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self._samples())
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """Increase the counter.
+
+        Args:
+            amount: Non-negative amount to add (default: 1).
+            **labels: Value for each label name.
+
+        Raises:
+            ValueError: If ``amount`` is negative or labels do not match.
+        """
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Current value for a label set."""
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or be computed at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._functions: dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge to ``value``."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """Compute the gauge by calling ``function`` whenever it is scraped."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels: str) -> float:
+        """Current value for a label set."""
+        key = self._key(labels)
+        if key in self._functions:
+            return float(self._functions[key]())
+        return self._values.get(key, 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = float(function())
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative buckets, e.g. latencies."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the wall-clock duration of the ``with`` block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        """Total number of observations."""
+        return sum(self._counts)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}'
+        yield f"{self.name}_sum {_format_value(total)}"
+        yield f"{self.name}_count {cumulative}"
+
+
+class Registry:
+    """A collection of metrics that are exposed together."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric to the registry.
+
+        Raises:
+            ValueError: If a metric with the same name is already registered.
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """Render every registered metric in the text exposition format."""
+        return "".join(metric.expose() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+
+def _counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def _gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def _histogram(name: str, documentation: str) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation))
+
+
+# Cold start, from loading autoscrobbler to the first capture
+STARTUP_SECONDS = _gauge(
+    "autoscrobbler_startup_seconds", "Seconds from loading autoscrobbler to the first capture."
+)
+
+# Pipeline stage latencies
+CAPTURE_SECONDS = _histogram(
+    "autoscrobbler_capture_seconds", "Time spent obtaining a capture window."
+)
+SHAZAM_SECONDS = _histogram(
+    "autoscrobbler_shazam_seconds", "Latency of Shazam recognize calls."
+)
+LASTFM_LOOKUP_SECONDS = _histogram(
+    "autoscrobbler_lastfm_lookup_seconds", "Latency of Last.fm recent track lookups."
+)
+LASTFM_SCROBBLE_SECONDS = _histogram(
+    "autoscrobbler_lastfm_scrobble_seconds", "Latency of Last.fm scrobble calls."
+)
+CYCLE_SECONDS = _histogram(
+    "autoscrobbler_cycle_seconds", "Processing time of one main loop cycle."
+)
+
+# Outcomes
+IDENTIFICATIONS = _counter(
+    "autoscrobbler_identifications",
+    "Identification attempts by result (hit, miss, error).",
+    ["result"],
+)
+CAPTURES_SKIPPED = _counter(
+    "autoscrobbler_captures_skipped",
+    "Captures not sent for identification because they failed quality checks.",
+)
+DEDUPE_SKIPS = _counter(
+    "autoscrobbler_dedupe_skips",
+    "Identified songs not scrobbled because they were duplicates, by source.",
+    ["source"],
+)
+SCROBBLES = _counter("autoscrobbler_scrobbles", "Songs scrobbled to Last.fm.")
+CYCLE_OVERRUNS = _counter(
+    "autoscrobbler_cycle_overruns", "Cycles whose processing took longer than the duty cycle."
+)
+CAPTURE_OVERFLOWS = _counter(
+    "autoscrobbler_capture_overflows", "Captures during which PortAudio reported an input overflow."
+)
+
+# Input device recovery
+DEVICE_RESCANS = _counter(
+    "autoscrobbler_device_rescans", "Rescans of the audio device list after start-up."
+)
+DEVICE_REOPENS = _counter(
+    "autoscrobbler_device_reopens",
+    "Input streams reopened after the device failed, moved or came back.",
+)
+
+# Capture quality of the latest window
+CAPTURE_QUALITY = _gauge(
+    "autoscrobbler_capture_quality",
+    "Quality metrics of the latest capture (rms_dbfs, clipping_ratio, dc_offset, snr_db).",
+    ["metric"],
+)
+
+# Conditioning of the latest capture sent for identification
+CONDITIONING_SECONDS = _histogram(
+    "autoscrobbler_conditioning_seconds", "Time spent conditioning a capture."
+)
+CONDITIONING = _gauge(
+    "autoscrobbler_conditioning",
+    "Conditioning of the latest capture (gain_db, hum_hz, notched_bins).",
+    ["metric"],
+)
+
+# Shazam request limiter; gauges are bound by autoscrobbler.ratelimit
+RATE_LIMIT_TOKENS = _gauge(
+    "autoscrobbler_rate_limit_tokens", "Shazam requests that may be sent without waiting."
+)
+RATE_LIMIT_RATE = _gauge(
+    "autoscrobbler_rate_limit_rate", "Current Shazam request rate limit per second."
+)
+RATE_LIMIT_WAIT_SECONDS = _histogram(
+    "autoscrobbler_rate_limit_wait_seconds", "Time Shazam requests waited for a token."
+)
+CIRCUIT_STATE = _gauge(
+    "autoscrobbler_circuit_state", "Shazam circuit breaker state (0 closed, 1 half-open, 2 open)."
+)
+SHAZAM_THROTTLED = _counter(
+    "autoscrobbler_shazam_throttled", "Shazam responses with HTTP 429 Too Many Requests."
+)
+SHAZAM_RETRIES = _counter("autoscrobbler_shazam_retries", "Shazam requests retried after backoff.")
+RATE_LIMIT_REJECTIONS = _counter(
+    "autoscrobbler_rate_limit_rejections", "Shazam calls refused while the circuit breaker was open."
+)
+
+# Daily identification budget; gauges are bound by autoscrobbler.budget
+BUDGET_REMAINING = _gauge(
+    "autoscrobbler_budget_remaining", "Identification calls left in today's budget."
+)
+BUDGET_PLANNED = _gauge(
+    "autoscrobbler_budget_planned", "Identification calls the plan expects to have spent by now."
+)
+BUDGET_DEFERRALS = _counter(
+    "autoscrobbler_budget_deferrals",
+    "Captures not sent for identification to stay within the daily budget.",
+)
+
+# Re-identification of archived captures
+BACKFILLS = _counter(
+    "autoscrobbler_backfills",
+    "Archived captures identified again, by result (hit, miss, error).",
+    ["result"],
+)
+
+# Coordination with other nodes in the room
+ROOM_MESSAGES = _counter(
+    "autoscrobbler_room_messages",
+    "Room coordination messages, by direction (sent, received) and type.",
+    ["direction", "type"],
+)
+ROOM_SHARED_RESULTS = _counter(
+    "autoscrobbler_room_shared_results",
+    "Captures identified from another node's result instead of calling Shazam.",
+)
+
+# Edge/hub split
+HUB_SUBMISSIONS = _counter(
+    "autoscrobbler_hub_submissions",
+    "Fingerprints from edge nodes answered by the hub, by source (shazam, cache, batch).",
+    ["source"],
+)
+HUB_UPLOAD_BYTES = _counter(
+    "autoscrobbler_hub_upload_bytes", "Bytes of fingerprints sent by this edge node to the hub."
+)
+
+# Local now playing feed; the gauge is bound by autoscrobbler.nowplaying
+NOW_PLAYING_EVENTS = _counter(
+    "autoscrobbler_now_playing_events",
+    "Events published to now playing subscribers, by type (identified, scrobbled, miss).",
+    ["type"],
+)
+NOW_PLAYING_SUBSCRIBERS = _gauge(
+    "autoscrobbler_now_playing_subscribers", "Connected now playing subscribers."
+)
+
+# Logging; records are written off the main loop by autoscrobbler.logs
+LOG_RECORDS_DROPPED = _counter(
+    "autoscrobbler_log_records_dropped",
+    "Log records not written, by reason (repeat, queue_full).",
+    ["reason"],
+)
+
+# Queue depths; producers register callbacks with set_function
+QUEUE_DEPTH = _gauge(
+    "autoscrobbler_queue_depth", "Items waiting in internal queues, by queue.", ["queue"]
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:  # noqa: N802 (http.server naming)
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        logger.debug(f"metrics: {format % args}")
+
+
+def start_metrics_server(
+    port: int, host: str = "127.0.0.1", registry: Optional[Registry] = None
+) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread.
+
+    Args:
+        port: TCP port to listen on (0 picks a free port).
+        host: Address to bind (default: 127.0.0.1).
+        registry: Registry to expose (default: the global registry).
+
+    Returns:
+        The running server; call ``shutdown()`` to stop it.
+    """
+    handler = type(
+        "MetricsHandler", (_MetricsHandler,), {"registry": registry or REGISTRY}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="autoscrobbler-metrics", daemon=True
+    )
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,398 @@
+"""Local "now playing" feed for displays, lighting controllers and scripts.
+
+Consumers that want to react to the music subscribe to autoscrobbler instead
+of running their own identification service. Every identification, miss and
+scrobble is published once and fanned out to all subscribers:
+
+* a Unix socket streams newline-delimited JSON, e.g. ``nc -U <path>``;
+* a TCP port speaks WebSocket (text frames of the same JSON) and answers a
+  plain ``GET`` with the current snapshot, for polling clients.
+
+New subscribers first receive a ``now_playing`` snapshot of the latest
+identified track, so a display that starts late does not wait for the next
+song. Events look like::
+
+    {"type": "identified", "key": "...", "artist": "...", "title": "...",
+     "album": "...", "timestamp": 1700000000.0}
+    {"type": "scrobbled", ...same fields...}
+    {"type": "miss", "timestamp": 1700000000.0}
+    {"type": "now_playing", ...fields of the latest identification..., "scrobbled": true}
+
+All sockets are non-blocking and served by a single selector thread, so each
+subscriber costs one file descriptor and one ``send`` per event. Events are
+encoded once per publish. A subscriber that cannot keep up (its socket buffer
+is full) is disconnected rather than allowed to delay the main loop; it can
+reconnect and pick up the snapshot.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import selectors
+import socket
+import threading
+from typing import Any, Optional
+
+from autoscrobbler import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_REQUEST_BYTES = 8192
+
+
+def websocket_accept(key: str) -> str:
+    """Compute the ``Sec-WebSocket-Accept`` answer to a client's key."""
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def websocket_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """Wrap a payload in a single unmasked server frame (text by default)."""
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 1 << 16:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+def _parse_frames(buffer: bytes) -> tuple[list[tuple[int, bytes]], bytes]:
+    """Split complete (masked) client frames off a buffer.
+
+    Returns:
+        Tuple of ([(opcode, payload), ...], remaining bytes).
+    """
+    frames = []
+    while len(buffer) >= 2:
+        opcode = buffer[0] & 0x0F
+        masked = buffer[1] & 0x80
+        length = buffer[1] & 0x7F
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                break
+            length = int.from_bytes(buffer[2:4], "big")
+            offset = 4
+        elif length == 127:
+            if len(buffer) < 10:
+                break
+            length = int.from_bytes(buffer[2:10], "big")
+            offset = 10
+        mask = buffer[offset : offset + 4] if masked else b""
+        offset += len(mask) if masked else 0
+        if len(buffer) < offset + length:
+            break
+        payload = buffer[offset : offset + length]
+        if masked:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        frames.append((opcode, payload))
+        buffer = buffer[offset + length :]
+    return frames, buffer
+
+
+class _Connection:
+    """A client socket and what has been read from it."""
+
+    def __init__(self, sock: socket.socket, websocket: bool) -> None:
+        self.sock = sock
+        self.websocket = websocket
+        self.buffer = b""
+        self.subscribed = False
+
+
+class NowPlaying:
+    """Publish identification and scrobble events to local subscribers.
+
+    Without any listening socket, events only update the snapshot.
+
+    Args:
+        socket_path: Unix socket to stream newline-delimited JSON on.
+        websocket: Address ``(host, port)`` to serve WebSocket and HTTP
+                   snapshot requests on (port 0 picks a free port).
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        websocket: Optional[tuple[str, int]] = None,
+    ) -> None:
+        self.socket_path = socket_path
+        self.port: Optional[int] = None
+        self._lock = threading.Lock()
+        self._subscribers: list[_Connection] = []
+        self._snapshot: Optional[dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._selector = selectors.DefaultSelector()
+        self._listeners: list[socket.socket] = []
+        self._thread: Optional[threading.Thread] = None
+        try:
+            if socket_path is not None:
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)  # stale socket of a previous run
+                self._listen(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), socket_path, False)
+            if websocket is not None:
+                listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._listen(listener, websocket, True)
+                self.port = listener.getsockname()[1]
+        except OSError:
+            self.close()
+            raise
+        if self._listeners:
+            self._thread = threading.Thread(target=self._serve, name="now-playing", daemon=True)
+            self._thread.start()
+
+    def _listen(self, listener: socket.socket, address: Any, websocket: bool) -> None:
+        self._listeners.append(listener)
+        listener.bind(address)
+        listener.listen(16)
+        listener.setblocking(False)
+        self._selector.register(listener, selectors.EVENT_READ, websocket)
+
+    @property
+    def snapshot(self) -> Optional[dict[str, Any]]:
+        """The latest identified track, or None before the first one."""
+        with self._lock:
+            return dict(self._snapshot) if self._snapshot is not None else None
+
+    @property
+    def subscribers(self) -> int:
+        """Number of connected subscribers."""
+        with self._lock:
+            return len(self._subscribers)
+
+    def close(self) -> None:
+        """Disconnect all subscribers and stop listening."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()  # type: ignore[union-attr]
+        self._selector.close()
+        for listener in self._listeners:
+            listener.close()
+        with self._lock:
+            self._subscribers.clear()
+        if self.socket_path is not None and self._listeners:
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    # Publishing
+
+    def identified(
+        self, key: str, artist: str, title: str, album: Optional[str], timestamp: float
+    ) -> None:
+        """Publish an identified track; it becomes the snapshot unless older."""
+        self.publish({
+            "type": "identified",
+            "key": key,
+            "artist": artist,
+            "title": title,
+            "album": album,
+            "timestamp": timestamp,
+        })
+
+    def scrobbled(
+        self, key: str, artist: str, title: str, album: Optional[str], timestamp: float
+    ) -> None:
+        """Publish a scrobble."""
+        self.publish({
+            "type": "scrobbled",
+            "key": key,
+            "artist": artist,
+            "title": title,
+            "album": album,
+            "timestamp": timestamp,
+        })
+
+    def miss(self, timestamp: float) -> None:
+        """Publish a capture in which no song was found."""
+        self.publish({"type": "miss", "timestamp": timestamp})
+
+    def publish(self, event: dict[str, Any]) -> None:
+        """Update the snapshot and send an event to every subscriber.
+
+        Args:
+            event: JSON-serializable event with a ``type``.
+        """
+        with self._lock:
+            self._update_snapshot(event)
+            metrics.NOW_PLAYING_EVENTS.inc(type=event["type"])
+            if not self._subscribers:
+                return
+            payload = json.dumps(event, separators=(",", ":")).encode()
+            line, frame = payload + b"\n", websocket_frame(payload)
+            for connection in list(self._subscribers):
+                self._send(connection, frame if connection.websocket else line)
+
+    def _update_snapshot(self, event: dict[str, Any]) -> None:
+        snapshot = self._snapshot
+        if event["type"] == "identified":
+            # Backfilled captures identified late must not replace what plays now
+            if snapshot is None or event["timestamp"] >= snapshot["timestamp"]:
+                self._snapshot = {**event, "type": "now_playing", "scrobbled": False}
+        elif event["type"] == "scrobbled" and snapshot is not None:
+            if snapshot["key"] == event["key"]:
+                snapshot["scrobbled"] = True
+
+    def _send(self, connection: _Connection, data: bytes) -> None:
+        # Called with the lock held; a partial send would corrupt the stream
+        try:
+            sent = connection.sock.send(data)
+        except OSError:
+            sent = -1
+        if sent != len(data):
+            logger.info("Disconnecting a now playing subscriber that is not keeping up")
+            self._subscribers.remove(connection)
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)  # the serve loop closes it
+            except OSError:
+                pass
+
+    # Serving
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(timeout=0.2):
+                if isinstance(key.data, _Connection):
+                    self._read(key.data)
+                else:
+                    self._accept(key.fileobj, websocket=key.data)  # type: ignore[arg-type]
+
+    def _accept(self, listener: socket.socket, websocket: bool) -> None:
+        try:
+            sock, _ = listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        connection = _Connection(sock, websocket)
+        self._selector.register(sock, selectors.EVENT_READ, connection)
+        if not websocket:
+            self._subscribe(connection)
+
+    def _subscribe(self, connection: _Connection) -> None:
+        with self._lock:
+            connection.subscribed = True
+            self._subscribers.append(connection)
+            if self._snapshot is not None:
+                payload = json.dumps(self._snapshot, separators=(",", ":")).encode()
+                self._send(
+                    connection,
+                    websocket_frame(payload) if connection.websocket else payload + b"\n",
+                )
+
+    def _disconnect(self, connection: _Connection) -> None:
+        with self._lock:
+            if connection in self._subscribers:
+                self._subscribers.remove(connection)
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _read(self, connection: _Connection) -> None:
+        try:
+            data = connection.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._disconnect(connection)
+            return
+        if not connection.websocket:
+            return  # stream subscribers have nothing to say
+        connection.buffer += data
+        if connection.subscribed:
+            frames, connection.buffer = _parse_frames(connection.buffer)
+            for opcode, payload in frames:
+                if opcode == 0x8:
+                    self._reply(connection, websocket_frame(payload[:2], 0x8))
+                    self._disconnect(connection)
+                    return
+                if opcode == 0x9:
+                    self._reply(connection, websocket_frame(payload, 0xA))
+        elif b"\r\n\r\n" in connection.buffer:
+            self._handle_request(connection)
+        elif len(connection.buffer) > MAX_REQUEST_BYTES:
+            self._disconnect(connection)
+
+    def _reply(self, connection: _Connection, data: bytes) -> None:
+        with self._lock:
+            try:
+                connection.sock.send(data)
+            except OSError:
+                pass
+
+    def _handle_request(self, connection: _Connection) -> None:
+        head, _, connection.buffer = connection.buffer.partition(b"\r\n\r\n")
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if not request_line.startswith("GET "):
+            self._respond(connection, "405 Method Not Allowed", b"")
+            return
+        key = headers.get("sec-websocket-key")
+        if "websocket" not in headers.get("upgrade", "").lower() or not key:
+            # Plain HTTP: answer with the snapshot for polling clients
+            body = json.dumps(self.snapshot).encode()
+            self._respond(connection, "200 OK", body, "application/json")
+            return
+        self._reply(connection, (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n"
+        ).encode())
+        self._subscribe(connection)
+
+    def _respond(
+        self, connection: _Connection, status: str, body: bytes, content_type: str = "text/plain"
+    ) -> None:
+        self._reply(connection, (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode() + body)
+        self._disconnect(connection)
+
+
+_publisher = NowPlaying()
+
+
+def get_publisher() -> NowPlaying:
+    """Return the process-wide publisher."""
+    return _publisher
+
+
+def configure_publisher(
+    socket_path: Optional[str] = None, websocket: Optional[tuple[str, int]] = None
+) -> NowPlaying:
+    """Replace the process-wide publisher, closing the previous one.
+
+    Args:
+        socket_path: Unix socket to stream newline-delimited JSON on.
+        websocket: Address ``(host, port)`` to serve WebSocket subscribers on.
+
+    Returns:
+        The new publisher.
+
+    Raises:
+        OSError: If a socket cannot be bound.
+    """
+    global _publisher
+    publisher = NowPlaying(socket_path, websocket)
+    _publisher.close()
+    _publisher = publisher
+    metrics.NOW_PLAYING_SUBSCRIBERS.set_function(lambda: publisher.subscribers)
+    return publisher
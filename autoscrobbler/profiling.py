@@ -0,0 +1,261 @@
+"""On-demand profiling of the running daemon.
+
+A profiling session is requested with ``--profile`` at startup or by sending
+the process ``SIGUSR1``. The request only sets a flag; the main loop picks it
+up at the start of its next cycle, profiles the following N cycles with
+cProfile and takes tracemalloc snapshots around them, then writes the results
+to the profiling directory and carries on. The loop is never interrupted and
+sleeping between cycles is not profiled.
+
+cProfile only records the thread that enables it (before Python 3.12), so
+Shazam requests, which run on their own event loop thread, would be missing.
+Event loops passed to :class:`Profiler` get a profiler of their own, enabled
+on the loop's thread for the same cycles, and their stats are merged into the
+session's. From Python 3.12 a single profiler sees every thread and the
+second one cannot be enabled, so it is skipped.
+
+tracemalloc keeps tracing from the first session until :meth:`Profiler.close`,
+so allocations made between sessions are recorded too. This slows allocation
+down and costs memory for each traced block, which is the price of comparing
+sessions taken days apart.
+
+Each session writes, with a common timestamp prefix:
+
+* ``<prefix>.prof``: raw cProfile stats, for snakeviz/pstats.
+* ``<prefix>-cpu.txt``: the top functions by cumulative time.
+* ``<prefix>-memory.txt``: allocation growth over the session by line, and
+  growth since the previous session's final snapshot, so slow leaks show up
+  when sessions are taken days apart.
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for an event loop to switch its profiler on or off
+LOOP_TIMEOUT = 1.0
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process, where the platform reports it."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Largest resident set size of this process so far, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def open_fds() -> Optional[int]:
+    """Number of open file descriptors of this process, where the platform lists them."""
+    for directory in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # Listing the directory opens one more descriptor, which is listed
+            return len(os.listdir(directory)) - 1
+        except OSError:
+            continue
+    return None
+
+
+class Profiler:
+    """Profile a number of main loop cycles when requested.
+
+    Args:
+        directory: Where to write profiling output.
+        cycles: Number of cycles each session covers (default: 10).
+        top: Number of entries in the text summaries (default: 25).
+        frames: Traceback depth recorded by tracemalloc (default: 5).
+        loops: Event loops running in other threads whose work is part of a
+               cycle, such as the Shazam loop.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        cycles: int = 10,
+        top: int = 25,
+        frames: int = 5,
+        loops: Sequence[asyncio.AbstractEventLoop] = (),
+    ) -> None:
+        self.directory = directory
+        self.cycles = cycles
+        self.top = top
+        self.frames = frames
+        self.loops = list(loops)
+        self.sessions = 0
+        self._requested = threading.Event()
+        self._profile: Optional[cProfile.Profile] = None
+        self._loop_profiles: list[tuple[asyncio.AbstractEventLoop, cProfile.Profile]] = []
+        self._remaining = 0
+        self._started_tracemalloc = False
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._previous_final: Optional[tracemalloc.Snapshot] = None
+        self._started_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        """Whether a session is currently recording."""
+        return self._profile is not None
+
+    def request(self) -> None:
+        """Ask for a session to start at the next cycle; safe from signal handlers."""
+        self._requested.set()
+
+    def install_signal_handler(self, signum: Optional[int] = None) -> bool:
+        """Start a session whenever the process receives ``signum``.
+
+        Args:
+            signum: Signal to listen for (default: SIGUSR1).
+
+        Returns:
+            False if the platform has no such signal or this is not the main thread.
+        """
+        signum = signum if signum is not None else getattr(signal, "SIGUSR1", None)
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, lambda *_: self.request())
+        return True
+
+    def before_cycle(self) -> None:
+        """Start recording if a session was requested."""
+        if self._profile is None and self._requested.is_set():
+            self._requested.clear()
+            self._start()
+        if self._profile is not None:
+            self._profile.enable()
+            for loop, profile in self._loop_profiles:
+                _call_on_loop(loop, profile.enable)
+
+    def after_cycle(self) -> None:
+        """Pause recording, and finish the session once it covered enough cycles."""
+        if self._profile is None:
+            return
+        self._profile.disable()
+        for loop, profile in self._loop_profiles:
+            _call_on_loop(loop, profile.disable)
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self._finish()
+
+    def _start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        self._baseline = tracemalloc.take_snapshot()
+        self._profile = cProfile.Profile()
+        self._loop_profiles = []
+        for loop in self.loops:
+            profile = cProfile.Profile()
+            if _call_on_loop(loop, lambda p=profile: _can_enable(p)):
+                self._loop_profiles.append((loop, profile))
+        self._remaining = self.cycles
+        self._started_at = time.time()
+        logger.info(f"Profiling the next {self.cycles} cycles into {self.directory}")
+
+    def _finish(self) -> None:
+        profile, self._profile = self._profile, None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+        prefix = os.path.join(self.directory, f"profile-{stamp}-{os.getpid()}-{self.sessions + 1}")
+
+        cpu = io.StringIO()
+        stats = pstats.Stats(profile, stream=cpu)
+        for _, loop_profile in self._loop_profiles:
+            loop_profile.create_stats()
+            if loop_profile.stats:
+                stats.add(loop_profile)
+        self._loop_profiles = []
+        stats.dump_stats(f"{prefix}.prof")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        with open(f"{prefix}-cpu.txt", "w") as f:
+            f.write(cpu.getvalue())
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        self._write_memory_report(f"{prefix}-memory.txt", snapshot)
+        self._previous_final = snapshot
+        self._baseline = None
+        self.sessions += 1
+        logger.info(f"Profiling results written to {prefix}.*")
+
+    def close(self) -> None:
+        """Stop tracemalloc if a session started it."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _write_memory_report(self, path: str, snapshot: tracemalloc.Snapshot) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        with open(path, "w") as f:
+            f.write(f"cycles profiled: {self.cycles}\n")
+            f.write(f"traced memory: {current} bytes (peak {peak})\n")
+            if rss is not None:
+                f.write(f"rss: {rss} bytes\n")
+            sections = [("growth during session", self._baseline)]
+            if self._previous_final is not None:
+                sections.append(("growth since previous session", self._previous_final))
+            for title, reference in sections:
+                f.write(f"\n== {title} ==\n")
+                for diff in snapshot.compare_to(reference, "lineno")[: self.top]:
+                    f.write(f"{diff}\n")
+            f.write("\n== largest allocations ==\n")
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                f.write(f"{stat}\n")
+
+
+def _can_enable(profile: cProfile.Profile) -> bool:
+    """Switch a profiler on and off again, to find out whether this thread can have one."""
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+: the session's profiler already records every thread
+        return False
+    profile.disable()
+    return True
+
+
+def _call_on_loop(loop: asyncio.AbstractEventLoop, function: Callable[[], object]) -> object:
+    """Run a function on an event loop's thread and return its result.
+
+    Returns:
+        The function's result, or None if the loop is closed or busy for
+        longer than :data:`LOOP_TIMEOUT`.
+    """
+    done = threading.Event()
+    result: list[object] = [None]
+
+    def call() -> None:
+        try:
+            result[0] = function()
+        finally:
+            done.set()
+
+    try:
+        loop.call_soon_threadsafe(call)
+    except RuntimeError:
+        return None
+    done.wait(LOOP_TIMEOUT)
+    return result[0]
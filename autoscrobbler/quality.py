@@ -0,0 +1,156 @@
+"""Audio quality metrics for capture windows.
+
+Each capture is measured before it is sent to Shazam so that clipped,
+silent or overflowed captures can be skipped instead of costing an API call.
+All metrics are computed with vectorized numpy reductions over the int16
+samples and do not copy the capture buffer.
+"""
+
+import json
+import math
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import numpy as np
+
+FULL_SCALE = 32768.0
+# Frame length used to estimate the noise floor for SNR
+SNR_FRAME = 2048
+# Floor for log10 of silent signals, in dBFS / dB
+MIN_DB = -120.0
+
+
+@dataclass(frozen=True)
+class CaptureQuality:
+    """Quality metadata for one capture window.
+
+    Attributes:
+        overflow: Whether PortAudio reported an input overflow during capture.
+        clipping_ratio: Fraction of samples at or beyond full scale.
+        rms_dbfs: RMS level in dB relative to full scale.
+        dc_offset: Mean sample value as a fraction of full scale.
+        snr_db: Estimated signal-to-noise ratio in dB, from the spread between
+                loud and quiet frames.
+    """
+
+    overflow: bool
+    clipping_ratio: float
+    rms_dbfs: float
+    dc_offset: float
+    snr_db: float
+
+
+@dataclass(frozen=True)
+class QualityThresholds:
+    """Limits a capture must meet before it is sent for identification.
+
+    Attributes:
+        min_rms_dbfs: Minimum RMS level; quieter captures are treated as silence.
+        max_clipping_ratio: Maximum fraction of clipped samples.
+        min_snr_db: Minimum estimated SNR, or None to not check it.
+        max_dc_offset: Maximum absolute DC offset, or None to not check it.
+        skip_on_overflow: Whether an input overflow alone disqualifies a capture.
+    """
+
+    min_rms_dbfs: float = -60.0
+    max_clipping_ratio: float = 0.05
+    min_snr_db: Optional[float] = None
+    max_dc_offset: Optional[float] = None
+    skip_on_overflow: bool = False
+
+    def rejection_reason(self, quality: CaptureQuality) -> Optional[str]:
+        """Explain why a capture fails these thresholds.
+
+        Args:
+            quality: Metrics of the capture.
+
+        Returns:
+            A human readable reason, or None if the capture is acceptable.
+        """
+        if self.skip_on_overflow and quality.overflow:
+            return "input overflow during capture"
+        if quality.rms_dbfs < self.min_rms_dbfs:
+            return f"level {quality.rms_dbfs:.1f} dBFS below {self.min_rms_dbfs:.1f} dBFS"
+        if quality.clipping_ratio > self.max_clipping_ratio:
+            return (
+                f"{quality.clipping_ratio:.1%} of samples clipped "
+                f"(max {self.max_clipping_ratio:.1%})"
+            )
+        if self.min_snr_db is not None and quality.snr_db < self.min_snr_db:
+            return f"estimated SNR {quality.snr_db:.1f} dB below {self.min_snr_db:.1f} dB"
+        if self.max_dc_offset is not None and abs(quality.dc_offset) > self.max_dc_offset:
+            return f"DC offset {quality.dc_offset:+.3f} exceeds {self.max_dc_offset:.3f}"
+        return None
+
+
+def _to_db(power: float) -> float:
+    """Convert a power ratio to dB, clamped at ``MIN_DB`` for silence."""
+    return max(MIN_DB, 10.0 * math.log10(power)) if power > 0 else MIN_DB
+
+
+def measure_quality(samples: np.ndarray, overflow: bool = False) -> CaptureQuality:
+    """Compute quality metrics for a mono int16 capture.
+
+    Args:
+        samples: Captured samples.
+        overflow: Whether the capture reported an input overflow.
+
+    Returns:
+        Quality metadata for the capture.
+    """
+    samples = samples.reshape(-1)
+    n = samples.size
+    if n == 0:
+        return CaptureQuality(overflow, 0.0, MIN_DB, 0.0, 0.0)
+
+    clipped = np.count_nonzero(samples >= 32767) + np.count_nonzero(samples <= -32768)
+    total = float(samples.sum(dtype=np.int64))
+    # Per-frame energy via einsum accumulates in float64 without a squared copy
+    frames = n // SNR_FRAME
+    if frames:
+        framed = samples[: frames * SNR_FRAME].reshape(frames, SNR_FRAME)
+        frame_energy = np.einsum("ij,ij->i", framed, framed, dtype=np.float64)
+        energy = float(frame_energy.sum())
+        tail = samples[frames * SNR_FRAME :]
+        energy += float(np.einsum("i,i->", tail, tail, dtype=np.float64))
+        quiet, loud = np.percentile(frame_energy, [10, 90])
+        snr_db = _to_db(loud / quiet) if quiet > 0 else (0.0 if loud == 0 else -MIN_DB)
+    else:
+        energy = float(np.einsum("i,i->", samples, samples, dtype=np.float64))
+        snr_db = 0.0
+
+    mean_power = energy / n / (FULL_SCALE * FULL_SCALE)
+    return CaptureQuality(
+        overflow=bool(overflow),
+        clipping_ratio=float(clipped / n),
+        rms_dbfs=_to_db(mean_power),
+        dc_offset=total / n / FULL_SCALE,
+        snr_db=float(snr_db),
+    )
+
+
+class QualityLog:
+    """Append capture quality metrics to a JSON lines time series.
+
+    Args:
+        path: File to append to.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+
+    def write(self, quality: CaptureQuality, skipped: Optional[str] = None) -> None:
+        """Record one capture's metrics.
+
+        Args:
+            quality: Metrics of the capture.
+            skipped: Rejection reason if identification was skipped.
+        """
+        record = {"timestamp": time.time(), **asdict(quality), "skipped": skipped}
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self) -> None:
+        """Close the underlying file."""
+        self._file.close()
@@ -0,0 +1,395 @@
+"""Rate limiting, retries and circuit breaking for Shazam requests.
+
+Every recognize call goes through one process-wide :class:`RequestLimiter`,
+so all capture sources share the same request budget:
+
+* A :class:`TokenBucket` spaces calls out. When Shazam answers 429 the refill
+  rate is halved, and it creeps back to the configured rate with each success.
+* Throttling (429), server errors (5xx) and connection errors are retried with
+  exponential backoff and full jitter, honouring ``Retry-After`` when given.
+  A ``Retry-After`` longer than the backoff cap is not waited out, as that
+  would hold up the main loop; it opens the breaker for that long instead.
+* A :class:`CircuitBreaker` opens after repeated failed calls. While it is open
+  calls are refused immediately with :class:`CircuitOpenError`; after the
+  cool-down one trial call is let through and its outcome closes or reopens it.
+
+Calls run on the process-wide Shazam event loop thread while the main loop
+waits for them. The limiter only uses thread-safe state and
+``asyncio.sleep``, so it can be shared with calls made on other loops, such
+as those of the benchmarks and tests.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from autoscrobbler import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Circuit breaker states, also the values of the breaker state gauge
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half-open", OPEN: "open"}
+
+
+class HTTPStatusError(Exception):
+    """An HTTP request failed with an error status.
+
+    Attributes:
+        status: HTTP status code.
+        retry_after: Seconds the server asked us to wait, if it said.
+    """
+
+    def __init__(self, status: int, retry_after: Optional[float] = None) -> None:
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        """Whether the server is rate limiting us."""
+        return self.status == 429
+
+    @property
+    def retryable(self) -> bool:
+        """Whether the request may succeed if sent again later."""
+        return self.throttled or self.status >= 500
+
+
+class CircuitOpenError(RuntimeError):
+    """A call was refused because the circuit breaker is open.
+
+    Attributes:
+        retry_in: Seconds until the breaker lets a trial call through.
+    """
+
+    def __init__(self, retry_in: float) -> None:
+        super().__init__(f"Shazam calls paused for {retry_in:.0f}s after repeated failures")
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header given in seconds; dates are ignored."""
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(
+    attempt: int, base: float, cap: float, rng: Callable[[], float] = random.random
+) -> float:
+    """Exponential backoff with full jitter.
+
+    Args:
+        attempt: Number of the retry, starting at 1.
+        base: Delay ceiling of the first retry in seconds.
+        cap: Maximum delay ceiling in seconds.
+        rng: Source of uniform values in [0, 1).
+
+    Returns:
+        A delay drawn uniformly from ``[0, min(cap, base * 2 ** (attempt - 1))]``.
+    """
+    return rng() * min(cap, base * 2 ** (attempt - 1))
+
+
+class TokenBucket:
+    """Token bucket whose refill rate backs off when the server throttles.
+
+    Args:
+        rate: Tokens added per second.
+        capacity: Maximum number of stored tokens, i.e. the allowed burst.
+        min_rate: Lowest rate throttling can push the bucket down to
+                  (default: an eighth of ``rate``).
+        clock: Monotonic time source.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        min_rate: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.max_rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.capacity = capacity
+        self._rate = rate
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def rate(self) -> float:
+        """Current refill rate in tokens per second."""
+        return self._rate
+
+    @property
+    def tokens(self) -> float:
+        """Tokens currently available."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def reserve(self) -> float:
+        """Take a token, going into debt if none is available.
+
+        Returns:
+            Seconds the caller must wait before using the token.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    async def acquire(self) -> float:
+        """Wait for a token.
+
+        Returns:
+            Seconds spent waiting.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def throttle(self) -> None:
+        """Halve the refill rate after the server throttled us."""
+        with self._lock:
+            self._refill()
+            self._rate = max(self.min_rate, self._rate / 2)
+
+    def recover(self) -> None:
+        """Raise the refill rate one step back towards its configured value."""
+        with self._lock:
+            self._refill()
+            self._rate = min(self.max_rate, self._rate + self.max_rate / 8)
+
+
+class CircuitBreaker:
+    """Stop calling a failing service for a cool-down period.
+
+    Args:
+        failure_threshold: Consecutive failed calls that open the breaker.
+        cooldown: Seconds the breaker stays open before allowing a trial call.
+        clock: Monotonic time source.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        cooldown: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._state = CLOSED
+        self._open_until = 0.0
+        self._trial_running = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> int:
+        """Current state: CLOSED, HALF_OPEN or OPEN."""
+        with self._lock:
+            if self._state == OPEN and self._clock() >= self._open_until:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """Check that a call may go ahead.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or a trial call is
+                              already running after the cool-down.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            remaining = self._open_until - self._clock()
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(max(remaining, 0.0))
+            self._state = HALF_OPEN
+            self._trial_running = True
+            logger.info("Circuit breaker half-open, sending a trial Shazam request")
+
+    def record_success(self) -> None:
+        """Close the breaker and reset the failure count."""
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit breaker closed, Shazam requests resumed")
+            self._state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """Count a failed call, opening the breaker at the threshold."""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(
+                        f"Circuit breaker open after {self.failures} failed Shazam "
+                        f"request(s), pausing for {self.cooldown:.0f}s"
+                    )
+                self._state = OPEN
+                self._open_until = self._clock() + self.cooldown
+
+    def open_for(self, seconds: float) -> None:
+        """Open the breaker for at least ``seconds``, as the server asked."""
+        with self._lock:
+            until = self._clock() + seconds
+            if self._state != OPEN or until > self._open_until:
+                logger.warning(f"Shazam asked to retry in {seconds:.0f}s, pausing Shazam requests")
+                self._open_until = until
+            self._state = OPEN
+            self._trial_running = False
+
+
+class RequestLimiter:
+    """Token bucket, retries and circuit breaker in front of one service.
+
+    Args:
+        rate: Sustained requests per second.
+        burst: Requests allowed back to back.
+        max_retries: Retries after the first attempt of a call.
+        backoff_base: Delay ceiling of the first retry in seconds.
+        backoff_cap: Maximum retry delay ceiling in seconds, and the longest
+                     ``Retry-After`` waited out before retrying.
+        failure_threshold: Consecutive failed calls that open the breaker.
+        cooldown: Seconds the breaker stays open.
+        rng: Source of uniform values in [0, 1) for jitter.
+        retry_allowed: Called before each retry; when it returns False the
+                       call fails instead, e.g. once a daily budget is spent.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.1,
+        burst: int = 2,
+        max_retries: int = 3,
+        backoff_base: float = 2.0,
+        backoff_cap: float = 60.0,
+        failure_threshold: int = 5,
+        cooldown: float = 300.0,
+        rng: Callable[[], float] = random.random,
+        retry_allowed: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._rng = rng
+        self.retry_allowed = retry_allowed
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Run ``func`` within the rate limit, retrying transient failures.
+
+        Args:
+            func: Zero-argument coroutine function making one request.
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            CircuitOpenError: If the breaker refuses the call, or the server
+                              asks to wait longer than ``backoff_cap``.
+            Exception: The last error, once retries are exhausted or for
+                       errors that are not worth retrying.
+        """
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            metrics.RATE_LIMIT_REJECTIONS.inc()
+            raise
+        attempt = 0
+        while True:
+            attempt += 1
+            metrics.RATE_LIMIT_WAIT_SECONDS.observe(await self.bucket.acquire())
+            try:
+                with tracing.span("shazam.attempt", attempt=attempt):
+                    result = await func()
+            except Exception as e:
+                retry_after = self._classify(e)
+                if retry_after is not None and retry_after > self.backoff_cap:
+                    self.breaker.open_for(retry_after)
+                    raise CircuitOpenError(retry_after) from e
+                if retry_after is None or attempt > self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                if self.retry_allowed is not None and not self.retry_allowed():
+                    logger.warning(f"Shazam request failed ({e}), no budget left to retry it")
+                    self.breaker.record_failure()
+                    raise
+                delay = max(
+                    retry_after,
+                    backoff_delay(attempt, self.backoff_base, self.backoff_cap, self._rng),
+                )
+                metrics.SHAZAM_RETRIES.inc()
+                logger.warning(f"Shazam request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.bucket.recover()
+                self.breaker.record_success()
+                return result
+
+    def _classify(self, error: Exception) -> Optional[float]:
+        """Return the minimum retry delay for a retryable error, else None."""
+        if isinstance(error, HTTPStatusError):
+            if error.throttled:
+                metrics.SHAZAM_THROTTLED.inc()
+                self.bucket.throttle()
+            return (error.retry_after or 0.0) if error.retryable else None
+        if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+            return 0.0
+        return None
+
+
+def _export(limiter: RequestLimiter) -> None:
+    """Point the limiter gauges at ``limiter``."""
+    metrics.RATE_LIMIT_TOKENS.set_function(lambda: limiter.bucket.tokens)
+    metrics.RATE_LIMIT_RATE.set_function(lambda: limiter.bucket.rate)
+    metrics.CIRCUIT_STATE.set_function(lambda: limiter.breaker.state)
+
+
+_limiter = RequestLimiter()
+_export(_limiter)
+
+
+def get_limiter() -> RequestLimiter:
+    """Return the process-wide Shazam request limiter."""
+    return _limiter
+
+
+def configure_limiter(**kwargs: Any) -> RequestLimiter:
+    """Replace the process-wide Shazam request limiter.
+
+    Args:
+        **kwargs: :class:`RequestLimiter` options.
+
+    Returns:
+        The new limiter.
+    """
+    global _limiter
+    _limiter = RequestLimiter(**kwargs)
+    _export(_limiter)
+    return _limiter
@@ -0,0 +1,544 @@
+"""Replay a labeled listening session to compare scheduling strategies.
+
+``python -m autoscrobbler.replay --audio session.flac --tracklist session.txt``
+runs the unmodified :func:`autoscrobbler.__main__.main` over a recorded
+listening session once per strategy, each strategy being a set of main loop
+arguments such as ``--duty-cycle 90`` or ``--daily-budget 300``:
+
+* ``sounddevice`` is replaced by a loopback device playing the session audio,
+  so the quality checks, the budget and dedupe see what a microphone would.
+* ``time`` is replaced by a :class:`~autoscrobbler.loopback.VirtualClock`:
+  sleeping and recording take no time, so hours of listening replay in
+  seconds. Every strategy starts at the same simulated wall clock time.
+* Shazam is replaced by an oracle answering from the tracklist: a capture is
+  identified as the track covering at least ``--min-coverage`` of it, after
+  ``--latency`` simulated seconds. No signature is computed and the Shazam
+  rate limiter is not involved, as it runs on real time.
+* Last.fm is the in-process stand-in from :mod:`autoscrobbler.standins`.
+
+Scrobbles are then scored against the tracklist: recall over plays long
+enough to scrobble, duplicate and wrong scrobbles, Shazam and Last.fm calls
+per hour of session and the time from the start of a play to its scrobble.
+
+The tracklist is a text file with one line per play, the time the play
+starts (seconds, ``mm:ss`` or ``h:mm:ss``) followed by ``Artist - Title``. A
+time on its own marks a gap, such as talk or silence, where nothing should
+be scrobbled; each line lasts until the next, the last until the end of the
+audio. Blank lines and lines starting with ``#`` are ignored::
+
+    0:00 Boards of Canada - Roygbiv
+    2:31 Aphex Twin - Avril 14th
+    4:36
+    5:10 Burial - Archangel
+
+Without ``--audio`` a session of synthetic tracks is generated instead.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import shlex
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Iterator, Optional, Sequence
+
+import numpy as np
+import soundfile as sf
+
+from autoscrobbler import __main__ as app
+from autoscrobbler import logs
+from autoscrobbler.loadtest import percentiles, score_scrobbles
+from autoscrobbler.loopback import (
+    ClockStopped,
+    LoopbackDevice,
+    LoopbackSoundDevice,
+    Play,
+    VirtualClock,
+)
+from autoscrobbler.standins import API_KEY, API_SECRET, LastfmStandIn, Track, synthetic_music
+
+SAMPLE_RATE = 44100
+WINDOW_SECONDS = 10
+USERNAME = "replay"
+DEFAULT_DUTY_CYCLES = (15, 30, 60, 90, 120, 180)
+# Last.fm only accepts scrobbles of tracks longer than 30 seconds
+DEFAULT_MIN_PLAY = 30.0
+
+
+@dataclass(frozen=True)
+class Session:
+    """A listening session and what was played in it.
+
+    Attributes:
+        audio: Mono int16 audio at ``SAMPLE_RATE``.
+        plays: Labeled plays, in seconds from the start of the audio.
+    """
+
+    audio: np.ndarray
+    plays: list[Play]
+
+    @property
+    def duration(self) -> float:
+        """Length of the session in seconds."""
+        return self.audio.size / SAMPLE_RATE
+
+
+@dataclass(frozen=True)
+class Strategy:
+    """A scheduling strategy to replay.
+
+    Attributes:
+        name: Name shown in the report.
+        args: Command line arguments of the main loop.
+    """
+
+    name: str
+    args: list[str]
+
+
+@dataclass(frozen=True)
+class StrategyResult:
+    """How a strategy did on a session.
+
+    Attributes:
+        name: Strategy name.
+        args: Command line arguments of the main loop.
+        cycles: Capture cycles run.
+        shazam_calls: Identification requests made.
+        lastfm_calls: Last.fm API requests made.
+        shazam_calls_per_hour: Identification requests per hour of session.
+        lastfm_calls_per_hour: Last.fm API requests per hour of session.
+        scrobbles: Scrobbles sent.
+        correct: Plays scrobbled, each counted once.
+        duplicates: Further scrobbles of an already scrobbled play.
+        wrong: Scrobbles of a track that was not playing.
+        missed: Plays long enough to scrobble that were not scrobbled.
+        recall: Share of plays long enough to scrobble that were scrobbled.
+        time_to_scrobble_s: p50, p99 and maximum seconds from the start of
+                            a play to its scrobble.
+        real_seconds: Wall clock time the replay took.
+    """
+
+    name: str
+    args: list[str]
+    cycles: int
+    shazam_calls: int
+    lastfm_calls: int
+    shazam_calls_per_hour: float
+    lastfm_calls_per_hour: float
+    scrobbles: int
+    correct: int
+    duplicates: int
+    wrong: int
+    missed: int
+    recall: Optional[float]
+    time_to_scrobble_s: dict[str, Optional[float]]
+    real_seconds: float
+
+
+def parse_time(text: str) -> float:
+    """Parse seconds, ``mm:ss`` or ``h:mm:ss`` into seconds.
+
+    Raises:
+        ValueError: If ``text`` is not a time.
+    """
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Negative time: {text}")
+    return seconds
+
+
+def read_tracklist(path: str, duration: float) -> list[Play]:
+    """Read a tracklist into plays.
+
+    Args:
+        path: Tracklist file, in the format described in the module docstring.
+        duration: Length of the session, where the last entry ends.
+
+    Returns:
+        The labeled plays; gaps are left out.
+
+    Raises:
+        ValueError: If a line is malformed or out of order.
+    """
+    entries: list[tuple[float, Optional[Track]]] = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            when, _, label = line.partition(" ")
+            try:
+                start = parse_time(when)
+            except ValueError:
+                raise ValueError(f"{path}:{number}: expected a time, got '{when}'") from None
+            if entries and start <= entries[-1][0]:
+                raise ValueError(f"{path}:{number}: times must increase")
+            track = None
+            if label.strip():
+                artist, sep, title = label.strip().partition(" - ")
+                if not sep:
+                    raise ValueError(f"{path}:{number}: expected 'Artist - Title'")
+                track = Track(artist.strip(), title.strip())
+            entries.append((start, track))
+    ends = [start for start, _ in entries[1:]] + [duration]
+    return [
+        Play(track, start, min(end, duration))
+        for (start, track), end in zip(entries, ends)
+        if track is not None and start < duration
+    ]
+
+
+def read_session_audio(path: str) -> np.ndarray:
+    """Read an audio file as mono int16 at ``SAMPLE_RATE``.
+
+    The file is read a minute at a time, so a session of several hours only
+    needs memory for its int16 samples.
+    """
+    parts = []
+    with sf.SoundFile(path) as f:
+        rate = f.samplerate
+        for block in f.blocks(blocksize=60 * rate, dtype="float32", always_2d=True):
+            audio = block.mean(axis=1)
+            if rate != SAMPLE_RATE and audio.size:
+                frames = int(round(audio.size * SAMPLE_RATE / rate))
+                audio = np.interp(
+                    np.arange(frames) * (rate / SAMPLE_RATE), np.arange(audio.size), audio
+                )
+            parts.append(np.clip(audio * 32768.0, -32768, 32767).astype(np.int16))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int16)
+
+
+def load_session(audio: str, tracklist: str) -> Session:
+    """Read a recorded session and its tracklist."""
+    samples = read_session_audio(audio)
+    return Session(samples, read_tracklist(tracklist, samples.size / SAMPLE_RATE))
+
+
+def synthetic_session(
+    tracks: int = 12,
+    seed: int = 0,
+    min_seconds: float = 60.0,
+    max_seconds: float = 300.0,
+    gap: float = 2.0,
+) -> Session:
+    """Generate a session of synthetic tracks of random lengths.
+
+    Args:
+        tracks: Number of tracks.
+        seed: Seed of the track lengths and music.
+        min_seconds: Shortest track.
+        max_seconds: Longest track.
+        gap: Seconds of silence after each track.
+
+    Returns:
+        The session.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    plays = []
+    position = 0.0
+    for i in range(tracks):
+        seconds = float(rng.uniform(min_seconds, max_seconds))
+        audio = synthetic_music(seconds, SAMPLE_RATE, seed=seed * tracks + i)
+        plays.append(Play(Track(f"Replay Artist {i}", f"Replay Song {i}"), position, position + audio.size / SAMPLE_RATE))
+        parts.extend([audio, np.zeros(int(gap * SAMPLE_RATE), dtype=np.int16)])
+        position += (audio.size + parts[-1].size) / SAMPLE_RATE
+    return Session(np.concatenate(parts), plays)
+
+
+def duty_cycle_strategies(duty_cycles: Sequence[int] = DEFAULT_DUTY_CYCLES) -> list[Strategy]:
+    """One strategy per duty cycle."""
+    return [Strategy(f"duty {d}s", ["--duty-cycle", str(d)]) for d in duty_cycles]
+
+
+def parse_strategy(text: str) -> Strategy:
+    """Parse ``NAME=ARGS`` into a strategy; ARGS is split like a shell would.
+
+    Raises:
+        ValueError: If there is no name.
+    """
+    name, sep, args = text.partition("=")
+    if not sep or not name.strip():
+        raise ValueError(f"Expected NAME=ARGS, got '{text}'")
+    return Strategy(name.strip(), shlex.split(args))
+
+
+class Oracle:
+    """Shazam stand-in identifying captures from the tracklist.
+
+    Args:
+        plays: Labeled plays, in simulated time.
+        sd: Loopback sound device whose latest recording is identified.
+        clock: Clock advanced by ``latency`` per identification.
+        latency: Simulated seconds an identification takes.
+        min_coverage: Share of a capture a track must cover to be identified.
+    """
+
+    def __init__(
+        self,
+        plays: Sequence[Play],
+        sd: LoopbackSoundDevice,
+        clock: VirtualClock,
+        latency: float,
+        min_coverage: float,
+    ) -> None:
+        self.plays = list(plays)
+        self.sd = sd
+        self.clock = clock
+        self.latency = latency
+        self.min_coverage = min_coverage
+        self.calls = 0
+
+    def match(self, start: float, seconds: float) -> Optional[Track]:
+        """The track covering enough of a capture, if any."""
+        best, covered = None, 0.0
+        for play in self.plays:
+            overlap = min(play.end, start + seconds) - max(play.start, start)
+            if overlap > covered:
+                best, covered = play.track, overlap
+        return best if seconds > 0 and covered / seconds >= self.min_coverage else None
+
+    async def identify(self, buffer: Any, sample_rate: int = SAMPLE_RATE) -> dict[str, Any]:
+        """Replacement for :func:`autoscrobbler.__main__.identify_song`."""
+        self.calls += 1
+        # Moved forward directly: sleeping past the end would raise on the
+        # Shazam event loop instead of in the main loop
+        self.clock.now += self.latency
+        start, seconds = self.sd.last_recording or (self.clock.time(), 0.0)
+        track = self.match(start, seconds)
+        return track.shazam_result() if track is not None else {"matches": []}
+
+
+@contextlib.contextmanager
+def patched(target: Any, **attributes: Any) -> Iterator[None]:
+    """Temporarily replace attributes of a module or object."""
+    saved = {name: getattr(target, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def replay_strategy(
+    session: Session,
+    strategy: Strategy,
+    start: float,
+    latency: float = 1.0,
+    min_coverage: float = 0.6,
+    min_play: float = DEFAULT_MIN_PLAY,
+) -> StrategyResult:
+    """Run the main loop over a session with one strategy and score it.
+
+    Args:
+        session: The session to replay.
+        strategy: Main loop arguments to replay it with.
+        start: Simulated wall clock time at which the session starts.
+        latency: Simulated seconds each identification takes.
+        min_coverage: Share of a capture a track must cover to be identified.
+        min_play: Shortest play that should be scrobbled.
+
+    Returns:
+        The strategy's result.
+    """
+    clock = VirtualClock(start, end=start + session.duration)
+    plays = [Play(p.track, start + p.start, start + p.end) for p in session.plays]
+    sd = LoopbackSoundDevice(
+        [LoopbackDevice("Replay", [(Track("Replay", "Session"), session.audio)], SAMPLE_RATE, start=start)],
+        clock,
+    )
+    oracle = Oracle(plays, sd, clock, latency, min_coverage)
+    lastfm = LastfmStandIn()
+
+    async def warm_up_shazam() -> None:
+        return None
+
+    began = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="autoscrobbler-replay-") as workdir:
+        credentials = os.path.join(workdir, "credentials.json")
+        with open(credentials, "w") as f:
+            json.dump({"lastfm": {
+                "api_key": API_KEY,
+                "api_secret": API_SECRET,
+                "username": USERNAME,
+                "password": "password",
+            }}, f)
+        argv = [
+            "--input-source", "auto",
+            "--credentials", credentials,
+            "--history-db", os.path.join(workdir, "history.db"),
+            "--dedupe-file", os.path.join(workdir, "dedupe_index.json"),
+            "--budget-history", os.path.join(workdir, "budget_history.json"),
+            "--log-level", "WARNING",
+            *strategy.args,
+        ]
+        with patched(
+            app,
+            sd=sd,
+            time=clock,
+            identify_song=oracle.identify,
+            warm_up_shazam=warm_up_shazam,
+            lastfm_network=lambda creds: lastfm.network(creds["username"]),
+            parse_arguments=lambda: app.build_parser().parse_args(argv),
+            _devices=None,
+        ):
+            try:
+                app.main()
+            except ClockStopped:
+                pass
+    real_seconds = time.perf_counter() - began
+
+    score = score_scrobbles(
+        plays,
+        lastfm.scrobbles_of(USERNAME),
+        start,
+        clock.end,
+        min_play=min_play,
+        # A capture ending in the last seconds of a play is scrobbled after it
+        slack=WINDOW_SECONDS + latency,
+    )
+    hours = session.duration / 3600
+    expected = score.correct + score.missed
+    return StrategyResult(
+        name=strategy.name,
+        args=list(strategy.args),
+        cycles=sd.recordings,
+        shazam_calls=oracle.calls,
+        lastfm_calls=lastfm.requests,
+        shazam_calls_per_hour=oracle.calls / hours,
+        lastfm_calls_per_hour=lastfm.requests / hours,
+        scrobbles=score.scrobbles,
+        correct=score.correct,
+        duplicates=score.duplicates,
+        wrong=score.wrong,
+        missed=score.missed,
+        recall=score.correct / expected if expected else None,
+        time_to_scrobble_s=percentiles(score.time_to_scrobble),
+        real_seconds=real_seconds,
+    )
+
+
+def replay(
+    session: Session,
+    strategies: Sequence[Strategy],
+    start: Optional[float] = None,
+    **options: Any,
+) -> list[StrategyResult]:
+    """Replay a session with each strategy in turn.
+
+    Args:
+        session: The session to replay.
+        strategies: Strategies to compare.
+        start: Simulated wall clock time at which the session starts
+               (default: 8 pm on 1 January 2024, local time).
+        **options: Further arguments of :func:`replay_strategy`.
+
+    Returns:
+        One result per strategy, in the same order.
+    """
+    if start is None:
+        start = datetime.datetime(2024, 1, 1, 20).timestamp()
+    return [replay_strategy(session, strategy, start, **options) for strategy in strategies]
+
+
+def format_table(results: Sequence[StrategyResult]) -> str:
+    """Format results as a plain text table."""
+    lines = [
+        f"{'strategy':<20} {'recall':>7} {'dupes':>6} {'wrong':>6} {'shazam/h':>9} "
+        f"{'lastfm/h':>9} {'tts p50':>8} {'tts max':>8} {'real s':>7}"
+    ]
+    for r in results:
+        recall = f"{r.recall:.2f}" if r.recall is not None else "-"
+        tts = [r.time_to_scrobble_s[k] for k in ("p50", "max")]
+        p50, peak = (f"{v:.0f}" if v is not None else "-" for v in tts)
+        lines.append(
+            f"{r.name:<20} {recall:>7} {r.duplicates:>6} {r.wrong:>6} "
+            f"{r.shazam_calls_per_hour:>9.1f} {r.lastfm_calls_per_hour:>9.1f} "
+            f"{p50:>8} {peak:>8} {r.real_seconds:>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Replay a session from the command line and print the results."""
+    parser = argparse.ArgumentParser(
+        prog="python -m autoscrobbler.replay",
+        description="Compare scheduling strategies on a labeled listening session.",
+        epilog="Arguments after -- are passed to the main loop of every strategy.",
+    )
+    parser.add_argument("--audio", type=str, default=None, help="Audio of the session (default: synthetic tracks)")
+    parser.add_argument("--tracklist", type=str, default=None, help="Tracklist of the session audio")
+    parser.add_argument("--tracks", type=int, default=12, help="Synthetic tracks (default: 12)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic session (default: 0)")
+    parser.add_argument(
+        "--duty-cycles",
+        type=str,
+        default=None,
+        help="Comma separated duty cycles to compare (default: "
+        + ",".join(map(str, DEFAULT_DUTY_CYCLES))
+        + ", unless --strategy is given)",
+    )
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        default=[],
+        metavar="NAME=ARGS",
+        help="A named set of main loop arguments, e.g. 'budget=--duty-cycle 30 --daily-budget 200'; repeatable",
+    )
+    parser.add_argument("--start", type=str, default="20:00", help="Local time of day the session starts (default: 20:00)")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds each identification takes (default: 1)")
+    parser.add_argument("--min-coverage", type=float, default=0.6, help="Share of a capture a track must cover to be identified (default: 0.6)")
+    parser.add_argument("--min-play", type=float, default=DEFAULT_MIN_PLAY, help="Shortest play that should be scrobbled (default: 30)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("main_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if (args.audio is None) != (args.tracklist is None):
+        parser.error("--audio and --tracklist go together")
+
+    try:
+        strategies = [parse_strategy(text) for text in args.strategy]
+        if args.duty_cycles is not None or not strategies:
+            duty_cycles = (
+                [int(d) for d in args.duty_cycles.split(",")]
+                if args.duty_cycles is not None
+                else DEFAULT_DUTY_CYCLES
+            )
+            strategies = duty_cycle_strategies(duty_cycles) + strategies
+        hour, minute = (int(part) for part in args.start.split(":"))
+        start = datetime.datetime(2024, 1, 1, hour, minute).timestamp()
+    except ValueError as e:
+        parser.error(str(e))
+    main_args = args.main_args[1:] if args.main_args[:1] == ["--"] else args.main_args
+    strategies = [Strategy(s.name, [*s.args, *main_args]) for s in strategies]
+
+    # Per-cycle log lines would swamp the results
+    logs.configure_logging(level=logging.WARNING)
+    if args.audio is not None:
+        session = load_session(args.audio, args.tracklist)
+    else:
+        session = synthetic_session(args.tracks, seed=args.seed)
+    results = replay(
+        session,
+        strategies,
+        start=start,
+        latency=args.latency,
+        min_coverage=args.min_coverage,
+        min_play=args.min_play,
+    )
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        print(format_table(results))
+
+
+if __name__ == "__main__":
+    main()
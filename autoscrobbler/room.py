@@ -0,0 +1,290 @@
+"""Coordination between autoscrobbler nodes hearing the same music.
+
+Nodes in adjacent rooms often hear the same song. Without coordination each
+one identifies and scrobbles it, so Last.fm gets duplicates and Shazam gets
+redundant calls. :class:`RoomPeer` gossips small JSON datagrams over UDP, to a
+multicast group and/or a list of unicast peers:
+
+* ``result``: a song this node identified, with the spectral profile of the
+  capture. A peer whose own capture has a similar profile shortly afterwards
+  reuses the result instead of calling Shazam.
+* ``claim``: this node is about to scrobble a song. Before scrobbling, a node
+  claims the song and waits a short settle time; of all claims for the same
+  song within the dedupe window, the earliest (ties broken by node id) wins
+  and only the winner scrobbles.
+* ``scrobbled``: a song this node scrobbled. Peers add it to their dedupe
+  index, so they treat it as a play that is already running.
+
+Datagrams are received on a background thread; remote scrobbles are applied
+to the dedupe index from the main loop with :meth:`RoomPeer.sync`, since the
+index is not thread safe. Everything works over loopback, so several nodes
+can be run and tested on one machine.
+"""
+
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+import numpy as np
+
+from autoscrobbler import metrics
+from autoscrobbler.addresses import DEFAULT_GROUP, DEFAULT_PORT
+from autoscrobbler.budget import check_profile, novelty
+from autoscrobbler.dedupe import DedupeIndex
+
+logger = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 65507
+
+
+def _trim(result: dict[str, Any]) -> dict[str, Any]:
+    """Keep only the parts of a Shazam result needed to scrobble it."""
+    track = result["track"]
+    sections = [
+        {
+            "type": "SONG",
+            "metadata": [
+                item for item in section.get("metadata", []) if item.get("title") == "Album"
+            ],
+        }
+        for section in track.get("sections", [])
+        if section.get("type") == "SONG"
+    ]
+    return {
+        "track": {
+            "key": track.get("key"),
+            "title": track.get("title"),
+            "subtitle": track.get("subtitle"),
+            "sections": sections,
+        }
+    }
+
+
+class RoomPeer:
+    """Share identifications and scrobbles with other nodes over UDP.
+
+    Args:
+        node_id: Unique name of this node (default: host name and process id).
+        group: Multicast group to join and send to, or None for unicast only.
+        port: UDP port to listen on; also the port of the multicast group.
+        peers: Unicast addresses of other nodes.
+        bind: Local address to listen on (default: all interfaces).
+        settle: Seconds to wait for competing claims before scrobbling.
+        window: Seconds within which claims for the same song compete.
+        match_threshold: Largest profile novelty for reusing a peer's result.
+        max_age: Seconds a peer's result stays reusable.
+    """
+
+    def __init__(
+        self,
+        node_id: Optional[str] = None,
+        group: Optional[str] = DEFAULT_GROUP,
+        port: int = DEFAULT_PORT,
+        peers: Optional[list[tuple[str, int]]] = None,
+        bind: str = "",
+        settle: float = 0.5,
+        window: float = 300.0,
+        match_threshold: float = 0.15,
+        max_age: float = 90.0,
+    ) -> None:
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.group = group
+        self.peers = list(peers or [])
+        self.settle = settle
+        self.window = window
+        self.match_threshold = match_threshold
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._results: "deque[tuple[float, np.ndarray, dict[str, Any]]]" = deque(maxlen=32)
+        self._claims: dict[str, list[tuple[float, str]]] = {}
+        self._scrobbled: dict[str, float] = {}
+        self._pending: "deque[tuple[str, float]]" = deque()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._socket.bind((bind, port))
+        self.port = self._socket.getsockname()[1]
+        if group is not None:
+            membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._socket.settimeout(0.2)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._receive_loop, name="room-peer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop receiving and close the socket."""
+        self._stop.set()
+        self._thread.join()
+        self._socket.close()
+
+    # Sending
+
+    def _send(self, message: dict[str, Any]) -> None:
+        message["node"] = self.node_id
+        data = json.dumps(message, separators=(",", ":")).encode()
+        if len(data) > MAX_DATAGRAM:
+            logger.warning(f"Room message of {len(data)} bytes is too large to send")
+            return
+        targets = list(self.peers)
+        if self.group is not None:
+            targets.append((self.group, self.port))
+        for address in targets:
+            try:
+                self._socket.sendto(data, address)
+            except OSError as e:
+                logger.warning(f"Could not send room message to {address[0]}:{address[1]}: {e}")
+        metrics.ROOM_MESSAGES.inc(direction="sent", type=message["type"])
+
+    def announce_result(
+        self, result: dict[str, Any], profile: np.ndarray, now: Optional[float] = None
+    ) -> None:
+        """Share a song this node identified.
+
+        Args:
+            result: Shazam result with a ``track``.
+            profile: Spectral profile of the capture it was identified from.
+            now: When the capture was taken (default: now).
+        """
+        now = time.time() if now is None else now
+        self._send({
+            "type": "result",
+            "timestamp": now,
+            "profile": [round(float(x), 4) for x in profile],
+            "result": _trim(result),
+        })
+
+    def claim(self, key: str, now: Optional[float] = None) -> bool:
+        """Claim a song for scrobbling and wait for competing claims.
+
+        Args:
+            key: Normalized track key.
+            now: When the song was heard (default: now).
+
+        Returns:
+            True if this node should scrobble the song.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._prune(now)
+            self._claims.setdefault(key, []).append((now, self.node_id))
+        self._send({"type": "claim", "key": key, "timestamp": now})
+        self._stop.wait(self.settle)
+        with self._lock:
+            scrobbled = self._scrobbled.get(key)
+            if scrobbled is not None and abs(scrobbled - now) <= self.window:
+                return False
+            competing = [c for c in self._claims.get(key, []) if abs(c[0] - now) <= self.window]
+        return min(competing, default=(now, self.node_id)) >= (now, self.node_id)
+
+    def announce_scrobble(self, key: str, now: Optional[float] = None) -> None:
+        """Tell peers that this node scrobbled a song.
+
+        Args:
+            key: Normalized track key.
+            now: When the song was heard (default: now).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._scrobbled[key] = now
+        self._send({"type": "scrobbled", "key": key, "timestamp": now})
+
+    # Using what peers sent
+
+    def match(self, profile: np.ndarray, now: Optional[float] = None) -> Optional[dict[str, Any]]:
+        """Find a recent peer result for a capture that sounds the same.
+
+        Args:
+            profile: Spectral profile of this node's capture.
+            now: When the capture was taken (default: now).
+
+        Returns:
+            The peer's Shazam result, or None if no peer heard this recently.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            results = list(self._results)
+        best = None
+        best_novelty = self.match_threshold
+        for timestamp, reference, result in results:
+            if abs(now - timestamp) > self.max_age:
+                continue
+            distance = novelty(profile, reference)
+            if distance <= best_novelty:
+                best, best_novelty = result, distance
+        return best
+
+    def sync(self, dedupe: DedupeIndex) -> int:
+        """Record songs scrobbled by peers in the dedupe index.
+
+        Args:
+            dedupe: This node's dedupe index.
+
+        Returns:
+            Number of remote scrobbles applied.
+        """
+        applied = 0
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return applied
+                key, timestamp = self._pending.popleft()
+            dedupe.record(key, timestamp)
+            applied += 1
+
+    def _prune(self, now: float) -> None:
+        # Forget claims and scrobbles that can no longer compete
+        for key in list(self._claims):
+            claims = [c for c in self._claims[key] if now - c[0] <= self.window]
+            if claims:
+                self._claims[key] = claims
+            else:
+                del self._claims[key]
+        for key, timestamp in list(self._scrobbled.items()):
+            if now - timestamp > self.window:
+                del self._scrobbled[key]
+
+    # Receiving
+
+    def _receive_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                data, address = self._socket.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                self._handle(json.loads(data))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.debug(f"Ignoring malformed room message from {address[0]}: {e}")
+
+    def _handle(self, message: dict[str, Any]) -> None:
+        node = str(message["node"])
+        if node == self.node_id:
+            return
+        kind = message["type"]
+        timestamp = float(message["timestamp"])
+        with self._lock:
+            if kind == "result":
+                profile = check_profile(message["profile"])
+                self._results.append((timestamp, profile, message["result"]))
+            elif kind == "claim":
+                self._prune(timestamp)
+                self._claims.setdefault(str(message["key"]), []).append((timestamp, node))
+            elif kind == "scrobbled":
+                key = str(message["key"])
+                self._scrobbled[key] = timestamp
+                self._pending.append((key, timestamp))
+            else:
+                return
+        metrics.ROOM_MESSAGES.inc(direction="received", type=kind)
@@ -0,0 +1,145 @@
+"""Single-attempt HTTP client for shazamio.
+
+shazamio's default client retries throttled and failed requests up to 20
+times internally and hides the HTTP status from the caller. This client sends
+each request exactly once and raises :class:`~autoscrobbler.ratelimit.HTTPStatusError`
+on error statuses, so :mod:`autoscrobbler.ratelimit` can apply its own backoff
+and circuit breaking to every attempt.
+
+The client keeps one aiohttp session, so its connection pool, DNS cache and
+TLS context are reused by every identification instead of being rebuilt each
+cycle. A session is bound to the event loop it was created on, so all
+requests of one client must run on the same loop; :class:`EventLoopThread`
+provides a long-lived one that synchronous code can submit to.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import urllib.parse
+from typing import Any, Coroutine, Optional, TypeVar, Union
+
+import aiohttp
+from shazamio.exceptions import BadMethod
+from shazamio.interfaces.client import HTTPClientInterface
+from shazamio.utils import validate_json
+
+from autoscrobbler.ratelimit import HTTPStatusError, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WARM_UP_URL = "https://amp.shazam.com/"
+DNS_CACHE_SECONDS = 300
+
+
+class ShazamHTTPClient(HTTPClientInterface):
+    """Send each Shazam request once and surface HTTP errors.
+
+    Args:
+        timeout: Total timeout of one request in seconds (default: 30).
+        base_url: Send requests to this server instead, e.g. a local stand-in;
+                  the scheme, host and port of every URL are replaced.
+    """
+
+    def __init__(self, timeout: float = 30.0, base_url: Optional[str] = None) -> None:
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.base_url = base_url
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session, created on first use in the running loop."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(ttl_dns_cache=DNS_CACHE_SECONDS),
+            )
+        return self._session
+
+    async def warm_up(self, url: Optional[str] = None) -> None:
+        """Resolve and connect to Shazam ahead of the first request.
+
+        Failures are only logged; the first real request simply connects
+        again.
+
+        Args:
+            url: URL to connect to (default: :data:`WARM_UP_URL`).
+        """
+        try:
+            async with self.session.head(self._rebase(url or WARM_UP_URL), allow_redirects=False):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.debug(f"Could not warm up Shazam connection: {e}")
+
+    def _rebase(self, url: str) -> str:
+        if self.base_url is None:
+            return url
+        parts = urllib.parse.urlsplit(url)
+        return self.base_url.rstrip("/") + urllib.parse.urlunsplit(("", "", *parts[2:]))
+
+    async def close(self) -> None:
+        """Close the shared session and its connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> Union[list[Any], dict[str, Any]]:
+        """Send one request and decode its JSON body.
+
+        Raises:
+            HTTPStatusError: If the response status is 400 or above.
+            ConnectionError: If the connection failed or was dropped.
+            BadMethod: For methods other than GET and POST.
+        """
+        if method.upper() not in ("GET", "POST"):
+            raise BadMethod("Accept only GET/POST")
+        try:
+            async with self.session.request(method.upper(), self._rebase(url), **kwargs) as resp:
+                if resp.status >= 400:
+                    raise HTTPStatusError(
+                        resp.status, parse_retry_after(resp.headers.get("Retry-After"))
+                    )
+                return await validate_json(resp, *args)
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(str(e) or type(e).__name__) from e
+
+
+class EventLoopThread:
+    """Run coroutines on one long-lived event loop in a daemon thread.
+
+    Coroutines run with a copy of the submitting thread's context, so tracing
+    spans opened around :meth:`run` still parent the spans inside.
+
+    Args:
+        name: Name of the thread.
+    """
+
+    def __init__(self, name: str = "event-loop") -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine and return a future for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        """Run a coroutine to completion and return its result.
+
+        Raises:
+            Exception: Whatever the coroutine raised.
+        """
+        return self.submit(coroutine).result(timeout)
+
+    def close(self) -> None:
+        """Stop the loop and wait for the thread to finish."""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
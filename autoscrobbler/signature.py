@@ -0,0 +1,283 @@
+"""Streaming Shazam signature generation over a sliding window.
+
+Shazam signatures are built from spectral peaks: every 128 samples of 16 kHz
+audio, a 2048-point Hann-windowed FFT is taken, spread over neighbouring bins
+and frames, and bins that stand out from their neighbourhood become peaks.
+Recomputing that over a whole capture every cycle repeats 80-90% of the work
+when captures overlap, so :class:`StreamingSignatureGenerator` keeps the FFT
+and peak state between calls instead. Audio is fed in as it arrives (at any
+sample rate; it is resampled to 16 kHz on the way in) and
+:meth:`~StreamingSignatureGenerator.signature` encodes the peaks of the last
+``window_seconds`` on demand, which costs no FFTs at all.
+
+The peak detection follows shazamio's reference ``SignatureGenerator``, with
+the per-bin loops vectorized. Like the reference, it leaves out the 3500-5500
+Hz band, which is not used in the legacy signatures that
+``send_recognize_request`` sends. :class:`SignatureFollower` feeds a
+generator from the capture process's shared ring on a background thread.
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
+from shazamio.enums import FrequencyBand
+from shazamio.signature import DecodedMessage, FrequencyPeak
+
+from autoscrobbler.capture import SharedRingBuffer
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+HOP = 128
+FFT_SIZE = 2048
+BINS = FFT_SIZE // 2 + 1
+RING = 256  # spread FFT frames kept, as in the reference generator
+DELAY = 46  # frames of lookahead needed before a frame's peaks are known
+
+_HANNING = np.hanning(FFT_SIZE + 2)[1:-1]
+_BINS = np.arange(10, 1015)
+_NEIGHBOURS = np.array([-10, -7, -4, -3, 1, 2, 5, 8])
+_OTHER_FRAMES = np.array([-53, -45, *range(165, 201, 7), *range(214, 250, 7)])
+_BANDS = (
+    (250, 520, FrequencyBand.hz_250_520),
+    (520, 1450, FrequencyBand.hz_520_1450),
+    (1450, 3500, FrequencyBand.hz_1450_3500),
+)
+
+
+class _Resampler:
+    """Streaming low-pass filter and linear interpolation to 16 kHz."""
+
+    def __init__(self, sample_rate: int, taps: int = 63) -> None:
+        self.step = sample_rate / SAMPLE_RATE
+        cutoff = 0.45 * min(SAMPLE_RATE, sample_rate) / sample_rate
+        n = np.arange(taps) - (taps - 1) / 2
+        self._kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        self.reset()
+
+    def reset(self) -> None:
+        self._tail = np.zeros(len(self._kernel) - 1)
+        self._last = 0.0
+        self._position = 1.0
+
+    def __call__(self, samples: np.ndarray) -> np.ndarray:
+        signal = np.concatenate([self._tail, samples])
+        self._tail = signal[len(signal) - len(self._tail) :]
+        filtered = np.concatenate([[self._last], np.convolve(signal, self._kernel, "valid")])
+        end = len(filtered) - 1
+        count = max(0, int(np.ceil((end - self._position) / self.step)))
+        positions = self._position + self.step * np.arange(count)
+        self._position += self.step * count - end
+        self._last = filtered[-1]
+        return np.interp(positions, np.arange(len(filtered)), filtered)
+
+
+class StreamingSignatureGenerator:
+    """Incrementally computed Shazam signature of the most recent audio.
+
+    Thread safe: one thread may feed audio while another takes signatures.
+
+    Args:
+        window_seconds: Length of audio each signature covers (default: 10).
+        sample_rate: Sample rate of the fed audio in Hz (default: 16000).
+    """
+
+    def __init__(self, window_seconds: float = 10.0, sample_rate: int = SAMPLE_RATE) -> None:
+        self.window_seconds = window_seconds
+        self.sample_rate = sample_rate
+        self._window_frames = int(window_seconds * SAMPLE_RATE) // HOP
+        self._resampler = _Resampler(sample_rate) if sample_rate != SAMPLE_RATE else None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all audio, e.g. after a gap in the input."""
+        with self._lock:
+            if self._resampler is not None:
+                self._resampler.reset()
+            self._history = np.zeros(FFT_SIZE)
+            self._pending = np.zeros(0)
+            self._fft = np.zeros((RING, BINS))
+            self._spread = np.zeros((RING, BINS))
+            self._peaks: "deque[tuple[int, FrequencyBand, int, int]]" = deque()
+            self.frames = 0
+
+    def feed(self, samples: np.ndarray) -> None:
+        """Process newly captured samples.
+
+        Args:
+            samples: Mono int16 samples at ``sample_rate``, in capture order.
+        """
+        audio = np.asarray(samples, dtype=np.float64).reshape(-1)
+        with self._lock:
+            if self._resampler is not None:
+                audio = self._resampler(audio)
+            audio = np.concatenate([self._pending, audio])
+            hops = len(audio) // HOP
+            self._pending = audio[hops * HOP :]
+            if not hops:
+                return
+            # All FFTs of this chunk in one batch; spreading and peak
+            # detection depend on earlier frames and run frame by frame
+            stream = np.concatenate([self._history[HOP:], audio[: hops * HOP]])
+            windows = np.lib.stride_tricks.sliding_window_view(stream, FFT_SIZE)[::HOP]
+            spectra = np.fft.rfft(windows * _HANNING)
+            powers = np.maximum((spectra.real**2 + spectra.imag**2) / (1 << 17), 1e-10)
+            self._history = stream[-FFT_SIZE:]
+            for power in powers:
+                self._process_frame(power)
+            oldest = self.frames - self._window_frames
+            while self._peaks and self._peaks[0][0] < oldest:
+                self._peaks.popleft()
+
+    def _process_frame(self, power: np.ndarray) -> None:
+        position = self.frames % RING
+        self._fft[position] = power
+        # Spread over the two next bins, then into frames -1, -3 and -6
+        spread = power.copy()
+        spread[:-3] = np.maximum(np.maximum(power[:-3], power[1:-2]), power[2:-1])
+        row = spread
+        for offset in (1, 3, 6):
+            index = (position - offset) % RING
+            row = np.maximum(row, self._spread[index])
+            self._spread[index] = row
+        self._spread[position] = spread
+        self.frames += 1
+        if self.frames >= DELAY:
+            self._find_peaks()
+
+    def _find_peaks(self) -> None:
+        fft_number = self.frames - DELAY
+        current = self._fft[fft_number % RING]
+        before = self._spread[(self.frames - 49) % RING]
+        values = current[_BINS]
+        candidates = (values >= 1 / 64) & (values >= before[_BINS - 1])
+        if not candidates.any():
+            return
+        bins = _BINS[candidates]
+        values = values[candidates]
+        neighbours = before[bins[None, :] + _NEIGHBOURS[:, None]].max(axis=0)
+        others = self._spread[(self.frames + _OTHER_FRAMES) % RING][:, bins - 1].max(axis=0)
+        peaks = values > np.maximum(np.maximum(neighbours, 0.0), others)
+        for bin_position in bins[peaks]:
+            magnitudes = np.log(np.maximum(1 / 64, current[bin_position - 1 : bin_position + 2]))
+            before_mag, magnitude, after_mag = magnitudes * 1477.3 + 6144
+            variation = magnitude * 2 - before_mag - after_mag
+            if variation <= 0:
+                continue
+            corrected = bin_position * 64 + (after_mag - before_mag) * 32 / variation
+            frequency = corrected * (SAMPLE_RATE / 2 / 1024 / 64)
+            for low, high, band in _BANDS:
+                if low < frequency < high:
+                    self._peaks.append((fft_number, band, int(magnitude), int(corrected)))
+                    break
+
+    def signature(self) -> DecodedMessage:
+        """Encode the peaks of the last ``window_seconds`` of audio.
+
+        Returns:
+            Signature ready for :meth:`shazamio.Shazam.send_recognize_request`.
+        """
+        with self._lock:
+            start = max(0, self.frames - self._window_frames)
+            peaks = list(self._peaks)
+            frames = self.frames
+        message = DecodedMessage()
+        message.sample_rate_hz = SAMPLE_RATE
+        message.number_samples = (frames - start) * HOP
+        message.frequency_band_to_sound_peaks = {}
+        for fft_number, band, magnitude, corrected in peaks:
+            if fft_number < start:
+                continue
+            message.frequency_band_to_sound_peaks.setdefault(band, []).append(
+                FrequencyPeak(fft_number - start, magnitude, corrected, SAMPLE_RATE)
+            )
+        return message
+
+    @property
+    def peak_count(self) -> int:
+        """Peaks currently in the window."""
+        return len(self._peaks)
+
+
+def signature_of(samples: np.ndarray, sample_rate: int) -> DecodedMessage:
+    """Compute the signature of a whole capture in one go.
+
+    Args:
+        samples: Mono int16 samples.
+        sample_rate: Sample rate of the samples in Hz.
+
+    Returns:
+        Signature covering the capture.
+    """
+    generator = StreamingSignatureGenerator(len(samples) / sample_rate, sample_rate)
+    generator.feed(samples)
+    return generator.signature()
+
+
+class SignatureFollower:
+    """Feed a signature generator from the capture ring on a background thread.
+
+    Args:
+        ring: Shared ring the capture process writes into.
+        generator: Generator to feed.
+        interval: Seconds between polls of the ring (default: 0.25).
+    """
+
+    def __init__(
+        self,
+        ring: SharedRingBuffer,
+        generator: StreamingSignatureGenerator,
+        interval: float = 0.25,
+    ) -> None:
+        self.ring = ring
+        self.generator = generator
+        self.interval = interval
+        self._next = ring.write_index
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start following the ring from its current position."""
+        self._thread = threading.Thread(
+            target=self._follow_loop, name="signature-follower", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self) -> int:
+        """Feed everything written since the last poll.
+
+        Returns:
+            Number of samples fed.
+        """
+        fed = 0
+        while True:
+            view, start = self.ring.read_from(self._next)
+            samples = np.array(view)
+            if start != self._next or not self.ring.is_intact(start):
+                logger.warning("Signature generator fell behind the capture ring, restarting it")
+                self.generator.reset()
+                self._next = self.ring.write_index
+                return fed
+            if not samples.size:
+                return fed
+            self.generator.feed(samples)
+            self._next = start + samples.size
+            fed += samples.size
+
+    def _follow_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Signature generation failed: {e}")
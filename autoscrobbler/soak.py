@@ -0,0 +1,446 @@
+"""Accelerated soak test of the main loop for slow leaks.
+
+``python -m autoscrobbler.soak --cycles 5000`` runs the unmodified
+:func:`autoscrobbler.__main__.main` for thousands of cycles back to back, in
+this process, to find per-cycle leaks that would otherwise take weeks of
+running under systemd to notice:
+
+* ``sounddevice`` is a loopback device playing synthetic tracks in a loop,
+  and ``time`` a :class:`~autoscrobbler.loopback.VirtualClock`, so the wait
+  for the next cycle and for a recording take no time.
+* Shazam and Last.fm are the stand-ins from :mod:`autoscrobbler.standins`,
+  served over HTTP on localhost so that the real clients, their connections
+  and their sockets are exercised. Signatures are generated as usual. Fault
+  injection (``--shazam-error-rate``, ``--lastfm-error-rate``) exercises the
+  error paths too; retry backoff is skipped.
+
+Every ``--sample-every`` cycles the resident set size, open file
+descriptors, memory traced by tracemalloc, tasks on the Shazam event loop
+and threads are sampled. Samples before ``--warmup`` cycles are ignored, as
+caches, connection pools and the interpreter settle. Growth is the rise of
+the median of the last quarter of the remaining samples over the median of
+the first quarter, per 1000 cycles, so that one-off spikes do not count but
+any steady climb does. The run fails, with exit code 1, when any metric grows
+faster than its ``--max-*-growth`` bound. The JSON report also lists the
+source lines whose tracemalloc allocations grew the most after warm-up.
+
+Runs should be long enough for the warm-up to cover about 150 cycles:
+urllib and yarl keep the last 128 URLs they parsed, and every Shazam request
+has a URL of its own, so their caches fill up over that many cycles. The
+stand-ins keep a record of every request and scrobble in this process, a few
+hundred bytes per cycle that the default limits leave room for and that the
+top allocators leave out.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Optional, Sequence
+
+from autoscrobbler import __main__ as app
+from autoscrobbler import logs, ratelimit, standins
+from autoscrobbler.loopback import LoopbackDevice, LoopbackSoundDevice, VirtualClock
+from autoscrobbler.profiling import Profiler, open_fds, rss_bytes
+from autoscrobbler.replay import patched
+from autoscrobbler.standins import (
+    API_KEY,
+    API_SECRET,
+    Faults,
+    LastfmStandIn,
+    RedirectTransport,
+    ShazamStandIn,
+    Track,
+    serve_lastfm,
+    serve_shazam,
+    synthetic_music,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+USERNAME = "soak"
+START = 1_700_000_000.0
+
+
+class SoakFinished(BaseException):
+    """Raised after the last cycle to leave the main loop.
+
+    It derives from BaseException so that the main loop does not catch it as
+    a failed cycle, and shuts down through its ``finally`` block.
+    """
+
+
+@dataclass(frozen=True)
+class Sample:
+    """Resource usage after a cycle.
+
+    Attributes:
+        cycle: Cycles completed.
+        rss_bytes: Resident set size, or None where not reported.
+        open_fds: Open file descriptors, or None where not listed.
+        traced_bytes: Memory allocated by Python, as traced by tracemalloc.
+        asyncio_tasks: Tasks pending on the Shazam event loop.
+        threads: Live threads.
+    """
+
+    cycle: int
+    rss_bytes: Optional[int]
+    open_fds: Optional[int]
+    traced_bytes: int
+    asyncio_tasks: int
+    threads: int
+
+
+@dataclass(frozen=True)
+class Limits:
+    """Largest growth per 1000 cycles tolerated for each sampled metric.
+
+    Attributes:
+        rss_bytes: Resident set size growth in bytes.
+        open_fds: File descriptor growth.
+        traced_bytes: Traced Python memory growth in bytes.
+        asyncio_tasks: Growth of pending event loop tasks.
+        threads: Growth of live threads.
+    """
+
+    rss_bytes: float = 4 * 1024 * 1024
+    open_fds: float = 1.0
+    traced_bytes: float = 512 * 1024
+    asyncio_tasks: float = 1.0
+    threads: float = 1.0
+
+
+async def _pending_tasks() -> int:
+    # Not counting this task itself
+    return len(asyncio.all_tasks()) - 1
+
+
+def take_sample(cycle: int) -> Sample:
+    """Sample the resource usage of this process after ``cycle`` cycles."""
+    return Sample(
+        cycle=cycle,
+        rss_bytes=rss_bytes(),
+        open_fds=open_fds(),
+        traced_bytes=tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0,
+        asyncio_tasks=app.run_shazam(_pending_tasks()),
+        threads=threading.active_count(),
+    )
+
+
+def growth(samples: Sequence[Sample], metric: str, warmup: int = 0) -> Optional[float]:
+    """Sustained growth of a metric per 1000 cycles.
+
+    Args:
+        samples: Samples in cycle order.
+        metric: Name of a :class:`Sample` field.
+        warmup: Samples up to this cycle are ignored.
+
+    Returns:
+        Rise of the median of the last quarter of samples over the median of
+        the first quarter, per 1000 cycles between them, or None with fewer
+        than four samples of the metric after warm-up.
+    """
+    points = [
+        (s.cycle, getattr(s, metric))
+        for s in samples
+        if s.cycle > warmup and getattr(s, metric) is not None
+    ]
+    if len(points) < 4:
+        return None
+    quarter = len(points) // 4
+    first, last = points[:quarter], points[-quarter:]
+    cycles = statistics.median(c for c, _ in last) - statistics.median(c for c, _ in first)
+    rise = statistics.median(v for _, v in last) - statistics.median(v for _, v in first)
+    return rise / cycles * 1000
+
+
+def check_growth(
+    samples: Sequence[Sample], limits: Limits, warmup: int = 0
+) -> list[dict[str, Any]]:
+    """Compare the growth of every sampled metric with its limit.
+
+    Args:
+        samples: Samples in cycle order.
+        limits: Tolerated growth per 1000 cycles.
+        warmup: Samples up to this cycle are ignored.
+
+    Returns:
+        One entry per metric with its growth per 1000 cycles, its limit and
+        whether it stayed within it. Metrics that could not be measured pass.
+    """
+    checks = []
+    for field in fields(Limits):
+        per_1000 = growth(samples, field.name, warmup)
+        limit = getattr(limits, field.name)
+        checks.append({
+            "metric": field.name,
+            "per_1000_cycles": per_1000,
+            "limit": limit,
+            "ok": per_1000 is None or per_1000 <= limit,
+        })
+    return checks
+
+
+class SoakProbe(Profiler):
+    """Profiler replacement sampling resource usage between cycles.
+
+    Profiling still works as with the real profiler; after every cycle the
+    probe counts it, samples resources when due and raises
+    :class:`SoakFinished` after the last one.
+
+    Args:
+        total: Cycles to run.
+        sample_every: Cycles between samples.
+        warmup: Cycle after which the tracemalloc baseline is taken.
+        *args: Arguments of :class:`~autoscrobbler.profiling.Profiler`.
+        **kwargs: Keyword arguments of the profiler.
+    """
+
+    def __init__(self, total: int, sample_every: int, warmup: int, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.total = total
+        self.sample_every = sample_every
+        self.warmup = warmup
+        self.completed = 0
+        self.samples: list[Sample] = []
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+
+    def after_cycle(self) -> None:
+        super().after_cycle()
+        self.completed += 1
+        if self.completed % self.sample_every == 0 or self.completed == self.total:
+            self.samples.append(take_sample(self.completed))
+        if self.completed == self.warmup and tracemalloc.is_tracing():
+            self.baseline = tracemalloc.take_snapshot()
+        if self.completed >= self.total:
+            raise SoakFinished(f"{self.completed} cycles completed")
+
+
+def top_allocators(
+    baseline: Optional[tracemalloc.Snapshot], snapshot: tracemalloc.Snapshot, top: int
+) -> list[dict[str, Any]]:
+    """Source lines whose allocations grew the most since ``baseline``."""
+    if baseline is None:
+        return []
+    ignored = [
+        tracemalloc.Filter(False, path) for path in (tracemalloc.__file__, __file__, standins.__file__)
+    ]
+    diffs = snapshot.filter_traces(ignored).compare_to(baseline.filter_traces(ignored), "lineno")
+    return [
+        {
+            "location": f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}",
+            "size_diff": diff.size_diff,
+            "count_diff": diff.count_diff,
+        }
+        for diff in diffs[:top]
+    ]
+
+
+def run_soak(
+    cycles: int = 2000,
+    duty_cycle: int = 60,
+    sample_every: int = 25,
+    warmup: Optional[int] = None,
+    tracks: int = 4,
+    track_seconds: float = 90.0,
+    shazam_faults: Faults = Faults(),
+    lastfm_faults: Faults = Faults(),
+    limits: Limits = Limits(),
+    top: int = 10,
+    main_args: Sequence[str] = (),
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Run the main loop for a number of cycles and check it for leaks.
+
+    Args:
+        cycles: Cycles to run.
+        duty_cycle: Duty cycle of the main loop, in simulated seconds.
+        sample_every: Cycles between resource samples.
+        warmup: Cycles before growth is measured (default: a fifth of the run).
+        tracks: Number of synthetic tracks the device plays.
+        track_seconds: Length of each track.
+        shazam_faults: Latency and errors of the Shazam stand-in.
+        lastfm_faults: Latency and errors of the Last.fm stand-in.
+        limits: Tolerated growth per 1000 cycles.
+        top: Number of top allocators reported.
+        main_args: Extra command line arguments of the main loop.
+        seed: Seed of the tracks and fault injection.
+
+    Returns:
+        The report, as printed by the command line.
+    """
+    from autoscrobbler.shazam_client import ShazamHTTPClient
+
+    warmup = cycles // 5 if warmup is None else warmup
+    playlist = [
+        (Track(f"Soak Artist {i}", f"Soak Song {i}"), synthetic_music(track_seconds, SAMPLE_RATE, seed=seed + i))
+        for i in range(tracks)
+    ]
+    shazam = ShazamStandIn()
+    for track, audio in playlist:
+        shazam.add_track(track, audio, SAMPLE_RATE)
+    lastfm = LastfmStandIn()
+    shazam_server = serve_shazam(shazam, shazam_faults, seed=seed)
+    lastfm_server = serve_lastfm(lastfm, lastfm_faults, seed=seed + 1)
+    transport = RedirectTransport(lastfm_server.url)
+
+    def lastfm_network(lastfm_creds: dict[str, str]) -> Any:
+        import pylast
+
+        return pylast.LastFMNetwork(
+            api_key=lastfm_creds["api_key"],
+            api_secret=lastfm_creds["api_secret"],
+            username=lastfm_creds["username"],
+            password_hash=pylast.md5(lastfm_creds["password"]),
+            proxy={"https://": transport},
+        )
+
+    clock = VirtualClock(START)
+    sd = LoopbackSoundDevice([LoopbackDevice("Soak", playlist, SAMPLE_RATE, start=START)], clock)
+    probes: list[SoakProbe] = []
+
+    def probe(*args: Any, **kwargs: Any) -> SoakProbe:
+        probes.append(SoakProbe(cycles, sample_every, warmup, *args, **kwargs))
+        return probes[-1]
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    began = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix="autoscrobbler-soak-") as workdir:
+            credentials = os.path.join(workdir, "credentials.json")
+            with open(credentials, "w") as f:
+                json.dump({"lastfm": {
+                    "api_key": API_KEY,
+                    "api_secret": API_SECRET,
+                    "username": USERNAME,
+                    "password": "password",
+                }}, f)
+            argv = [
+                "--input-source", "auto",
+                "--credentials", credentials,
+                "--duty-cycle", str(duty_cycle),
+                "--history-db", os.path.join(workdir, "history.db"),
+                "--dedupe-file", os.path.join(workdir, "dedupe_index.json"),
+                "--budget-history", os.path.join(workdir, "budget_history.json"),
+                # The rate limiter runs on real time, which hardly passes here
+                "--shazam-rate", "1000000",
+                "--shazam-burst", "1000",
+                "--log-level", "WARNING",
+                *main_args,
+            ]
+            app.configure_shazam(ShazamHTTPClient(base_url=shazam_server.url))
+            with patched(
+                app,
+                sd=sd,
+                time=clock,
+                lastfm_network=lastfm_network,
+                parse_arguments=lambda: app.build_parser().parse_args(argv),
+                Profiler=probe,
+                _devices=None,
+            ), patched(ratelimit, backoff_delay=lambda *args: 0.0):
+                try:
+                    app.main()
+                except SoakFinished:
+                    pass
+        real_seconds = time.perf_counter() - began
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        shazam_server.close()
+        lastfm_server.close()
+
+    if not probes:
+        raise RuntimeError("The main loop exited before its first cycle.")
+    soak = probes[-1]
+    checks = check_growth(soak.samples, limits, warmup)
+    return {
+        "cycles": soak.completed,
+        "real_seconds": real_seconds,
+        "cycles_per_second": soak.completed / real_seconds,
+        "warmup": warmup,
+        "requests": {
+            "shazam": len(shazam_server.latencies),
+            "shazam_injected_errors": shazam_server.errors,
+            "lastfm": len(lastfm_server.latencies),
+            "lastfm_injected_errors": lastfm_server.errors,
+            "scrobbles": len(lastfm.scrobbles_of(USERNAME)),
+        },
+        "growth": checks,
+        "top_allocators": top_allocators(soak.baseline, snapshot, top) if snapshot else [],
+        "samples": [asdict(sample) for sample in soak.samples],
+        "passed": all(check["ok"] for check in checks),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run a soak test from the command line and print its report as JSON."""
+    defaults = Limits()
+    parser = argparse.ArgumentParser(
+        prog="python -m autoscrobbler.soak",
+        description="Run the main loop for thousands of cycles and fail on resource growth.",
+        epilog="Arguments after -- are passed to the main loop. Growth limits are per 1000 cycles.",
+    )
+    parser.add_argument("--cycles", type=int, default=2000, help="Cycles to run (default: 2000)")
+    parser.add_argument("-d", "--duty-cycle", type=int, default=60, help="Duty cycle in simulated seconds (default: 60)")
+    parser.add_argument("--sample-every", type=int, default=25, help="Cycles between samples (default: 25)")
+    parser.add_argument("--warmup", type=int, default=None, help="Cycles before growth is measured (default: a fifth of --cycles)")
+    parser.add_argument("--tracks", type=int, default=4, help="Synthetic tracks (default: 4)")
+    parser.add_argument("--track-seconds", type=float, default=90.0, help="Length of synthetic tracks (default: 90)")
+    parser.add_argument("--shazam-error-rate", type=float, default=0.0, help="Share of Shazam requests failing with HTTP 503")
+    parser.add_argument("--lastfm-error-rate", type=float, default=0.0, help="Share of Last.fm requests failing with HTTP 503")
+    parser.add_argument("--max-rss-growth", type=float, default=defaults.rss_bytes / 2**20, help="MiB (default: %(default)s)")
+    parser.add_argument("--max-fd-growth", type=float, default=defaults.open_fds, help="File descriptors (default: %(default)s)")
+    parser.add_argument("--max-traced-growth", type=float, default=defaults.traced_bytes / 1024, help="KiB of traced Python memory (default: %(default)s)")
+    parser.add_argument("--max-task-growth", type=float, default=defaults.asyncio_tasks, help="Pending asyncio tasks (default: %(default)s)")
+    parser.add_argument("--max-thread-growth", type=float, default=defaults.threads, help="Threads (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=10, help="Top allocators reported (default: 10)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of tracks and faults (default: 0)")
+    parser.add_argument("main_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.cycles < 1 or args.sample_every < 1:
+        parser.error("--cycles and --sample-every must be positive")
+
+    # Per-cycle log lines would swamp the report
+    logs.configure_logging(level=logging.WARNING)
+    main_args = args.main_args[1:] if args.main_args[:1] == ["--"] else args.main_args
+    report = run_soak(
+        cycles=args.cycles,
+        duty_cycle=args.duty_cycle,
+        sample_every=args.sample_every,
+        warmup=args.warmup,
+        tracks=args.tracks,
+        track_seconds=args.track_seconds,
+        shazam_faults=Faults(error_rate=args.shazam_error_rate),
+        lastfm_faults=Faults(error_rate=args.lastfm_error_rate),
+        limits=Limits(
+            rss_bytes=args.max_rss_growth * 2**20,
+            open_fds=args.max_fd_growth,
+            traced_bytes=args.max_traced_growth * 1024,
+            asyncio_tasks=args.max_task_growth,
+            threads=args.max_thread_growth,
+        ),
+        top=args.top,
+        main_args=main_args,
+        seed=args.seed,
+    )
+    print(json.dumps(report, indent=2))
+    if not report["passed"]:
+        failed = ", ".join(check["metric"] for check in report["growth"] if not check["ok"])
+        logger.error(f"Sustained growth beyond limits: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,581 @@
+"""Offline stand-ins for Shazam, Last.fm and the music being played.
+
+Benchmarks and load tests should exercise the real shazamio and pylast code
+paths (signature generation, request building, XML parsing) without network
+access or API keys. The stand-ins here answer the requests those clients
+send:
+
+* :class:`ShazamStandIn` decodes the submitted signature and compares its
+  spectral peaks with those of reference tracks, so a capture of a known
+  track is recognized as that track, and anything else is a miss.
+* :class:`LastfmStandIn` implements the Last.fm API methods autoscrobbler
+  calls and records every scrobble, so results can be checked afterwards.
+
+Both answer in process (:class:`ShazamStandInClient`,
+:meth:`LastfmStandIn.network`) or over HTTP on localhost
+(:func:`serve_shazam`, :func:`serve_lastfm`), where :class:`Faults` adds
+latency and errors to the responses.
+
+:func:`synthetic_music` generates reproducible music-like signals (a few
+tones per track, with harmonics, note changes and noise) that the Shazam
+stand-in can tell apart.
+
+:func:`impair` degrades them as a capture might be: quietly recorded, with
+mains hum, or with turntable rumble.
+"""
+
+import base64
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional, Tuple
+from xml.sax.saxutils import escape
+
+import httpx2 as httpx
+import numpy as np
+import pylast
+from shazamio.enums import FrequencyBand
+from shazamio.interfaces.client import HTTPClientInterface
+from shazamio.signature import DATA_URI_PREFIX, DecodedMessage
+
+from autoscrobbler.signature import signature_of
+
+API_KEY = "stand-in-api-key"
+API_SECRET = "stand-in-api-secret"
+
+_PROFILE_BINS = 1024
+
+
+def synthetic_music(
+    seconds: float, sample_rate: int = 44100, seed: int = 0, note_seconds: float = 0.5
+) -> np.ndarray:
+    """Generate a reproducible music-like mono int16 signal.
+
+    Each seed picks its own set of pitches; notes of two or three of them,
+    with harmonics and a decaying envelope, change every ``note_seconds``
+    over a noise floor about 30 dB down.
+
+    Args:
+        seconds: Length of the signal.
+        sample_rate: Sample rate in Hz.
+        seed: Selects the pitches and melody; equal seeds give equal audio.
+        note_seconds: Duration of each note.
+
+    Returns:
+        The signal.
+    """
+    rng = np.random.default_rng(seed)
+    pitches = np.exp(rng.uniform(np.log(220.0), np.log(1800.0), 6))
+    frames = int(seconds * sample_rate)
+    note_frames = max(1, int(note_seconds * sample_rate))
+    t = np.arange(note_frames) / sample_rate
+    envelope = np.exp(-3.0 * t / note_seconds)
+    audio = np.empty(frames, dtype=np.float64)
+    for start in range(0, frames, note_frames):
+        chord = rng.choice(pitches, size=rng.integers(2, 4), replace=False)
+        note = np.zeros(note_frames)
+        for pitch in chord:
+            for harmonic, level in ((1, 1.0), (2, 0.4), (3, 0.2)):
+                note += level * np.sin(2 * np.pi * pitch * harmonic * t + rng.uniform(0, 2 * np.pi))
+        end = min(frames, start + note_frames)
+        audio[start:end] = (note * envelope)[: end - start]
+    audio *= 6000.0 / max(1e-9, np.abs(audio).max()) * 1.5
+    audio += rng.normal(0.0, 200.0, frames)
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+@dataclass(frozen=True)
+class Impairment:
+    """How a capture falls short of the music that was played.
+
+    Attributes:
+        gain_db: Level of the music relative to the original.
+        hum_hz: Mains frequency of added hum, or None.
+        hum_dbfs: Level of the hum's fundamental; each harmonic ``n`` is
+                  ``10 * log10(n)`` dB below it.
+        hum_harmonics: Harmonics of the hum, including the fundamental.
+        rumble_dbfs: Peak level of added rumble below 15 Hz, or None.
+        dc_offset: Added DC offset as a fraction of full scale.
+    """
+
+    gain_db: float = 0.0
+    hum_hz: Optional[float] = None
+    hum_dbfs: float = -30.0
+    hum_harmonics: int = 12
+    rumble_dbfs: Optional[float] = None
+    dc_offset: float = 0.0
+
+
+IMPAIRMENTS = {
+    "clean": Impairment(),
+    "low_gain": Impairment(gain_db=-45.0),
+    "hum": Impairment(gain_db=-20.0, hum_hz=50.0, hum_dbfs=-10.0),
+    "rumble": Impairment(gain_db=-30.0, rumble_dbfs=-3.0, dc_offset=0.05),
+    "turntable": Impairment(
+        gain_db=-30.0, hum_hz=60.0, hum_dbfs=-35.0, rumble_dbfs=-6.0, dc_offset=0.02
+    ),
+}
+
+
+def impair(
+    samples: np.ndarray, sample_rate: int, impairment: Impairment, seed: int = 0
+) -> np.ndarray:
+    """Degrade a capture as a poor microphone, mains hum or a turntable would.
+
+    Args:
+        samples: Mono int16 samples.
+        sample_rate: Sample rate in Hz.
+        impairment: What to do to the samples.
+        seed: Selects the hum phases and the rumble; equal seeds give equal audio.
+
+    Returns:
+        The degraded samples as a new int16 array.
+    """
+    rng = np.random.default_rng(seed)
+    frames = samples.size
+    audio = samples.astype(np.float64) * 10 ** (impairment.gain_db / 20)
+    if impairment.hum_hz is not None:
+        t = np.arange(frames) / sample_rate
+        level = 32768.0 * 10 ** (impairment.hum_dbfs / 20)
+        for n in range(1, impairment.hum_harmonics + 1):
+            audio += level / math.sqrt(n) * np.sin(
+                2 * np.pi * impairment.hum_hz * n * t + rng.uniform(0, 2 * np.pi)
+            )
+    if impairment.rumble_dbfs is not None:
+        spectrum = np.fft.rfft(rng.standard_normal(frames))
+        spectrum[np.fft.rfftfreq(frames, 1 / sample_rate) > 15.0] = 0
+        rumble = np.fft.irfft(spectrum, frames)
+        rumble *= 32768.0 * 10 ** (impairment.rumble_dbfs / 20) / max(1e-9, np.abs(rumble).max())
+        audio += rumble
+    audio += impairment.dc_offset * 32768.0
+    return np.clip(np.rint(audio), -32768, 32767).astype(np.int16)
+
+
+@dataclass(frozen=True)
+class Track:
+    """A track known to the Shazam stand-in.
+
+    Attributes:
+        artist: Artist name.
+        title: Track title.
+        album: Album name, or None.
+        key: Shazam track key.
+    """
+
+    artist: str
+    title: str
+    album: Optional[str] = None
+    key: str = ""
+
+    def shazam_result(self) -> dict[str, Any]:
+        """The track as it appears in a Shazam recognition response."""
+        track: dict[str, Any] = {"key": self.key, "title": self.title, "subtitle": self.artist}
+        if self.album:
+            track["sections"] = [
+                {"type": "SONG", "metadata": [{"title": "Album", "text": self.album}]}
+            ]
+        return {"matches": [{"id": self.key}], "track": track}
+
+
+def peak_profile(signature: DecodedMessage) -> np.ndarray:
+    """Unit-length, zero-mean histogram of a signature's peaks over frequency.
+
+    Peaks are counted per FFT bin (16 kHz, 2048 points) and smeared over
+    neighbouring bins, so signatures computed by different generators from
+    the same audio, whose peaks differ by a bin here and there, still agree.
+    Only the bands of legacy signatures are counted: shazamio's native
+    generator also fills the 3500-5500 Hz band, which they leave out.
+    """
+    bins = np.fromiter(
+        (
+            peak.corrected_peak_frequency_bin
+            for band, band_peaks in signature.frequency_band_to_sound_peaks.items()
+            if band != FrequencyBand.hz_3500_5500
+            for peak in band_peaks
+        ),
+        dtype=np.int64,
+    )
+    counts = np.bincount(np.minimum(bins // 64, _PROFILE_BINS - 1), minlength=_PROFILE_BINS)
+    profile = np.convolve(counts.astype(np.float64), [0.5, 1.0, 0.5], mode="same")
+    profile -= profile.mean()
+    norm = np.linalg.norm(profile)
+    return profile / norm if norm else profile
+
+
+class ShazamStandIn:
+    """Recognize Shazam signatures by comparing their peaks to known tracks.
+
+    Each track is summarized by where in frequency its spectral peaks fall
+    (:func:`peak_profile`). A signature matches the most similar track if the
+    correlation reaches ``min_similarity``; captures of unknown music, noise
+    or two tracks crossfading fall below it and are misses.
+
+    Args:
+        min_similarity: Smallest profile correlation for a recognition.
+    """
+
+    def __init__(self, min_similarity: float = 0.8) -> None:
+        self.min_similarity = min_similarity
+        self.requests = 0
+        self.tracks: list[Track] = []
+        self._profiles: list[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def add_track(self, track: Track, audio: np.ndarray, sample_rate: int) -> None:
+        """Learn a track from its audio."""
+        self.tracks.append(track)
+        self._profiles.append(peak_profile(signature_of(audio, sample_rate)))
+
+    def match(self, signature: DecodedMessage) -> Optional[Track]:
+        """Return the best matching known track, or None."""
+        if not self.tracks:
+            return None
+        similarities = np.stack(self._profiles) @ peak_profile(signature)
+        best = int(np.argmax(similarities))
+        return self.tracks[best] if similarities[best] >= self.min_similarity else None
+
+    def recognize(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """Answer a recognition request body as Shazam would.
+
+        Args:
+            payload: JSON body sent by shazamio.
+
+        Returns:
+            A response with the matched track, or no matches.
+
+        Raises:
+            ValueError: If the body holds no valid signature.
+        """
+        with self._lock:
+            self.requests += 1
+        try:
+            uri = payload["signature"]["uri"]
+            signature = DecodedMessage.decode_from_binary(
+                base64.b64decode(uri[len(DATA_URI_PREFIX):])
+            )
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid signature: {e}") from e
+        track = self.match(signature)
+        if track is None:
+            return {"matches": [], "timestamp": int(time.time() * 1000)}
+        return track.shazam_result()
+
+
+class ShazamStandInClient(HTTPClientInterface):
+    """shazamio HTTP client answering from a stand-in inside the process."""
+
+    def __init__(self, standin: ShazamStandIn) -> None:
+        self.standin = standin
+
+    async def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> dict[str, Any]:
+        """Answer a recognition request without leaving the process."""
+        return self.standin.recognize(kwargs.get("json") or {})
+
+
+@dataclass(frozen=True)
+class Scrobble:
+    """A scrobble received by the Last.fm stand-in."""
+
+    user: str
+    artist: str
+    title: str
+    album: Optional[str]
+    timestamp: int
+
+
+class LastfmStandIn:
+    """Answer the Last.fm API calls that autoscrobbler makes.
+
+    Implements ``auth.getMobileSession``, ``track.scrobble``,
+    ``track.updateNowPlaying`` and ``user.getRecentTracks``; any password is
+    accepted. Signatures are not checked.
+    """
+
+    def __init__(self) -> None:
+        self.scrobbles: list[Scrobble] = []
+        self.requests = 0
+        self._sessions: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def handle(self, params: dict[str, str]) -> str:
+        """Answer one API call.
+
+        Args:
+            params: Form and query parameters of the request.
+
+        Returns:
+            The XML response body.
+        """
+        with self._lock:
+            self.requests += 1
+            method = params.get("method", "")
+            if method == "auth.getMobileSession":
+                user = params.get("username", "")
+                key = f"sk-{user}"
+                self._sessions[key] = user
+                return _ok(f"<session><name>{escape(user)}</name><key>{key}</key><subscriber>0</subscriber></session>")
+            if method == "track.scrobble":
+                user = self._sessions.get(params.get("sk", ""))
+                if user is None:
+                    return _error(9, "Invalid session key")
+                accepted = 0
+                while f"artist[{accepted}]" in params:
+                    i = accepted
+                    self.scrobbles.append(Scrobble(
+                        user,
+                        params[f"artist[{i}]"],
+                        params[f"track[{i}]"],
+                        params.get(f"album[{i}]"),
+                        int(params[f"timestamp[{i}]"]),
+                    ))
+                    accepted += 1
+                return _ok(f'<scrobbles accepted="{accepted}" ignored="0"></scrobbles>')
+            if method == "track.updateNowPlaying":
+                return _ok("<nowplaying></nowplaying>")
+            if method == "user.getRecentTracks":
+                user = params.get("user", "")
+                played = [s for s in self.scrobbles if s.user == user]
+                played.sort(key=lambda s: s.timestamp, reverse=True)
+                limit = int(params.get("limit") or 10)
+                tracks = "".join(_recent_track(s) for s in played[:limit])
+                return _ok(
+                    f'<recenttracks user="{escape(user)}" page="1" perPage="{limit}" '
+                    f'totalPages="1" total="{len(played)}">{tracks}</recenttracks>'
+                )
+            return _error(3, "Invalid Method - No method with that name in this package")
+
+    def handle_form(self, body: bytes, query: str = "") -> str:
+        """Answer a request given its form body and query string."""
+        params = dict(urllib.parse.parse_qsl(query))
+        params.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+        return self.handle(params)
+
+    def scrobbles_of(self, user: str) -> list[Scrobble]:
+        """Scrobbles received for a user, oldest first."""
+        with self._lock:
+            return [s for s in self.scrobbles if s.user == user]
+
+    def transport(self) -> httpx.MockTransport:
+        """An httpx transport answering pylast's requests in process."""
+
+        def respond(request: httpx.Request) -> httpx.Response:
+            text = self.handle_form(request.read(), request.url.query.decode())
+            return httpx.Response(200, text=text, headers={"Content-Type": "text/xml"})
+
+        return httpx.MockTransport(respond)
+
+    def network(self, username: str, password: str = "password") -> pylast.LastFMNetwork:
+        """A pylast network talking to this stand-in in process."""
+        return pylast.LastFMNetwork(
+            api_key=API_KEY,
+            api_secret=API_SECRET,
+            username=username,
+            password_hash=pylast.md5(password),
+            proxy={"https://": self.transport()},
+        )
+
+
+class RedirectTransport(httpx.BaseTransport):
+    """httpx transport sending pylast's requests to a stand-in server.
+
+    pylast opens a client per request and closes its transports afterwards,
+    so closing is ignored and the connection pool outlives each request.
+
+    Args:
+        url: Base URL of the server, e.g. from :func:`serve_lastfm`.
+    """
+
+    def __init__(self, url: str) -> None:
+        target = httpx.URL(url)
+        self._scheme = target.scheme
+        self._host = target.host
+        self._port = target.port
+        self._transport = httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self._scheme, host=self._host, port=self._port)
+        return self._transport.handle_request(request)
+
+    def close(self) -> None:
+        pass
+
+
+def _ok(body: str) -> str:
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="ok">{body}</lfm>'
+
+
+def _error(code: int, message: str) -> str:
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<lfm status="failed"><error code="{code}">{escape(message)}</error></lfm>'
+    )
+
+
+def _recent_track(scrobble: Scrobble) -> str:
+    return (
+        f"<track><artist>{escape(scrobble.artist)}</artist><name>{escape(scrobble.title)}</name>"
+        f"<album>{escape(scrobble.album or '')}</album>"
+        f'<date uts="{scrobble.timestamp}">{scrobble.timestamp}</date></track>'
+    )
+
+
+@dataclass(frozen=True)
+class Faults:
+    """Latency and errors added to the responses of a stand-in server.
+
+    Attributes:
+        latency: Seconds every response is delayed by.
+        jitter: Further delay of up to this many seconds, uniformly random.
+        error_rate: Share of requests answered with HTTP 503.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+
+Answer = Callable[[str, bytes], Tuple[int, str, bytes]]
+
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server answering POST requests from a stand-in, with faults.
+
+    Attributes:
+        latencies: Seconds spent answering each request, including delays.
+        errors: Number of injected errors.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        answer: Answer,
+        error: Tuple[str, bytes],
+        faults: Faults,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__((host, port), _StandInHandler)
+        self.answer = answer
+        self.error = error
+        self.faults = faults
+        self.latencies: list[float] = []
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="autoscrobbler-standin", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, path: str, body: bytes) -> Tuple[int, str, bytes]:
+        """Answer one request, applying the configured faults."""
+        with self._lock:
+            delay = self.faults.latency + self._rng.uniform(0.0, self.faults.jitter)
+            failed = self._rng.random() < self.faults.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.errors += 1
+            return (503, *self.error)
+        return self.answer(path, body)
+
+    def record_latency(self, seconds: float) -> None:
+        """Record how long a request took to answer."""
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def close(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+    # Keep connections open, as the real services do
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self) -> None:  # noqa: N802 (http.server naming)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:  # noqa: N802 (http.server naming)
+        started = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, content_type, reply = self.server.respond(self.path, body)
+        # Recorded before replying, so clients that got their answer find it
+        self.server.record_latency(time.perf_counter() - started)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def serve_shazam(
+    standin: ShazamStandIn, faults: Faults = Faults(), port: int = 0, seed: int = 0
+) -> StandInServer:
+    """Serve Shazam recognition requests from a stand-in on localhost.
+
+    Requests to any path are answered, so clients only need their scheme,
+    host and port replaced.
+
+    Args:
+        standin: Stand-in recognizing the signatures.
+        faults: Latency and errors to add.
+        port: TCP port to listen on (0 picks a free port).
+        seed: Seed of the fault injection.
+
+    Returns:
+        The running server.
+    """
+
+    def answer(path: str, body: bytes) -> Tuple[int, str, bytes]:
+        try:
+            result = standin.recognize(json.loads(body))
+        except ValueError as e:
+            return 400, "application/json", json.dumps({"error": str(e)}).encode()
+        return 200, "application/json", json.dumps(result).encode()
+
+    return StandInServer(answer, ("application/json", b"{}"), faults, port=port, seed=seed)
+
+
+def serve_lastfm(
+    standin: LastfmStandIn, faults: Faults = Faults(), port: int = 0, seed: int = 0
+) -> StandInServer:
+    """Serve the Last.fm API from a stand-in on localhost.
+
+    Args:
+        standin: Stand-in answering the API calls.
+        faults: Latency and errors to add.
+        port: TCP port to listen on (0 picks a free port).
+        seed: Seed of the fault injection.
+
+    Returns:
+        The running server.
+    """
+
+    def answer(path: str, body: bytes) -> Tuple[int, str, bytes]:
+        query = path.partition("?")[2]
+        return 200, "text/xml", standin.handle_form(body, query).encode("utf-8")
+
+    unavailable = _error(16, "There was a temporary error processing your request").encode()
+    return StandInServer(answer, ("text/xml", unavailable), faults, port=port, seed=seed)
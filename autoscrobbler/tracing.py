@@ -0,0 +1,257 @@
+"""Per-cycle tracing spans written to a rotating JSON lines file.
+
+Every main loop iteration is a trace: its root span carries the cycle ID and
+each stage (capture, Shazam, Last.fm, retries) is a nested child span. Spans
+are serialized in the OpenTelemetry (OTLP/JSON) span shape, one per line, and
+handed to a background thread so writing never blocks the loop.
+
+Tracing is disabled until :func:`configure_tracing` is called; disabled spans
+cost a single attribute check.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute(key: str, value: Any) -> dict[str, Any]:
+    """Encode one attribute as an OTLP key/value pair."""
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+class Span:
+    """A timed operation within a cycle's trace.
+
+    Attributes:
+        name: Operation name, e.g. ``shazam.recognize``.
+        trace_id: 32 hex digit ID shared by every span of the cycle.
+        span_id: 16 hex digit ID of this span.
+        parent_span_id: ID of the enclosing span, or empty for the root.
+        attributes: Extra key/value data recorded on the span.
+    """
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "status",
+        "error",
+    )
+
+    def __init__(
+        self, name: str, trace_id: str, parent_span_id: str, attributes: dict[str, Any]
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.status = STATUS_UNSET
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Record an attribute on the span."""
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        """Mark the span as failed with ``error``, for errors handled inside it."""
+        self.status = STATUS_ERROR
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_otlp(self) -> dict[str, Any]:
+        """Serialize the span in the OTLP/JSON span shape."""
+        status: dict[str, Any] = {"code": self.status}
+        if self.error:
+            status["message"] = self.error
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": status,
+        }
+
+
+class _NullSpan:
+    """Stand-in yielded when tracing is disabled."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+
+class _SpanFormatter(logging.Formatter):
+    """Serialize the span carried by a record, on the writer thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg.to_otlp())
+
+
+_NULL_SPAN = _NullSpan()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "autoscrobbler_current_span", default=None
+)
+
+
+class Tracer:
+    """Create spans and write finished ones from a background thread.
+
+    Args:
+        path: Trace file to write, or None to disable tracing.
+        max_bytes: Size at which the trace file is rotated (default: 10 MB).
+        backup_count: Number of rotated files to keep (default: 3).
+        service_name: Value of the ``service.name`` attribute on root spans.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+        service_name: str = "autoscrobbler",
+    ) -> None:
+        self.enabled = path is not None
+        self.service_name = service_name
+        self.cycle_id = 0
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        if path is not None:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count
+            )
+            handler.setFormatter(_SpanFormatter())
+            self._listener = logging.handlers.QueueListener(self._queue, handler)
+            self._listener.start()
+
+    @contextmanager
+    def cycle(self, **attributes: Any) -> Iterator[Any]:
+        """Open the root span of a new cycle with a fresh trace ID.
+
+        Args:
+            **attributes: Extra attributes recorded on the root span.
+
+        Yields:
+            The root span.
+        """
+        self.cycle_id += 1
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        root = Span(
+            "cycle",
+            os.urandom(16).hex(),
+            "",
+            {"service.name": self.service_name, "cycle.id": self.cycle_id, **attributes},
+        )
+        with self._activate(root):
+            yield root
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """Open a child span of the current span.
+
+        Outside of a cycle, or with tracing disabled, nothing is recorded.
+
+        Args:
+            name: Operation name.
+            **attributes: Attributes recorded on the span.
+
+        Yields:
+            The span, so callers can add attributes to it.
+        """
+        parent = _current_span.get() if self.enabled else None
+        if parent is None:
+            yield _NULL_SPAN
+            return
+        with self._activate(Span(name, parent.trace_id, parent.span_id, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span) -> Iterator[Span]:
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        else:
+            if span.status == STATUS_UNSET:
+                span.status = STATUS_OK
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self._export(span)
+
+    def _export(self, span: Span) -> None:
+        """Queue a finished span for the writer thread to serialize and write."""
+        self._queue.put(logging.makeLogRecord({"msg": span}))
+
+    def close(self) -> None:
+        """Flush queued spans and stop the writer thread."""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer."""
+    return _tracer
+
+
+def configure_tracing(path: Optional[str], **kwargs: Any) -> Tracer:
+    """Replace the process-wide tracer.
+
+    Args:
+        path: Trace file to write, or None to disable tracing.
+        **kwargs: Further :class:`Tracer` options.
+
+    Returns:
+        The new tracer.
+    """
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(path, **kwargs)
+    return _tracer
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """Open a child span on the process-wide tracer; see :meth:`Tracer.span`."""
+    return _tracer.span(name, **attributes)
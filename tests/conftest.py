@@ -101,7 +101,7 @@ def mock_shazam():
         mock_recognize_func = Mock(side_effect=mock_recognize)
         mock_shazam.recognize = mock_recognize_func
 
-        m.setattr("autoscrobbler.__main__.Shazam", Mock(return_value=mock_shazam))
+        m.setattr("shazamio.Shazam", Mock(return_value=mock_shazam))
         yield mock_shazam
 
 
@@ -118,3 +118,62 @@ def mock_pylast():
 
         m.setattr("autoscrobbler.__main__.pylast", mock_pylast_module)
         yield mock_network
+
+
+@pytest.fixture
+def make_args(tmp_path):
+    """Factory for parsed CLI arguments with every option at its default.
+
+    State files kept across restarts are placed in the test's temporary
+    directory so tests do not share them.
+    """
+    from autoscrobbler.__main__ import build_parser
+
+    def _make_args(**overrides):
+        args = build_parser().parse_args([])
+        args.dedupe_file = str(tmp_path / "dedupe_index.json")
+        args.history_db = str(tmp_path / "history.db")
+        for name, value in overrides.items():
+            setattr(args, name, value)
+        return args
+
+    return _make_args
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter():
+    """Give each test its own Shazam limiter, without rate limit waits."""
+    from autoscrobbler import ratelimit
+
+    yield ratelimit.configure_limiter(rate=1000, burst=1000)
+    ratelimit.configure_limiter()
+
+
+@pytest.fixture(autouse=True)
+def fresh_shazam(monkeypatch):
+    """Give each test its own Shazam client, warmed up against a closed local port."""
+    from autoscrobbler.__main__ import close_shazam
+
+    monkeypatch.setattr("autoscrobbler.shazam_client.WARM_UP_URL", "http://127.0.0.1:9/")
+    close_shazam()
+    yield
+    close_shazam()
+
+
+@pytest.fixture(autouse=True)
+def fresh_logging():
+    """Detach the log queue a test set up, and restore the root logger's level."""
+    import logging
+
+    from autoscrobbler import logs
+
+    level = logging.getLogger().level
+    yield
+    logs.stop_logging()
+    logging.getLogger().setLevel(level)
+
+
+@pytest.fixture(autouse=True)
+def fresh_device_registry(monkeypatch):
+    """Scan input devices afresh in each test, as sounddevice is mocked per test."""
+    monkeypatch.setattr("autoscrobbler.__main__._devices", None)
@@ -0,0 +1,321 @@
+"""Tests for the rolling audio archive and backfill of failed identifications."""
+
+import os
+import time
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import backfill_segment, main, process_result
+from autoscrobbler.archive import (
+    CAPTURED,
+    EMPTY,
+    MAX_BACKFILL_AGE,
+    SPOOLED,
+    AudioArchive,
+    BackfillQueue,
+)
+from autoscrobbler.dedupe import DedupeIndex, normalize_key
+from autoscrobbler.standins import LastfmStandIn
+
+# time.sleep is patched module-wide in the main tests
+_real_sleep = time.sleep
+
+SONG_RESULT = {"track": {"title": "Test Song", "subtitle": "Test Artist"}}
+FRAMES = 800
+
+
+def capture(value):
+    """A capture of FRAMES samples."""
+    return np.arange(FRAMES, dtype=np.int16) + value
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """A small archive in a temporary directory."""
+    archive = AudioArchive(str(tmp_path / "ring"), slots=3, frames=FRAMES, sample_rate=8000)
+    yield archive
+    archive.close()
+
+
+class TestAudioArchive:
+    """Test the memory-mapped ring and spooling."""
+
+    @pytest.mark.unit
+    def test_ring_overwrites_oldest(self, archive):
+        """Test that appends cycle through the slots."""
+        slots = [archive.append(capture(i), 1000.0 + i) for i in range(4)]
+        assert slots == [0, 1, 2, 0]
+        assert archive.status(0) == CAPTURED
+
+    def test_reopens_existing_ring(self, tmp_path):
+        """Test that captures survive a restart and appends continue after the newest."""
+        path = str(tmp_path / "ring")
+        archive = AudioArchive(path, slots=3, frames=FRAMES)
+        archive.append(capture(1), 1000.0)
+        archive.append(capture(2), 1010.0)
+        archive.close()
+
+        reopened = AudioArchive(path, slots=3, frames=FRAMES)
+        try:
+            assert reopened.status(1) == CAPTURED
+            assert reopened.status(2) == EMPTY
+            assert reopened.append(capture(3), 1020.0) == 2
+        finally:
+            reopened.close()
+
+    def test_failed_capture_is_spooled_to_flac(self, archive):
+        """Test that a failed capture is written to the spool losslessly."""
+        slot = archive.append(capture(7), 1234.5)
+        archive.mark_failed(slot)
+        archive.flush()
+
+        assert archive.status(slot) == SPOOLED
+        assert os.listdir(archive.spool_dir) == ["1234500.0.flac"]
+        segment = BackfillQueue(archive.spool_dir).next(now=1300.0)
+        samples, sample_rate = segment.read()
+        assert sample_rate == 8000
+        np.testing.assert_array_equal(samples, capture(7))
+
+    def test_spool_is_capped(self, tmp_path):
+        """Test that the oldest spooled captures are dropped, with few misses kept."""
+        archive = AudioArchive(str(tmp_path / "ring"), slots=3, frames=FRAMES, sample_rate=8000, max_misses=1)
+        try:
+            for second, miss in ((1, False), (2, False), (3, False), (4, True), (5, False), (6, True)):
+                archive.mark_failed(archive.append(capture(second), float(second)), miss=miss)
+                archive.flush()
+            assert sorted(os.listdir(archive.spool_dir)) == ["3000.0.flac", "5000.0.flac", "6000.0.miss.flac"]
+        finally:
+            archive.close()
+
+
+class TestBackfillQueue:
+    """Test ordering, attempts and expiry of spooled captures."""
+
+    def spool(self, tmp_path, *names):
+        """Create empty spool files."""
+        for name in names:
+            (tmp_path / name).write_bytes(b"")
+        return BackfillQueue(str(tmp_path))
+
+    @pytest.mark.unit
+    def test_oldest_first(self, tmp_path):
+        """Test that segments are served in capture order and unknown files ignored."""
+        queue = self.spool(tmp_path, "3000.0.flac", "1000.1.flac", "2000.0.flac.tmp", "notes.txt")
+        segment = queue.next(now=10.0)
+        assert (segment.timestamp, segment.attempts) == (1.0, 1)
+        assert len(queue) == 2
+
+    def test_attempts_are_limited(self, tmp_path):
+        """Test that a failed segment is retried once, then dropped."""
+        queue = self.spool(tmp_path, "1000.0.flac")
+        queue.failed(queue.next(now=10.0))
+        assert os.listdir(tmp_path) == ["1000.1.flac"]
+        queue.failed(queue.next(now=10.0))
+        assert len(queue) == 0
+
+    def test_misses_are_retried_once(self, tmp_path):
+        """Test that a plain miss is dropped after its first failed retry."""
+        queue = self.spool(tmp_path, "1000.0.miss.flac")
+        segment = queue.next(now=10.0)
+        assert segment.miss
+        queue.failed(segment)
+        assert len(queue) == 0
+
+    def test_done_and_expiry(self, tmp_path):
+        """Test that identified and too old segments are removed."""
+        queue = self.spool(tmp_path, "1000.0.flac", "5000.0.flac")
+        segment = queue.next(now=1.0 + MAX_BACKFILL_AGE + 1)
+        assert segment.timestamp == 5.0
+        queue.done(segment)
+        assert len(queue) == 0
+
+
+class TestBackfill:
+    """Test scrobbling backfilled captures."""
+
+    def test_out_of_order_plays_are_deduplicated(self):
+        """Test that a backfilled song inside a known play is a duplicate, and outside is not."""
+        dedupe = DedupeIndex()
+        key = normalize_key("Test Artist", "Test Song")
+        dedupe.record(key, 1000.0)
+        assert dedupe.observe(key, 900.0)
+        assert not dedupe.observe(key, 100.0)
+        dedupe.record(key, 100.0)
+        assert dedupe.is_playing(key, 1000.0)
+
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None)
+    @patch("autoscrobbler.__main__.identify_song")
+    def test_scrobbles_with_capture_time(self, mock_identify, mock_last, archive):
+        """Test that a recognized backfill is scrobbled as of when it was heard."""
+        mock_identify.return_value = SONG_RESULT
+        heard = time.time() - 3600
+        archive.mark_failed(archive.append(capture(0), heard))
+        archive.flush()
+        queue = BackfillQueue(archive.spool_dir)
+        network = Mock()
+        hits = metrics.BACKFILLS.value(result="hit")
+
+        assert backfill_segment(queue, network, "user", DedupeIndex())
+
+        assert network.scrobble.call_args.kwargs["timestamp"] == int(heard)
+        assert metrics.BACKFILLS.value(result="hit") == hits + 1
+        assert len(queue) == 0
+
+    @patch("autoscrobbler.__main__.identify_song", side_effect=ConnectionError("offline"))
+    def test_error_counts_an_attempt(self, mock_identify, archive):
+        """Test that a failed backfill stays queued for another attempt."""
+        archive.mark_failed(archive.append(capture(0), time.time()))
+        archive.flush()
+        queue = BackfillQueue(archive.spool_dir)
+
+        assert not backfill_segment(queue, Mock(), "user", DedupeIndex())
+        assert queue.next().attempts == 1
+
+    def test_process_result_uses_timestamp_for_dedupe(self):
+        """Test that a backfilled result is checked against the index at its own time."""
+        dedupe = DedupeIndex()
+        network = Mock()
+        with patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None):
+            process_result(SONG_RESULT, network, "user", dedupe, timestamp=1000.0)
+            process_result(SONG_RESULT, network, "user", dedupe, timestamp=1100.0)
+        assert network.scrobble.call_count == 1
+        assert network.scrobble.call_args.kwargs["timestamp"] == 1000
+
+
+class TestMainArchive:
+    """Test the --archive option of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track")
+    @patch("autoscrobbler.__main__.scrobble_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_failed_capture_is_backfilled(
+        self,
+        mock_sleep,
+        mock_scrobble,
+        mock_get_last,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that a capture lost to an error is identified after Shazam recovers."""
+        args = make_args(
+            input_source="auto",
+            archive=str(tmp_path / "ring"),
+            archive_hours=0.1,
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_parse_args.return_value = args
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_get_last.return_value = None
+        other = {"track": {"title": "Other Song", "subtitle": "Other Artist"}}
+        mock_identify.side_effect = [ConnectionError("offline"), SONG_RESULT, other]
+
+        def sleep(seconds):
+            if mock_sleep.call_count > 1:
+                raise Exception("Stop execution")
+            # Give the spool thread time to write the failed capture
+            for _ in range(100):
+                if len(BackfillQueue(args.archive + ".spool")):
+                    return
+                _real_sleep(0.05)
+
+        mock_sleep.side_effect = sleep
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert mock_identify.call_count == 3
+        assert [call.args[1] for call in mock_scrobble.call_args_list] == [
+            "Test Artist",
+            "Other Artist",
+        ]
+        assert "timestamp" in mock_scrobble.call_args_list[1].kwargs
+        assert os.listdir(args.archive + ".spool") == []
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.lastfm_network")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_failed_scrobble_is_backfilled(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_lastfm_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that a song identified while Last.fm fails is scrobbled once it is back."""
+
+        class FlakyLastfm(LastfmStandIn):
+            """Last.fm stand-in that is unavailable for the first scrobble."""
+
+            outage = True
+
+            def handle(self, params):
+                if params.get("method") == "track.scrobble" and self.outage:
+                    self.outage = False
+                    return (
+                        '<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="failed">'
+                        '<error code="16">Temporarily unavailable</error></lfm>'
+                    )
+                return super().handle(params)
+
+        args = make_args(
+            input_source="auto",
+            archive=str(tmp_path / "ring"),
+            archive_hours=0.1,
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_parse_args.return_value = args
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        lastfm = FlakyLastfm()
+        mock_lastfm_network.return_value = lastfm.network("test_username")
+        other = {"track": {"title": "Other Song", "subtitle": "Other Artist"}}
+        mock_identify.side_effect = [SONG_RESULT, other, SONG_RESULT]
+        started = time.time()
+
+        def sleep(seconds):
+            if mock_sleep.call_count > 1:
+                raise Exception("Stop execution")
+            # Give the spool thread time to write the capture
+            for _ in range(100):
+                if len(BackfillQueue(args.archive + ".spool")):
+                    return
+                _real_sleep(0.05)
+
+        mock_sleep.side_effect = sleep
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert mock_identify.call_count == 3
+        other_scrobble, backfilled = lastfm.scrobbles_of("test_username")
+        assert other_scrobble.title == "Other Song"
+        assert backfilled.title == "Test Song"
+        assert int(started) <= backfilled.timestamp <= other_scrobble.timestamp
+        assert os.listdir(args.archive + ".spool") == []
@@ -108,9 +108,8 @@ class TestRecordAudio:
     @pytest.mark.unit
     def test_record_audio_success(self, mock_sounddevice):
         """Test successful audio recording."""
-        # Mock the audio data
-        mock_audio = Mock()
-        mock_audio.flatten.return_value = np.array([1, 2, 3, 4, 5])
+        # Mock the audio data as sounddevice returns it: (frames, channels)
+        mock_audio = np.array([[1], [2], [3], [4], [5]], dtype=np.int16)
         mock_sounddevice.rec.return_value = mock_audio
 
         result = record_audio(duration=1, sample_rate=44100, device=0)
@@ -127,18 +126,14 @@ class TestRecordAudio:
         # Verify sounddevice.wait was called
         mock_sounddevice.wait.assert_called_once()
 
-        # Verify audio.flatten was called
-        mock_audio.flatten.assert_called_once()
-
-        # Verify result
+        # Verify result is a flat view of the recording, not a copy
         assert isinstance(result, np.ndarray)
         assert len(result) == 5
+        assert np.shares_memory(result, mock_audio)
 
     def test_record_audio_default_parameters(self, mock_sounddevice):
         """Test audio recording with default parameters."""
-        mock_audio = Mock()
-        mock_audio.flatten.return_value = np.array([1, 2, 3])
-        mock_sounddevice.rec.return_value = mock_audio
+        mock_sounddevice.rec.return_value = np.zeros((3, 1), dtype=np.int16)
 
         result = record_audio()
 
@@ -153,6 +148,37 @@ class TestRecordAudio:
 
         assert isinstance(result, np.ndarray)
 
+    def test_record_audio_into_preallocated_buffer(self, mock_sounddevice):
+        """Test recording into a preallocated array fills it in place."""
+        out = np.zeros(8, dtype=np.int16)
+
+        def rec_side_effect(**kwargs):
+            kwargs["out"][:] = 7
+            return kwargs["out"]
+
+        mock_sounddevice.rec.side_effect = rec_side_effect
+
+        result = record_audio(sample_rate=8000, device=0, out=out)
+
+        _, kwargs = mock_sounddevice.rec.call_args
+        assert kwargs["out"].shape == (8, 1)
+        assert np.shares_memory(kwargs["out"], out)
+        assert np.shares_memory(result, out)
+        assert (out == 7).all()
+
+    def test_record_audio_flags_overflow_on_pooled_buffer(self, mock_sounddevice):
+        """Test that a PortAudio input overflow is recorded on the buffer."""
+        from autoscrobbler.buffers import AudioBuffer
+
+        buffer = AudioBuffer(frames=8, sample_rate=8000)
+        mock_sounddevice.rec.side_effect = lambda **kwargs: kwargs["out"]
+        mock_sounddevice.wait.return_value = Mock(input_overflow=True)
+
+        result = record_audio(sample_rate=8000, out=buffer)
+
+        assert buffer.overflow is True
+        assert np.shares_memory(result, buffer.samples)
+
 
 class TestPrintDefaultInputDeviceInfo:
     """Test print_default_input_device_info functionality."""
@@ -0,0 +1,95 @@
+"""Tests for the offline stage benchmarks."""
+
+import json
+import logging
+
+import pytest
+
+from autoscrobbler import bench
+
+
+class TestMeasure:
+    """Test timing and allocation measurements."""
+
+    @pytest.mark.unit
+    def test_allocations_are_attributed_per_cycle(self):
+        """Test that a cycle allocating and keeping memory is reported as such."""
+        kept = []
+
+        def cycle():
+            scratch = bytearray(1 << 20)
+            kept.append(bytearray(1000))
+            return scratch
+
+        result = bench.measure("alloc", cycle, iterations=10, alloc_iterations=5)
+
+        assert result.iterations == 10
+        assert result.throughput > 0
+        assert 0 < result.p50_ms <= result.p99_ms
+        assert result.alloc_bytes >= 1 << 20
+        assert 1000 <= result.retained_bytes < 1 << 20
+
+
+class TestStages:
+    """Test the stages on short synthetic tracks."""
+
+    def test_every_stage_runs(self):
+        """Test that all stages run against the stand-ins and are reported."""
+        results = bench.run(iterations=3, tracks=2, track_seconds=11)
+
+        assert [r.name for r in results] == [
+            "capture_handoff", "condition", "identify", "parse_dedupe", "lastfm_lookup", "scrobble",
+        ]
+        assert all(r.iterations == 3 and r.throughput > 0 for r in results)
+
+    @pytest.mark.unit
+    def test_session_results(self):
+        """Test that the simulated session changes songs and includes misses."""
+        tracks = [bench.Track("A", "One"), bench.Track("B", "Two")]
+        results = bench.session_results(tracks, 10, cycles_per_track=2)
+
+        titles = [r["track"]["title"] if "track" in r else None for r in results]
+        assert titles == ["One", "One", "Two", "Two", None, "One", "Two", "Two", "One", None]
+
+
+class TestMatchRates:
+    """Test recognition of impaired captures with and without conditioning."""
+
+    def test_conditioning_recovers_hummed_captures(self):
+        """Test that clean captures stay recognized and hummed ones are recovered."""
+        impairments = {name: bench.IMPAIRMENTS[name] for name in ("clean", "hum")}
+        clean, hum = bench.match_rates(impairments, tracks=2, track_seconds=12, windows=1)
+
+        assert (clean.impairment, clean.captures) == ("clean", 2)
+        assert clean.raw == clean.conditioned == 1.0
+        assert hum.conditioned > hum.raw
+        assert hum.condition_ms > 0
+
+
+class TestCommandLine:
+    """Test python -m autoscrobbler.bench."""
+
+    def test_json_output(self, capsys, caplog):
+        """Test selecting stages and printing JSON."""
+        caplog.set_level(logging.INFO)  # restored after main() quietens logging
+        bench.main(["parse_dedupe", "scrobble", "-n", "5", "--json"])
+
+        results = json.loads(capsys.readouterr().out)
+        assert [r["name"] for r in results] == ["parse_dedupe", "scrobble"]
+        assert set(results[0]) == {
+            "name", "iterations", "throughput", "p50_ms", "p99_ms", "alloc_bytes", "retained_bytes",
+        }
+
+    def test_unknown_stage(self, capsys, caplog):
+        """Test that a misspelt stage is a usage error."""
+        caplog.set_level(logging.INFO)
+        with pytest.raises(SystemExit):
+            bench.main(["scrobbles"])
+        assert "Unknown stage(s): scrobbles" in capsys.readouterr().err
+
+    def test_match_rate_windows(self, capsys, caplog):
+        """Test that --match-rate needs at least one window per track."""
+        caplog.set_level(logging.INFO)
+        with pytest.raises(SystemExit):
+            bench.main(["--match-rate", "--windows", "0"])
+        assert "--windows must be at least 1" in capsys.readouterr().err
@@ -0,0 +1,255 @@
+"""Tests for the daily identification budget planner."""
+
+import datetime
+import json
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics, ratelimit
+from autoscrobbler.__main__ import main
+from autoscrobbler.budget import (
+    BudgetPlanner,
+    ListeningHistory,
+    novelty,
+    spectral_profile,
+)
+from autoscrobbler.quality import measure_quality
+from autoscrobbler.ratelimit import RequestLimiter
+
+SAMPLE_RATE = 8000
+
+
+def tones(*frequencies, seconds=2.0, amplitude=6000):
+    """Int16 capture made of equal-amplitude tones plus a little noise."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    rng = np.random.default_rng(len(frequencies))
+    audio = sum(np.sin(2 * np.pi * f * t) for f in frequencies) * amplitude / len(frequencies)
+    audio += rng.normal(0, 100, t.size)
+    return audio.astype(np.int16)
+
+
+class FakeClock:
+    """Manually advanced wall clock."""
+
+    def __init__(self, hour=12):
+        self.now = datetime.datetime(2026, 3, 2, hour)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += datetime.timedelta(**kwargs)
+
+
+def planner(budget=10, clock=None, history=None):
+    """A planner over SAMPLE_RATE captures."""
+    return BudgetPlanner(
+        budget, history=history, sample_rate=SAMPLE_RATE, clock=clock or FakeClock()
+    )
+
+
+def claim(planner, samples):
+    """Offer a capture to the planner."""
+    return planner.claim(samples, measure_quality(samples))
+
+
+class TestSpectralProfile:
+    """Test the novelty features."""
+
+    @pytest.mark.unit
+    def test_same_sound_is_not_novel(self):
+        """Test that similar captures score low and different ones high."""
+        song = spectral_profile(tones(220, 880), SAMPLE_RATE)
+        again = spectral_profile(tones(220, 880, amplitude=4000), SAMPLE_RATE)
+        other = spectral_profile(tones(150, 2500), SAMPLE_RATE)
+
+        assert novelty(song, again) < 0.05
+        assert novelty(song, other) > 0.3
+        assert novelty(song, None) == 1.0
+
+    def test_silence_profile(self):
+        """Test that digital silence gives an all-zero profile."""
+        assert not spectral_profile(np.zeros(SAMPLE_RATE, dtype=np.int16), SAMPLE_RATE).any()
+
+
+class TestListeningHistory:
+    """Test the hourly hit rate history."""
+
+    def test_persists_across_restarts(self, tmp_path):
+        """Test that recorded outcomes are saved and reloaded."""
+        path = str(tmp_path / "history.json")
+        history = ListeningHistory(path, alpha=0.5)
+        history.record(20, True)
+
+        reloaded = ListeningHistory(path)
+        assert reloaded.hit_rates[20] == 0.75
+        assert reloaded.hit_rates[3] == 0.5
+
+    def test_unreadable_file_is_ignored(self, tmp_path):
+        """Test that a corrupt history starts from scratch."""
+        path = tmp_path / "history.json"
+        path.write_text("{not json")
+        assert ListeningHistory(str(path)).hit_rates == [0.5] * 24
+
+
+class TestBudgetPlanner:
+    """Test spending decisions."""
+
+    @pytest.mark.unit
+    def test_repeated_song_is_deferred(self):
+        """Test that a new song is identified but the same song a minute later is not."""
+        clock = FakeClock()
+        p = planner(clock=clock)
+
+        assert claim(p, tones(220, 880)) is None
+        clock.advance(minutes=1)
+        reason = claim(p, tones(220, 880))
+        assert reason.startswith("score")
+        clock.advance(minutes=1)
+        assert claim(p, tones(150, 2500)) is None
+        assert p.spent == 2
+
+    def test_silence_is_deferred(self):
+        """Test that quiet captures are not worth a call."""
+        p = planner()
+        quiet = tones(220) // 100
+        assert claim(p, quiet) is not None
+        assert p.spent == 0
+
+    def test_never_exceeds_budget(self):
+        """Test that the daily budget is a hard cap, reset on a new day."""
+        clock = FakeClock(hour=23)
+        p = planner(budget=2, clock=clock)
+        for frequency in (200, 400, 800):
+            clock.advance(minutes=10)
+            reason = claim(p, tones(frequency, frequency * 3))
+        assert reason == "daily budget of 2 calls used up"
+        assert metrics.BUDGET_REMAINING.value() == 0
+
+        clock.advance(hours=1)
+        assert claim(p, tones(1600, 300)) is None
+        assert p.spent == 1
+
+    async def test_retries_are_charged(self, monkeypatch):
+        """Test that retries of a failing request stop once the budget is spent."""
+        async def no_sleep(delay):
+            pass
+
+        monkeypatch.setattr(ratelimit.asyncio, "sleep", no_sleep)
+        p = planner(budget=3)
+        limiter = RequestLimiter(rate=100.0, burst=100, max_retries=5, retry_allowed=p.claim_retry)
+        failing = AsyncMock(side_effect=ConnectionError("reset"))
+
+        assert claim(p, tones(220, 880)) is None
+        with pytest.raises(ConnectionError):
+            await limiter.call(failing)
+
+        assert failing.await_count == 3
+        assert p.spent == 3
+        assert claim(p, tones(150, 2500)) == "daily budget of 3 calls used up"
+
+    def test_spending_survives_a_restart(self, tmp_path):
+        """Test that a restarted planner keeps today's spending but not yesterday's."""
+        path = str(tmp_path / "history.json")
+        clock = FakeClock(hour=20)
+        first = planner(budget=2, clock=clock, history=ListeningHistory(path))
+        assert claim(first, tones(220, 880)) is None
+        assert first.claim_backfill()
+
+        clock.advance(minutes=10)
+        second = planner(budget=2, clock=clock, history=ListeningHistory(path))
+        assert second.spent == 2
+        assert claim(second, tones(150, 2500)) == "daily budget of 2 calls used up"
+        assert not second.claim_retry()
+
+        clock.advance(days=1)
+        third = planner(budget=2, clock=clock, history=ListeningHistory(path))
+        assert third.spent == 0
+
+    def test_threshold_follows_pace(self):
+        """Test that the threshold rises ahead of plan and falls behind it."""
+        clock = FakeClock(hour=12)
+        p = planner(budget=100, clock=clock)
+        behind = p.threshold(clock.now)
+        p.spent = 90
+        ahead = p.threshold(clock.now)
+
+        assert behind == p.base_threshold / 2
+        assert ahead > p.base_threshold
+
+    def test_plan_follows_listening_history(self):
+        """Test that hours with more music get more of the budget."""
+        history = ListeningHistory()
+        history.hit_rates = [0.0] * 18 + [1.0] * 6
+        p = planner(budget=100, history=history)
+        evening = datetime.datetime(2026, 3, 2, 18)
+
+        assert p.planned(evening) < 100 * 18 / 24 / 2
+        assert p.planned(evening.replace(hour=23, minute=59, second=59)) == pytest.approx(
+            100, abs=1
+        )
+
+    def test_record_result_updates_claimed_hour(self, tmp_path):
+        """Test that outcomes are learned for the hour the call was made in."""
+        clock = FakeClock(hour=21)
+        path = tmp_path / "history.json"
+        p = planner(clock=clock, history=ListeningHistory(str(path)))
+        claim(p, tones(220, 880))
+        p.record_result(False)
+        p.record_result(False)  # nothing pending, ignored
+
+        rates = json.loads(path.read_text())["hit_rates"]
+        assert rates[21] < 0.5
+        assert rates.count(0.5) == 23
+
+
+class TestMainBudget:
+    """Test the --daily-budget option of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_defers_when_budget_spent(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that calls beyond the daily budget are deferred."""
+        history = tmp_path / "history.json"
+        mock_parse_args.return_value = make_args(
+            input_source="auto",
+            daily_budget=1,
+            budget_history=str(history),
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = {}
+        mock_sleep.side_effect = [None, None, Exception("Stop execution")]
+
+        def loud_capture(device=None, out=None):
+            out.samples[:] = tones(440, seconds=out.samples.size / SAMPLE_RATE)
+
+        mock_record.side_effect = loud_capture
+        deferrals = metrics.BUDGET_DEFERRALS.value()
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert mock_identify.call_count == 1
+        assert metrics.BUDGET_DEFERRALS.value() == deferrals + 2
+        assert history.exists()
+        assert ratelimit.get_limiter().retry_allowed is not None
@@ -0,0 +1,130 @@
+"""Tests for the preallocated capture buffer pool."""
+
+import asyncio
+import tracemalloc
+import wave
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from autoscrobbler.buffers import (
+    WAV_HEADER_SIZE,
+    AudioBuffer,
+    BufferPool,
+    encode_wav,
+)
+
+
+class TestAudioBuffer:
+    """Test the WAV-backed audio buffer."""
+
+    @pytest.mark.unit
+    def test_samples_view_into_wav_payload(self):
+        """Test that writing samples writes the WAV payload in place."""
+        buffer = AudioBuffer(frames=4, sample_rate=8000)
+        buffer.samples[:] = [1, -1, 2, -2]
+
+        assert len(buffer.wav) == WAV_HEADER_SIZE + 8
+        assert np.shares_memory(buffer.samples, np.frombuffer(buffer.wav, np.uint8))
+        assert bytes(buffer.wav[WAV_HEADER_SIZE:]) == np.array(
+            [1, -1, 2, -2], dtype="<i2"
+        ).tobytes()
+
+    def test_wav_header_is_valid(self):
+        """Test that the buffer is a readable WAV file."""
+        buffer = AudioBuffer(frames=10, sample_rate=22050)
+        buffer.samples[:] = np.arange(10)
+
+        with wave.open(BytesIO(bytes(buffer.wav))) as wav:
+            assert wav.getframerate() == 22050
+            assert wav.getnchannels() == 1
+            assert wav.getsampwidth() == 2
+            assert wav.getnframes() == 10
+            frames = np.frombuffer(wav.readframes(10), dtype=np.int16)
+        assert np.array_equal(frames, np.arange(10))
+
+    def test_encode_wav_matches_buffer(self):
+        """Test that encoding an array produces the same bytes as a buffer."""
+        audio = np.array([5, 4, 3, 2, 1], dtype=np.int16)
+        buffer = AudioBuffer(frames=5, sample_rate=44100)
+        buffer.samples[:] = audio
+
+        assert encode_wav(audio, 44100) == buffer.wav
+
+
+class TestBufferPool:
+    """Test buffer pool ownership semantics."""
+
+    def test_acquire_and_release_reuses_buffers(self):
+        """Test that released buffers are handed out again."""
+        pool = BufferPool(frames=8, sample_rate=8000, size=1)
+        with pool.acquire() as first:
+            assert pool.available == 0
+        assert pool.available == 1
+        assert pool.acquire() is first
+
+    def test_acquire_exhausted_pool_times_out(self):
+        """Test that acquiring from an empty pool raises after the timeout."""
+        pool = BufferPool(frames=8, sample_rate=8000, size=1)
+        pool.acquire()
+        with pytest.raises(RuntimeError, match="No free audio buffer"):
+            pool.acquire(timeout=0.01)
+
+    def test_release_foreign_buffer(self):
+        """Test that a pool rejects buffers it does not own."""
+        pool = BufferPool(frames=8, sample_rate=8000, size=1)
+        with pytest.raises(ValueError, match="does not belong"):
+            pool.release(AudioBuffer(frames=8, sample_rate=8000))
+
+    @pytest.mark.slow
+    def test_steady_state_allocation_per_cycle(self, monkeypatch):
+        """Test that record/identify cycles do not allocate sample-sized memory."""
+        from autoscrobbler.__main__ import identify_song, record_audio
+
+        frames = 10 * 44100
+        pool = BufferPool(frames=frames, sample_rate=44100, size=2)
+        source = np.ones((frames, 1), dtype=np.int16)
+
+        # Plain stand-ins rather than Mocks, which keep every call they see
+        def rec(samplerate, device, out):
+            np.copyto(out, source)
+            return out
+
+        class Shazam:
+            async def recognize(self, wav):
+                assert len(wav) == WAV_HEADER_SIZE + frames * 2
+                return {"matches": []}
+
+        monkeypatch.setattr(
+            "autoscrobbler.__main__.sd", SimpleNamespace(rec=rec, wait=lambda: None)
+        )
+        monkeypatch.setattr("autoscrobbler.__main__._shazam", Shazam())
+
+        async def cycles(count):
+            for _ in range(count):
+                with pool.acquire() as buffer:
+                    record_audio(out=buffer)
+                    await identify_song(buffer)
+
+        loop = asyncio.new_event_loop()
+        try:
+            # Warm up so lazily created interpreter state is not counted
+            loop.run_until_complete(cycles(5))
+
+            count = 200
+            tracemalloc.start()
+            try:
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                loop.run_until_complete(cycles(count))
+                after, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        finally:
+            loop.close()
+
+        # A single copy of the samples would be ~880 KB per cycle.
+        assert (after - before) / count < 64
+        assert peak - before < 16 * 1024
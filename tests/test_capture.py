@@ -0,0 +1,221 @@
+"""Tests for the shared-memory capture ring buffer and capture process."""
+
+import multiprocessing
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler.__main__ import log_capture_stats, main
+from autoscrobbler.capture import CaptureProcess, CaptureStats, SharedRingBuffer
+
+
+def _produce(ring_name, capacity, window_frames, total):
+    """Write a ramp into the ring from another process."""
+    ring = SharedRingBuffer(capacity, window_frames, name=ring_name)
+    for start in range(0, total, 100):
+        ring.write(np.arange(start, start + 100, dtype=np.int16))
+    ring.record_status(input_overflow=True, any_status=True)
+    ring.close()
+
+
+@pytest.fixture
+def ring():
+    """A small ring buffer that is removed after the test."""
+    ring = SharedRingBuffer(capacity=1000, window_frames=300)
+    yield ring
+    ring.close()
+
+
+class TestSharedRingBuffer:
+    """Test the lock-free ring buffer."""
+
+    @pytest.mark.unit
+    def test_latest_window_is_view(self, ring):
+        """Test that reading a window does not copy the samples."""
+        ring.write(np.arange(500, dtype=np.int16))
+
+        view, start = ring.latest_window(300)
+
+        assert start == 200
+        assert np.array_equal(view, np.arange(200, 500))
+        assert np.shares_memory(view, ring._data)
+        assert not view.flags.writeable
+
+    def test_window_across_wrap_is_contiguous(self, ring):
+        """Test that the mirrored tail keeps wrapped windows contiguous."""
+        for start in range(0, 1200, 50):
+            ring.write(np.arange(start, start + 50, dtype=np.int16))
+
+        view, start = ring.latest_window(300)
+
+        assert start == 900
+        assert np.array_equal(view, np.arange(900, 1200))
+        assert np.shares_memory(view, ring._data)
+
+    def test_read_from_follows_producer(self, ring):
+        """Test that a streaming reader gets new samples without moving the read index."""
+        ring.write(np.arange(200, dtype=np.int16))
+        view, start = ring.read_from(50)
+        assert start == 50
+        assert np.array_equal(view, np.arange(50, 200))
+        assert ring.stats().frames_read == 0
+
+        for start in range(200, 1500, 100):
+            ring.write(np.arange(start, start + 100, dtype=np.int16))
+        view, start = ring.read_from(200)
+        assert start == 500  # oldest sample still in the ring
+        assert np.array_equal(view, np.arange(500, 800))
+
+    def test_large_write_keeps_tail(self, ring):
+        """Test that writes longer than the ring keep only the newest samples."""
+        ring.write(np.arange(2500, dtype=np.int16))
+
+        view, _ = ring.latest_window(300)
+
+        assert ring.write_index == 2500
+        assert np.array_equal(view, np.arange(2200, 2500))
+
+    def test_window_too_large(self, ring):
+        """Test that windows larger than the mirror are rejected."""
+        ring.write(np.zeros(1000, dtype=np.int16))
+        with pytest.raises(ValueError, match="exceeds"):
+            ring.latest_window(301)
+
+    def test_window_not_yet_captured(self, ring):
+        """Test reading before a full window has been written."""
+        ring.write(np.zeros(10, dtype=np.int16))
+        with pytest.raises(ValueError, match="Only 10 of 300"):
+            ring.latest_window(300)
+
+    def test_is_intact(self, ring):
+        """Test detecting windows the producer has overwritten."""
+        ring.write(np.zeros(500, dtype=np.int16))
+        _, start = ring.latest_window(300)
+        assert ring.is_intact(start)
+        ring.write(np.zeros(900, dtype=np.int16))
+        assert not ring.is_intact(start)
+
+    def test_mark_not_ready(self, ring):
+        """Test that the ready flag can be cleared before a stream is reopened."""
+        ring.mark_ready()
+        assert ring.ready
+        ring.mark_not_ready()
+        assert not ring.ready
+
+    def test_counters_visible_across_processes(self, ring):
+        """Test that samples and xrun counters written by a child are visible."""
+        ctx = multiprocessing.get_context("spawn")
+        child = ctx.Process(
+            target=_produce, args=(ring.name, ring.capacity, ring.window_frames, 1200)
+        )
+        child.start()
+        child.join(timeout=30)
+
+        assert child.exitcode == 0
+        stats = ring.stats()
+        assert stats.frames_written == 1200
+        assert stats.overflows == 1
+        assert stats.xruns == 1
+        view, _ = ring.latest_window(300)
+        assert np.array_equal(view, np.arange(900, 1200))
+
+
+class TestCaptureProcess:
+    """Test the capture process wrapper."""
+
+    def test_read_into_copies_latest_window(self):
+        """Test that read_into fills the destination from the ring."""
+        capture = CaptureProcess(window_frames=100, sample_rate=100, ring_seconds=3)
+        try:
+            capture.ring.write(np.arange(250, dtype=np.int16))
+            out = np.zeros(100, dtype=np.int16)
+
+            assert capture.read_into(out) is out
+            assert np.array_equal(out, np.arange(150, 250))
+        finally:
+            capture.stop()
+
+    def test_read_into_rereads_overwritten_window(self, caplog):
+        """Test that a window lapped by the producer during the copy is read again."""
+        capture = CaptureProcess(window_frames=100, sample_rate=100, ring_seconds=3)
+        ring = capture.ring
+        latest_window = ring.latest_window
+        lapped = []
+
+        def lap_after_first_read(frames):
+            view, start = latest_window(frames)
+            if not lapped:
+                # The producer laps the ring before the copy finishes
+                ring.write(np.full(ring.capacity, -1, dtype=np.int16))
+                lapped.append(start)
+            return view, start
+
+        try:
+            ring.write(np.arange(250, dtype=np.int16))
+            out = np.zeros(100, dtype=np.int16)
+            with patch.object(ring, "latest_window", side_effect=lap_after_first_read):
+                capture.read_into(out)
+
+            assert lapped == [150]
+            assert np.array_equal(out, np.full(100, -1))
+            assert "overwritten while copying" in caplog.text
+        finally:
+            capture.stop()
+
+    def test_read_into_times_out(self):
+        """Test that read_into gives up when no window arrives."""
+        capture = CaptureProcess(window_frames=100, sample_rate=100, ring_seconds=3)
+        try:
+            with pytest.raises(RuntimeError, match="No full capture window"):
+                capture.read_into(np.zeros(100, dtype=np.int16), timeout=0.05)
+        finally:
+            capture.stop()
+
+    def test_log_capture_stats_reports_new_xruns(self, caplog):
+        """Test that only newly reported overflows are logged."""
+        capture = Mock()
+        capture.stats.return_value = CaptureStats(1000, 3, 4, 0)
+
+        stats = log_capture_stats(capture, CaptureStats(900, 1, 4, 0))
+
+        assert stats.overflows == 3
+        assert "2 input overflow(s) and 0 xrun(s)" in caplog.text
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.capture.CaptureProcess")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_reads_from_capture_process(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_capture_cls,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+    ):
+        """Test that main reads windows from the capture process when enabled."""
+        mock_parse_args.return_value = make_args(input_source="auto", capture_process=True)
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = {}
+        capture = mock_capture_cls.return_value
+        capture.stats.return_value = CaptureStats(441000, 0, 0, 441000)
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        capture.start.assert_called_once()
+        capture.read_into.assert_called_once()
+        mock_record.assert_not_called()
+        capture.stop.assert_called_once()
@@ -1,10 +1,22 @@
 """Tests for CLI and argument parsing functionality."""
 
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
 from unittest.mock import Mock, patch
 
+import pylast
 import pytest
 
-from autoscrobbler.__main__ import list_input_devices, main, parse_arguments
+from autoscrobbler.__main__ import (
+    lastfm_error_is_permanent,
+    list_input_devices,
+    main,
+    parse_arguments,
+)
+from autoscrobbler.dedupe import normalize_key
 
 
 class TestParseArguments:
@@ -68,14 +80,37 @@ class TestParseArguments:
             assert args.duty_cycle == 30
             assert args.input_source == "list"
 
+    def test_parse_arguments_capture_process(self):
+        """Test parsing the capture process flag."""
+        with patch("sys.argv", ["autoscrobbler"]):
+            assert parse_arguments().capture_process is False
+        with patch("sys.argv", ["autoscrobbler", "--capture-process"]):
+            assert parse_arguments().capture_process is True
+
+    def test_parse_arguments_metrics_port(self):
+        """Test parsing the metrics endpoint options."""
+        with patch("sys.argv", ["autoscrobbler"]):
+            args = parse_arguments()
+            assert args.metrics_port is None
+            assert args.metrics_host == "127.0.0.1"
+        with patch("sys.argv", ["autoscrobbler", "--metrics-port", "9400"]):
+            assert parse_arguments().metrics_port == 9400
+
+    def test_parse_arguments_room_needs_scrobbling_node(self, capsys):
+        """Test that an edge node cannot join a room, as it does not scrobble."""
+        with patch("sys.argv", ["autoscrobbler", "--room", "--hub", "http://hub:8765"]):
+            with pytest.raises(SystemExit):
+                parse_arguments()
+        assert "--room cannot be combined with --hub" in capsys.readouterr().err
+
 
 class TestMainFunction:
     """Test main function edge cases."""
 
     @patch("autoscrobbler.__main__.parse_arguments")
-    def test_main_list_devices(self, mock_parse_args):
+    def test_main_list_devices(self, mock_parse_args, make_args):
         """Test main function when listing devices."""
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.input_source = "list"
         mock_parse_args.return_value = mock_args
 
@@ -85,9 +120,9 @@ class TestMainFunction:
 
     @patch("autoscrobbler.__main__.parse_arguments")
     @patch("autoscrobbler.__main__.select_input_device")
-    def test_main_device_selection_exception(self, mock_select_device, mock_parse_args):
+    def test_main_device_selection_exception(self, mock_select_device, mock_parse_args, make_args):
         """Test main function when device selection raises an exception."""
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.input_source = "auto"
         mock_parse_args.return_value = mock_args
 
@@ -99,9 +134,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.parse_arguments")
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
-    def test_main_credentials_file_not_found(self, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_credentials_file_not_found(self, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when credentials file is not found."""
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_parse_args.return_value = mock_args
@@ -116,9 +151,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_incomplete_track_info(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_incomplete_track_info(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when track info is incomplete."""
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -162,9 +197,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_title_with_parentheses(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_title_with_parentheses(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when title contains parentheses."""
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -214,9 +249,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_record_exception(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_record_exception(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when recording raises an exception."""
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -254,9 +289,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_short_title_with_parentheses(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_short_title_with_parentheses(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when title has parentheses but is short."""
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -304,9 +339,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_with_album_info(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_with_album_info(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when track has album info."""
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -364,9 +399,9 @@ class TestMainFunction:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
-    def test_main_device_info_error(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args):
+    def test_main_device_info_error(self, mock_network, mock_load_creds, mock_select_device, mock_parse_args, make_args):
         """Test main function when getting device info raises an exception."""
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.input_source = "auto"
         mock_args.credentials = None
         mock_args.duty_cycle = 60
@@ -403,3 +438,260 @@ class TestMainFunction:
             with pytest.raises(Exception, match="Stop execution"):
                 main()
 
+
+
+class TestFastStart:
+    """Test start-up cost, concurrent initialization and the single-shot mode."""
+
+    HEAVY = {"numpy", "pylast", "shazamio", "aiohttp", "sounddevice", "soundfile"}
+
+    @pytest.mark.parametrize("argv", [["--help"], ["--stats", "--history-db", "missing.db"]])
+    def test_light_modes_skip_heavy_imports(self, argv, tmp_path):
+        """Test that --help and --stats never import the audio or network stack."""
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "autoscrobbler", *argv],
+            capture_output=True,
+            text=True,
+            cwd=tmp_path,
+            env={"PYTHONPATH": str(Path(__file__).parent.parent)},
+            timeout=60,
+        )
+        assert completed.returncode == 0, completed.stderr
+        imported = {
+            line.split("|")[-1].strip().split(".")[0]
+            for line in completed.stderr.splitlines()
+            if line.startswith("import time:")
+        }
+        assert "autoscrobbler" in imported
+        assert not imported & self.HEAVY
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    def test_once_prints_json(
+        self,
+        mock_identify,
+        mock_record,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        capsys,
+    ):
+        """Test that --once identifies a single capture without Last.fm."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto", once=True, min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_identify.return_value = {
+            "track": {
+                "key": "42",
+                "title": "Test Song (Remastered)",
+                "subtitle": "Test Artist",
+                "sections": [{"type": "SONG", "metadata": [{"title": "Album", "text": "LP"}]}],
+            }
+        }
+
+        main()
+
+        out = capsys.readouterr().out
+        assert "Infinity" not in out  # silence measures -inf dBFS, which is not valid JSON
+        report = json.loads(out)
+        assert report["track"] == {
+            "artist": "Test Artist",
+            "title": "Test Song",
+            "album": "LP",
+            "key": normalize_key("Test Artist", "Test Song"),
+            "shazam_key": "42",
+        }
+        assert set(report["timings"]) == {"startup", "capture", "identify"}
+        mock_record.assert_called_once()
+        mock_load_creds.assert_not_called()
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    def test_once_exit_status(
+        self, mock_identify, mock_record, mock_select_device, mock_parse_args, make_args, capsys
+    ):
+        """Test that skipped captures succeed and failed identifications exit with 1."""
+        mock_parse_args.return_value = make_args(input_source="auto", once=True)
+        mock_select_device.return_value = 0
+
+        main()
+        assert json.loads(capsys.readouterr().out)["skipped"]
+        mock_identify.assert_not_called()
+
+        mock_parse_args.return_value = make_args(
+            input_source="auto", once=True, min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_identify.side_effect = ConnectionError("offline")
+        with pytest.raises(SystemExit) as exit_info:
+            main()
+        assert exit_info.value.code == 1
+        assert json.loads(capsys.readouterr().out)["error"] == "offline"
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_lastfm_authenticates_during_capture(
+        self,
+        mock_sleep,
+        mock_get_last,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+    ):
+        """Test that Last.fm authenticates off the main thread while audio is captured."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        network = Mock()
+        authenticated = threading.Event()
+        threads = []
+
+        def authenticate(**kwargs):
+            threads.append(threading.current_thread().name)
+            authenticated.set()
+            return network
+
+        def record(**kwargs):
+            # Capture starts without waiting for Last.fm
+            assert authenticated.wait(5)
+
+        mock_network.side_effect = authenticate
+        mock_record.side_effect = record
+        mock_identify.return_value = {"track": {"title": "Song", "subtitle": "Artist"}}
+        mock_get_last.return_value = None
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert threads == ["lastfm_0"]
+        mock_record.assert_called_once()
+        assert mock_get_last.call_args.args[0] is network
+        network.scrobble.assert_called_once()
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.process_result")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_failed_authentication_is_retried(
+        self,
+        mock_sleep,
+        mock_process,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        caplog,
+    ):
+        """Test that Last.fm being down at start-up costs a cycle, not the process."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        network = Mock()
+        captured = threading.Event()
+
+        def authenticate(**kwargs):
+            if mock_network.call_count == 1:
+                # Fail only once the first result is waiting for Last.fm
+                assert captured.wait(5)
+                raise ConnectionError("Last.fm offline")
+            return network
+
+        mock_network.side_effect = authenticate
+        mock_record.side_effect = lambda **kwargs: captured.set()
+        mock_identify.return_value = {"track": {"title": "Song", "subtitle": "Artist"}}
+        mock_sleep.side_effect = [None, Exception("Stop execution")]
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert "Last.fm authentication failed, retrying: Last.fm offline" in caplog.text
+        assert "Not authenticated with Last.fm yet" in caplog.text
+        assert mock_network.call_count == 2
+        mock_process.assert_called_once()
+        assert mock_process.call_args.args[1] is network
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_rejected_credentials_exit(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        caplog,
+    ):
+        """Test that credentials Last.fm rejects end the process instead of being retried."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_network.side_effect = pylast.WSError(
+            None, "4", "Authentication Failed - You do not have permissions to access the service"
+        )
+        mock_identify.return_value = {"track": {"title": "Song", "subtitle": "Artist"}}
+        mock_sleep.side_effect = [None, None, Exception("Stop execution")]
+
+        with pytest.raises(SystemExit) as exit_info:
+            main()
+
+        assert exit_info.value.code == 1
+        assert "Last.fm authentication failed: Authentication Failed" in caplog.text
+        assert mock_network.call_count == 1
+        assert mock_identify.call_count <= 1
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "error, permanent",
+        [
+            (pylast.WSError(None, "4", "Authentication Failed"), True),
+            (pylast.WSError(None, "10", "Invalid API key"), True),
+            (pylast.WSError(None, "16", "Temporarily unavailable"), False),
+            (pylast.WSError(None, 503, "Connection to the API failed with HTTP code 503"), False),
+            (pylast.NetworkError(None, ConnectionError("reset")), False),
+            (ConnectionError("reset"), False),
+        ],
+    )
+    def test_lastfm_error_is_permanent(self, error, permanent):
+        """Test which authentication errors are worth retrying."""
+        assert lastfm_error_is_permanent(error) is permanent
@@ -0,0 +1,245 @@
+"""Tests for in-place conditioning of captures before identification."""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import audio_conditioner, main
+from autoscrobbler.buffers import AudioBuffer
+from autoscrobbler.conditioning import Conditioner, ConditioningSettings
+from autoscrobbler.standins import (
+    IMPAIRMENTS,
+    Impairment,
+    ShazamStandIn,
+    Track,
+    impair,
+    synthetic_music,
+)
+from autoscrobbler.signature import signature_of
+
+RATE = 44100
+
+
+def band_power(samples, low, high, sample_rate=RATE):
+    """Power of the samples between two frequencies."""
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float64))) ** 2
+    frequencies = np.fft.rfftfreq(samples.size, 1 / sample_rate)
+    return float(spectrum[(frequencies >= low) & (frequencies <= high)].sum())
+
+
+def hum_power(samples, mains, harmonics=8, sample_rate=RATE):
+    """Power within 0.5 Hz of the first harmonics of a mains frequency."""
+    return sum(
+        band_power(samples, n * mains - 0.5, n * mains + 0.5, sample_rate)
+        for n in range(2, harmonics + 1)
+    )
+
+
+@pytest.fixture(scope="module")
+def music():
+    """Ten seconds of synthetic music."""
+    return synthetic_music(10, RATE, seed=3)
+
+
+class TestConditioner:
+    """Test the filters and gain applied to a capture."""
+
+    @pytest.mark.unit
+    def test_removes_dc_and_rumble(self, music):
+        """Test that DC and rumble below the cutoff are removed and the music is kept."""
+        captured = impair(music, RATE, Impairment(rumble_dbfs=-12.0, dc_offset=0.05))
+        samples = captured.copy()
+
+        Conditioner(ConditioningSettings(max_gain_db=0)).condition(samples, RATE)
+
+        assert abs(samples.mean()) < 1.0
+        assert band_power(samples, 0, 20) < band_power(captured, 0, 20) * 1e-4
+        assert band_power(samples, 250, 5500) == pytest.approx(band_power(music, 250, 5500), rel=0.05)
+
+    @pytest.mark.unit
+    def test_detects_and_notches_hum(self, music):
+        """Test that automatic detection finds the mains frequency and notches its harmonics."""
+        samples = impair(music, RATE, Impairment(hum_hz=60.0, hum_dbfs=-20.0))
+        before = hum_power(samples, 60.0)
+
+        result = Conditioner(ConditioningSettings(max_gain_db=0)).condition(samples, RATE)
+
+        assert result.hum_hz == 60.0
+        assert result.notched_bins > 0
+        # What is left at the harmonics is no more than the music had there
+        assert before > hum_power(music, 60.0) * 100
+        assert hum_power(samples, 60.0) < hum_power(music, 60.0)
+
+    @pytest.mark.unit
+    def test_no_hum_detected_in_music(self, music):
+        """Test that notes of the music itself are not taken for hum."""
+        result = Conditioner().condition(music.copy(), RATE)
+
+        assert result.hum_hz is None
+        assert result.notched_bins == 0
+
+    @pytest.mark.unit
+    def test_fixed_and_disabled_hum(self, music):
+        """Test that a fixed mains frequency is notched without detection, and 'off' notches nothing."""
+        captured = impair(music, RATE, Impairment(hum_hz=50.0, hum_dbfs=-20.0))
+
+        fixed = Conditioner(ConditioningSettings(hum="50")).condition(captured.copy(), RATE)
+        other = Conditioner(ConditioningSettings(hum="60")).condition(captured.copy(), RATE)
+        off = Conditioner(ConditioningSettings(hum="off")).condition(captured.copy(), RATE)
+
+        assert fixed.hum_hz == 50.0
+        # Only the harmonics 50 and 60 Hz share, at multiples of 300 Hz
+        assert other.notched_bins < fixed.notched_bins / 3
+        assert off.hum_hz is None and off.notched_bins == 0
+
+    @pytest.mark.unit
+    def test_amplifies_quiet_captures(self, music):
+        """Test that a quiet capture is raised to the target level, within the maximum gain."""
+        quiet = impair(music, RATE, Impairment(gain_db=-20.0))
+        samples = quiet.copy()
+
+        result = Conditioner(ConditioningSettings(target_dbfs=-20.0, max_gain_db=40.0)).condition(samples, RATE)
+        rms_dbfs = 10 * np.log10(np.mean(samples.astype(np.float64) ** 2) / 32768.0**2)
+
+        assert rms_dbfs == pytest.approx(-20.0, abs=0.5)
+        assert result.gain_db > 10.0
+
+        capped = Conditioner(ConditioningSettings(target_dbfs=-20.0, max_gain_db=6.0)).condition(quiet.copy(), RATE)
+        assert capped.gain_db == pytest.approx(6.0)
+
+    @pytest.mark.unit
+    def test_gain_never_clips(self):
+        """Test that the gain stops short of clipping the loudest sample."""
+        samples = np.zeros(RATE, dtype=np.int16)
+        samples[::4410] = 1000  # sparse clicks: low RMS, high peaks
+
+        result = Conditioner(ConditioningSettings(highpass_hz=0, hum="off", max_gain_db=60.0)).condition(samples, RATE)
+
+        assert result.gain_db < 60.0
+        assert np.abs(samples.astype(np.int32)).max() <= 32767
+
+    @pytest.mark.unit
+    def test_loud_captures_keep_their_level(self, music):
+        """Test that captures above the target are not attenuated."""
+        loud = impair(music, RATE, Impairment(gain_db=6.0))
+
+        result = Conditioner(ConditioningSettings(target_dbfs=-30.0)).condition(loud, RATE)
+
+        assert result.gain_db == pytest.approx(0.0, abs=0.01)
+
+    @pytest.mark.unit
+    def test_in_place_on_pooled_buffer(self, music):
+        """Test that conditioning writes into the WAV payload of a pooled buffer."""
+        buffer = AudioBuffer(music.size, RATE)
+        np.copyto(buffer.samples, impair(music, RATE, Impairment(dc_offset=0.1)))
+        samples = buffer.samples
+
+        Conditioner().condition(buffer.samples, RATE)
+
+        assert buffer.samples is samples
+        payload = np.frombuffer(buffer.wav, dtype=np.int16, offset=44)
+        assert abs(payload.mean()) < 1.0
+
+    @pytest.mark.unit
+    def test_reuses_plan_per_window_size(self, music):
+        """Test that filters are built once per window size and sample rate."""
+        conditioner = Conditioner()
+        conditioner.condition(music.copy(), RATE)
+        conditioner.condition(music.copy(), RATE)
+        conditioner.condition(music[: RATE].copy(), RATE)
+
+        assert len(conditioner._plans) == 2
+
+    @pytest.mark.unit
+    def test_empty_and_silent(self):
+        """Test that empty and silent captures are left alone."""
+        conditioner = Conditioner()
+        assert conditioner.condition(np.zeros(0, dtype=np.int16), RATE).gain_db == 0.0
+        silence = np.zeros(RATE, dtype=np.int16)
+        assert conditioner.condition(silence, RATE).gain_db == 0.0
+        assert not silence.any()
+
+    @pytest.mark.unit
+    def test_unknown_hum_setting(self):
+        """Test that an unknown hum setting is rejected."""
+        with pytest.raises(ValueError, match="Unknown hum setting"):
+            Conditioner(ConditioningSettings(hum="55"))
+
+    def test_raises_match_rate(self):
+        """Test that conditioned captures of a hummed track are recognized again."""
+        standin = ShazamStandIn()
+        tracks = [synthetic_music(30, RATE, seed=seed) for seed in range(3)]
+        for seed, audio in enumerate(tracks):
+            standin.add_track(Track("Artist", f"Song {seed}"), audio, RATE)
+        conditioner = Conditioner()
+        raw = conditioned = 0
+        for seed, audio in enumerate(tracks):
+            captured = impair(audio[5 * RATE : 15 * RATE], RATE, IMPAIRMENTS["hum"], seed=seed)
+            match = standin.match(signature_of(captured, RATE))
+            raw += match is not None and match.title == f"Song {seed}"
+            conditioner.condition(captured, RATE)
+            match = standin.match(signature_of(captured, RATE))
+            conditioned += match is not None and match.title == f"Song {seed}"
+
+        assert conditioned == 3
+        assert conditioned > raw
+
+
+class TestMainConditioning:
+    """Test conditioning in the main loop."""
+
+    @pytest.mark.unit
+    def test_disabled_by_default(self, make_args):
+        """Test that captures are only conditioned with --condition."""
+        assert audio_conditioner(make_args()) is None
+        conditioner = audio_conditioner(make_args(condition=True, hum="60", highpass_hz=80.0))
+        assert conditioner.settings == ConditioningSettings(highpass_hz=80.0, hum="60")
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_capture_conditioned_before_identification(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        music,
+    ):
+        """Test that the buffer sent to Shazam has been conditioned, after the quality check."""
+        captured = impair(music, RATE, Impairment(gain_db=-20.0, dc_offset=0.05))
+        identified = []
+
+        def record(device=None, out=None):
+            np.copyto(out.samples, captured)
+            return out.samples
+
+        def identify(buffer):
+            identified.append((buffer.quality, buffer.samples.copy()))
+            return {"matches": []}
+
+        mock_record.side_effect = record
+        mock_identify.side_effect = identify
+        mock_parse_args.return_value = make_args(input_source="auto", condition=True)
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        (quality, samples), = identified
+        assert quality.dc_offset == pytest.approx(0.05, abs=0.01)
+        assert abs(samples.mean()) < 1.0
+        assert metrics.CONDITIONING.value(metric="gain_db") > 10.0
@@ -0,0 +1,152 @@
+"""Tests for the windowed dedupe index."""
+
+import sys
+import tracemalloc
+from unittest.mock import Mock, patch
+
+import pytest
+
+from autoscrobbler.__main__ import process_result
+from autoscrobbler.dedupe import DedupeIndex, normalize_key
+
+
+def song_result(title, artist):
+    """Minimal Shazam result for a song."""
+    return {"track": {"title": title, "subtitle": artist}}
+
+
+class TestNormalizeKey:
+    """Test dedupe key normalization."""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "artist,title",
+        [
+            ("Daft Punk", "One More Time"),
+            ("DAFT PUNK", "one more time"),
+            ("Daft Punk feat. Romanthony", "One More Time (Radio Edit)"),
+            ("Daft Punk", "One More Time - Remastered 2011"),
+            ("Daft  Punk", "One More Time!"),
+        ],
+    )
+    def test_variants_share_a_key(self, artist, title):
+        """Test that spelling variants of a song map to one key."""
+        assert normalize_key(artist, title) == normalize_key("Daft Punk", "One More Time")
+
+    def test_different_songs_differ(self):
+        """Test that artist and title both matter."""
+        assert normalize_key("A", "Song") != normalize_key("B", "Song")
+        assert normalize_key("A", "(Intro)") != normalize_key("A", "(Outro)")
+
+
+class TestDedupeIndex:
+    """Test play windows, eviction and persistence."""
+
+    @pytest.mark.unit
+    def test_aba_within_window_is_duplicate(self):
+        """Test that a song flipping back during a crossfade is not a new play."""
+        index = DedupeIndex(gap=300)
+        index.record("a", 0.0)
+        index.record("b", 60.0)
+
+        assert index.observe("a", 120.0)
+        assert index.observe("b", 180.0)
+
+    def test_play_ends_after_gap_or_max_play(self):
+        """Test that songs heard again later count as new plays."""
+        index = DedupeIndex(gap=300, max_play=900)
+        index.record("a", 0.0)
+        assert not index.observe("a", 301.0)
+
+        index.record("b", 0.0)
+        for now in range(240, 900, 240):
+            assert index.observe("b", float(now))
+        assert not index.observe("b", 960.0)
+
+    def test_lru_eviction(self):
+        """Test that the least recently heard songs are evicted."""
+        index = DedupeIndex(capacity=2)
+        index.record("a", 0.0)
+        index.record("b", 1.0)
+        index.observe("a", 2.0)
+        index.record("c", 3.0)
+
+        assert len(index) == 2
+        assert "b" not in index
+        assert "a" in index
+
+    def test_persists_across_restarts(self, tmp_path):
+        """Test that a restarted index still knows the current play."""
+        path = str(tmp_path / "dedupe.json")
+        DedupeIndex(path).record("a", 100.0)
+
+        restarted = DedupeIndex(path)
+        assert restarted.observe("a", 200.0)
+
+    def test_observe_saves_periodically(self, tmp_path):
+        """Test that long plays are saved so a restart mid-song still dedupes."""
+        path = str(tmp_path / "dedupe.json")
+        index = DedupeIndex(path, gap=300, max_play=3600)
+        index.record("a", 0.0)
+        for now in (100.0, 200.0, 300.0, 400.0):
+            index.observe("a", now)
+
+        assert DedupeIndex(path, gap=300, max_play=3600).observe("a", 650.0)
+
+    def test_unreadable_file_is_ignored(self, tmp_path):
+        """Test that a corrupt index starts empty."""
+        path = tmp_path / "dedupe.json"
+        path.write_text('{"plays": [["a", "x"]]}')
+        assert len(DedupeIndex(str(path))) == 0
+
+    @pytest.mark.skipif(sys.implementation.name != "cpython", reason="CPython allocator")
+    def test_repeat_lookup_does_not_allocate(self):
+        """Test that observing a running play does not grow memory per call."""
+        index = DedupeIndex()
+        key = normalize_key("Artist", "Title")
+        index.record(key, 0.0)
+        index.observe(key, 2.0)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            for _ in range(10000):
+                index.observe(key, 2.0)
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        growth = sum(
+            stat.size_diff
+            for stat in after.compare_to(before, "filename")
+            if stat.traceback[0].filename.endswith("dedupe.py")
+        )
+        assert growth < 1000  # well under a byte per call
+
+
+class TestProcessResultDedupe:
+    """Test dedupe in process_result."""
+
+    def test_aba_pattern_scrobbles_each_song_once(self):
+        """Test that A-B-A scrobbles A and B once, with one Last.fm lookup each."""
+        dedupe = DedupeIndex()
+        with patch(
+            "autoscrobbler.__main__.get_last_scrobbled_track", return_value=None
+        ) as mock_get_last, patch("autoscrobbler.__main__.scrobble_song") as mock_scrobble, \
+             patch("autoscrobbler.__main__.time.time", side_effect=[0.0, 60.0, 120.0]):
+            for title in ("Song A", "Song B", "Song A (Live)"):
+                process_result(song_result(title, "Artist"), Mock(), "user", dedupe)
+
+        assert mock_scrobble.call_count == 2
+        assert mock_get_last.call_count == 2
+
+    def test_lastfm_duplicate_is_remembered(self):
+        """Test that a song found on Last.fm is not looked up again."""
+        dedupe = DedupeIndex()
+        with patch(
+            "autoscrobbler.__main__.get_last_scrobbled_track",
+            return_value=("artist", "song a"),
+        ) as mock_get_last, patch("autoscrobbler.__main__.scrobble_song") as mock_scrobble:
+            for _ in range(3):
+                process_result(song_result("Song A", "Artist"), Mock(), "user", dedupe)
+
+        mock_scrobble.assert_not_called()
+        assert mock_get_last.call_count == 1
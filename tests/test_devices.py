@@ -0,0 +1,209 @@
+"""Tests for the input device registry and device recovery."""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import main, select_input_device
+from autoscrobbler.capture import CaptureProcess
+from autoscrobbler.devices import DeviceRegistry, DeviceWatch
+
+SPEAKERS = {"name": "Speakers", "hostapi": 0, "max_input_channels": 0, "default_samplerate": 48000.0}
+BUILT_IN = {"name": "Built-in Mic", "hostapi": 0, "max_input_channels": 2, "default_samplerate": 48000.0}
+USB = {"name": "USB Audio CODEC", "hostapi": 0, "max_input_channels": 1, "default_samplerate": 44100.0}
+USB_JACK = dict(USB, hostapi=1)
+USB_KEY = ("USB Audio CODEC", "ALSA")
+
+
+class FakeSoundDevice:
+    """The parts of sounddevice the registry uses, with pluggable devices."""
+
+    def __init__(self, *devices):
+        self.devices = list(devices)
+        self.scans = 0
+        self.initializations = 0
+
+    def _terminate(self):
+        pass
+
+    def _initialize(self):
+        self.initializations += 1
+
+    def query_hostapis(self):
+        return [{"name": "ALSA"}, {"name": "JACK Audio Connection Kit"}]
+
+    def query_devices(self, kind=None):
+        listed = [dict(device, index=i) for i, device in enumerate(self.devices)]
+        if kind == "input":
+            return next(d for d in listed if d["max_input_channels"] > 0)
+        self.scans += 1
+        return listed
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeviceRegistry:
+    """Test scanning and lookups."""
+
+    @pytest.mark.unit
+    def test_devices_are_keyed_by_name_and_host_api(self):
+        """Test that the same device on two host APIs has two keys."""
+        registry = DeviceRegistry(FakeSoundDevice(SPEAKERS, USB, USB_JACK))
+
+        assert [device.index for device in registry.devices] == [1, 2]
+        assert registry.find(("USB Audio CODEC", "ALSA")).index == 1
+        assert registry.find(("USB Audio CODEC", "JACK Audio Connection Kit")).index == 2
+        assert registry.find(("Built-in Mic", "ALSA")) is None
+        assert registry.default_index == 1
+
+    def test_selection_scans_once(self, monkeypatch):
+        """Test that selecting a device queries PortAudio's device list once."""
+        sd = FakeSoundDevice(SPEAKERS, BUILT_IN, USB)
+        monkeypatch.setattr("autoscrobbler.__main__.sd", sd)
+
+        assert select_input_device("usb") == 2
+        assert select_input_device(0) == 1
+        assert sd.scans == 1
+
+    def test_refresh_reinitializes_portaudio(self):
+        """Test that only refreshing scans see hot-plugged devices."""
+        sd = FakeSoundDevice(BUILT_IN)
+        registry = DeviceRegistry(sd)
+        registry.scan()
+        sd.devices.append(USB)
+        rescans = metrics.DEVICE_RESCANS.value()
+
+        registry.scan(refresh=True)
+
+        assert sd.initializations == 1
+        assert registry.find(USB_KEY) is not None
+        assert metrics.DEVICE_RESCANS.value() == rescans + 1
+
+
+class TestDeviceWatch:
+    """Test following a device through unplugs and rescans."""
+
+    @pytest.fixture
+    def setup(self):
+        """A USB device watched with a 60 second rescan interval."""
+        sd = FakeSoundDevice(BUILT_IN, USB)
+        registry = DeviceRegistry(sd)
+        clock = FakeClock()
+        watch = DeviceWatch(registry, registry.find(USB_KEY), interval=60, clock=clock)
+        return sd, watch, clock
+
+    def test_replugged_device_is_found_at_new_index(self, setup, caplog):
+        """Test unplug, failed captures, and the device coming back elsewhere."""
+        sd, watch, _ = setup
+        sd.devices.remove(USB)
+
+        assert watch.check(failed=True) is False
+        assert watch.check(failed=True) is False
+        assert watch.missing
+        assert caplog.text.count("is missing") == 1
+
+        sd.devices[:0] = [SPEAKERS, SPEAKERS]
+        sd.devices.append(USB)
+        assert watch.check(failed=True) is True
+        assert watch.index == 3
+        assert not watch.missing
+
+    def test_periodic_rescan(self, setup):
+        """Test that a device that moved is noticed without a capture error."""
+        sd, watch, clock = setup
+        sd.devices.insert(0, SPEAKERS)
+
+        assert watch.check() is False
+        clock.now = 61
+        assert watch.check() is True
+        assert watch.index == 2
+        clock.now = 122
+        assert watch.check() is False
+
+    def test_failure_reopens_unmoved_device(self, setup):
+        """Test that a failed stream is reopened even on the same index."""
+        _, watch, _ = setup
+        watch.interval = 0
+        assert watch.check() is False
+        assert watch.check(failed=True) is True
+        assert watch.index == 1
+
+
+class TestCaptureStall:
+    """Test that a stream that stops delivering audio is reported."""
+
+    def test_read_into_requires_new_audio(self):
+        """Test that a second read without new audio raises instead of repeating."""
+        capture = CaptureProcess(window_frames=100, sample_rate=100, ring_seconds=3)
+        try:
+            capture.ring.write(np.arange(150, dtype=np.int16))
+            out = np.zeros(100, dtype=np.int16)
+            capture.read_into(out)
+
+            with pytest.raises(RuntimeError, match="No new audio"):
+                capture.read_into(out, timeout=0.05)
+            capture.ring.write(np.arange(10, dtype=np.int16))
+            capture.read_into(out, timeout=0.05)
+        finally:
+            capture.stop()
+
+
+class TestMainDeviceRecovery:
+    """Test that main reopens a replugged device without restarting."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_recording_follows_replugged_device(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        monkeypatch,
+    ):
+        """Test that recording resumes on the device's new index after an error."""
+        sd = FakeSoundDevice(BUILT_IN, USB)
+        monkeypatch.setattr("autoscrobbler.__main__.sd", sd)
+        mock_parse_args.return_value = make_args(
+            input_source="usb", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 1
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = {}
+
+        def record(**kwargs):
+            if mock_record.call_count == 1:
+                # The USB interface resets and comes back after another device
+                sd.devices[:] = [SPEAKERS, BUILT_IN, USB]
+                raise OSError("Error opening InputStream: Device unavailable")
+
+        mock_record.side_effect = record
+        reopens = metrics.DEVICE_REOPENS.value()
+        mock_sleep.side_effect = [None, Exception("Stop execution")]
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert [c.kwargs["device"] for c in mock_record.call_args_list] == [1, 2]
+        assert metrics.DEVICE_REOPENS.value() == reopens + 1
+        mock_identify.assert_called_once()
@@ -0,0 +1,147 @@
+"""Tests for the hardware benchmark subcommand."""
+
+import json
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from autoscrobbler import __main__ as app
+from autoscrobbler.hardware import (
+    bench_window,
+    measure_capture,
+    measure_identify,
+    measure_memory,
+    measure_signature,
+    run_bench,
+)
+from autoscrobbler.standins import ShazamStandIn, Track, serve_shazam
+
+RATE = 8000
+
+
+class Status:
+    """PortAudio callback flags."""
+
+    def __init__(self, input_overflow=False):
+        self.input_overflow = input_overflow
+
+    def __bool__(self):
+        return self.input_overflow
+
+
+class FakeInputStream:
+    """Callback stream delivering blocks from a thread, the third one overflowing."""
+
+    def __init__(self, samplerate, channels, dtype, device, blocksize, callback):
+        self.period = blocksize / samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self.latency = 0.02
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+
+    def _run(self):
+        block = 0
+        while not self._stop.wait(self.period):
+            now = time.monotonic()
+            self.callback(
+                np.zeros((self.blocksize, 1), dtype=np.int16),
+                self.blocksize,
+                SimpleNamespace(currentTime=now, inputBufferAdcTime=now - 0.005),
+                Status(input_overflow=block == 2),
+            )
+            block += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+@pytest.fixture
+def shazam_server():
+    """A Shazam stand-in knowing the benchmark window."""
+    standin = ShazamStandIn()
+    standin.add_track(Track("Bench", "Window"), bench_window(RATE), RATE)
+    server = serve_shazam(standin)
+    yield server
+    server.close()
+
+
+class TestMeasurements:
+    """Test each section of the benchmark."""
+
+    def test_capture(self, mock_sounddevice):
+        """Test callback timing, latency and xrun counts."""
+        mock_sounddevice.InputStream = FakeInputStream
+
+        capture = measure_capture(0, RATE, seconds=0.3, blocksize=80)
+
+        assert capture["blocks"] >= 5
+        assert capture["frames"] == 80 * capture["blocks"]
+        assert capture["overflows"] == capture["xruns"] == 1
+        assert capture["expected_interval_ms"] == 10.0
+        assert capture["callback_interval_ms"]["p50"] >= 5.0
+        assert capture["adc_latency_ms"]["p50"] == pytest.approx(5.0)
+        assert capture["reported_latency_ms"] == 20.0
+
+    def test_signature_and_memory(self):
+        """Test signature timing per second of audio and the memory footprint."""
+        window = bench_window(RATE)
+
+        signature = measure_signature(window, RATE, runs=2)
+        memory = measure_memory(window, RATE)
+
+        assert signature["window_seconds"] == 10.0
+        assert signature["ms_per_audio_second"]["p50"] > 0
+        assert signature["realtime_factor"] > 1
+        assert memory["capture_buffer_bytes"] == 10 * RATE * 2
+        assert memory["signature_peak_traced_bytes"] > 0
+
+    def test_identify(self, shazam_server):
+        """Test round trips to a local identification endpoint."""
+        identify = measure_identify(bench_window(RATE), RATE, shazam_server.url, requests=2, timeout=5.0)
+
+        assert identify["matched"] == 2
+        assert identify["errors"] == []
+        assert identify["round_trip_ms"]["max"] > 0
+        assert len(shazam_server.latencies) == 2
+
+
+class TestCommand:
+    """Test the bench subcommand."""
+
+    def test_subcommand_prints_json(self, mock_sounddevice, shazam_server, monkeypatch, tmp_path, capsys):
+        """Test that 'autoscrobbler bench' runs every section and writes the report."""
+        mock_sounddevice.InputStream = FakeInputStream
+        output = tmp_path / "bench.json"
+        monkeypatch.setattr(sys, "argv", [
+            "autoscrobbler", "bench", "--sample-rate", str(RATE), "--seconds", "0.1",
+            "--blocksize", "80", "--signature-runs", "1", "--endpoint", shazam_server.url,
+            "--identify-requests", "1", "--output", str(output),
+        ])
+
+        app.main()
+
+        report = json.loads(capsys.readouterr().out)
+        assert set(report) == {"host", "sample_rate", "capture", "signature", "conditioning", "memory", "identify"}
+        assert report["capture"]["device_name"] == "Test Microphone"
+        assert report["identify"]["matched"] == 1
+        assert json.loads(output.read_text()) == report
+
+    def test_failing_section_is_reported(self, mock_sounddevice):
+        """Test that a capture error is reported instead of aborting the benchmark."""
+        mock_sounddevice.InputStream.side_effect = OSError("Device unavailable")
+
+        report = run_bench(sample_rate=RATE, seconds=0.1, signature_runs=1, identify_requests=0)
+
+        assert report["capture"] == {"error": "OSError: Device unavailable"}
+        assert "identify" not in report
+        assert report["signature"]["runs"] == 1
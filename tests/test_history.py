@@ -0,0 +1,197 @@
+"""Tests for the SQLite play history."""
+
+import json
+import sqlite3
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from autoscrobbler.__main__ import main, print_stats, process_result
+from autoscrobbler.dedupe import DedupeIndex
+from autoscrobbler.history import DECISION, IDENTIFICATION, SCROBBLE, PlayHistory
+
+SONG_RESULT = {"track": {"title": "Test Song", "subtitle": "Test Artist"}}
+
+
+@pytest.fixture
+def history(tmp_path):
+    """A play history in a temporary database."""
+    history = PlayHistory(str(tmp_path / "history.db"), flush_interval=0.05)
+    yield history
+    history.close()
+
+
+def rows(path, sql="SELECT kind, track_key, detail FROM events ORDER BY id"):
+    """Read events straight from the database."""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+class TestPlayHistory:
+    """Test recording and querying events."""
+
+    @pytest.mark.unit
+    def test_records_events(self, history):
+        """Test that each kind of event is written with its details."""
+        history.record_identification(SONG_RESULT, "a\tb", "A", "B", timestamp=10.0)
+        history.record_decision("scrobbled", "a\tb", "A", "B", timestamp=10.0)
+        history.record_scrobble("a\tb", "A", "B", album="C", timestamp=10.0)
+        assert history.flush(5)
+
+        identification, decision, scrobble = rows(history.path)
+        assert identification[:2] == (IDENTIFICATION, "a\tb")
+        assert json.loads(identification[2]) == SONG_RESULT
+        assert decision == (DECISION, "a\tb", "scrobbled")
+        assert scrobble == (SCROBBLE, "a\tb", '{"album":"C"}')
+
+    def test_wal_mode_and_indexes(self, history):
+        """Test that the database uses WAL and indexes time and track key."""
+        assert rows(history.path, "PRAGMA journal_mode") == [("wal",)]
+        indexes = {name for (name,) in rows(
+            history.path, "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )}
+        assert {"events_timestamp", "events_track_key"} <= indexes
+
+    def test_batches_writes(self, tmp_path):
+        """Test that queued events are written in few transactions."""
+        history = PlayHistory(str(tmp_path / "history.db"), batch_size=50, flush_interval=5)
+        with patch.object(history, "_write", wraps=history._write) as write:
+            for i in range(100):
+                history.record_decision("miss", timestamp=float(i))
+            history.close()
+
+        assert len(rows(history.path)) == 100
+        assert 1 <= write.call_count <= 3
+
+    def test_stats(self, history):
+        """Test summary queries."""
+        for timestamp, key in ((1.0, "x"), (2.0, "y"), (3.0, "y"), (100.0, "z")):
+            history.record_scrobble(key, key.upper(), "Song", timestamp=timestamp)
+            history.record_decision("scrobbled", key, timestamp=timestamp)
+        history.record_decision("miss", timestamp=5.0)
+        history.flush(5)
+
+        stats = history.stats(since=2.0)
+        assert stats["scrobbles"] == 3
+        assert stats["decisions"] == {"miss": 1, "scrobbled": 3}
+        assert stats["top_tracks"][0] == ("Y", "Song", 2)
+        assert history.last_scrobble("y") == 3.0
+        assert history.last_scrobble("unknown") is None
+
+    def test_retention_deletes_old_events(self, tmp_path):
+        """Test that the writer deletes events older than the retention period."""
+        path = str(tmp_path / "history.db")
+        history = PlayHistory(path, flush_interval=0.05, retention_days=30, prune_interval=0)
+        now = time.time()
+        history.record_decision("miss", timestamp=now - 31 * 86400)
+        history.record_decision("miss", timestamp=now - 29 * 86400)
+        assert history.flush(5)
+        history.record_decision("miss", timestamp=now)
+        history.close()
+
+        assert rows(path, "SELECT timestamp FROM events ORDER BY id") == [
+            (now - 29 * 86400,),
+            (now,),
+        ]
+
+    def test_reopens_existing_database(self, tmp_path):
+        """Test that history accumulates across restarts."""
+        path = str(tmp_path / "history.db")
+        for _ in range(2):
+            history = PlayHistory(path)
+            history.record_decision("miss")
+            history.close()
+        assert len(rows(path)) == 2
+
+
+class TestProcessResultHistory:
+    """Test that process_result records what it does."""
+
+    def test_records_decisions(self, history):
+        """Test scrobble, duplicate and miss decisions."""
+        dedupe = DedupeIndex()
+        with patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None), \
+             patch("autoscrobbler.__main__.scrobble_song"):
+            process_result(SONG_RESULT, Mock(), "user", dedupe, history)
+            process_result(SONG_RESULT, Mock(), "user", dedupe, history)
+            process_result({}, Mock(), "user", dedupe, history)
+        history.flush(5)
+
+        decisions = [detail for kind, _, detail in rows(history.path) if kind == DECISION]
+        assert decisions == ["scrobbled", "duplicate_local", "miss"]
+        assert history.count(SCROBBLE) == 1
+        assert history.count(IDENTIFICATION) == 3
+
+
+class TestMainHistory:
+    """Test play history in main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track")
+    @patch("autoscrobbler.__main__.scrobble_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_records_history_instead_of_json_dump(
+        self,
+        mock_sleep,
+        mock_scrobble,
+        mock_get_last,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+        monkeypatch,
+    ):
+        """Test that a cycle lands in the database and no JSON file is written."""
+        monkeypatch.chdir(tmp_path)
+        args = make_args(
+            input_source="auto", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_parse_args.return_value = args
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = SONG_RESULT
+        mock_get_last.return_value = None
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert not (tmp_path / "last_result.json").exists()
+        kinds = [kind for kind, _, _ in rows(args.history_db)]
+        assert kinds == [IDENTIFICATION, DECISION, SCROBBLE]
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    def test_stats_option(self, mock_parse_args, make_args, capsys):
+        """Test that --stats prints a summary and exits."""
+        args = make_args(stats=7.0)
+        history = PlayHistory(args.history_db)
+        history.record_scrobble("a\tb", "Artist", "Song", timestamp=time.time())
+        history.close()
+        mock_parse_args.return_value = args
+
+        main()
+
+        output = capsys.readouterr().out
+        assert "Scrobbles: 1" in output
+        assert "Artist - Song" in output
+
+    def test_stats_without_history(self, tmp_path, capsys):
+        """Test that a missing database is reported, not created."""
+        path = tmp_path / "missing.db"
+        print_stats(str(path), 7)
+        assert "No play history" in capsys.readouterr().out
+        assert not path.exists()
@@ -0,0 +1,286 @@
+"""Tests for the edge/hub split."""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import main
+from autoscrobbler.budget import spectral_profile
+from autoscrobbler.hub import (
+    SUBMIT_PATH,
+    Hub,
+    HubClient,
+    Submission,
+    decode_submission,
+    encode_submission,
+    start_hub_server,
+)
+from autoscrobbler.signature import signature_of
+
+SAMPLE_RATE = 16000
+SONG_RESULT = {"track": {"title": "Test Song", "subtitle": "Test Artist"}}
+
+
+def music(seconds=10, *frequencies, seed=0):
+    """Int16 mix of tones and noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = sum(np.sin(2 * np.pi * f * t * (1 + 0.05 * np.sin(t))) * 2000 for f in frequencies)
+    return (audio + rng.normal(0, 300, t.size)).astype(np.int16)
+
+
+def submission(*frequencies, node="edge", timestamp=1000.0, seconds=2):
+    """A decoded submission of a capture of the given tones."""
+    audio = music(seconds, *frequencies)
+    return Submission(
+        node,
+        signature_of(audio, SAMPLE_RATE),
+        spectral_profile(audio, SAMPLE_RATE),
+        timestamp,
+    )
+
+
+@pytest.fixture
+def hub():
+    """A hub with mocked identification and processing."""
+    hub = Hub(Mock(return_value=SONG_RESULT), Mock(), batch_window=0.2)
+    yield hub
+    hub.close()
+
+
+def submit_all(hub, submissions):
+    """Submit concurrently, as several edge nodes would."""
+    replies = [None] * len(submissions)
+
+    def run(i):
+        replies[i] = hub.submit(submissions[i], timeout=10)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(submissions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return replies
+
+
+class TestSubmissionEncoding:
+    """Test the wire format between edge and hub."""
+
+    @pytest.mark.unit
+    def test_round_trip_is_compact(self):
+        """Test that a 10 second capture travels as a few KB and decodes intact."""
+        audio = music(10, 300, 700, 1200, 2500)
+        signature = signature_of(audio, SAMPLE_RATE)
+        data = encode_submission("kitchen", signature, spectral_profile(audio, SAMPLE_RATE), 5.0)
+
+        assert len(data) < 16 * 1024 < audio.nbytes
+        decoded = decode_submission(data)
+        assert decoded.node == "kitchen"
+        assert decoded.timestamp == 5.0
+        assert decoded.peaks == sum(
+            len(p) for p in signature.frequency_band_to_sound_peaks.values()
+        )
+
+    def test_corrupt_signature_is_rejected(self):
+        """Test that the signature checksum is verified."""
+        message = json.loads(encode_submission("a", submission(440).signature, np.zeros(24), 1.0))
+        uri = message["signature"]
+        message["signature"] = uri[:-8] + ("A" if uri[-8] != "A" else "B") + uri[-7:]
+        with pytest.raises(ValueError, match="Invalid submission"):
+            decode_submission(json.dumps(message).encode())
+        with pytest.raises(ValueError):
+            decode_submission(b"{}")
+
+    def test_bad_profile_is_rejected(self):
+        """Test that profiles of the wrong length or with non-finite values are refused."""
+        signature = submission(440).signature
+        for profile in (np.zeros(5), np.full(24, np.inf)):
+            with pytest.raises(ValueError, match="Invalid submission"):
+                decode_submission(encode_submission("a", signature, profile, 1.0))
+
+
+class TestHub:
+    """Test batching, grouping and caching."""
+
+    def test_same_song_from_several_rooms_is_identified_once(self, hub):
+        """Test that similar captures in one batch share a single call and scrobble."""
+        replies = submit_all(hub, [
+            submission(300, 700, 1200, node="kitchen", timestamp=1001.0),
+            submission(300, 700, 1200, node="lounge", timestamp=1000.0),
+            submission(200, 3000, node="garage"),
+        ])
+
+        assert hub.identify.call_count == 2
+        assert hub.process.call_count == 2
+        assert hub.process.call_args_list[0].args == (SONG_RESULT, 1000.0)
+        assert replies[0] == replies[1]
+        assert replies[0]["track"] == {"artist": "Test Artist", "title": "Test Song"}
+        assert replies[0]["batched"] == 2
+        assert replies[2]["batched"] == 1
+
+    def test_identified_song_is_cached(self, hub):
+        """Test that a later capture of the same song does not call Shazam."""
+        cached = metrics.HUB_SUBMISSIONS.value(source="cache")
+        hub.submit(submission(300, 700, 1200), timeout=10)
+        reply = hub.submit(submission(300, 700, 1200, timestamp=1060.0), timeout=10)
+
+        assert hub.identify.call_count == 1
+        assert reply["source"] == "cache"
+        assert hub.process.call_count == 2  # dedupe is left to process_result
+        assert metrics.HUB_SUBMISSIONS.value(source="cache") == cached + 1
+
+    def test_worker_survives_a_bad_batch(self, hub):
+        """Test that a batch the worker cannot group is answered and later submissions still are."""
+        good, bad = submission(300, 700), submission(300, 700)
+        bad.profile = bad.profile[:5]
+        for queued in (good, bad):  # queued together, so they land in one batch
+            hub._queue.put(queued)
+        for queued in (good, bad):
+            assert queued.done.wait(10)
+            assert "error" in queued.reply
+
+        assert hub.submit(submission(300, 700), timeout=10)["track"]["title"] == "Test Song"
+
+    def test_identification_error_is_reported(self, hub):
+        """Test that a failed Shazam call answers every member of the group."""
+        hub.identify.side_effect = ConnectionError("offline")
+        reply = hub.submit(submission(440), timeout=10)
+        assert reply == {"error": "offline"}
+        hub.process.assert_not_called()
+
+
+class TestHubServer:
+    """Test the HTTP endpoint and client over localhost."""
+
+    @pytest.fixture
+    def server(self, hub):
+        """A hub server on a free port."""
+        server = start_hub_server(hub, 0, host="127.0.0.1")
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+        server.shutdown()
+        server.server_close()
+
+    def test_client_submits_to_server(self, server):
+        """Test an edge node identifying a capture through the hub."""
+        audio = music(2, 300, 700)
+        uploaded = metrics.HUB_UPLOAD_BYTES.value()
+        client = HubClient(server + "/", node="edge")
+
+        reply = client.submit(
+            signature_of(audio, SAMPLE_RATE), spectral_profile(audio, SAMPLE_RATE), 1.0
+        )
+
+        assert reply["track"]["title"] == "Test Song"
+        assert 0 < metrics.HUB_UPLOAD_BYTES.value() - uploaded < 16 * 1024
+
+    def test_bad_requests(self, server):
+        """Test that unknown paths and malformed bodies are refused."""
+        for path, status in (("/other", 404), (SUBMIT_PATH, 400)):
+            request = urllib.request.Request(server + path, data=b"garbage")
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(request, timeout=5)
+            assert error.value.code == status
+
+    def test_bad_profile_then_good_one(self, server):
+        """Test that a submission with a bad profile is refused without stopping the hub."""
+        audio = music(2, 300, 700)
+        signature = signature_of(audio, SAMPLE_RATE)
+        request = urllib.request.Request(
+            server + SUBMIT_PATH, data=encode_submission("old", signature, np.zeros(5), 1.0)
+        )
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=5)
+        assert error.value.code == 400
+
+        reply = HubClient(server, node="edge").submit(signature, spectral_profile(audio, SAMPLE_RATE), 1.0)
+        assert reply["track"]["title"] == "Test Song"
+
+    def test_unreachable_hub(self):
+        """Test that a hub that is down raises ConnectionError."""
+        client = HubClient("http://127.0.0.1:9", node="edge", timeout=2)
+        with pytest.raises(ConnectionError, match="unavailable"):
+            client.submit(submission(440).signature, np.zeros(24), 1.0)
+
+
+class TestMainHub:
+    """Test edge and hub modes of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.hub.HubClient")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_edge_sends_fingerprint(
+        self,
+        mock_sleep,
+        mock_client_cls,
+        mock_identify,
+        mock_record,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+    ):
+        """Test that an edge node needs no credentials and never calls Shazam itself."""
+        args = make_args(
+            input_source="auto",
+            hub="http://hub.local:8765",
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        client = mock_client_cls.return_value
+        client.submit.return_value = {"track": {"artist": "A", "title": "B"}, "source": "shazam"}
+        mock_parse_args.return_value = args
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with patch("autoscrobbler.__main__.ThreadPoolExecutor") as mock_pool, \
+             patch("autoscrobbler.__main__.DedupeIndex") as mock_dedupe, \
+             patch("autoscrobbler.__main__.PlayHistory") as mock_history, \
+             pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        mock_load_creds.assert_not_called()
+        mock_identify.assert_not_called()
+        client.submit.assert_called_once()
+        assert mock_client_cls.call_args.args == ("http://hub.local:8765",)
+        # The hub keeps Last.fm, the dedupe index and the play history
+        mock_pool.assert_not_called()
+        mock_dedupe.assert_not_called()
+        mock_history.assert_not_called()
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.hub.start_hub_server")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_hub_mode(
+        self,
+        mock_sleep,
+        mock_start,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+    ):
+        """Test that hub mode serves fingerprints instead of capturing."""
+        mock_parse_args.return_value = make_args(hub_listen="127.0.0.1:9000")
+        mock_load_creds.return_value = sample_credentials
+        mock_sleep.side_effect = KeyboardInterrupt
+
+        main()
+
+        mock_select_device.assert_not_called()
+        assert mock_start.call_args.args[1] == 9000
+        assert mock_start.call_args.kwargs == {"host": "127.0.0.1"}
+        mock_start.return_value.shutdown.assert_called_once()
@@ -5,6 +5,7 @@ from unittest.mock import Mock, patch
 import pytest
 
 from autoscrobbler.__main__ import main
+from autoscrobbler.buffers import AudioBuffer
 
 
 class TestMainWorkflow:
@@ -33,10 +34,11 @@ class TestMainWorkflow:
         mock_load_creds,
         mock_select_device,
         mock_parse_args,
+        make_args,
     ):
         """Test successful main workflow execution."""
         # Mock command line arguments
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.credentials = None
         mock_args.duty_cycle = 60
         mock_args.input_source = "auto"
@@ -97,7 +99,9 @@ class TestMainWorkflow:
         mock_select_device.assert_called_once_with("auto")
         mock_load_creds.assert_called_once_with(None)
         mock_network.assert_called_once()
-        mock_record.assert_called_once_with(device=0)
+        mock_record.assert_called_once()
+        assert mock_record.call_args.kwargs["device"] == 0
+        assert isinstance(mock_record.call_args.kwargs["out"], AudioBuffer)
         mock_identify.assert_called_once()
         mock_scrobble.assert_called_once_with(
             mock_network_instance, "Test Artist", "Test Song", album="Test Album"
@@ -106,11 +110,11 @@ class TestMainWorkflow:
     @patch("autoscrobbler.__main__.parse_arguments")
     @patch("autoscrobbler.__main__.select_input_device")
     def test_main_workflow_device_selection_error(
-        self, mock_select_device, mock_parse_args
+        self, mock_select_device, mock_parse_args, make_args
     ):
         """Test main workflow when device selection fails."""
         # Mock command line arguments
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.input_source = "invalid_device"
         mock_parse_args.return_value = mock_args
 
@@ -127,11 +131,11 @@ class TestMainWorkflow:
     @patch("autoscrobbler.__main__.select_input_device")
     @patch("autoscrobbler.__main__.load_credentials")
     def test_main_workflow_credentials_error(
-        self, mock_load_creds, mock_select_device, mock_parse_args
+        self, mock_load_creds, mock_select_device, mock_parse_args, make_args
     ):
         """Test main workflow when credentials loading fails."""
         # Mock command line arguments
-        mock_args = Mock()
+        mock_args = make_args()
         mock_args.credentials = "/nonexistent/path"
         mock_parse_args.return_value = mock_args
 
@@ -167,10 +171,11 @@ class TestMainWorkflow:
         mock_load_creds,
         mock_select_device,
         mock_parse_args,
+        make_args,
     ):
         """Test main workflow when no song is identified."""
         # Mock command line arguments
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.credentials = None
         mock_args.duty_cycle = 60
         mock_args.input_source = "auto"
@@ -240,10 +245,11 @@ class TestMainWorkflow:
         mock_load_creds,
         mock_select_device,
         mock_parse_args,
+        make_args,
     ):
         """Test main workflow when the same song is identified twice."""
         # Mock command line arguments
-        mock_args = Mock()
+        mock_args = make_args(min_rms_dbfs=float("-inf"))  # mocked capture is silent
         mock_args.credentials = None
         mock_args.duty_cycle = 60
         mock_args.input_source = "auto"
@@ -0,0 +1,79 @@
+"""Tests for the simulated load test."""
+
+import pytest
+
+from autoscrobbler.loadtest import percentiles, run_load, score_scrobbles
+from autoscrobbler.loopback import Play
+from autoscrobbler.standins import Scrobble, Track
+
+ONE = Track("Artist", "One")
+TWO = Track("Artist", "Two")
+PLAYS = [Play(ONE, 0.0, 200.0), Play(TWO, 200.0, 400.0), Play(ONE, 400.0, 450.0), Play(TWO, 450.0, 700.0)]
+
+
+def scrobble(track, timestamp):
+    """A scrobble of a track."""
+    return Scrobble("user", track.artist, track.title, None, timestamp)
+
+
+class TestScoring:
+    """Test matching scrobbles to plays."""
+
+    @pytest.mark.unit
+    def test_score(self):
+        """Test correct, duplicate, wrong and missed scrobbles."""
+        score = score_scrobbles(
+            PLAYS,
+            [
+                scrobble(ONE, 40.0),
+                scrobble(ONE, 100.0),  # same play again
+                scrobble(Track("artist", "ONE"), 230.0),  # within the slack after One ended
+                scrobble(TWO, 150.0),  # not playing yet
+            ],
+            start=0.0,
+            end=700.0,
+            min_play=120.0,
+            slack=60.0,
+        )
+
+        assert (score.scrobbles, score.correct, score.duplicates, score.wrong) == (4, 1, 2, 1)
+        # The second play of Two was long enough and missed; One's was too short
+        assert score.missed == 2
+        assert score.time_to_scrobble == [40.0]
+
+    def test_plays_outside_the_span_are_not_missed(self):
+        """Test that plays before the first cycle or after the end are not expected."""
+        score = score_scrobbles(PLAYS, [], start=100.0, end=600.0, min_play=120.0, slack=60.0)
+        assert score.missed == 1
+
+    @pytest.mark.unit
+    def test_percentiles(self):
+        """Test the latency summaries."""
+        assert percentiles([]) == {"p50": None, "p99": None, "max": None}
+        assert percentiles([1.0, 2.0, 3.0], scale=1000.0)["max"] == 3000.0
+
+
+class TestRunLoad:
+    """Test a short simulation end to end."""
+
+    @pytest.mark.slow
+    def test_simulated_node_scrobbles_what_it_hears(self, tmp_path):
+        """Test one node running main() against the stand-ins at 60 times real time."""
+        report = run_load(
+            nodes=1,
+            speed=60.0,
+            duration=420.0,
+            tracks=2,
+            track_seconds=130.0,
+            workdir=str(tmp_path),
+            startup=3.0,
+        )
+
+        [node] = report["per_node"]
+        assert node["exit_code"] == 0
+        assert node["cycles"] >= 4
+        assert report["scrobbles"]["correct"] >= 2
+        assert report["scrobbles"]["wrong"] == 0
+        assert report["scrobbles"]["duplicates"] == 0
+        assert report["latency"]["cycle_ms"]["p99"] is not None
+        assert report["throughput"]["shazam_requests_per_second"] > 0
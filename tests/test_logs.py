@@ -0,0 +1,231 @@
+"""Tests for queued, repeat-sampled logging."""
+
+import io
+import json
+import logging
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from autoscrobbler import logs, metrics
+from autoscrobbler.__main__ import main
+
+
+def make_record(msg, *args, created=1000.0, level=logging.INFO, name="autoscrobbler"):
+    """A log record as if logged at ``created``."""
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.created = created
+    return record
+
+
+class SlowStream(io.StringIO):
+    """A stream that blocks each write until released, like stderr under backpressure."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class TestRepeatFilter:
+    """Test sampling of repeated messages."""
+
+    @pytest.mark.unit
+    def test_burst_then_sample(self):
+        """Test that the first repeats pass, then one in every ``sample``."""
+        repeats = logs.RepeatFilter(burst=3, sample=10)
+        passed = [
+            i for i in range(1, 31) if repeats.filter(make_record("No song identified.", created=1000.0 + i))
+        ]
+        assert passed == [1, 2, 3, 13, 23]
+
+    @pytest.mark.unit
+    def test_passed_record_counts_suppressed(self):
+        """Test that the next record let through notes the repeats suppressed before it."""
+        repeats = logs.RepeatFilter(burst=1, sample=5)
+        records = [make_record("Nothing new.", created=1000.0 + i) for i in range(6)]
+        passed = [r for r in records if repeats.filter(r)]
+        assert passed == [records[0], records[5]]
+        assert not hasattr(records[0], "suppressed")
+        assert records[5].suppressed == 4
+
+    @pytest.mark.unit
+    def test_numbers_are_ignored(self):
+        """Test that messages differing only in their numbers count as repeats."""
+        repeats = logs.RepeatFilter(burst=1, sample=100)
+        assert repeats.filter(make_record("Processing took 9.8s, sleeping for 50.2s"))
+        assert not repeats.filter(make_record("Processing took 10.1s, sleeping for 49.9s"))
+        assert repeats.filter(make_record("Identified %s", "A - B"))
+        assert not repeats.filter(make_record("Identified %s", "C - D"))
+
+    @pytest.mark.unit
+    def test_level_and_logger_distinguish_messages(self):
+        """Test that the same text at another level or from another logger is new."""
+        repeats = logs.RepeatFilter(burst=1, sample=100)
+        assert repeats.filter(make_record("Timeout"))
+        assert repeats.filter(make_record("Timeout", level=logging.WARNING))
+        assert repeats.filter(make_record("Timeout", name="pylast"))
+
+    @pytest.mark.unit
+    def test_quiet_window_resets(self):
+        """Test that a message is new again after a window without it."""
+        repeats = logs.RepeatFilter(burst=1, sample=100, window=60)
+        assert repeats.filter(make_record("Device lost", created=1000.0))
+        assert not repeats.filter(make_record("Device lost", created=1030.0))
+        assert repeats.filter(make_record("Device lost", created=1100.0))
+
+    @pytest.mark.unit
+    def test_zero_burst_disables(self):
+        """Test that a burst of 0 lets every record through."""
+        repeats = logs.RepeatFilter(burst=0)
+        assert all(repeats.filter(make_record("Same")) for _ in range(50))
+
+    @pytest.mark.unit
+    def test_remembers_bounded_messages(self):
+        """Test that the least recently seen message is forgotten first."""
+        repeats = logs.RepeatFilter(burst=1, sample=100, max_messages=2)
+        repeats.filter(make_record("first", created=1.0))
+        repeats.filter(make_record("second", created=2.0))
+        repeats.filter(make_record("third", created=3.0))
+        assert len(repeats._seen) == 2
+        assert repeats.filter(make_record("first", created=4.0))
+
+    @pytest.mark.unit
+    def test_counts_dropped_repeats(self):
+        """Test that suppressed repeats are counted."""
+        before = metrics.LOG_RECORDS_DROPPED.value(reason="repeat")
+        repeats = logs.RepeatFilter(burst=1, sample=100)
+        for _ in range(5):
+            repeats.filter(make_record("Again"))
+        assert metrics.LOG_RECORDS_DROPPED.value(reason="repeat") == before + 4
+
+
+class TestConfigureLogging:
+    """Test the queue between the logger and the stream."""
+
+    @pytest.mark.unit
+    def test_text_format(self):
+        """Test that records are written as text, noting suppressed repeats."""
+        stream = io.StringIO()
+        logs.configure_logging(stream=stream, repeats=1, sample=3)
+        logger = logging.getLogger("autoscrobbler.test")
+        for i in range(4):
+            logger.info("No song identified (attempt %d).", i)
+        logs.stop_logging()
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith("[INFO] No song identified (attempt 0).")
+        assert lines[1].endswith("No song identified (attempt 3). (2 similar messages suppressed)")
+
+    @pytest.mark.unit
+    def test_json_format(self):
+        """Test that records are written as one JSON object per line."""
+        stream = io.StringIO()
+        logs.configure_logging("json", stream=stream)
+        logger = logging.getLogger("autoscrobbler.test")
+        logger.warning("Scrobble of %s failed", "Artist - Title")
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("Cycle failed")
+        logs.stop_logging()
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert first["level"] == "WARNING"
+        assert first["logger"] == "autoscrobbler.test"
+        assert first["message"] == "Scrobble of Artist - Title failed"
+        assert first["thread"] == threading.current_thread().name
+        assert first["time"].endswith("+00:00")
+        assert "exception" not in first
+        assert second["message"] == "Cycle failed"
+        assert "RuntimeError: boom" in second["exception"]
+
+    @pytest.mark.unit
+    def test_unknown_format(self):
+        """Test that an unknown format is rejected."""
+        with pytest.raises(ValueError, match="Unknown log format"):
+            logs.configure_logging("xml")
+
+    @pytest.mark.unit
+    def test_level(self):
+        """Test that the root level is set unless None is given."""
+        logs.configure_logging(stream=io.StringIO(), level="WARNING")
+        assert logging.getLogger().level == logging.WARNING
+        logs.configure_logging(stream=io.StringIO(), level=None)
+        assert logging.getLogger().level == logging.WARNING
+
+    @pytest.mark.unit
+    def test_reconfigure_replaces_queue(self):
+        """Test that configuring again leaves a single queue handler on the root logger."""
+        logs.configure_logging(stream=io.StringIO())
+        logs.configure_logging(stream=io.StringIO())
+        queued = [h for h in logging.getLogger().handlers if isinstance(h, logs._DroppingQueueHandler)]
+        assert len(queued) == 1
+        logs.stop_logging()
+        assert not any(isinstance(h, logs._DroppingQueueHandler) for h in logging.getLogger().handlers)
+
+    @pytest.mark.unit
+    def test_slow_stream_does_not_block(self):
+        """Test that logging returns at once while the stream is blocked."""
+        stream = SlowStream()
+        logs.configure_logging(stream=stream, repeats=0)
+        logger = logging.getLogger("autoscrobbler.test")
+        began = time.perf_counter()
+        for i in range(100):
+            logger.info("Record %d", i)
+        elapsed = time.perf_counter() - began
+        stream.release.set()
+        logs.stop_logging()
+        assert elapsed < 1.0
+        assert len(stream.getvalue().splitlines()) == 100
+
+    @pytest.mark.unit
+    def test_full_queue_drops(self):
+        """Test that records are dropped and counted once the queue is full."""
+        before = metrics.LOG_RECORDS_DROPPED.value(reason="queue_full")
+        stream = SlowStream()
+        logs.configure_logging(stream=stream, repeats=0, queue_size=5)
+        logger = logging.getLogger("autoscrobbler.test")
+        for i in range(50):
+            logger.info("Record %d", i)
+        stream.release.set()
+        logs.stop_logging()
+        dropped = metrics.LOG_RECORDS_DROPPED.value(reason="queue_full") - before
+        assert dropped >= 50 - 5 - 1
+        assert len(stream.getvalue().splitlines()) == 50 - dropped
+
+    @pytest.mark.unit
+    def test_other_handlers_see_every_record(self, caplog):
+        """Test that sampling only applies to the written log."""
+        logs.configure_logging(stream=io.StringIO(), repeats=1)
+        with caplog.at_level(logging.INFO):
+            for _ in range(5):
+                logging.getLogger("autoscrobbler.test").info("No song identified.")
+        assert caplog.text.count("No song identified.") == 5
+
+
+class TestLoggingArguments:
+    """Test the logging options of the main loop."""
+
+    @pytest.mark.unit
+    def test_main_configures_logging(self, make_args):
+        """Test that main sets up logging from its arguments before anything else."""
+        args = make_args(log_format="json", log_level="DEBUG", log_repeats=0, log_repeat_sample=4, stats=7)
+        with patch("autoscrobbler.__main__.parse_arguments", return_value=args), \
+             patch("autoscrobbler.__main__.print_stats"), \
+             patch("autoscrobbler.logs.configure_logging") as configure:
+            main()
+        configure.assert_called_once_with("json", level="DEBUG", repeats=0, sample=4)
+
+    @pytest.mark.unit
+    def test_defaults(self, make_args):
+        """Test the default logging options."""
+        args = make_args()
+        assert args.log_format == "text"
+        assert args.log_level == "INFO"
+        assert args.log_repeats == 3
+        assert args.log_repeat_sample == 10
@@ -0,0 +1,154 @@
+"""Tests for the loopback audio backend and scaled clock."""
+
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from autoscrobbler.__main__ import record_audio
+from autoscrobbler.buffers import BufferPool
+from autoscrobbler.loopback import (
+    ClockStopped,
+    LoopbackDevice,
+    LoopbackSoundDevice,
+    ScaledClock,
+    VirtualClock,
+    read_track,
+)
+from autoscrobbler.standins import Track
+
+RATE = 100
+ONE = Track("A", "One")
+TWO = Track("B", "Two")
+
+
+def device(start=1000.0):
+    """A device alternating a 2 s track of ones and a 3 s track of twos."""
+    return LoopbackDevice(
+        "Loopback",
+        [(ONE, np.full(2 * RATE, 1, np.int16)), (TWO, np.full(3 * RATE, 2, np.int16))],
+        RATE,
+        start=start,
+    )
+
+
+class StoppedClock(ScaledClock):
+    """Clock standing still at a chosen simulated time."""
+
+    def __init__(self, now):
+        super().__init__(speed=1000.0)
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+class TestScaledClock:
+    """Test the faster wall clock."""
+
+    @pytest.mark.unit
+    def test_time_runs_faster(self):
+        """Test that simulated time advances speed times faster than real time."""
+        clock = ScaledClock(speed=100.0, origin=time.time(), epoch=0.0)
+        started = time.perf_counter()
+        clock.sleep(5.0)
+
+        assert time.perf_counter() - started < 1.0
+        assert clock.time() >= 5.0
+        assert clock.to_real(100.0) == pytest.approx(clock.origin + 1.0)
+        assert clock.perf_counter is time.perf_counter
+
+    def test_speed_must_be_positive(self):
+        """Test that a stopped or reversed clock is refused."""
+        with pytest.raises(ValueError):
+            ScaledClock(speed=0)
+
+
+class TestLoopbackDevice:
+    """Test playback of a looping playlist."""
+
+    @pytest.mark.unit
+    def test_read_spans_tracks_and_loops(self):
+        """Test reads across a track change, the loop and the start."""
+        loop = device()
+
+        assert list(loop.read(1001.5, 100)) == [1] * 50 + [2] * 50
+        assert list(loop.read(1004.5, 100)) == [2] * 50 + [1] * 50
+        assert list(loop.read(999.5, 100)) == [0] * 50 + [1] * 50
+
+    def test_plays(self):
+        """Test the plays of the looping playlist."""
+        plays = device(start=0.0).plays(until=7.0)
+
+        assert [(p.track, p.start, p.end) for p in plays] == [
+            (ONE, 0.0, 2.0), (TWO, 2.0, 5.0), (ONE, 5.0, 7.0),
+        ]
+
+    def test_read_track(self, tmp_path):
+        """Test that files are named after their track and resampled."""
+        path = tmp_path / "Some Artist - Some Title.wav"
+        sf.write(path, np.zeros((200, 2), dtype=np.int16), 200)
+
+        track, audio = read_track(str(path), sample_rate=RATE)
+
+        assert track == Track("Some Artist", "Some Title", key="Some Artist - Some Title")
+        assert audio.dtype == np.int16
+        assert audio.size == 100
+
+
+class TestLoopbackSoundDevice:
+    """Test recording through the sounddevice interface."""
+
+    def test_record_audio_into_pooled_buffer(self, monkeypatch):
+        """Test that record_audio captures what the device is playing."""
+        clock = StoppedClock(now=1001.0)
+        sd = LoopbackSoundDevice([device()], clock)
+        monkeypatch.setattr("autoscrobbler.__main__.sd", sd)
+        pool = BufferPool(frames=2 * RATE, sample_rate=RATE, size=1)
+
+        with pool.acquire() as buffer:
+            audio = record_audio(sample_rate=RATE, device=0, out=buffer)
+            assert list(audio) == [1] * 100 + [2] * 100
+
+        assert clock.slept == [2.0]
+        assert sd.query_devices(kind="input")["name"] == "Loopback"
+        assert sd.query_hostapis() == [{"name": "Loopback"}]
+
+    def test_sample_rate_must_match(self):
+        """Test that recording at another rate than the files is refused."""
+        sd = LoopbackSoundDevice([device()], StoppedClock(now=0.0))
+        with pytest.raises(ValueError, match="plays at 100 Hz"):
+            sd.rec(10, samplerate=44100, channels=1, dtype="int16")
+
+
+class TestVirtualClock:
+    """Test the clock that only advances when slept on."""
+
+    @pytest.mark.unit
+    def test_sleep_advances_until_the_end(self):
+        """Test that sleeping takes no time and stops at the end."""
+        clock = VirtualClock(start=100.0, end=130.0)
+        started = time.perf_counter()
+        clock.sleep(20.0)
+
+        assert clock.time() == clock.monotonic() == 120.0
+        with pytest.raises(ClockStopped):
+            clock.sleep(10.0)
+        assert time.perf_counter() - started < 1.0
+        assert clock.perf_counter is time.perf_counter
+
+    def test_recordings_are_timed(self):
+        """Test that the device notes when its latest recording started."""
+        clock = VirtualClock(start=1001.0)
+        sd = LoopbackSoundDevice([device()], clock)
+
+        sd.rec(2 * RATE, samplerate=RATE, channels=1, dtype="int16")
+        sd.wait()
+
+        assert sd.last_recording == (1001.0, 2.0)
+        assert clock.time() == 1003.0
@@ -0,0 +1,165 @@
+"""Tests for the Prometheus-style metrics and their instrumentation."""
+
+import urllib.error
+import urllib.request
+from unittest.mock import Mock, patch
+
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import process_result
+from autoscrobbler.dedupe import DedupeIndex
+from autoscrobbler.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    start_metrics_server,
+)
+
+SONG_RESULT = {"track": {"title": "Test Song", "subtitle": "Test Artist"}}
+
+
+class TestMetricTypes:
+    """Test counters, gauges and histograms."""
+
+    @pytest.mark.unit
+    def test_counter_with_labels(self):
+        """Test counting per label set and exposition format."""
+        counter = Counter("test_events", "Events.", ["kind"])
+        counter.inc(kind="a")
+        counter.inc(2, kind="b")
+
+        assert counter.value(kind="a") == 1
+        text = counter.expose()
+        assert "# TYPE test_events counter" in text
+        assert 'test_events_total{kind="a"} 1' in text
+        assert 'test_events_total{kind="b"} 2' in text
+
+    def test_counter_rejects_bad_usage(self):
+        """Test that counters refuse decrements and unknown labels."""
+        counter = Counter("test_events", "Events.", ["kind"])
+        with pytest.raises(ValueError, match="only increase"):
+            counter.inc(-1, kind="a")
+        with pytest.raises(ValueError, match="expects labels"):
+            counter.inc(other="a")
+
+    def test_gauge_set_and_function(self):
+        """Test static and scrape-time gauge values."""
+        gauge = Gauge("test_depth", "Depth.", ["queue"])
+        gauge.set(3, queue="static")
+        gauge.set_function(lambda: 7, queue="live")
+
+        assert gauge.value(queue="live") == 7
+        text = gauge.expose()
+        assert 'test_depth{queue="static"} 3' in text
+        assert 'test_depth{queue="live"} 7' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test bucket counts, sum and count lines."""
+        histogram = Histogram("test_seconds", "Latency.", buckets=[0.1, 1.0])
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+
+        text = histogram.expose()
+        assert 'test_seconds_bucket{le="0.1"} 1' in text
+        assert 'test_seconds_bucket{le="1"} 3' in text
+        assert 'test_seconds_bucket{le="+Inf"} 4' in text
+        assert "test_seconds_sum 6.05" in text
+        assert "test_seconds_count 4" in text
+
+    def test_histogram_time_observes_on_error(self):
+        """Test that timing a failing block still records an observation."""
+        histogram = Histogram("test_seconds", "Latency.")
+        with pytest.raises(RuntimeError):
+            with histogram.time():
+                raise RuntimeError("boom")
+        assert histogram.count == 1
+
+    def test_registry_rejects_duplicates(self):
+        """Test that metric names are unique within a registry."""
+        registry = Registry()
+        registry.register(Counter("test_events", "Events."))
+        with pytest.raises(ValueError, match="already registered"):
+            registry.register(Counter("test_events", "Events."))
+
+
+class TestMetricsServer:
+    """Test the /metrics HTTP endpoint."""
+
+    def test_serves_metrics(self):
+        """Test that /metrics returns the registry in text format."""
+        registry = Registry()
+        registry.register(Counter("test_events", "Events.")).inc()
+        server = start_metrics_server(0, registry=registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                body = response.read().decode()
+                assert response.headers["Content-Type"].startswith("text/plain")
+            assert "test_events_total 1" in body
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other")
+        finally:
+            server.shutdown()
+
+
+class TestPipelineInstrumentation:
+    """Test that the pipeline records its outcomes."""
+
+    def test_process_result_counts_hits_and_misses(self):
+        """Test identification hit and miss counters."""
+        hits = metrics.IDENTIFICATIONS.value(result="hit")
+        misses = metrics.IDENTIFICATIONS.value(result="miss")
+
+        process_result({}, Mock(), "user", DedupeIndex())
+        with patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None), \
+             patch("autoscrobbler.__main__.scrobble_song"):
+            process_result(SONG_RESULT, Mock(), "user", DedupeIndex())
+
+        assert metrics.IDENTIFICATIONS.value(result="miss") == misses + 1
+        assert metrics.IDENTIFICATIONS.value(result="hit") == hits + 1
+
+    def test_process_result_counts_dedupe_skips(self):
+        """Test dedupe counters for local and Last.fm duplicates."""
+        local = metrics.DEDUPE_SKIPS.value(source="local")
+        remote = metrics.DEDUPE_SKIPS.value(source="lastfm")
+
+        with patch(
+            "autoscrobbler.__main__.get_last_scrobbled_track",
+            return_value=("test artist", "test song"),
+        ) as mock_get_last, patch("autoscrobbler.__main__.scrobble_song") as mock_scrobble:
+            dedupe = DedupeIndex()
+            process_result(SONG_RESULT, Mock(), "user", dedupe)
+            process_result(SONG_RESULT, Mock(), "user", dedupe)
+            mock_scrobble.assert_not_called()
+            assert mock_get_last.call_count == 1
+
+        assert metrics.DEDUPE_SKIPS.value(source="local") == local + 1
+        assert metrics.DEDUPE_SKIPS.value(source="lastfm") == remote + 1
+
+    def test_lastfm_latency_recorded(self, mock_pylast):
+        """Test that scrobbles and lookups are timed."""
+        from autoscrobbler.__main__ import get_last_scrobbled_track, scrobble_song
+
+        scrobbles = metrics.LASTFM_SCROBBLE_SECONDS.count
+        lookups = metrics.LASTFM_LOOKUP_SECONDS.count
+
+        scrobble_song(mock_pylast, "Artist", "Title")
+        get_last_scrobbled_track(mock_pylast, "user")
+
+        assert metrics.LASTFM_SCROBBLE_SECONDS.count == scrobbles + 1
+        assert metrics.LASTFM_LOOKUP_SECONDS.count == lookups + 1
+
+    def test_global_registry_exposes_pipeline_metrics(self):
+        """Test that every pipeline metric is in the default registry."""
+        text = metrics.REGISTRY.expose()
+        for name in (
+            "autoscrobbler_capture_seconds",
+            "autoscrobbler_shazam_seconds",
+            "autoscrobbler_lastfm_lookup_seconds",
+            "autoscrobbler_lastfm_scrobble_seconds",
+            "autoscrobbler_cycle_overruns",
+            "autoscrobbler_queue_depth",
+        ):
+            assert f"# TYPE {name}" in text
@@ -0,0 +1,232 @@
+"""Tests for the local now playing feed."""
+
+import base64
+import json
+import os
+import socket
+import time
+import urllib.request
+from unittest.mock import Mock, patch
+
+import pytest
+
+from autoscrobbler import metrics, nowplaying
+from autoscrobbler.__main__ import main, process_result
+from autoscrobbler.dedupe import DedupeIndex
+from autoscrobbler.nowplaying import NowPlaying, websocket_accept, websocket_frame
+
+SONG_RESULT = {
+    "track": {
+        "title": "Test Song",
+        "subtitle": "Test Artist",
+        "sections": [{"type": "SONG", "metadata": [{"title": "Album", "text": "Test Album"}]}],
+    }
+}
+
+
+def wait_for(condition, timeout=5.0):
+    """Poll until a condition holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def read_line(stream):
+    """Read one JSON line from a subscriber socket's file."""
+    return json.loads(stream.readline())
+
+
+def connect_websocket(port):
+    """Open a WebSocket connection with a raw socket."""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((
+        "GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+        f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n"
+    ).encode())
+    stream = sock.makefile("rb")
+    head = b""
+    while not head.endswith(b"\r\n\r\n"):
+        head += stream.readline()
+    assert head.startswith(b"HTTP/1.1 101")
+    assert f"Sec-WebSocket-Accept: {websocket_accept(key)}".encode() in head
+    return sock, stream
+
+
+def read_frame(stream):
+    """Read one unmasked server frame."""
+    first, second = stream.read(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(stream.read(2), "big")
+    return first & 0x0F, stream.read(length)
+
+
+def client_frame(payload, opcode):
+    """A masked client frame."""
+    mask = b"\x01\x02\x03\x04"
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + masked
+
+
+@pytest.fixture
+def feed(tmp_path):
+    """A publisher on a Unix socket and a free TCP port."""
+    publisher = NowPlaying(str(tmp_path / "feed.sock"), ("127.0.0.1", 0))
+    yield publisher
+    publisher.close()
+
+
+class TestNowPlaying:
+    """Test fan-out, snapshots and the WebSocket endpoint."""
+
+    @pytest.mark.unit
+    def test_websocket_accept(self):
+        """Test the handshake answer against the example in RFC 6455."""
+        assert websocket_accept("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+        assert websocket_frame(b"x" * 200)[:4] == bytes([0x81, 126, 0, 200])
+
+    def test_snapshot_ignores_older_identifications(self):
+        """Test that a backfilled identification does not replace the current track."""
+        publisher = NowPlaying()
+        publisher.identified("b", "B", "Now", None, 2000.0)
+        publisher.identified("a", "A", "Earlier", None, 1000.0)
+        publisher.scrobbled("b", "B", "Now", None, 2000.0)
+
+        snapshot = publisher.snapshot
+        assert snapshot["type"] == "now_playing"
+        assert snapshot["title"] == "Now"
+        assert snapshot["scrobbled"] is True
+
+    def test_stream_subscribers(self, feed):
+        """Test that late subscribers get the snapshot and then every event."""
+        feed.identified("k", "Artist", "Song", "Album", 1000.0)
+        subscribers = []
+        for _ in range(3):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(feed.socket_path)
+            subscribers.append((sock, sock.makefile("rb")))
+        wait_for(lambda: feed.subscribers == 3)
+        events = metrics.NOW_PLAYING_EVENTS.value(type="scrobbled")
+
+        feed.scrobbled("k", "Artist", "Song", "Album", 1000.0)
+
+        for sock, stream in subscribers:
+            assert read_line(stream)["type"] == "now_playing"
+            assert read_line(stream) == {
+                "type": "scrobbled",
+                "key": "k",
+                "artist": "Artist",
+                "title": "Song",
+                "album": "Album",
+                "timestamp": 1000.0,
+            }
+            stream.close()
+            sock.close()
+        assert metrics.NOW_PLAYING_EVENTS.value(type="scrobbled") == events + 1
+        wait_for(lambda: feed.subscribers == 0)
+
+    def test_websocket_subscriber(self, feed):
+        """Test events, ping and close over WebSocket."""
+        sock, stream = connect_websocket(feed.port)
+        wait_for(lambda: feed.subscribers == 1)
+        feed.miss(1000.0)
+        assert read_frame(stream) == (0x1, b'{"type":"miss","timestamp":1000.0}')
+
+        sock.sendall(client_frame(b"hi", 0x9))
+        assert read_frame(stream) == (0xA, b"hi")
+        sock.sendall(client_frame(b"\x03\xe8", 0x8))
+        assert read_frame(stream) == (0x8, b"\x03\xe8")
+        wait_for(lambda: feed.subscribers == 0)
+        sock.close()
+
+    def test_http_snapshot(self, feed):
+        """Test that a plain GET returns the current track for polling clients."""
+        url = f"http://127.0.0.1:{feed.port}/"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert json.loads(response.read()) is None
+        feed.identified("k", "Artist", "Song", None, 1000.0)
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert json.loads(response.read())["artist"] == "Artist"
+
+    def test_slow_subscriber_is_dropped(self, feed):
+        """Test that a subscriber that stops reading cannot stall publishing."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(feed.socket_path)
+        wait_for(lambda: feed.subscribers == 1)
+
+        feed.publish({"type": "identified", "key": "k", "timestamp": 1.0, "blob": "x" * 2**23})
+
+        assert feed.subscribers == 0
+        sock.close()
+
+
+class TestProcessResultNowPlaying:
+    """Test the events published while processing results."""
+
+    @pytest.fixture
+    def publisher(self):
+        """A fresh process-wide publisher without sockets."""
+        publisher = nowplaying.configure_publisher()
+        yield publisher
+        publisher.close()
+
+    def test_identification_and_scrobble(self, publisher):
+        """Test that a scrobbled song is published with its album."""
+        with patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None), \
+             patch.object(publisher, "publish", wraps=publisher.publish) as publish:
+            process_result(SONG_RESULT, Mock(), "user", DedupeIndex(), timestamp=1000.0)
+            process_result({}, Mock(), "user", DedupeIndex(), timestamp=1010.0)
+
+        assert [call.args[0]["type"] for call in publish.call_args_list] == [
+            "identified",
+            "scrobbled",
+            "miss",
+        ]
+        assert publisher.snapshot["album"] == "Test Album"
+        assert publisher.snapshot["scrobbled"] is True
+
+
+class TestMainNowPlaying:
+    """Test the now playing options of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.nowplaying.configure_publisher")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_starts_and_closes_feed(
+        self,
+        mock_sleep,
+        mock_configure,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that the feed is bound as requested and closed on exit."""
+        path = str(tmp_path / "feed.sock")
+        mock_parse_args.return_value = make_args(
+            input_source="auto", now_playing_socket=path, now_playing_port=0
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        mock_configure.assert_called_once_with(path, ("127.0.0.1", 0))
+        mock_configure.return_value.close.assert_called_once()
@@ -0,0 +1,183 @@
+"""Tests for on-demand cProfile and tracemalloc sessions."""
+
+import os
+import pstats
+import signal
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+from autoscrobbler.__main__ import main
+from autoscrobbler.profiling import Profiler
+from autoscrobbler.shazam_client import EventLoopThread
+
+
+def busy_cycle(leak):
+    """Stand-in for a main loop cycle that retains some memory."""
+    leak.append(bytearray(64 * 1024))
+    return sum(range(1000))
+
+
+def leak_between_sessions(leak):
+    """Retain 16 MiB outside of any session."""
+    leak.extend(bytearray(1 << 20) for _ in range(16))
+
+
+async def work_on_loop():
+    """Stand-in for Shazam work on the event loop thread."""
+    return sum(range(1000))
+
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    """Stop tracemalloc left running by sessions."""
+    yield
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+class TestProfiler:
+    """Test profiling sessions."""
+
+    @pytest.mark.unit
+    def test_idle_until_requested(self, tmp_path):
+        """Test that nothing is recorded without a request."""
+        profiler = Profiler(str(tmp_path / "profiles"), cycles=2)
+        profiler.before_cycle()
+        profiler.after_cycle()
+
+        assert not profiler.active
+        assert not (tmp_path / "profiles").exists()
+
+    def test_session_covers_requested_cycles(self, tmp_path):
+        """Test that a session records N cycles and writes its reports."""
+        directory = tmp_path / "profiles"
+        profiler = Profiler(str(directory), cycles=2)
+        leak = []
+        profiler.request()
+
+        for expected_active in (True, True, False):
+            profiler.before_cycle()
+            assert profiler.active == expected_active
+            busy_cycle(leak)
+            profiler.after_cycle()
+
+        assert profiler.sessions == 1
+        assert tracemalloc.is_tracing()
+        profiler.close()
+        assert not tracemalloc.is_tracing()
+        assert len(list(directory.glob("*-cpu.txt"))) == 1
+        prof = next(directory.glob("*.prof"))
+        stats = pstats.Stats(str(prof))
+        assert any(func[2] == "busy_cycle" for func in stats.stats)
+        memory = next(directory.glob("*-memory.txt")).read_text()
+        assert "growth during session" in memory
+        assert "test_profiling.py" in memory
+
+    def test_second_session_reports_leak_between_sessions(self, tmp_path):
+        """Test that memory retained between sessions shows up as growth in the next one."""
+        directory = tmp_path / "profiles"
+        profiler = Profiler(str(directory), cycles=1)
+        leak = []
+        for session in range(2):
+            if session:
+                leak_between_sessions(leak)
+            profiler.request()
+            profiler.before_cycle()
+            busy_cycle(leak)
+            profiler.after_cycle()
+        profiler.close()
+
+        assert profiler.sessions == 2
+        first, second = sorted(directory.glob("*-memory.txt"))
+        assert "growth since previous session" not in first.read_text()
+        growth = second.read_text().split("== growth since previous session ==")[1].split("\n==")[0]
+        assert any("test_profiling.py" in line and "(+16.0 MiB)" in line for line in growth.splitlines())
+
+    def test_profiles_event_loop_thread(self, tmp_path):
+        """Test that work on a given event loop's thread is in the session's stats."""
+        loop = EventLoopThread(name="profiled")
+        try:
+            profiler = Profiler(str(tmp_path), cycles=1, loops=[loop.loop])
+            profiler.request()
+            profiler.before_cycle()
+            loop.run(work_on_loop())
+            profiler.after_cycle()
+        finally:
+            loop.close()
+
+        stats = pstats.Stats(str(next(tmp_path.glob("*.prof"))))
+        assert any(func[2] == "work_on_loop" for func in stats.stats)
+
+    def test_leaves_existing_tracemalloc_running(self, tmp_path):
+        """Test that a session does not stop tracing someone else started."""
+        tracemalloc.start()
+        try:
+            profiler = Profiler(str(tmp_path), cycles=1)
+            profiler.request()
+            profiler.before_cycle()
+            profiler.after_cycle()
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+    @pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="no SIGUSR1")
+    def test_signal_requests_session(self, tmp_path):
+        """Test that SIGUSR1 starts a session at the next cycle."""
+        profiler = Profiler(str(tmp_path), cycles=1)
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            assert profiler.install_signal_handler()
+            os.kill(os.getpid(), signal.SIGUSR1)
+            profiler.before_cycle()
+            assert profiler.active
+            profiler.after_cycle()
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        assert profiler.sessions == 1
+
+
+class TestMainProfiling:
+    """Test the --profile option of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_profile_writes_reports(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that --profile profiles the first cycles and keeps looping."""
+        directory = tmp_path / "profiles"
+        mock_parse_args.return_value = make_args(
+            input_source="auto", profile=True, profile_cycles=1, profile_dir=str(directory)
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = {}
+        mock_sleep.side_effect = [None, Exception("Stop execution")]
+
+        previous = signal.getsignal(signal.SIGUSR1) if hasattr(signal, "SIGUSR1") else None
+        try:
+            with pytest.raises(Exception, match="Stop execution"):
+                main()
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGUSR1, previous)
+
+        assert mock_record.call_count == 2
+        assert len(list(directory.glob("*.prof"))) == 1
@@ -0,0 +1,164 @@
+"""Tests for capture quality metrics and gating."""
+
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler.__main__ import main
+from autoscrobbler.quality import (
+    MIN_DB,
+    CaptureQuality,
+    QualityLog,
+    QualityThresholds,
+    measure_quality,
+)
+
+
+def tone(amplitude, seconds=1.0, sample_rate=44100):
+    """A 440 Hz sine at the given peak amplitude."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return np.clip(amplitude * np.sin(2 * np.pi * 440 * t), -32768, 32767).astype(np.int16)
+
+
+class TestMeasureQuality:
+    """Test the vectorized quality metrics."""
+
+    @pytest.mark.unit
+    def test_sine_level(self):
+        """Test RMS of a sine is 3 dB below its peak."""
+        quality = measure_quality(tone(16384))
+
+        assert quality.rms_dbfs == pytest.approx(-9.03, abs=0.05)
+        assert quality.clipping_ratio == 0.0
+        assert quality.dc_offset == pytest.approx(0.0, abs=1e-4)
+        assert not quality.overflow
+
+    def test_silence(self):
+        """Test that digital silence hits the dB floor."""
+        quality = measure_quality(np.zeros(44100, dtype=np.int16))
+
+        assert quality.rms_dbfs == MIN_DB
+        assert quality.snr_db == 0.0
+
+    def test_clipping_ratio(self):
+        """Test that samples at full scale are counted as clipped."""
+        quality = measure_quality(tone(60000))
+
+        assert 0.5 < quality.clipping_ratio < 0.9
+
+    def test_dc_offset(self):
+        """Test that a constant offset is reported as a fraction of full scale."""
+        quality = measure_quality(np.full(4096, 8192, dtype=np.int16))
+
+        assert quality.dc_offset == pytest.approx(0.25)
+
+    def test_snr_of_music_over_noise(self):
+        """Test that a tone gated over a noise floor yields a high SNR."""
+        rng = np.random.default_rng(0)
+        signal = tone(8000, seconds=2.0)
+        signal[: signal.size // 2] = 0
+        noise = rng.normal(0, 30, signal.size).astype(np.int16)
+
+        quality = measure_quality(signal + noise)
+
+        assert quality.snr_db > 30
+
+    def test_overflow_flag_passthrough(self):
+        """Test that the overflow flag is carried into the metrics."""
+        assert measure_quality(tone(1000), overflow=True).overflow
+
+
+class TestQualityThresholds:
+    """Test skipping identification for poor captures."""
+
+    def good(self, **changes):
+        """A capture that passes the default thresholds, with overrides."""
+        values = dict(
+            overflow=False, clipping_ratio=0.0, rms_dbfs=-20.0, dc_offset=0.0, snr_db=20.0
+        )
+        values.update(changes)
+        return CaptureQuality(**values)
+
+    def test_accepts_good_capture(self):
+        """Test that a clean capture is not rejected."""
+        assert QualityThresholds().rejection_reason(self.good()) is None
+
+    @pytest.mark.parametrize(
+        "thresholds, changes, reason",
+        [
+            (QualityThresholds(), {"rms_dbfs": -80.0}, "below -60.0 dBFS"),
+            (QualityThresholds(), {"clipping_ratio": 0.2}, "clipped"),
+            (QualityThresholds(min_snr_db=10), {"snr_db": 3.0}, "estimated SNR"),
+            (QualityThresholds(max_dc_offset=0.1), {"dc_offset": -0.3}, "DC offset"),
+            (QualityThresholds(skip_on_overflow=True), {"overflow": True}, "overflow"),
+        ],
+    )
+    def test_rejections(self, thresholds, changes, reason):
+        """Test each threshold rejects captures outside it."""
+        assert reason in thresholds.rejection_reason(self.good(**changes))
+
+    def test_optional_checks_disabled_by_default(self):
+        """Test that SNR, DC offset and overflow are not checked by default."""
+        capture = self.good(snr_db=-5.0, dc_offset=0.9, overflow=True)
+        assert QualityThresholds().rejection_reason(capture) is None
+
+
+class TestQualityLog:
+    """Test the quality time series file."""
+
+    def test_appends_json_lines(self, tmp_path):
+        """Test that each capture is appended as a timestamped record."""
+        path = tmp_path / "quality.jsonl"
+        log = QualityLog(str(path))
+        log.write(measure_quality(tone(1000)))
+        log.write(measure_quality(np.zeros(100, dtype=np.int16)), skipped="silence")
+        log.close()
+
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        assert len(records) == 2
+        assert records[0]["skipped"] is None
+        assert records[1]["skipped"] == "silence"
+        assert {"timestamp", "rms_dbfs", "clipping_ratio", "snr_db"} <= records[0].keys()
+
+
+class TestMainQualityGate:
+    """Test that main skips identification for rejected captures."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_silent_capture_not_identified(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that a silent capture is logged and never sent to Shazam."""
+        quality_log = tmp_path / "quality.jsonl"
+        mock_parse_args.return_value = make_args(
+            input_source="auto", quality_log=str(quality_log)
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        mock_record.assert_called_once()
+        mock_identify.assert_not_called()
+        record = json.loads(quality_log.read_text())
+        assert "dBFS" in record["skipped"]
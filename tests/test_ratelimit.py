@@ -0,0 +1,391 @@
+"""Tests for the Shazam rate limiter, retries and circuit breaker."""
+
+import asyncio
+import contextvars
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics, ratelimit
+from autoscrobbler.__main__ import identify_song, main
+from autoscrobbler.ratelimit import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    HTTPStatusError,
+    RequestLimiter,
+    TokenBucket,
+    backoff_delay,
+)
+from autoscrobbler.shazam_client import EventLoopThread, ShazamHTTPClient
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record asyncio sleeps in the limiter instead of waiting."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def limiter(**kwargs):
+    """A limiter with deterministic jitter and no token waits."""
+    options = {"rate": 100.0, "burst": 100, "rng": lambda: 0.5}
+    options.update(kwargs)
+    return RequestLimiter(**options)
+
+
+class TestBackoff:
+    """Test backoff delays."""
+
+    @pytest.mark.unit
+    def test_exponential_with_full_jitter(self):
+        """Test that the jitter ceiling doubles per attempt up to the cap."""
+        assert backoff_delay(1, 2.0, 60.0, rng=lambda: 1.0) == 2.0
+        assert backoff_delay(3, 2.0, 60.0, rng=lambda: 1.0) == 8.0
+        assert backoff_delay(10, 2.0, 60.0, rng=lambda: 1.0) == 60.0
+        assert backoff_delay(3, 2.0, 60.0, rng=lambda: 0.25) == 2.0
+
+    def test_parse_retry_after(self):
+        """Test that only numeric Retry-After values are used."""
+        assert ratelimit.parse_retry_after("12") == 12.0
+        assert ratelimit.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+        assert ratelimit.parse_retry_after(None) is None
+
+
+class TestTokenBucket:
+    """Test the token bucket."""
+
+    @pytest.mark.unit
+    def test_burst_then_wait(self):
+        """Test that calls beyond the burst wait for the refill."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=0.5, capacity=2, clock=clock)
+
+        assert bucket.reserve() == 0.0
+        assert bucket.reserve() == 0.0
+        assert bucket.reserve() == pytest.approx(2.0)
+        assert bucket.reserve() == pytest.approx(4.0)
+        clock.now = 10.0
+        assert bucket.tokens == pytest.approx(2.0)
+
+    def test_throttle_and_recover(self):
+        """Test that throttling halves the rate down to the floor and recovery restores it."""
+        bucket = TokenBucket(rate=1.0, capacity=1, clock=FakeClock())
+        for _ in range(5):
+            bucket.throttle()
+        assert bucket.rate == bucket.min_rate == 0.125
+        for _ in range(10):
+            bucket.recover()
+        assert bucket.rate == 1.0
+
+    def test_invalid_configuration(self):
+        """Test that a zero rate is rejected."""
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0, capacity=1)
+
+
+class TestCircuitBreaker:
+    """Test circuit breaker state transitions."""
+
+    def test_opens_after_threshold_and_recovers(self):
+        """Test closed -> open -> half-open -> closed."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=60, clock=clock)
+
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError) as excinfo:
+            breaker.before_call()
+        assert excinfo.value.retry_in == 60
+
+        clock.now = 60.0
+        assert breaker.state == HALF_OPEN
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()  # only one trial call at a time
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        assert breaker.failures == 0
+
+    def test_failed_trial_reopens(self):
+        """Test that a failed trial call starts a new cool-down."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60, clock=clock)
+        breaker.record_failure()
+        clock.now = 61.0
+        breaker.before_call()
+        breaker.record_failure()
+
+        assert breaker.state == OPEN
+        clock.now = 100.0
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+
+class TestRequestLimiter:
+    """Test retries, throttling and breaking around calls."""
+
+    async def test_retries_throttled_requests(self, sleeps):
+        """Test that 429s are retried with backoff and slow the bucket down."""
+        lim = limiter(backoff_base=2.0)
+        func = AsyncMock(side_effect=[HTTPStatusError(429), HTTPStatusError(503), "ok"])
+        throttled = metrics.SHAZAM_THROTTLED.value()
+        retries = metrics.SHAZAM_RETRIES.value()
+
+        assert await lim.call(func) == "ok"
+        assert func.await_count == 3
+        assert sleeps == [1.0, 2.0]
+        assert metrics.SHAZAM_THROTTLED.value() == throttled + 1
+        assert metrics.SHAZAM_RETRIES.value() == retries + 2
+        assert lim.bucket.rate < lim.bucket.max_rate
+
+    async def test_honours_retry_after(self, sleeps):
+        """Test that Retry-After sets a minimum delay."""
+        func = AsyncMock(side_effect=[HTTPStatusError(429, retry_after=30.0), "ok"])
+        assert await limiter().call(func) == "ok"
+        assert sleeps == [30.0]
+
+    async def test_long_retry_after_opens_breaker(self, sleeps):
+        """Test that a Retry-After beyond the backoff cap pauses calls instead of sleeping."""
+        clock = FakeClock()
+        lim = limiter(backoff_cap=60.0)
+        lim.breaker = CircuitBreaker(cooldown=30, clock=clock)
+        func = AsyncMock(side_effect=[HTTPStatusError(429, retry_after=600.0), "ok"])
+
+        with pytest.raises(CircuitOpenError) as excinfo:
+            await lim.call(func)
+        assert excinfo.value.retry_in == 600.0
+        assert sleeps == []
+        assert lim.breaker.state == OPEN
+
+        clock.now = 300.0
+        with pytest.raises(CircuitOpenError):
+            await lim.call(func)
+        assert func.await_count == 1
+
+        clock.now = 600.0
+        assert await lim.call(func) == "ok"
+        assert lim.breaker.state == CLOSED
+
+    async def test_gives_up_after_max_retries(self, sleeps):
+        """Test that the last error is raised once retries are exhausted."""
+        func = AsyncMock(side_effect=ConnectionError("reset"))
+        lim = limiter(max_retries=2)
+        with pytest.raises(ConnectionError):
+            await lim.call(func)
+        assert func.await_count == 3
+        assert lim.breaker.failures == 1
+
+    async def test_client_errors_are_not_retried(self, sleeps):
+        """Test that 4xx other than 429 and unexpected errors fail immediately."""
+        for error in (HTTPStatusError(404), ValueError("bad audio")):
+            func = AsyncMock(side_effect=error)
+            with pytest.raises(type(error)):
+                await limiter().call(func)
+            assert func.await_count == 1
+        assert sleeps == []
+
+    async def test_breaker_stops_calls(self, sleeps):
+        """Test that repeated failures open the breaker and later calls are refused."""
+        lim = limiter(max_retries=0, failure_threshold=2, cooldown=300)
+        func = AsyncMock(side_effect=HTTPStatusError(500))
+        rejections = metrics.RATE_LIMIT_REJECTIONS.value()
+        for _ in range(2):
+            with pytest.raises(HTTPStatusError):
+                await lim.call(func)
+
+        with pytest.raises(CircuitOpenError):
+            await lim.call(func)
+        assert func.await_count == 2
+        assert metrics.RATE_LIMIT_REJECTIONS.value() == rejections + 1
+
+    def test_state_is_shared_across_threads(self, sleeps):
+        """Test that capture sources in different threads share one limiter."""
+        lim = ratelimit.configure_limiter(rate=0.001, burst=2)
+        waits = []
+
+        def source():
+            waits.append(asyncio.run(lim.bucket.acquire()))
+
+        threads = [threading.Thread(target=source) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(waits)[:2] == [0.0, 0.0]
+        assert sorted(waits)[2] > 0
+        assert metrics.CIRCUIT_STATE.value() == CLOSED
+        assert metrics.RATE_LIMIT_TOKENS.value() < 0
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    status = 429
+
+    def do_POST(self):  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.status == 200:
+            body = b'{"matches": []}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        else:
+            body = b"slow down"
+            self.send_response(self.status)
+            self.send_header("Retry-After", "7")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestShazamHTTPClient:
+    """Test the single-attempt Shazam HTTP client."""
+
+    @pytest.fixture
+    def server(self):
+        """Local HTTP server answering with _StatusHandler.status."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StatusHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield server
+        server.shutdown()
+        _StatusHandler.status = 429
+
+    async def test_error_status_raises(self, server):
+        """Test that error statuses surface with their Retry-After."""
+        url = f"http://127.0.0.1:{server.server_address[1]}/tag"
+        with pytest.raises(HTTPStatusError) as excinfo:
+            await ShazamHTTPClient().request("POST", url, json={})
+        assert excinfo.value.status == 429
+        assert excinfo.value.retry_after == 7.0
+
+    async def test_json_response(self, server):
+        """Test that successful responses are decoded."""
+        _StatusHandler.status = 200
+        url = f"http://127.0.0.1:{server.server_address[1]}/tag"
+        assert await ShazamHTTPClient().request("POST", url, json={}) == {"matches": []}
+
+    async def test_connection_error(self):
+        """Test that connection failures become ConnectionError."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StatusHandler)
+        port = server.server_address[1]
+        server.server_close()
+        with pytest.raises(ConnectionError):
+            await ShazamHTTPClient().request("GET", f"http://127.0.0.1:{port}/")
+
+    async def test_session_is_reused(self, server):
+        """Test that requests share one session until the client is closed."""
+        _StatusHandler.status = 200
+        url = f"http://127.0.0.1:{server.server_address[1]}/tag"
+        client = ShazamHTTPClient()
+        await client.request("POST", url, json={})
+        session = client.session
+        await client.request("POST", url, json={})
+        assert client.session is session
+
+        await client.close()
+        assert session.closed
+        await client.close()
+
+    async def test_warm_up_failure_is_ignored(self):
+        """Test that an unreachable warm-up URL does not raise."""
+        client = ShazamHTTPClient(timeout=2)
+        await client.warm_up("http://127.0.0.1:9/")
+        await client.close()
+
+
+class TestEventLoopThread:
+    """Test the long-lived loop Shazam requests run on."""
+
+    def test_runs_coroutines_with_caller_context(self):
+        """Test results, exceptions and context variables across the thread."""
+        variable = contextvars.ContextVar("variable", default="unset")
+        loop = EventLoopThread(name="test-loop")
+
+        async def read():
+            return variable.get(), threading.current_thread().name
+
+        async def fail():
+            raise ValueError("boom")
+
+        try:
+            variable.set("caller")
+            assert loop.run(read()) == ("caller", "test-loop")
+            with pytest.raises(ValueError, match="boom"):
+                loop.run(fail())
+        finally:
+            loop.close()
+        assert loop.loop.is_closed()
+        loop.close()
+
+
+class TestIdentifyThroughLimiter:
+    """Test that identification goes through the shared limiter."""
+
+    async def test_identify_song_retries(self, mock_shazam, sleeps):
+        """Test that a throttled recognize call is retried."""
+        mock_shazam.recognize = AsyncMock(side_effect=[HTTPStatusError(429), {"track": {}}])
+
+        result = await identify_song(np.zeros(100, dtype=np.int16))
+        assert result == {"track": {}}
+        assert mock_shazam.recognize.await_count == 2
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_skips_while_breaker_open(
+        self,
+        mock_sleep,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        caplog,
+    ):
+        """Test that an open breaker skips the cycle without counting an error."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto", min_rms_dbfs=float("-inf")  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.side_effect = CircuitOpenError(120)
+        mock_sleep.side_effect = Exception("Stop execution")
+        errors = metrics.IDENTIFICATIONS.value(result="error")
+
+        with caplog.at_level("WARNING"), pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert "Shazam calls paused for 120s" in caplog.text
+        assert "Error:" not in caplog.text
+        assert metrics.IDENTIFICATIONS.value(result="error") == errors
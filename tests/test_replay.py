@@ -0,0 +1,143 @@
+"""Tests for replaying labeled sessions."""
+
+import json
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from autoscrobbler import __main__ as app
+from autoscrobbler.loopback import Play
+from autoscrobbler.replay import (
+    SAMPLE_RATE,
+    Oracle,
+    Strategy,
+    load_session,
+    main,
+    parse_strategy,
+    parse_time,
+    read_tracklist,
+    replay,
+    synthetic_session,
+)
+from autoscrobbler.standins import Track
+
+ONE = Track("Artist", "One")
+TWO = Track("Artist", "Two")
+
+
+@pytest.fixture(scope="module")
+def session():
+    """Four synthetic tracks of 40 to 120 seconds."""
+    return synthetic_session(tracks=4, min_seconds=40.0, max_seconds=120.0)
+
+
+class TestTracklist:
+    """Test reading ground truth."""
+
+    @pytest.mark.unit
+    def test_parse_time(self):
+        """Test seconds, minutes and hours."""
+        assert parse_time("90") == 90.0
+        assert parse_time("2:31") == 151.0
+        assert parse_time("1:00:05.5") == 3605.5
+        with pytest.raises(ValueError):
+            parse_time("soon")
+
+    def test_read_tracklist(self, tmp_path):
+        """Test plays ending at the next entry, gaps and the end of the audio."""
+        path = tmp_path / "session.txt"
+        path.write_text("# recorded live\n0:00 Artist - One\n1:30\n\n2:00 Artist - Two\n")
+
+        assert read_tracklist(str(path), duration=200.0) == [
+            Play(ONE, 0.0, 90.0),
+            Play(TWO, 120.0, 200.0),
+        ]
+
+    def test_malformed_tracklist(self, tmp_path):
+        """Test that bad lines are reported with their line number."""
+        path = tmp_path / "session.txt"
+        path.write_text("0:10 Artist - One\n0:05 Artist - Two\n")
+        with pytest.raises(ValueError, match="session.txt:2: times must increase"):
+            read_tracklist(str(path), duration=60.0)
+        path.write_text("0:00 Just a title\n")
+        with pytest.raises(ValueError, match="'Artist - Title'"):
+            read_tracklist(str(path), duration=60.0)
+
+    def test_load_session(self, tmp_path):
+        """Test that session audio is mixed down and resampled."""
+        audio = tmp_path / "session.wav"
+        sf.write(audio, np.zeros((8000 * 3, 2), dtype=np.int16), 8000)
+        tracklist = tmp_path / "session.txt"
+        tracklist.write_text("0 Artist - One\n")
+
+        session = load_session(str(audio), str(tracklist))
+
+        assert session.audio.size == 3 * SAMPLE_RATE
+        assert session.plays == [Play(ONE, 0.0, 3.0)]
+
+
+class TestOracle:
+    """Test identification from the tracklist."""
+
+    @pytest.mark.unit
+    def test_match_needs_coverage(self):
+        """Test that a capture straddling two tracks is only identified as the one filling it."""
+        oracle = Oracle([Play(ONE, 0.0, 100.0), Play(TWO, 100.0, 200.0)], None, None, 0.0, 0.6)
+
+        assert oracle.match(50.0, 10.0) == ONE
+        assert oracle.match(96.0, 10.0) == TWO
+        assert oracle.match(95.0, 10.0) is None
+        assert oracle.match(250.0, 10.0) is None
+
+
+class TestReplay:
+    """Test the main loop replayed on a virtual clock."""
+
+    def test_duty_cycles(self, session):
+        """Test that every track is scrobbled once and shorter cycles cost more calls."""
+        started = time.perf_counter()
+        short, long = replay(
+            session,
+            [Strategy("short", ["--duty-cycle", "20"]), Strategy("long", ["--duty-cycle", "40"])],
+        )
+
+        assert time.perf_counter() - started < 60.0
+        for result in (short, long):
+            assert result.recall == 1.0
+            assert (result.correct, result.duplicates, result.wrong) == (4, 0, 0)
+            assert result.time_to_scrobble_s["max"] <= 40.0 + 11.0 + 10.0
+        assert short.shazam_calls > long.shazam_calls
+        assert short.cycles == pytest.approx(session.duration / 20, abs=1)
+        assert short.lastfm_calls_per_hour > 0
+
+    def test_main_loop_is_restored(self, session):
+        """Test that the replaced globals of the main loop are put back."""
+        replay(session, [Strategy("once", ["--duty-cycle", "120"])])
+
+        assert app.time is time
+        assert app.parse_arguments.__module__ == "autoscrobbler.__main__"
+
+    @pytest.mark.unit
+    def test_parse_strategy(self):
+        """Test named argument sets."""
+        assert parse_strategy("budget=--duty-cycle 30 --daily-budget 200") == Strategy(
+            "budget", ["--duty-cycle", "30", "--daily-budget", "200"]
+        )
+        with pytest.raises(ValueError):
+            parse_strategy("--duty-cycle 30")
+
+    def test_command_line(self, capsys):
+        """Test the JSON report of a synthetic session."""
+        main(["--tracks", "2", "--duty-cycles", "60", "--strategy", "budget=--daily-budget 50", "--json", "--", "--duty-cycle", "30"])
+
+        results = json.loads(capsys.readouterr().out)
+        assert [r["name"] for r in results] == ["duty 60s", "budget"]
+        assert results[0]["args"] == ["--duty-cycle", "60", "--duty-cycle", "30"]
+        assert all(r["wrong"] == 0 for r in results)
+
+    def test_audio_needs_tracklist(self):
+        """Test that session audio without ground truth is refused."""
+        with pytest.raises(SystemExit):
+            main(["--audio", "session.wav"])
@@ -0,0 +1,207 @@
+"""Tests for coordination between nodes over UDP on localhost."""
+
+import socket
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pytest
+
+from autoscrobbler import metrics
+from autoscrobbler.__main__ import main, process_result
+from autoscrobbler.addresses import parse_address
+from autoscrobbler.dedupe import DedupeIndex, normalize_key
+from autoscrobbler.room import RoomPeer
+
+SONG_RESULT = {
+    "track": {
+        "key": "123",
+        "title": "Test Song",
+        "subtitle": "Test Artist",
+        "images": {"coverart": "https://example.com/" + "x" * 100},
+        "sections": [
+            {"type": "SONG", "metadata": [{"title": "Album", "text": "Test Album"}]},
+            {"type": "LYRICS", "text": ["la"] * 100},
+        ],
+    }
+}
+KEY = normalize_key("Test Artist", "Test Song")
+
+
+def profile(seed):
+    """A unit-norm spectral profile."""
+    vector = np.random.default_rng(seed).normal(size=24)
+    vector -= vector.mean()
+    return vector / np.linalg.norm(vector)
+
+
+def wait_for(condition, timeout=5.0):
+    """Poll until a condition holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def nodes():
+    """Two peers talking unicast over loopback."""
+    a = RoomPeer("a", group=None, port=0, bind="127.0.0.1", settle=0.3)
+    b = RoomPeer("b", group=None, port=0, bind="127.0.0.1", settle=0.3)
+    a.peers.append(("127.0.0.1", b.port))
+    b.peers.append(("127.0.0.1", a.port))
+    yield a, b
+    a.close()
+    b.close()
+
+
+class TestRoomPeer:
+    """Test the gossip messages between two nodes."""
+
+    @pytest.mark.unit
+    def test_parse_address(self):
+        """Test host and optional port parsing."""
+        assert parse_address("10.0.0.2:5000") == ("10.0.0.2", 5000)
+        assert parse_address("kitchen", 45454) == ("kitchen", 45454)
+
+    def test_shared_result_matches_similar_capture(self, nodes):
+        """Test that a peer's result is reused only for a capture that sounds the same."""
+        a, b = nodes
+        a.announce_result(SONG_RESULT, profile(1), now=1000.0)
+        wait_for(lambda: b._results)
+
+        shared = b.match(profile(1) * 0.999 + profile(2) * 0.001, now=1030.0)
+        assert shared["track"]["subtitle"] == "Test Artist"
+        assert shared["track"]["sections"][0]["metadata"][0]["text"] == "Test Album"
+        assert "images" not in shared["track"]
+        assert b.match(profile(2), now=1030.0) is None
+        assert b.match(profile(1), now=2000.0) is None
+        assert a.match(profile(1), now=1030.0) is None  # own messages are ignored
+
+    def test_earliest_claim_wins(self, nodes):
+        """Test that of two concurrent claims exactly the earlier one scrobbles."""
+        a, b = nodes
+        outcomes = {}
+        threads = [
+            threading.Thread(target=lambda: outcomes.update(a=a.claim(KEY, now=1001.0))),
+            threading.Thread(target=lambda: outcomes.update(b=b.claim(KEY, now=1000.0))),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert outcomes == {"a": False, "b": True}
+
+    def test_scrobble_is_synced_to_dedupe(self, nodes):
+        """Test that a peer's scrobble reaches the dedupe index and beats later claims."""
+        a, b = nodes
+        a.announce_scrobble(KEY, now=1000.0)
+        wait_for(lambda: b._pending)
+        dedupe = DedupeIndex()
+
+        assert b.sync(dedupe) == 1
+        assert dedupe.is_playing(KEY, 1060.0)
+        assert not b.claim(KEY, now=1060.0)
+        assert b.claim(normalize_key("Other", "Song"), now=1060.0)
+
+    def test_malformed_datagrams_are_ignored(self, nodes):
+        """Test that garbage does not stop the receiver."""
+        a, b = nodes
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"not json", ("127.0.0.1", b.port))
+            sock.sendto(b'{"type": "claim"}', ("127.0.0.1", b.port))
+        a.announce_scrobble(KEY, now=1000.0)
+        wait_for(lambda: b._pending)
+
+    def test_results_with_bad_profiles_are_dropped(self, nodes):
+        """Test that a result whose profile has the wrong length or is not finite is not kept."""
+        a, b = nodes
+        for bad in (profile(1)[:5], np.full(24, np.nan)):
+            a.announce_result(SONG_RESULT, bad, now=1000.0)
+        a.announce_result(SONG_RESULT, profile(1), now=1000.0)
+        wait_for(lambda: b._results)
+
+        assert len(b._results) == 1
+        assert b.match(profile(1), now=1030.0) is not None
+
+
+class TestProcessResultRoom:
+    """Test that nodes hearing the same song scrobble it once."""
+
+    def test_two_nodes_scrobble_once(self, nodes):
+        """Test concurrent processing of the same song on two nodes."""
+        networks = [Mock(), Mock()]
+
+        def run(node, network, now):
+            process_result(SONG_RESULT, network, "user", DedupeIndex(), timestamp=now, room=node)
+
+        with patch("autoscrobbler.__main__.get_last_scrobbled_track", return_value=None):
+            threads = [
+                threading.Thread(target=run, args=(node, network, 1000.0 + i))
+                for i, (node, network) in enumerate(zip(nodes, networks))
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert [network.scrobble.call_count for network in networks] == [1, 0]
+        wait_for(lambda: nodes[1]._pending)
+
+
+class TestMainRoom:
+    """Test the --room option of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track")
+    @patch("autoscrobbler.__main__.scrobble_song")
+    @patch("autoscrobbler.room.RoomPeer")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_shared_result_skips_shazam(
+        self,
+        mock_sleep,
+        mock_room_cls,
+        mock_scrobble,
+        mock_get_last,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+    ):
+        """Test that a result shared by another node is scrobbled without calling Shazam."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto",
+            room=True,
+            room_peer=["127.0.0.1:5000"],
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_get_last.return_value = None
+        room = mock_room_cls.return_value
+        room.match.return_value = SONG_RESULT
+        room.claim.return_value = True
+        mock_sleep.side_effect = Exception("Stop execution")
+        shared = metrics.ROOM_SHARED_RESULTS.value()
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        assert mock_room_cls.call_args.kwargs["peers"] == [("127.0.0.1", 5000)]
+        mock_identify.assert_not_called()
+        assert metrics.ROOM_SHARED_RESULTS.value() == shared + 1
+        mock_scrobble.assert_called_once()
+        room.sync.assert_called_once()
+        room.announce_scrobble.assert_called_once()
+        room.close.assert_called_once()
@@ -81,50 +81,49 @@ class TestIdentifySong:
         with pytest.raises(Exception, match="Shazam API error"):
             await identify_song(audio_data)
 
-    @patch("autoscrobbler.__main__.sf.write")
-    @patch("autoscrobbler.__main__.os.unlink")
     @pytest.mark.asyncio
     @pytest.mark.unit
-    async def test_identify_song_temp_file_handling(
-        self, mock_unlink, mock_write, mock_shazam
-    ):
-        """Test that temporary files are properly handled."""
+    async def test_identify_song_sends_in_memory_wav(self, mock_shazam):
+        """Test that plain arrays are encoded to an in-memory WAV, not a temp file."""
         import numpy as np
 
         audio_data = np.array([1, 2, 3, 4, 5], dtype=np.int16)
 
-        result = await identify_song(audio_data)
-
-        # Verify soundfile.write was called
-        mock_write.assert_called_once()
+        with patch("tempfile.NamedTemporaryFile") as mock_tempfile:
+            result = await identify_song(audio_data, sample_rate=8000)
 
-        # Verify os.unlink was called to clean up temp file
-        mock_unlink.assert_called_once()
-
-        # Verify result
+        mock_tempfile.assert_not_called()
+        (wav,), _ = mock_shazam.recognize.call_args
+        assert isinstance(wav, bytearray)
+        assert wav[:4] == b"RIFF"
+        assert np.array_equal(np.frombuffer(wav, dtype=np.int16, offset=44), audio_data)
         assert "track" in result
 
-    @patch("autoscrobbler.__main__.sf.write")
-    @patch("autoscrobbler.__main__.os.unlink")
     @pytest.mark.asyncio
     @pytest.mark.unit
-    async def test_identify_song_temp_file_cleanup_on_error(
-        self, mock_unlink, mock_write, mock_shazam
-    ):
-        """Test that temporary files are cleaned up even when Shazam fails."""
-        import numpy as np
+    async def test_identify_song_pooled_buffer_is_not_copied(self, mock_shazam):
+        """Test that a pooled buffer's WAV image is handed to Shazam as-is."""
+        from autoscrobbler.buffers import BufferPool
 
-        # Mock Shazam to raise an exception
-        async def mock_recognize_error(file_path):
-            raise Exception("Shazam API error")
+        pool = BufferPool(frames=16, sample_rate=8000, size=1)
+        with pool.acquire() as buffer:
+            buffer.samples[:] = 3
+            await identify_song(buffer)
 
-        mock_shazam.recognize.side_effect = mock_recognize_error
+            (wav,), _ = mock_shazam.recognize.call_args
+            assert wav is buffer.wav
 
-        audio_data = np.array([1, 2, 3, 4, 5], dtype=np.int16)
+    @pytest.mark.unit
+    def test_client_is_reused_across_identifications(self, mock_shazam):
+        """Test that one Shazam client and loop serve every identification."""
+        import numpy as np
+        import shazamio
 
-        with pytest.raises(Exception):
-            await identify_song(audio_data)
+        from autoscrobbler.__main__ import run_shazam
+
+        audio_data = np.zeros(100, dtype=np.int16)
+        run_shazam(identify_song(audio_data))
+        run_shazam(identify_song(audio_data))
 
-        # Note: The current implementation doesn't clean up temp files on error
-        # because os.unlink is outside the try block. This is a known issue.
-        # mock_unlink.assert_called_once()
+        shazamio.Shazam.assert_called_once()
+        assert mock_shazam.recognize.call_count == 2
@@ -0,0 +1,207 @@
+"""Tests for streaming Shazam signature generation."""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from shazamio.algorithm import SignatureGenerator
+
+from autoscrobbler.__main__ import main
+from autoscrobbler.capture import CaptureStats, SharedRingBuffer
+from autoscrobbler.signature import (
+    HOP,
+    SAMPLE_RATE,
+    SignatureFollower,
+    StreamingSignatureGenerator,
+    _Resampler,
+)
+
+
+def music(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    """Int16 mix of wobbling tones and noise with plenty of spectral peaks."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = sum(
+        np.sin(2 * np.pi * f * t * (1 + 0.05 * np.sin(t * k))) * 2000
+        for k, f in enumerate((300, 700, 1200, 2500, 4000), 1)
+    )
+    audio += rng.normal(0, 300, t.size)
+    return audio.astype(np.int16)
+
+
+def peaks(signature):
+    """Peaks of a signature as comparable tuples, by band."""
+    return {
+        band: [(p.fft_pass_number, p.peak_magnitude, p.corrected_peak_frequency_bin) for p in ps]
+        for band, ps in signature.frequency_band_to_sound_peaks.items()
+    }
+
+
+def feed_in_chunks(generator, audio, seed=1):
+    """Feed audio in random chunk sizes."""
+    rng = np.random.default_rng(seed)
+    position = 0
+    while position < audio.size:
+        size = int(rng.integers(1, 5000))
+        generator.feed(audio[position : position + size])
+        position += size
+
+
+class TestStreamingSignatureGenerator:
+    """Test incremental peak detection and windowing."""
+
+    @pytest.mark.unit
+    def test_matches_reference_generator(self):
+        """Test that streamed peaks equal shazamio's batch generator."""
+        audio = music(2)
+        reference = SignatureGenerator()
+        reference.MAX_TIME_SECONDS = 100
+        reference.feed_input(audio.tolist())
+        expected = reference.get_next_signature()
+
+        generator = StreamingSignatureGenerator(window_seconds=100)
+        feed_in_chunks(generator, audio)
+        actual = generator.signature()
+
+        assert actual.number_samples == expected.number_samples
+        assert peaks(expected)
+        assert peaks(actual) == peaks(expected)
+
+    def test_chunking_does_not_change_result(self):
+        """Test that resampled input gives the same signature however it is split."""
+        audio = music(3, sample_rate=44100)
+        whole = StreamingSignatureGenerator(sample_rate=44100)
+        whole.feed(audio)
+        chunked = StreamingSignatureGenerator(sample_rate=44100)
+        feed_in_chunks(chunked, audio)
+
+        assert peaks(chunked.signature()) == peaks(whole.signature())
+        assert whole.peak_count > 0
+
+    def test_window_slides(self):
+        """Test that signatures only cover the most recent window."""
+        generator = StreamingSignatureGenerator(window_seconds=4)
+        generator.feed(music(12))
+        signature = generator.signature()
+        window_frames = 4 * SAMPLE_RATE // HOP
+
+        assert signature.number_samples == window_frames * HOP
+        numbers = [p[0] for ps in peaks(signature).values() for p in ps]
+        assert numbers and 0 <= min(numbers) and max(numbers) < window_frames
+        assert signature.encode_to_uri().startswith("data:audio/vnd.shazam.sig;base64,")
+
+    def test_reset(self):
+        """Test that reset forgets all audio."""
+        generator = StreamingSignatureGenerator()
+        generator.feed(music(2))
+        generator.reset()
+        assert generator.signature().number_samples == 0
+        assert generator.peak_count == 0
+
+    def test_resampler_keeps_pitch(self):
+        """Test that resampling to 16 kHz keeps a tone's frequency and the length ratio."""
+        t = np.arange(44100) / 44100
+        tone = np.sin(2 * np.pi * 1000 * t) * 10000
+        resample = _Resampler(44100)
+        out = np.concatenate([resample(tone[:20000]), resample(tone[20000:])])
+
+        assert abs(out.size - SAMPLE_RATE) <= 1
+        spectrum = np.abs(np.fft.rfft(out[1000:]))
+        assert np.argmax(spectrum) * SAMPLE_RATE / (out.size - 1000) == pytest.approx(1000, abs=2)
+
+
+class TestSignatureFollower:
+    """Test feeding a generator from the capture ring."""
+
+    @pytest.fixture
+    def ring(self):
+        """A ring buffer removed after the test."""
+        ring = SharedRingBuffer(capacity=4000, window_frames=1000)
+        yield ring
+        ring.close()
+
+    def test_feeds_new_samples(self, ring):
+        """Test that each poll feeds only what was written since the last one."""
+        ring.write(np.zeros(500, dtype=np.int16))
+        generator = StreamingSignatureGenerator()
+        follower = SignatureFollower(ring, generator)
+        ring.write(music(0.15))
+
+        assert follower.poll() == 2400
+        assert generator.frames == 2400 // HOP
+        assert follower.poll() == 0
+
+    def test_restarts_after_lap(self, ring):
+        """Test that a follower lapped by the producer resets its generator."""
+        generator = StreamingSignatureGenerator()
+        follower = SignatureFollower(ring, generator)
+        ring.write(music(0.1))
+        follower.poll()
+        ring.write(np.zeros(5000, dtype=np.int16))
+
+        with patch.object(generator, "reset", wraps=generator.reset) as reset:
+            follower.poll()
+        reset.assert_called_once()
+        ring.write(np.zeros(256, dtype=np.int16))
+        assert follower.poll() == 256
+
+    def test_background_thread(self, ring):
+        """Test that start and stop run the polling thread."""
+        follower = SignatureFollower(ring, StreamingSignatureGenerator(), interval=0.01)
+        follower.start()
+        ring.write(np.zeros(HOP * 4, dtype=np.int16))
+        for _ in range(200):
+            if follower.generator.frames:
+                break
+            follower._stop.wait(0.01)
+        follower.stop()
+        assert follower.generator.frames == 4
+
+
+class TestMainStreamingSignature:
+    """Test the --streaming-signature option of main."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.capture.CaptureProcess")
+    @patch("autoscrobbler.signature.SignatureFollower")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.identify_signature")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_identifies_streamed_signature(
+        self,
+        mock_sleep,
+        mock_identify_signature,
+        mock_identify_song,
+        mock_follower_cls,
+        mock_capture_cls,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+    ):
+        """Test that the streamed signature is sent instead of the capture."""
+        mock_parse_args.return_value = make_args(
+            input_source="auto",
+            streaming_signature=True,
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify_signature.return_value = {}
+        mock_capture_cls.return_value.stats.return_value = CaptureStats(441000, 0, 0, 441000)
+        follower = mock_follower_cls.return_value
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        with pytest.raises(Exception, match="Stop execution"):
+            main()
+
+        mock_capture_cls.return_value.start.assert_called_once()
+        follower.start.assert_called_once()
+        mock_identify_signature.assert_called_once_with(follower.generator.signature.return_value)
+        mock_identify_song.assert_not_called()
+        follower.stop.assert_called_once()
@@ -0,0 +1,84 @@
+"""Tests for the accelerated soak test."""
+
+import json
+import os
+
+import pytest
+
+from autoscrobbler import __main__ as app
+from autoscrobbler.soak import Limits, Sample, check_growth, growth, main, run_soak
+
+SHORT = {"tracks": 2, "track_seconds": 40.0}
+
+
+def samples(values, every=10):
+    """Samples with the given open file descriptor counts and nothing else changing."""
+    return [
+        Sample(cycle=(i + 1) * every, rss_bytes=None, open_fds=value, traced_bytes=1000, asyncio_tasks=0, threads=3)
+        for i, value in enumerate(values)
+    ]
+
+
+class TestGrowth:
+    """Test telling sustained growth from noise."""
+
+    @pytest.mark.unit
+    def test_steady_climb(self):
+        """Test that one more descriptor per cycle is 1000 per 1000 cycles."""
+        assert growth(samples([10 * i for i in range(8)]), "open_fds") == pytest.approx(1000.0)
+
+    @pytest.mark.unit
+    def test_spikes_and_warmup_are_ignored(self):
+        """Test that a one-off spike and growth during warm-up do not count."""
+        values = [5, 20, 40, 40, 90, 40, 40, 40, 40]
+        assert growth(samples(values), "open_fds", warmup=20) == 0.0
+        assert growth(samples(values[:4]), "open_fds", warmup=20) is None
+
+    @pytest.mark.unit
+    def test_check_growth(self):
+        """Test that only the metric beyond its limit fails and unmeasured ones pass."""
+        checks = {c["metric"]: c for c in check_growth(samples([10 * i for i in range(8)]), Limits())}
+
+        assert not checks["open_fds"]["ok"]
+        assert checks["threads"]["ok"] and checks["threads"]["per_1000_cycles"] == 0.0
+        assert checks["rss_bytes"]["ok"] and checks["rss_bytes"]["per_1000_cycles"] is None
+
+
+class TestRunSoak:
+    """Test soaking the main loop against the stand-ins."""
+
+    def test_clean_run(self):
+        """Test that the unmodified main loop runs its cycles without leaking descriptors or tasks."""
+        report = run_soak(cycles=30, sample_every=3, warmup=6, **SHORT)
+
+        assert report["cycles"] == 30
+        assert report["requests"]["shazam"] == 30
+        assert report["requests"]["scrobbles"] >= 2
+        assert len(report["samples"]) == 10
+        checks = {c["metric"]: c for c in report["growth"]}
+        for metric in ("open_fds", "asyncio_tasks", "threads"):
+            assert checks[metric]["ok"], checks[metric]
+        assert report["top_allocators"]
+        assert app.time.__name__ == "time"
+
+    def test_leak_fails_the_run(self, monkeypatch, capsys):
+        """Test that a descriptor leaked every cycle makes the command fail."""
+        leaked = []
+        record_quality_metrics = app.record_quality_metrics
+
+        def leaky(quality):
+            leaked.append(os.open(os.devnull, os.O_RDONLY))
+            record_quality_metrics(quality)
+
+        monkeypatch.setattr(app, "record_quality_metrics", leaky)
+        try:
+            with pytest.raises(SystemExit) as exit:
+                main(["--cycles", "24", "--sample-every", "2", "--warmup", "4", "--tracks", "2", "--track-seconds", "40"])
+        finally:
+            for fd in leaked:
+                os.close(fd)
+
+        assert exit.value.code == 1
+        report = json.loads(capsys.readouterr().out)
+        failed = {c["metric"]: c for c in report["growth"] if not c["ok"]}
+        assert failed["open_fds"]["per_1000_cycles"] == pytest.approx(1000.0)
@@ -0,0 +1,171 @@
+"""Tests for the offline Shazam and Last.fm stand-ins."""
+
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pylast
+import pytest
+
+from autoscrobbler.__main__ import (
+    configure_shazam,
+    get_last_scrobbled_track,
+    identify_song,
+    process_result,
+    run_shazam,
+)
+from autoscrobbler.dedupe import DedupeIndex
+from autoscrobbler.shazam_client import ShazamHTTPClient
+from autoscrobbler.signature import signature_of
+from autoscrobbler.standins import (
+    API_KEY,
+    API_SECRET,
+    Faults,
+    LastfmStandIn,
+    RedirectTransport,
+    ShazamStandIn,
+    ShazamStandInClient,
+    Track,
+    serve_lastfm,
+    serve_shazam,
+    synthetic_music,
+)
+
+SAMPLE_RATE = 16000
+TRACKS = [Track("Artist A", "Song A", "Album A", key="1"), Track("Artist B", "Song B", key="2")]
+
+
+@pytest.fixture(scope="module")
+def shazam():
+    """A Shazam stand-in knowing two 15 second synthetic tracks."""
+    standin = ShazamStandIn()
+    for seed, track in enumerate(TRACKS):
+        standin.add_track(track, synthetic_music(15, SAMPLE_RATE, seed=seed), SAMPLE_RATE)
+    return standin
+
+
+class TestSyntheticMusic:
+    """Test the generated signals."""
+
+    @pytest.mark.unit
+    def test_reproducible_per_seed(self):
+        """Test that equal seeds give equal audio and others differ."""
+        a = synthetic_music(1, SAMPLE_RATE, seed=1)
+        assert a.dtype == np.int16
+        assert a.size == SAMPLE_RATE
+        assert np.array_equal(a, synthetic_music(1, SAMPLE_RATE, seed=1))
+        assert not np.array_equal(a, synthetic_music(1, SAMPLE_RATE, seed=2))
+
+
+class TestShazamStandIn:
+    """Test recognition of signatures."""
+
+    def test_window_of_known_track_matches(self, shazam):
+        """Test that a window from the middle of a track is recognized."""
+        for seed, track in enumerate(TRACKS):
+            window = synthetic_music(15, SAMPLE_RATE, seed=seed)[3 * SAMPLE_RATE : 13 * SAMPLE_RATE]
+            assert shazam.match(signature_of(window, SAMPLE_RATE)) == track
+
+    def test_unknown_music_and_noise_miss(self, shazam):
+        """Test that other music and plain noise are not recognized."""
+        other = synthetic_music(10, SAMPLE_RATE, seed=7)
+        noise = np.random.default_rng(0).normal(0, 1000, 10 * SAMPLE_RATE).astype(np.int16)
+        assert shazam.match(signature_of(other, SAMPLE_RATE)) is None
+        assert shazam.match(signature_of(noise, SAMPLE_RATE)) is None
+
+    def test_identify_song_through_shazamio(self, shazam):
+        """Test a real shazamio request answered by the stand-in."""
+        configure_shazam(ShazamStandInClient(shazam))
+        requests = shazam.requests
+        window = synthetic_music(15, SAMPLE_RATE, seed=1)[2 * SAMPLE_RATE : 12 * SAMPLE_RATE]
+
+        result = run_shazam(identify_song(window, SAMPLE_RATE))
+
+        assert result["track"]["title"] == "Song B"
+        assert result["track"]["subtitle"] == "Artist B"
+        assert shazam.requests == requests + 1
+
+    def test_invalid_signature(self, shazam):
+        """Test that a body without a decodable signature is refused."""
+        with pytest.raises(ValueError, match="Invalid signature"):
+            shazam.recognize({"signature": {"uri": "data:audio/vnd.shazam.sig;base64,AAAA"}})
+        with pytest.raises(ValueError):
+            shazam.recognize({})
+
+
+class TestLastfmStandIn:
+    """Test the Last.fm API answered in process through pylast."""
+
+    def test_scrobble_and_duplicate_check(self):
+        """Test that process_result scrobbles once and sees its own scrobble."""
+        lastfm = LastfmStandIn()
+        network = lastfm.network("listener")
+        dedupe = DedupeIndex()
+        result = TRACKS[0].shazam_result()
+
+        assert get_last_scrobbled_track(network, "listener") is None
+        process_result(result, network, "listener", dedupe, timestamp=1_700_000_000)
+        process_result(result, network, "listener", DedupeIndex(), timestamp=1_700_000_100)
+
+        [scrobble] = lastfm.scrobbles_of("listener")
+        assert (scrobble.artist, scrobble.title, scrobble.album) == ("Artist A", "Song A", "Album A")
+        assert scrobble.timestamp == 1_700_000_000
+        assert get_last_scrobbled_track(network, "listener") == ("artist a", "song a")
+
+    @pytest.mark.unit
+    def test_errors(self):
+        """Test unknown methods and session keys."""
+        lastfm = LastfmStandIn()
+        assert 'code="3"' in lastfm.handle({"method": "track.love"})
+        assert 'code="9"' in lastfm.handle({"method": "track.scrobble", "sk": "nope"})
+
+
+class TestStandInServers:
+    """Test the stand-ins served over HTTP on localhost."""
+
+    def test_shazam_client_rebased_onto_server(self, shazam):
+        """Test that ShazamHTTPClient's base URL sends requests to the stand-in."""
+        server = serve_shazam(shazam, Faults(latency=0.02))
+        try:
+            configure_shazam(ShazamHTTPClient(base_url=server.url))
+            window = synthetic_music(15, SAMPLE_RATE, seed=0)[2 * SAMPLE_RATE : 12 * SAMPLE_RATE]
+
+            result = run_shazam(identify_song(window, SAMPLE_RATE))
+
+            assert result["track"]["title"] == "Song A"
+            assert len(server.latencies) == 1
+            assert server.latencies[0] >= 0.02
+        finally:
+            server.close()
+
+    def test_lastfm_through_redirect_transport(self):
+        """Test pylast talking to the Last.fm stand-in over HTTP."""
+        lastfm = LastfmStandIn()
+        server = serve_lastfm(lastfm)
+        try:
+            network = pylast.LastFMNetwork(
+                api_key=API_KEY,
+                api_secret=API_SECRET,
+                username="listener",
+                password_hash=pylast.md5("password"),
+                proxy={"https://": RedirectTransport(server.url)},
+            )
+            network.scrobble(artist="Artist A", title="Song A", timestamp=1_700_000_000)
+            network.scrobble(artist="Artist B", title="Song B", timestamp=1_700_000_100)
+
+            assert get_last_scrobbled_track(network, "listener") == ("artist b", "song b")
+            assert len(lastfm.scrobbles_of("listener")) == 2
+        finally:
+            server.close()
+
+    def test_injected_errors(self):
+        """Test that the error rate turns responses into HTTP 503."""
+        server = serve_lastfm(LastfmStandIn(), Faults(error_rate=1.0))
+        try:
+            request = urllib.request.Request(server.url + "/2.0/", data=b"method=track.scrobble")
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(request, timeout=5)
+            assert error.value.code == 503
+            assert server.errors == 1
+        finally:
+            server.close()
@@ -0,0 +1,173 @@
+"""Tests for per-cycle tracing spans."""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from autoscrobbler import tracing
+from autoscrobbler.__main__ import main
+from autoscrobbler.tracing import STATUS_ERROR, STATUS_OK, Tracer
+
+
+def read_spans(path):
+    """Load every span written to a trace file."""
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def attributes(span):
+    """Flatten OTLP attributes into a dict of their encoded values."""
+    return {a["key"]: next(iter(a["value"].values())) for a in span["attributes"]}
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    """An enabled tracer installed as the process-wide tracer."""
+    tracer = tracing.configure_tracing(str(tmp_path / "trace.jsonl"))
+    yield tracer
+    tracing.configure_tracing(None)
+
+
+class TestTracer:
+    """Test span creation and export."""
+
+    @pytest.mark.unit
+    def test_nested_spans_share_trace(self, tracer, tmp_path):
+        """Test that child spans point at their parent within one trace."""
+        with tracer.cycle():
+            with tracing.span("capture", source="device"):
+                with tracing.span("inner"):
+                    pass
+        tracer.close()
+
+        inner, capture, cycle = read_spans(tmp_path / "trace.jsonl")
+        assert {inner["traceId"], capture["traceId"]} == {cycle["traceId"]}
+        assert len(cycle["traceId"]) == 32
+        assert cycle["parentSpanId"] == ""
+        assert capture["parentSpanId"] == cycle["spanId"]
+        assert inner["parentSpanId"] == capture["spanId"]
+        assert attributes(capture)["source"] == "device"
+        assert attributes(cycle)["cycle.id"] == "1"
+        assert int(cycle["endTimeUnixNano"]) >= int(capture["endTimeUnixNano"])
+        assert cycle["status"]["code"] == STATUS_OK
+
+    def test_each_cycle_is_a_new_trace(self, tracer, tmp_path):
+        """Test that cycle IDs increase and trace IDs differ per cycle."""
+        for _ in range(2):
+            with tracer.cycle():
+                pass
+        tracer.close()
+
+        first, second = read_spans(tmp_path / "trace.jsonl")
+        assert first["traceId"] != second["traceId"]
+        assert attributes(second)["cycle.id"] == "2"
+
+    def test_error_status(self, tracer, tmp_path):
+        """Test that raising inside a span marks it as failed."""
+        with tracer.cycle():
+            with pytest.raises(ValueError):
+                with tracing.span("shazam.recognize"):
+                    raise ValueError("throttled")
+        tracer.close()
+
+        failed, cycle = read_spans(tmp_path / "trace.jsonl")
+        assert failed["status"] == {"code": STATUS_ERROR, "message": "ValueError: throttled"}
+        assert cycle["status"]["code"] == STATUS_OK
+
+    def test_spans_follow_into_asyncio(self, tracer, tmp_path):
+        """Test that spans opened in a coroutine attach to the cycle."""
+
+        async def identify():
+            with tracing.span("shazam.recognize"):
+                await asyncio.sleep(0)
+
+        with tracer.cycle():
+            asyncio.run(identify())
+        tracer.close()
+
+        recognize, cycle = read_spans(tmp_path / "trace.jsonl")
+        assert recognize["parentSpanId"] == cycle["spanId"]
+
+    def test_disabled_tracer_records_nothing(self, tmp_path):
+        """Test that spans are no-ops when tracing is off."""
+        tracer = Tracer()
+        with tracer.cycle() as root, tracer.span("capture") as span:
+            span.set_attribute("ignored", True)
+            root.record_error(RuntimeError("ignored"))
+        assert tracer.cycle_id == 1
+        assert list(tmp_path.iterdir()) == []
+
+    def test_spans_outside_cycle_are_not_recorded(self, tracer, tmp_path):
+        """Test that stray spans are dropped instead of starting orphan traces."""
+        with tracing.span("lastfm.scrobble"):
+            pass
+        tracer.close()
+        assert read_spans(tmp_path / "trace.jsonl") == []
+
+    def test_rotation(self, tmp_path):
+        """Test that the trace file rotates at its size limit."""
+        path = tmp_path / "trace.jsonl"
+        tracer = Tracer(str(path), max_bytes=2000, backup_count=2)
+        for _ in range(50):
+            with tracer.cycle():
+                pass
+        tracer.close()
+
+        assert (tmp_path / "trace.jsonl.1").exists()
+        assert not (tmp_path / "trace.jsonl.3").exists()
+        assert path.stat().st_size <= 2000
+
+
+class TestMainTracing:
+    """Test that main records a trace per cycle."""
+
+    @patch("autoscrobbler.__main__.parse_arguments")
+    @patch("autoscrobbler.__main__.select_input_device")
+    @patch("autoscrobbler.__main__.load_credentials")
+    @patch("autoscrobbler.__main__.pylast.LastFMNetwork")
+    @patch("autoscrobbler.__main__.record_audio")
+    @patch("autoscrobbler.__main__.identify_song")
+    @patch("autoscrobbler.__main__.get_last_scrobbled_track")
+    @patch("autoscrobbler.__main__.scrobble_song")
+    @patch("autoscrobbler.__main__.time.sleep")
+    def test_main_writes_cycle_spans(
+        self,
+        mock_sleep,
+        mock_scrobble,
+        mock_get_last,
+        mock_identify,
+        mock_record,
+        mock_network,
+        mock_load_creds,
+        mock_select_device,
+        mock_parse_args,
+        make_args,
+        sample_credentials,
+        tmp_path,
+    ):
+        """Test that one cycle produces a root span with stage children."""
+        trace_file = tmp_path / "trace.jsonl"
+        mock_parse_args.return_value = make_args(
+            input_source="auto",
+            trace_file=str(trace_file),
+            min_rms_dbfs=float("-inf"),  # mocked capture is silent
+        )
+        mock_select_device.return_value = 0
+        mock_load_creds.return_value = sample_credentials
+        mock_identify.return_value = {"track": {"title": "Song", "subtitle": "Artist"}}
+        mock_get_last.return_value = None
+        mock_sleep.side_effect = Exception("Stop execution")
+
+        try:
+            with pytest.raises(Exception, match="Stop execution"):
+                main()
+        finally:
+            tracing.configure_tracing(None)
+
+        spans = {span["name"]: span for span in read_spans(trace_file)}
+        assert {"cycle", "capture", "quality", "process_result"} <= spans.keys()
+        root = spans["cycle"]
+        for name in ("capture", "quality", "process_result"):
+            assert spans[name]["parentSpanId"] == root["spanId"]
+        assert attributes(spans["capture"])["source"] == "device"